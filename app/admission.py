@@ -0,0 +1,664 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import math
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Mapping, Optional, Tuple
+
+from app import metrics
+from app.exceptions import AdmissionRejected
+
+try:
+    import redis.asyncio as aioredis
+    from redis.exceptions import WatchError
+except ImportError:  # pragma: no cover - redis is optional
+    aioredis = None
+    WatchError = None
+
+# Set to "false" to send every review straight to the review pipeline
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# Header naming the tenant a review is accounted to; without it, reviews are
+# keyed by their API key, and anonymous ones share one tenant
+ADMISSION_TENANT_HEADER = os.getenv("ADMISSION_TENANT_HEADER", "X-Tenant-ID")
+# Header choosing the priority lane of a review, e.g. "batch"
+ADMISSION_LANE_HEADER = os.getenv("ADMISSION_LANE_HEADER", "X-Priority")
+# Headers carrying a client API key, hashed into the tenant id
+API_KEY_HEADERS = ("X-API-Key", "Authorization")
+
+
+def tenant_of(headers: Mapping[str, str]) -> str:
+    """
+    Returns the tenant a request is accounted to: the tenant header if set,
+    otherwise a digest of the client's API key, otherwise "anonymous".
+    """
+    tenant = headers.get(ADMISSION_TENANT_HEADER, "").strip()
+    if tenant:
+        return tenant
+    for name in API_KEY_HEADERS:
+        key = headers.get(name, "").strip()
+        if key:
+            digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+            return f"key-{digest[:16]}"
+    return "anonymous"
+
+
+def _refill(
+    tokens: Optional[float],
+    updated: Optional[float],
+    now: float,
+    rate: float,
+    burst: int,
+) -> Tuple[float, float]:
+    """
+    Takes one token from a bucket refilled at `rate` per second.
+
+    Returns:
+        Tuple[float, float]: Tokens left, and 0 if a token was taken or the
+        seconds until one is available.
+    """
+    if tokens is None or updated is None:
+        tokens = float(burst)
+    else:
+        tokens = min(float(burst), tokens + max(now - updated, 0.0) * rate)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / rate
+
+
+class AdmissionState(ABC):
+    """
+    Limiter state that may be shared by every node: the token bucket of each
+    tenant and the leases of the reviews in flight.
+
+    Leases expire, so slots held by a node that died are freed eventually.
+    """
+
+    @abstractmethod
+    async def take_token(
+        self, tenant: str, rate: float, burst: int, now: float
+    ) -> float:
+        """
+        Takes a token from the tenant's bucket; returns 0 on success or the
+        seconds until a token is available.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def acquire_slot(
+        self, lease: str, limit: int, now: float, expires: float
+    ) -> bool:
+        """
+        Records the lease if fewer than `limit` unexpired leases are held.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release_slot(self, lease: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def in_flight(self, now: float) -> int:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+class MemoryAdmissionState(AdmissionState):
+    """
+    In-process state; limits then apply per node.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._leases: Dict[str, float] = {}
+
+    async def take_token(
+        self, tenant: str, rate: float, burst: int, now: float
+    ) -> float:
+        tokens, updated = self._buckets.get(tenant, (None, None))
+        tokens, wait = _refill(tokens, updated, now, rate, burst)
+        self._buckets[tenant] = (tokens, now)
+        return wait
+
+    async def acquire_slot(
+        self, lease: str, limit: int, now: float, expires: float
+    ) -> bool:
+        if await self.in_flight(now) >= limit:
+            return False
+        self._leases[lease] = expires
+        return True
+
+    async def release_slot(self, lease: str) -> None:
+        self._leases.pop(lease, None)
+
+    async def in_flight(self, now: float) -> int:
+        expired = [lease for lease, expires in self._leases.items() if expires <= now]
+        for lease in expired:
+            del self._leases[lease]
+        return len(self._leases)
+
+
+class RedisAdmissionState(AdmissionState):
+    """
+    Redis-backed state shared by every API node.
+
+    Each tenant's bucket is a hash under "<prefix>:bucket:<tenant>"; leases
+    live in the "<prefix>:leases" sorted set, scored by expiry. Updates are
+    optimistic WATCH/MULTI transactions, retried when another node changed
+    the key in between.
+
+    Args:
+        client: A redis.asyncio client (or a compatible stand-in).
+        prefix (str): Key namespace.
+    """
+
+    def __init__(self, client, prefix: str = "admission"):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisAdmissionState":
+        if aioredis is None:
+            raise RuntimeError(
+                "The redis package is required for shared admission control"
+            )
+        return cls(aioredis.from_url(url), **kwargs)
+
+    @property
+    def _leases_key(self) -> str:
+        return f"{self.prefix}:leases"
+
+    async def take_token(
+        self, tenant: str, rate: float, burst: int, now: float
+    ) -> float:
+        key = f"{self.prefix}:bucket:{tenant}"
+        # An idle bucket is full again after burst / rate seconds
+        ttl = max(math.ceil(burst / rate), 1)
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    tokens, updated = await pipe.hmget(key, "tokens", "updated")
+                    tokens, wait = _refill(
+                        float(tokens) if tokens is not None else None,
+                        float(updated) if updated is not None else None,
+                        now,
+                        rate,
+                        burst,
+                    )
+                    pipe.multi()
+                    pipe.hset(key, mapping={"tokens": tokens, "updated": now})
+                    pipe.expire(key, ttl)
+                    await pipe.execute()
+                    return wait
+                except WatchError:
+                    continue
+
+    async def acquire_slot(
+        self, lease: str, limit: int, now: float, expires: float
+    ) -> bool:
+        key = self._leases_key
+        async with self.client.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    if await pipe.zcount(key, f"({now}", "+inf") >= limit:
+                        return False
+                    pipe.multi()
+                    pipe.zremrangebyscore(key, "-inf", now)
+                    pipe.zadd(key, {lease: expires})
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+
+    async def release_slot(self, lease: str) -> None:
+        await self.client.zrem(self._leases_key, lease)
+
+    async def in_flight(self, now: float) -> int:
+        return await self.client.zcount(self._leases_key, f"({now}", "+inf")
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+@dataclass(order=True)
+class _Waiter:
+    """
+    A review queued for a slot, ordered by its weighted fair queuing tag.
+    """
+
+    tag: float
+    sequence: int
+    start: float = field(compare=False)
+    lease: "Lease" = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    granted: bool = field(default=False, compare=False)
+    removed: bool = field(default=False, compare=False)
+
+
+class Lease:
+    """
+    A slot held by one admitted review; released when the review ends.
+
+    Usable as an async context manager, and releasing twice is harmless.
+    """
+
+    def __init__(self, controller: "AdmissionController", tenant: str, lane: str):
+        self.controller = controller
+        self.id = uuid.uuid4().hex
+        self.tenant = tenant
+        self.lane = lane
+        self.admitted_at: Optional[float] = None
+        self.released = False
+
+    async def release(self) -> None:
+        if self.released:
+            return
+        self.released = True
+        await self.controller._release(self)
+
+    async def __aenter__(self) -> "Lease":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.release()
+
+
+class AdmissionController:
+    """
+    Admission control in front of the review pipeline.
+
+    A review first takes a token from its tenant's bucket (refilled at
+    `tenant_rate` per minute, up to `tenant_burst`); without one it is
+    rejected with a 429. It then needs one of `max_in_flight` slots shared by
+    all nodes through `state`. When none is free, it waits in the queue of
+    its priority lane. Lanes are served in strict order of priority (e.g.
+    interactive before batch), and tenants within a lane by weighted fair
+    queuing: each tenant gets slots in proportion to its weight however many
+    reviews it queued. A full lane queue is shed with a 503, a tenant over
+    its share of queued reviews with a 429, and a review still queued after
+    `queue_timeout` with a 503; every rejection carries a Retry-After
+    estimated from recent review durations.
+
+    Reviews submitted as background jobs (admit_job) only take a token from
+    their tenant's bucket, and are shed with a 429 while `max_jobs_queued`
+    jobs are already waiting; they hold no slot.
+
+    Args:
+        state (AdmissionState): Buckets and leases, in memory or in Redis.
+        max_in_flight (int): Reviews running at the same time.
+        lanes (Dict[str, int]): Queue capacity per lane, highest priority
+            first.
+        tenant_rate (float): Reviews per minute per tenant; 0 for no limit.
+        tenant_burst (int): Reviews a tenant may send at once.
+        tenant_max_queue (int): Reviews of one tenant waiting at once.
+        weights (Dict[str, float]): Fair-queuing weight per tenant (1 if not
+            listed).
+        queue_timeout (float): Seconds a review may wait for a slot.
+        max_jobs_queued (int): Background jobs waiting at most before new
+            ones are shed.
+        lease_seconds (float): Seconds after which the slot of a review that
+            never released it (e.g. its node died) is reclaimed.
+        service_seconds (float): Initial estimate of a review's duration,
+            for Retry-After.
+        poll_interval (float): Seconds between checks for slots freed by
+            other nodes while reviews are queued.
+        clock (Callable[[], float]): Epoch time source, for tests.
+    """
+
+    def __init__(
+        self,
+        state: AdmissionState,
+        max_in_flight: int = 32,
+        lanes: Optional[Dict[str, int]] = None,
+        tenant_rate: float = 0.0,
+        tenant_burst: int = 10,
+        tenant_max_queue: int = 20,
+        weights: Optional[Dict[str, float]] = None,
+        queue_timeout: float = 30.0,
+        max_jobs_queued: int = 1000,
+        lease_seconds: float = 900.0,
+        service_seconds: float = 10.0,
+        poll_interval: float = 0.05,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.state = state
+        self.max_in_flight = max_in_flight
+        self.lanes = dict(lanes or {"interactive": 100, "batch": 100})
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.tenant_max_queue = tenant_max_queue
+        self.weights = dict(weights or {})
+        self.queue_timeout = queue_timeout
+        self.max_jobs_queued = max_jobs_queued
+        self.lease_seconds = lease_seconds
+        self.service_seconds = service_seconds
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._queues: Dict[str, List[_Waiter]] = {lane: [] for lane in self.lanes}
+        self._queued: Counter = Counter()
+        self._tenant_queued: Counter = Counter()
+        # Virtual time of every lane, and the last finish tag of every tenant
+        self._virtual: Dict[str, float] = {lane: 0.0 for lane in self.lanes}
+        self._finish: Dict[Tuple[str, str], float] = {}
+        self._sequence = itertools.count()
+        self._dispatching = asyncio.Lock()
+        self._poller: Optional[asyncio.Task] = None
+        self.in_flight = 0
+        self.outcomes: Counter = Counter()
+
+    @classmethod
+    def from_env(cls, state: AdmissionState) -> "AdmissionController":
+        """
+        Builds a controller from the ADMISSION_* environment variables.
+
+        Lanes come from ADMISSION_LANES, highest priority first; each lane's
+        queue capacity is ADMISSION_{LANE}_MAX_QUEUE, falling back to
+        ADMISSION_MAX_QUEUE. ADMISSION_TENANT_WEIGHTS lists "tenant=weight"
+        pairs separated by commas.
+
+        Args:
+            state (AdmissionState): Buckets and leases to use.
+        """
+        lanes = [
+            lane.strip().lower()
+            for lane in os.getenv("ADMISSION_LANES", "interactive,batch").split(",")
+            if lane.strip()
+        ]
+        weights = {}
+        for pair in os.getenv("ADMISSION_TENANT_WEIGHTS", "").split(","):
+            tenant, _, weight = pair.partition("=")
+            if tenant.strip() and weight.strip():
+                weights[tenant.strip()] = float(weight)
+        return cls(
+            state,
+            max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32")),
+            lanes={
+                lane: int(
+                    os.getenv(f"ADMISSION_{lane.upper()}_MAX_QUEUE")
+                    or os.getenv("ADMISSION_MAX_QUEUE", "100")
+                )
+                for lane in lanes
+            },
+            tenant_rate=float(os.getenv("ADMISSION_TENANT_RATE", "0")),
+            tenant_burst=int(os.getenv("ADMISSION_TENANT_BURST", "10")),
+            tenant_max_queue=int(os.getenv("ADMISSION_TENANT_MAX_QUEUE", "20")),
+            weights=weights,
+            queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30")),
+            max_jobs_queued=int(os.getenv("ADMISSION_MAX_JOBS_QUEUED", "1000")),
+            lease_seconds=float(os.getenv("ADMISSION_LEASE_SECONDS", "900")),
+        )
+
+    async def admit(self, tenant: str, lane: str) -> Lease:
+        """
+        Waits until the review may run.
+
+        Args:
+            tenant (str): Tenant the review is accounted to.
+            lane (str): Priority lane, one of `lanes`.
+
+        Returns:
+            Lease: The review's slot, to be released once it ends.
+
+        Raises:
+            ValueError: If the lane is unknown.
+            AdmissionRejected: If the review is rate limited or shed.
+        """
+        await self._take_token(tenant, lane)
+
+        lease = Lease(self, tenant, lane)
+        # Queued reviews go first; a new one only skips the queue if it is empty
+        if not sum(self._queued.values()) and await self._acquire(lease):
+            self._admitted(lease, "admitted", 0.0)
+            return lease
+
+        if self._queued[lane] >= self.lanes[lane]:
+            self._reject(
+                lane,
+                503,
+                "overloaded",
+                f"The review service is overloaded ({self._queued[lane]} "
+                f"{lane} reviews queued)",
+                self._retry_after(),
+            )
+        if self._tenant_queued[tenant] >= self.tenant_max_queue:
+            self._reject(
+                lane,
+                429,
+                "tenant_queue_full",
+                f"Tenant {tenant} already has {self._tenant_queued[tenant]} "
+                "reviews queued",
+                self._retry_after(),
+            )
+
+        waiter = self._enqueue(lease)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter.future), self.queue_timeout or None
+            )
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            self._remove(waiter)
+            if waiter.granted:
+                # Admitted just as the wait ended; give the slot to the next one
+                await lease.release()
+            if isinstance(error, asyncio.CancelledError):
+                raise
+            self._reject(
+                lane,
+                503,
+                "queue_timeout",
+                f"The review waited {self.queue_timeout:g}s without being admitted",
+                self._retry_after(),
+            )
+        self._admitted(lease, "queued", time.monotonic() - started)
+        return lease
+
+    async def admit_job(self, tenant: str, lane: str, queued: int) -> None:
+        """
+        Admits a review submitted as a background job.
+
+        Args:
+            tenant (str): Tenant the review is accounted to.
+            lane (str): Priority lane, one of `lanes`.
+            queued (int): Jobs already waiting in the job queue.
+
+        Raises:
+            ValueError: If the lane is unknown.
+            AdmissionRejected: If the tenant is rate limited or the job queue
+                is full.
+        """
+        await self._take_token(tenant, lane)
+        if queued >= self.max_jobs_queued:
+            # Until enough of the backlog drains for one more job to fit
+            backlog = queued - self.max_jobs_queued + 1
+            self._reject(
+                lane,
+                429,
+                "jobs_queue_full",
+                f"The review service has {queued} review jobs queued",
+                max(self.service_seconds * backlog / max(self.max_in_flight, 1), 1.0),
+            )
+        self.outcomes["job_queued"] += 1
+        metrics.admission_requests.inc(lane=lane, outcome="job_queued")
+
+    def stats(self) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queued": {lane: self._queued[lane] for lane in self.lanes},
+            "tenants_queued": sum(1 for count in self._tenant_queued.values() if count),
+            "tenant_rate_per_minute": self.tenant_rate,
+            "service_seconds": round(self.service_seconds, 3),
+            "outcomes": dict(self.outcomes),
+        }
+
+    async def aclose(self) -> None:
+        if self._poller is not None:
+            self._poller.cancel()
+        await self.state.aclose()
+
+    async def _take_token(self, tenant: str, lane: str) -> None:
+        if lane not in self.lanes:
+            raise ValueError(
+                f"Unknown priority lane {lane!r}, expected one of "
+                f"{', '.join(self.lanes)}"
+            )
+        if self.tenant_rate > 0:
+            wait = await self.state.take_token(
+                tenant, self.tenant_rate / 60, self.tenant_burst, self.clock()
+            )
+            if wait > 0:
+                self._reject(
+                    lane,
+                    429,
+                    "rate_limited",
+                    f"Tenant {tenant} is over its rate limit of "
+                    f"{self.tenant_rate:g} reviews per minute",
+                    wait,
+                )
+
+    def _enqueue(self, lease: Lease) -> _Waiter:
+        key = (lease.lane, lease.tenant)
+        start = max(self._virtual[lease.lane], self._finish.get(key, 0.0))
+        tag = start + 1 / self.weights.get(lease.tenant, 1.0)
+        self._finish[key] = tag
+        waiter = _Waiter(
+            tag,
+            next(self._sequence),
+            start,
+            lease,
+            asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self._queues[lease.lane], waiter)
+        self._queued[lease.lane] += 1
+        self._tenant_queued[lease.tenant] += 1
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return waiter
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter.removed:
+            return
+        waiter.removed = True
+        self._queued[waiter.lease.lane] -= 1
+        self._tenant_queued[waiter.lease.tenant] -= 1
+        if not self._tenant_queued[waiter.lease.tenant]:
+            del self._tenant_queued[waiter.lease.tenant]
+
+    def _next(self) -> Optional[_Waiter]:
+        """
+        Returns the waiter to admit next: the smallest tag of the highest
+        priority lane with a queue.
+        """
+        for queue in self._queues.values():
+            while queue and queue[0].removed:
+                heapq.heappop(queue)
+            if queue:
+                return queue[0]
+        return None
+
+    async def _dispatch(self) -> None:
+        """
+        Admits queued reviews while slots are free.
+        """
+        async with self._dispatching:
+            while (waiter := self._next()) is not None:
+                if not await self._acquire(waiter.lease):
+                    return
+                if waiter.removed:
+                    # Gave up while the slot was being acquired
+                    await self.state.release_slot(waiter.lease.id)
+                    self.in_flight -= 1
+                    continue
+                lane = waiter.lease.lane
+                self._virtual[lane] = max(self._virtual[lane], waiter.start)
+                key = (lane, waiter.lease.tenant)
+                if self._finish.get(key, 0.0) <= self._virtual[lane]:
+                    self._finish.pop(key, None)
+                self._remove(waiter)
+                waiter.granted = True
+                waiter.future.set_result(None)
+
+    async def _poll(self) -> None:
+        """
+        Keeps dispatching while reviews are queued, so slots freed by other
+        nodes are noticed.
+        """
+        while sum(self._queued.values()):
+            await self._dispatch()
+            await asyncio.sleep(self.poll_interval)
+
+    async def _acquire(self, lease: Lease) -> bool:
+        now = self.clock()
+        acquired = await self.state.acquire_slot(
+            lease.id, self.max_in_flight, now, now + self.lease_seconds
+        )
+        if acquired:
+            self.in_flight += 1
+        return acquired
+
+    async def _release(self, lease: Lease) -> None:
+        await self.state.release_slot(lease.id)
+        self.in_flight -= 1
+        if lease.admitted_at is not None:
+            duration = time.monotonic() - lease.admitted_at
+            # Moving average of review durations, used for Retry-After
+            self.service_seconds += 0.2 * (duration - self.service_seconds)
+        await self._dispatch()
+
+    def _admitted(self, lease: Lease, outcome: str, waited: float) -> None:
+        lease.admitted_at = time.monotonic()
+        self.outcomes[outcome] += 1
+        metrics.admission_requests.inc(lane=lease.lane, outcome=outcome)
+        metrics.admission_wait_seconds.observe(waited, lane=lease.lane)
+
+    def _retry_after(self) -> float:
+        """
+        Estimates when a slot frees up for a review queued now.
+        """
+        queued = sum(self._queued.values())
+        return max(
+            self.service_seconds * (queued + 1) / max(self.max_in_flight, 1), 1.0
+        )
+
+    def _reject(
+        self,
+        lane: str,
+        status_code: int,
+        reason: str,
+        message: str,
+        retry_after: float,
+    ) -> None:
+        self.outcomes[reason] += 1
+        metrics.admission_requests.inc(lane=lane, outcome=reason)
+        raise AdmissionRejected(message, status_code, reason, retry_after)
+
+
+def create_admission_controller() -> Optional[AdmissionController]:
+    """
+    Builds the admission controller, or None when ADMISSION_CONTROL is off.
+
+    ADMISSION_BACKEND selects where its state lives: "memory" (per node) or
+    "redis" (REDIS_URL, shared by every node).
+    """
+    if not ADMISSION_CONTROL:
+        return None
+    backend = os.getenv("ADMISSION_BACKEND", "memory").lower()
+    if backend == "redis":
+        state = RedisAdmissionState.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        )
+    elif backend == "memory":
+        state = MemoryAdmissionState()
+    else:
+        raise ValueError(f"Unknown admission backend: {backend}")
+    return AdmissionController.from_env(state)
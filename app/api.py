@@ -1,18 +1,103 @@
+import asyncio
+import math
 import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Literal, Optional
 
-from fastapi import Depends, FastAPI, HTTPException
-from pydantic import BaseModel, HttpUrl
+from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, HttpUrl, field_validator
 
-from app.exceptions import ReviewServiceError
-from app.review_service import perform_code_review
+from app import metrics
+from app.admission import (
+    ADMISSION_LANE_HEADER,
+    AdmissionController,
+    Lease,
+    create_admission_controller,
+    tenant_of,
+)
+from app.batch import BATCH_MAX_REPOSITORIES, BatchScheduler, TokenChooser
+from app.cache import ReviewResultCache, SnapshotCache, create_cache_backend
+from app.clients import ClientPool
+from app.events import format_sse
+from app.exceptions import AdmissionRejected, CircuitOpenError, ReviewServiceError
+from app.fingerprints import FingerprintIndex, create_fingerprint_index
+from app.gpt import close_openai_clients, completion_hedgers
+from app.incremental import FragmentStore, create_fragment_store
+from app.jobs import (
+    JobQueue,
+    WorkerPool,
+    build_review_handler,
+    create_job_queue,
+    new_job,
+)
+from app.preanalysis import pre_analyzer
+from app.review_service import perform_code_review, perform_pull_review
+from app.webhooks import WebhookPolicy, WebhookRejected
 
-app = FastAPI(title="Code Review API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Owns the pooled HTTP clients, the caches, the job queue, the admission
+    controller and the in-process review workers for the lifetime of the
+    application.
+
+    Set JOB_WORKERS=0 on API-only nodes when dedicated worker nodes
+    (app.worker) drain a Redis-backed queue.
+    """
+    clients = app.state.clients = ClientPool()
+    app.state.result_cache = ReviewResultCache.from_env()
+    cache_backend = create_cache_backend()
+    app.state.snapshot_cache = SnapshotCache(cache_backend) if cache_backend else None
+    app.state.fragment_store = create_fragment_store(cache_backend)
+    app.state.fingerprint_index = create_fingerprint_index()
+    app.state.job_queue = create_job_queue()
+    app.state.batch_scheduler = BatchScheduler.from_env()
+    admission = app.state.admission = create_admission_controller()
+
+    workers = int(os.getenv("JOB_WORKERS", "4"))
+    worker_pool = None
+    if workers > 0:
+        worker_pool = WorkerPool(
+            app.state.job_queue,
+            build_review_handler(
+                clients,
+                app.state.snapshot_cache,
+                app.state.result_cache,
+                app.state.fragment_store,
+                app.state.fingerprint_index,
+            ),
+            concurrency=workers,
+            http_client=clients.webhooks,
+        )
+        worker_pool.start()
+    try:
+        yield
+    finally:
+        if worker_pool is not None:
+            await worker_pool.stop()
+        await app.state.job_queue.aclose()
+        del app.state.clients, app.state.snapshot_cache, app.state.result_cache
+        del app.state.fragment_store, app.state.fingerprint_index
+        del app.state.job_queue, app.state.batch_scheduler, app.state.admission
+        if admission is not None:
+            await admission.aclose()
+        await clients.aclose()
+        await close_openai_clients()
+        pre_analyzer.close()
+        if cache_backend is not None:
+            await cache_backend.aclose()
+
+
+app = FastAPI(title="Code Review API", lifespan=lifespan)
 
 
 class CodeReviewRequest(BaseModel):
     github_repo_url: HttpUrl
     assignment_description: str
     candidate_level: str
+    fetch_strategy: Optional[Literal["contents", "tree"]] = None
 
     model_config = {
         "json_schema_extra": {
@@ -25,9 +110,64 @@ class CodeReviewRequest(BaseModel):
     }
 
 
-async def get_tokens():
-    github_token = os.getenv("GITHUB_TOKEN")
-    openai_key = os.getenv("OPENAI_API_KEY")
+class PullReviewRequest(BaseModel):
+    pull_request_url: HttpUrl
+    assignment_description: str
+    candidate_level: str
+    diff_source: Optional[Literal["files", "diff"]] = None
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "pull_request_url": "https://github.com/username/repo/pull/1",
+                "assignment_description": "Build a REST API with user authentication",
+                "candidate_level": "Senior",
+            }
+        }
+    }
+
+
+class ReviewJobRequest(CodeReviewRequest):
+    webhook_url: Optional[HttpUrl] = None
+
+    @field_validator("webhook_url")
+    @classmethod
+    def webhook_url_must_be_allowed(cls, url: Optional[HttpUrl]):
+        if url is not None:
+            WebhookPolicy.from_env().check_url(str(url))
+        return url
+
+
+class BatchReviewRequest(BaseModel):
+    github_repo_urls: List[HttpUrl] = Field(
+        min_length=1, max_length=BATCH_MAX_REPOSITORIES
+    )
+    assignment_description: str
+    candidate_level: str
+    fetch_strategy: Optional[Literal["contents", "tree"]] = None
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "github_repo_urls": [
+                    "https://github.com/candidate-1/repo",
+                    "https://github.com/candidate-2/repo",
+                ],
+                "assignment_description": "Build a REST API with user authentication",
+                "candidate_level": "Middle",
+            }
+        }
+    }
+
+
+async def get_tokens(request: Request):
+    clients = get_client_pool(request)
+    if clients is not None:
+        # Spread reviews over the configured tokens by remaining quota
+        github_token, openai_key = clients.choose_tokens()
+    else:
+        github_token = os.getenv("GITHUB_TOKEN")
+        openai_key = os.getenv("OPENAI_API_KEY")
 
     if not github_token or not openai_key:
         raise HTTPException(
@@ -36,27 +176,459 @@ async def get_tokens():
     return github_token, openai_key
 
 
+def get_client_pool(request: Request) -> Optional[ClientPool]:
+    # None when the app runs without its lifespan (e.g. bare test transports)
+    return getattr(request.app.state, "clients", None)
+
+
+def get_snapshot_cache(request: Request) -> Optional[SnapshotCache]:
+    return getattr(request.app.state, "snapshot_cache", None)
+
+
+def get_result_cache(request: Request) -> Optional[ReviewResultCache]:
+    return getattr(request.app.state, "result_cache", None)
+
+
+def get_fragment_store(request: Request) -> Optional[FragmentStore]:
+    return getattr(request.app.state, "fragment_store", None)
+
+
+def get_fingerprint_index(request: Request) -> Optional[FingerprintIndex]:
+    return getattr(request.app.state, "fingerprint_index", None)
+
+
+def get_batch_scheduler(request: Request) -> BatchScheduler:
+    scheduler = getattr(request.app.state, "batch_scheduler", None)
+    # Without the lifespan, limits only apply within the one request
+    return scheduler or BatchScheduler.from_env()
+
+
+def get_token_chooser(
+    tokens: tuple = Depends(get_tokens),
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+) -> TokenChooser:
+    if clients is not None:
+        # Every repository of a batch gets the credentials with most quota left
+        return clients.choose_tokens
+    return lambda: tokens
+
+
+def get_admission(request: Request) -> Optional[AdmissionController]:
+    return getattr(request.app.state, "admission", None)
+
+
+async def admission_lease(request: Request, lane: str) -> Optional[Lease]:
+    """
+    Waits until the review of a request is admitted.
+
+    The tenant comes from the request headers (see tenant_of) and the lane
+    from the ADMISSION_LANE_HEADER header, defaulting to `lane`. Reviews are
+    admitted explicitly in the endpoints rather than by a dependency, so that
+    a request failing validation never holds a slot.
+
+    Returns:
+        Lease, optional: The slot to release once the review ends; None
+        without admission control.
+
+    Raises:
+        HTTPException: 429 or 503 with Retry-After when the review is
+            rejected, 400 for an unknown lane.
+    """
+    admission = get_admission(request)
+    if admission is None:
+        return None
+    lane = _admission_lane(request, admission, lane)
+    try:
+        return await admission.admit(tenant_of(request.headers), lane)
+    except AdmissionRejected as e:
+        raise _rejection(e)
+
+
+async def admit_job(request: Request, lane: str, job_queue: JobQueue) -> None:
+    """
+    Admits a review submitted as a background job: charges its tenant's
+    rate limit and sheds it while the job queue is full.
+
+    Raises:
+        HTTPException: 429 with Retry-After when the job is rejected, 400 for
+            an unknown lane.
+    """
+    admission = get_admission(request)
+    if admission is None:
+        return
+    lane = _admission_lane(request, admission, lane)
+    try:
+        await admission.admit_job(
+            tenant_of(request.headers), lane, await job_queue.depth()
+        )
+    except AdmissionRejected as e:
+        raise _rejection(e)
+
+
+def _admission_lane(request: Request, admission: AdmissionController, lane: str) -> str:
+    lane = request.headers.get(ADMISSION_LANE_HEADER, lane).strip().lower()
+    if lane not in admission.lanes:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown priority lane {lane!r}, expected one of "
+            f"{', '.join(admission.lanes)}",
+        )
+    return lane
+
+
+def _rejection(error: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+@asynccontextmanager
+async def admitted(request: Request, lane: str):
+    """
+    Holds an admission slot (see admission_lease) for the enclosed review.
+    """
+    lease = await admission_lease(request, lane)
+    try:
+        yield
+    finally:
+        if lease is not None:
+            await lease.release()
+
+
+def get_job_queue(request: Request) -> JobQueue:
+    job_queue = getattr(request.app.state, "job_queue", None)
+    if job_queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is not available")
+    return job_queue
+
+
 @app.post("/review")
 async def create_code_review(
-    request: CodeReviewRequest, tokens: tuple = Depends(get_tokens)
+    request: CodeReviewRequest,
+    http_request: Request,
+    tokens: tuple = Depends(get_tokens),
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+    snapshot_cache: Optional[SnapshotCache] = Depends(get_snapshot_cache),
+    result_cache: Optional[ReviewResultCache] = Depends(get_result_cache),
+    fragment_store: Optional[FragmentStore] = Depends(get_fragment_store),
+    fingerprint_index: Optional[FingerprintIndex] = Depends(get_fingerprint_index),
 ):
     """
     Create a code review for a GitHub repository
+
+    Reviews are admitted per tenant in the "interactive" lane unless the
+    X-Priority header names another; see app.admission.
     """
     github_token, openai_key = tokens
 
     request_data = request.model_dump()
     request_data["github_repo_url"] = str(request.github_repo_url)
 
+    async with admitted(http_request, "interactive"):
+        try:
+            return await perform_code_review(
+                request=request_data,
+                github_token=github_token,
+                openai_key=openai_key,
+                http_client=clients.github if clients else None,
+                openai_client=clients.openai(openai_key) if clients else None,
+                snapshot_cache=snapshot_cache,
+                result_cache=result_cache,
+                fragment_store=fragment_store,
+                fingerprint_index=fingerprint_index,
+            )
+        except CircuitOpenError as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+        except ReviewServiceError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/review/pull")
+async def create_pull_review(
+    request: PullReviewRequest,
+    http_request: Request,
+    tokens: tuple = Depends(get_tokens),
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+    result_cache: Optional[ReviewResultCache] = Depends(get_result_cache),
+):
+    """
+    Review only the changes of a pull request, with comments anchored to
+    the changed lines
+    """
+    github_token, openai_key = tokens
+
+    request_data = request.model_dump()
+    request_data["pull_request_url"] = str(request.pull_request_url)
+
+    async with admitted(http_request, "interactive"):
+        try:
+            return await perform_pull_review(
+                request=request_data,
+                github_token=github_token,
+                openai_key=openai_key,
+                http_client=clients.github if clients else None,
+                openai_client=clients.openai(openai_key) if clients else None,
+                result_cache=result_cache,
+            )
+        except CircuitOpenError as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e),
+                headers={"Retry-After": str(math.ceil(e.retry_after))},
+            )
+        except ReviewServiceError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception:
+            raise HTTPException(status_code=500, detail="Internal server error")
+
+
+class LeasedStreamingResponse(StreamingResponse):
+    """
+    Streaming response that releases an admission lease however the stream
+    ends: completed, failed, or cut off by a client that disconnected before
+    the first event, when the body generator never even starts.
+    """
+
+    def __init__(self, content, lease: Optional[Lease], **kwargs):
+        super().__init__(content, **kwargs)
+        self.lease = lease
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.lease is not None:
+                # Shielded so a cancelled request still frees its slot
+                await asyncio.shield(self.lease.release())
+
+
+async def event_stream_response(
+    stream: AsyncIterator[str], lease: Optional[Lease]
+) -> StreamingResponse:
+    """
+    Sends Server-Sent Events from `stream`, holding `lease` until it ends.
+    """
     try:
-        result = await perform_code_review(
-            request=request_data, github_token=github_token, openai_key=openai_key
+        return LeasedStreamingResponse(
+            stream,
+            lease,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-        return result
-    except ReviewServiceError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail="Internal server error")
+    except BaseException:
+        if lease is not None:
+            await lease.release()
+        raise
+
+
+@app.post("/review/stream")
+async def stream_code_review(
+    request: CodeReviewRequest,
+    http_request: Request,
+    tokens: tuple = Depends(get_tokens),
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+    snapshot_cache: Optional[SnapshotCache] = Depends(get_snapshot_cache),
+    result_cache: Optional[ReviewResultCache] = Depends(get_result_cache),
+    fragment_store: Optional[FragmentStore] = Depends(get_fragment_store),
+    fingerprint_index: Optional[FingerprintIndex] = Depends(get_fingerprint_index),
+):
+    """
+    Create a code review, streaming progress as Server-Sent Events
+
+    Events: started, files_discovered, file_fetched, batch_started, comment,
+    batch_completed, merging, then either result or error.
+    """
+    github_token, openai_key = tokens
+
+    request_data = request.model_dump()
+    request_data["github_repo_url"] = str(request.github_repo_url)
+
+    # Admitted before the stream starts, so a rejection is a plain 429/503
+    lease = await admission_lease(http_request, "interactive")
+    # Bounded so a slow client applies back-pressure instead of piling up events
+    events: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+    async def progress(event: str, data: dict) -> None:
+        await events.put((event, data))
+
+    async def run_review() -> None:
+        try:
+            result = await perform_code_review(
+                request=request_data,
+                github_token=github_token,
+                openai_key=openai_key,
+                http_client=clients.github if clients else None,
+                openai_client=clients.openai(openai_key) if clients else None,
+                snapshot_cache=snapshot_cache,
+                result_cache=result_cache,
+                progress=progress,
+                fragment_store=fragment_store,
+                fingerprint_index=fingerprint_index,
+            )
+            await events.put(("result", result))
+        except ReviewServiceError as e:
+            await events.put(("error", {"detail": str(e)}))
+        except Exception:
+            await events.put(("error", {"detail": "Internal server error"}))
+        finally:
+            await events.put(None)
+
+    async def event_stream():
+        task = asyncio.create_task(run_review())
+        try:
+            yield format_sse(
+                "started", {"github_repo_url": request_data["github_repo_url"]}
+            )
+            while (item := await events.get()) is not None:
+                yield format_sse(*item)
+        finally:
+            # Stops the review if the client disconnects early
+            task.cancel()
+
+    return await event_stream_response(event_stream(), lease)
+
+
+@app.post("/review/batch")
+async def batch_code_review(
+    request: BatchReviewRequest,
+    http_request: Request,
+    choose_tokens: TokenChooser = Depends(get_token_chooser),
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+    scheduler: BatchScheduler = Depends(get_batch_scheduler),
+    snapshot_cache: Optional[SnapshotCache] = Depends(get_snapshot_cache),
+    result_cache: Optional[ReviewResultCache] = Depends(get_result_cache),
+    fingerprint_index: Optional[FingerprintIndex] = Depends(get_fingerprint_index),
+):
+    """
+    Review many repositories against one assignment, streaming each result
+    as a Server-Sent Event as soon as it is ready
+
+    Events: started, then result or error per repository (with its index in
+    the request), then completed. The whole batch holds one admission slot
+    in the "batch" lane.
+    """
+    repo_urls = [str(url) for url in request.github_repo_urls]
+    lease = await admission_lease(http_request, "batch")
+
+    async def event_stream():
+        yield format_sse("started", {"repositories": len(repo_urls)})
+        succeeded = failed = 0
+        async for event, data in scheduler.review(
+            repo_urls,
+            request.assignment_description,
+            request.candidate_level,
+            choose_tokens,
+            fetch_strategy=request.fetch_strategy,
+            http_client=clients.github if clients else None,
+            openai_client=clients.openai if clients else None,
+            snapshot_cache=snapshot_cache,
+            result_cache=result_cache,
+            fingerprint_index=fingerprint_index,
+        ):
+            if event == "result":
+                succeeded += 1
+            else:
+                failed += 1
+            yield format_sse(event, data)
+        yield format_sse("completed", {"succeeded": succeeded, "failed": failed})
+
+    return await event_stream_response(event_stream(), lease)
+
+
+@app.post("/review/batch/openai")
+async def batch_api_file(
+    request: BatchReviewRequest,
+    http_request: Request,
+    choose_tokens: TokenChooser = Depends(get_token_chooser),
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+    scheduler: BatchScheduler = Depends(get_batch_scheduler),
+    snapshot_cache: Optional[SnapshotCache] = Depends(get_snapshot_cache),
+):
+    """
+    Fetch many repositories and return an OpenAI Batch API input file
+    (JSONL) with their review requests
+
+    Building the file holds one admission slot in the "batch" lane.
+    """
+    repo_urls = [str(url) for url in request.github_repo_urls]
+    lease = await admission_lease(http_request, "batch")
+
+    async def lines():
+        async for line in scheduler.batch_api_lines(
+            repo_urls,
+            request.assignment_description,
+            request.candidate_level,
+            choose_tokens,
+            fetch_strategy=request.fetch_strategy,
+            http_client=clients.github if clients else None,
+            snapshot_cache=snapshot_cache,
+        ):
+            yield line + "\n"
+
+    try:
+        return LeasedStreamingResponse(
+            lines(),
+            lease,
+            media_type="application/jsonl",
+            headers={"Content-Disposition": 'attachment; filename="reviews.jsonl"'},
+        )
+    except BaseException:
+        if lease is not None:
+            await lease.release()
+        raise
+
+
+@app.post("/reviews", status_code=status.HTTP_202_ACCEPTED)
+async def submit_code_review(
+    request: ReviewJobRequest,
+    http_request: Request,
+    job_queue: JobQueue = Depends(get_job_queue),
+):
+    """
+    Queue a code review and return its job id immediately
+
+    The job is admitted in the "batch" lane when it is submitted: it counts
+    against its tenant's rate limit, and is rejected while the job queue is
+    full.
+    """
+    request_data = request.model_dump(exclude={"webhook_url"})
+    request_data["github_repo_url"] = str(request.github_repo_url)
+    webhook_url = str(request.webhook_url) if request.webhook_url else None
+    if webhook_url is not None:
+        try:
+            await WebhookPolicy.from_env().check_destination(webhook_url)
+        except WebhookRejected as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    await admit_job(http_request, "batch", job_queue)
+
+    job = new_job(request_data, webhook_url=webhook_url)
+    await job_queue.enqueue(job)
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/reviews/{job['job_id']}",
+    }
+
+
+@app.get("/reviews/{job_id}")
+async def get_code_review_job(
+    job_id: str, job_queue: JobQueue = Depends(get_job_queue)
+):
+    """
+    Return the status of a queued review and its result once finished
+    """
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 
 @app.get("/health")
@@ -65,3 +637,41 @@ async def health_check():
     Simple health check endpoint
     """
     return {"status": "healthy"}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Review pipeline metrics in the Prometheus text format
+    """
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/stats")
+async def stats(
+    clients: Optional[ClientPool] = Depends(get_client_pool),
+    snapshot_cache: Optional[SnapshotCache] = Depends(get_snapshot_cache),
+    result_cache: Optional[ReviewResultCache] = Depends(get_result_cache),
+    fragment_store: Optional[FragmentStore] = Depends(get_fragment_store),
+    fingerprint_index: Optional[FingerprintIndex] = Depends(get_fingerprint_index),
+    scheduler: BatchScheduler = Depends(get_batch_scheduler),
+    admission: Optional[AdmissionController] = Depends(get_admission),
+):
+    """
+    Connection pool and cache statistics
+    """
+    return {
+        "http": clients.stats() if clients else {},
+        "github_rate_limit": clients.github_rate_limiter.stats() if clients else {},
+        "credentials": clients.credential_stats() if clients else {},
+        "circuit_breakers": clients.breaker_stats() if clients else {},
+        "llm_backends": clients.backend_stats() if clients else {},
+        "hedging": completion_hedgers.stats(),
+        "preanalysis": pre_analyzer.stats(),
+        "batch": scheduler.stats(),
+        "admission": admission.stats() if admission else {},
+        "snapshot_cache": snapshot_cache.stats() if snapshot_cache else {},
+        "result_cache": result_cache.stats() if result_cache else {},
+        "fragments": fragment_store.stats() if fragment_store else {},
+        "fingerprints": fingerprint_index.stats() if fingerprint_index else {},
+    }
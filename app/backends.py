@@ -0,0 +1,250 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+# Names of the OpenAI-compatible backends completions can be sent to; the
+# first one gets every model not listed in another backend's LLM_{NAME}_MODELS
+LLM_BACKENDS = [
+    name.strip().lower()
+    for name in os.getenv("LLM_BACKENDS", "openai").split(",")
+    if name.strip()
+] or ["openai"]
+
+
+@dataclass(frozen=True)
+class BackendSettings:
+    """
+    Where and how completions of one LLM backend are sent.
+
+    Attributes:
+        name (str): Backend name, also the LLM_{NAME}_* variable prefix.
+        base_url (str, optional): Root of the OpenAI-compatible API, e.g.
+            "http://localhost:8001/v1"; None for the OpenAI API (or the
+            OPENAI_BASE_URL variable read by the SDK).
+        api_key (str, optional): Key sent to the backend instead of the
+            review's OpenAI key, e.g. for a self-hosted server.
+        max_concurrency (int): Completions in flight at the same time across
+            all reviews; 0 for no limit.
+        timeout (float, optional): Overall timeout for a single completion;
+            None for the client pool's OPENAI_TIMEOUT.
+        models (Tuple[str, ...]): Models routed to this backend.
+    """
+
+    name: str = "openai"
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    max_concurrency: int = 0
+    timeout: Optional[float] = None
+    models: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_env(cls, name: str) -> "BackendSettings":
+        """
+        Builds the settings of a backend from LLM_{NAME}_* variables.
+
+        Args:
+            name (str): Backend name, e.g. "local".
+        """
+        prefix = f"LLM_{name.upper()}_"
+        timeout = os.getenv(f"{prefix}TIMEOUT")
+        models = os.getenv(f"{prefix}MODELS", "")
+        return cls(
+            name=name,
+            base_url=os.getenv(f"{prefix}BASE_URL") or None,
+            api_key=os.getenv(f"{prefix}API_KEY") or None,
+            max_concurrency=int(os.getenv(f"{prefix}MAX_CONCURRENCY", "0")),
+            timeout=float(timeout) if timeout else None,
+            models=tuple(model.strip() for model in models.split(",") if model.strip()),
+        )
+
+
+def backend_settings() -> List[BackendSettings]:
+    """
+    Returns the settings of every backend in LLM_BACKENDS, the default one
+    first.
+    """
+    return [BackendSettings.from_env(name) for name in LLM_BACKENDS]
+
+
+class ConcurrencyLimiter:
+    """
+    Caps the requests in flight to one backend.
+
+    A request holds its slot until its response is closed, so a streamed
+    completion counts until its last chunk has been read.
+
+    Args:
+        limit (int): Requests allowed in flight; 0 for no limit.
+    """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self) -> None:
+        self.requests += 1
+        if self._semaphore is not None:
+            if self._semaphore.locked():
+                self.waited += 1
+            started = time.monotonic()
+            await self._semaphore.acquire()
+            self.wait_seconds += time.monotonic() - started
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        return {
+            "max_concurrency": self.limit,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waited": self.waited,
+            "wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """
+    Response body that gives the limiter slot back once it is closed.
+    """
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            release, self._release = self._release, None
+            if release is not None:
+                release()
+
+
+class ConcurrencyLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that sends every request within a ConcurrencyLimiter
+    slot, released when the response is closed.
+    """
+
+    def __init__(
+        self, transport: httpx.AsyncBaseTransport, limiter: ConcurrencyLimiter
+    ):
+        self._transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await self.limiter.acquire()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.limiter.release()
+            raise
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, self.limiter.release),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class LLMBackend:
+    """
+    One OpenAI-compatible backend: its settings, its pooled HTTP client and
+    an AsyncOpenAI client per API key.
+
+    Args:
+        settings (BackendSettings): Where and how completions are sent.
+        http (httpx.AsyncClient): Pooled client whose transport is limited
+            by `limiter`.
+        limiter (ConcurrencyLimiter): Caps the completions in flight.
+    """
+
+    def __init__(
+        self,
+        settings: BackendSettings,
+        http: httpx.AsyncClient,
+        limiter: ConcurrencyLimiter,
+    ):
+        self.settings = settings
+        self.http = http
+        self.limiter = limiter
+        self._clients: Dict[str, AsyncOpenAI] = {}
+
+    def client(self, api_key: str) -> AsyncOpenAI:
+        """
+        Returns the backend's client for the key; the backend's own key, when
+        configured, is used instead.
+        """
+        api_key = self.settings.api_key or api_key
+        client = self._clients.get(api_key)
+        if client is None:
+            client = self._clients[api_key] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=self.settings.base_url,
+                http_client=self.http,
+                timeout=self.settings.timeout,
+            )
+        return client
+
+    def stats(self) -> Dict:
+        return {
+            "base_url": self.settings.base_url or "default",
+            "models": list(self.settings.models),
+            "timeout": self.settings.timeout,
+            **self.limiter.stats(),
+        }
+
+
+class BackendRouter:
+    """
+    Client sending every chat completion to the backend serving its model.
+
+    Only `chat.completions.create` is routed; any other attribute is taken
+    from the default backend's client.
+
+    Args:
+        backends (List[LLMBackend]): Backends, the default one first.
+        api_key (str): OpenAI key of the review.
+    """
+
+    def __init__(self, backends: List[LLMBackend], api_key: str):
+        self._default = backends[0]
+        self._routes = {
+            model: backend for backend in backends for model in backend.settings.models
+        }
+        self._api_key = api_key
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def backend(self, model: Optional[str]) -> LLMBackend:
+        return self._routes.get(model, self._default)
+
+    async def _create(self, **request):
+        client = self.backend(request.get("model")).client(self._api_key)
+        return await client.chat.completions.create(**request)
+
+    def __getattr__(self, name: str):
+        return getattr(self._default.client(self._api_key), name)
@@ -0,0 +1,311 @@
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.cache import ReviewResultCache, SnapshotCache
+from app.chunking import plan_batches
+from app.exceptions import ReviewServiceError
+from app.files import ContentStore
+from app.fingerprints import FingerprintIndex, check_duplicates
+from app.github import SUPPORTED_EXTENSIONS, fetch_repository_files, parse_repo_url
+from app.gpt import analyze_code, build_prompt, completion_request
+from app.models import ReviewAnswer
+from app.preanalysis import pre_analyzer
+from app.selection import FileSelector
+
+logger = logging.getLogger(__name__)
+
+# Repositories accepted by one batch request
+BATCH_MAX_REPOSITORIES = int(os.getenv("BATCH_MAX_REPOSITORIES", "500"))
+
+# Returns the (GitHub token, OpenAI key) to review the next repository with
+TokenChooser = Callable[[], Tuple[Optional[str], Optional[str]]]
+
+
+class BatchScheduler:
+    """
+    Runs the reviews of batch requests under global concurrency limits.
+
+    Every repository goes through two stages: fetching its files, then
+    analyzing them. Each stage has its own limit shared by all batches the
+    scheduler runs, so repositories are fetched while others wait for the
+    model, and a large cohort cannot open more connections or completions
+    than the limits allow.
+
+    Args:
+        fetch_concurrency (int): Repositories fetched at the same time.
+        llm_concurrency (int): Repositories analyzed at the same time.
+    """
+
+    def __init__(self, fetch_concurrency: int = 8, llm_concurrency: int = 8):
+        self.fetch_concurrency = fetch_concurrency
+        self.llm_concurrency = llm_concurrency
+        self._fetch_slots = asyncio.Semaphore(fetch_concurrency)
+        self._llm_slots = asyncio.Semaphore(llm_concurrency)
+        self.reviewed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls) -> "BatchScheduler":
+        """
+        Builds a scheduler from BATCH_FETCH_CONCURRENCY and
+        BATCH_LLM_CONCURRENCY.
+        """
+        return cls(
+            fetch_concurrency=int(os.getenv("BATCH_FETCH_CONCURRENCY", "8")),
+            llm_concurrency=int(os.getenv("BATCH_LLM_CONCURRENCY", "8")),
+        )
+
+    async def review(
+        self,
+        repo_urls: List[str],
+        description: str,
+        level: str,
+        choose_tokens: TokenChooser,
+        fetch_strategy: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        openai_client: Optional[Callable[[str], AsyncOpenAI]] = None,
+        snapshot_cache: Optional[SnapshotCache] = None,
+        result_cache: Optional[ReviewResultCache] = None,
+        fingerprint_index: Optional[FingerprintIndex] = None,
+    ) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Reviews every repository against the same assignment, yielding
+        each outcome as soon as it is known.
+
+        Args:
+            repo_urls (List[str]): Repositories to review.
+            description (str): Shared assignment description.
+            level (str): Shared candidate level.
+            choose_tokens (TokenChooser): Picks the credentials per repository.
+            fetch_strategy (str, optional): "contents" or "tree".
+            http_client (httpx.AsyncClient, optional): Client for GitHub calls.
+            openai_client (Callable[[str], AsyncOpenAI], optional): Returns the
+                pooled OpenAI client for an API key.
+            snapshot_cache (SnapshotCache, optional): Cache of fetched files.
+            result_cache (ReviewResultCache, optional): Memo of analyses.
+            fingerprint_index (FingerprintIndex, optional): Flags files copied
+                between repositories of the cohort or earlier reviews.
+
+        Yields:
+            Tuple[str, Dict]: ("result", {index, github_repo_url, result}) or
+            ("error", {index, github_repo_url, detail}), in completion order.
+        """
+        outcomes: asyncio.Queue = asyncio.Queue()
+
+        async def run(index: int, repo_url: str) -> None:
+            try:
+                result = await self._review_one(
+                    repo_url,
+                    description,
+                    level,
+                    choose_tokens,
+                    fetch_strategy,
+                    http_client,
+                    openai_client,
+                    snapshot_cache,
+                    result_cache,
+                    fingerprint_index,
+                )
+                self.reviewed += 1
+                event = ("result", {"result": result})
+            except ReviewServiceError as e:
+                self.failed += 1
+                event = ("error", {"detail": str(e)})
+            except Exception:
+                logger.exception("Batch review of %s failed", repo_url)
+                self.failed += 1
+                event = ("error", {"detail": "Internal server error"})
+            name, data = event
+            await outcomes.put(
+                (name, {"index": index, "github_repo_url": repo_url, **data})
+            )
+
+        tasks = [
+            asyncio.create_task(run(index, repo_url))
+            for index, repo_url in enumerate(repo_urls)
+        ]
+        try:
+            for _ in tasks:
+                yield await outcomes.get()
+        finally:
+            # Stops the remaining reviews if the consumer goes away early
+            for task in tasks:
+                task.cancel()
+
+    async def _review_one(
+        self,
+        repo_url: str,
+        description: str,
+        level: str,
+        choose_tokens: TokenChooser,
+        fetch_strategy: Optional[str],
+        http_client: Optional[httpx.AsyncClient],
+        openai_client: Optional[Callable[[str], AsyncOpenAI]],
+        snapshot_cache: Optional[SnapshotCache],
+        result_cache: Optional[ReviewResultCache],
+        fingerprint_index: Optional[FingerprintIndex],
+    ) -> Dict:
+        github_token, openai_key = choose_tokens()
+        if not github_token or not openai_key:
+            raise ReviewServiceError(
+                "Missing required environment variables", category="configuration"
+            )
+
+        selector = FileSelector(extensions=SUPPORTED_EXTENSIONS)
+        store = ContentStore()
+        try:
+            async with self._fetch_slots:
+                files = await fetch_repository_files(
+                    repo_url,
+                    github_token,
+                    strategy=fetch_strategy,
+                    client=http_client,
+                    cache=snapshot_cache,
+                    selector=selector,
+                    store=store,
+                )
+            if not files:
+                raise ReviewServiceError(
+                    "No files found in repository", category="empty_repository"
+                )
+            _, duplicates = await check_duplicates(fingerprint_index, repo_url, files)
+
+            async with self._llm_slots:
+                result = await analyze_code(
+                    contents=files,
+                    description=description,
+                    level=level,
+                    api_key=openai_key,
+                    client=openai_client(openai_key) if openai_client else None,
+                    result_cache=result_cache,
+                )
+        finally:
+            store.close()
+        return {
+            "status": "success",
+            **result,
+            "duplicates": duplicates,
+            "selection": selector.report.as_dict(),
+        }
+
+    async def batch_api_lines(
+        self,
+        repo_urls: List[str],
+        description: str,
+        level: str,
+        choose_tokens: TokenChooser,
+        fetch_strategy: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        snapshot_cache: Optional[SnapshotCache] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Fetches every repository and yields OpenAI Batch API input lines for
+        its review, for cheaper asynchronous processing by OpenAI.
+
+        A repository that cannot be fetched gets one line with its
+        github_repo_url and an "error" instead of requests; such lines must be
+        dropped before the file is uploaded.
+
+        Yields:
+            str: One JSONL line per request or failed repository, in
+            completion order.
+        """
+        lines: asyncio.Queue = asyncio.Queue()
+
+        async def run(repo_url: str) -> None:
+            store = ContentStore()
+            error = None
+            try:
+                github_token, _ = choose_tokens()
+                async with self._fetch_slots:
+                    files = await fetch_repository_files(
+                        repo_url,
+                        github_token,
+                        strategy=fetch_strategy,
+                        client=http_client,
+                        cache=snapshot_cache,
+                        store=store,
+                    )
+                for line in await batch_api_requests(
+                    repo_url, files, description, level
+                ):
+                    await lines.put(line)
+            except ReviewServiceError as e:
+                error = str(e)
+            except Exception:
+                logger.exception("Batch file entry for %s failed", repo_url)
+                error = "Internal server error"
+            finally:
+                store.close()
+                if error is not None:
+                    await lines.put(
+                        json.dumps({"github_repo_url": repo_url, "error": error})
+                    )
+                await lines.put(None)
+
+        tasks = [asyncio.create_task(run(repo_url)) for repo_url in repo_urls]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                line = await lines.get()
+                if line is None:
+                    finished += 1
+                else:
+                    yield line
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "fetch_concurrency": self.fetch_concurrency,
+            "llm_concurrency": self.llm_concurrency,
+            "reviewed": self.reviewed,
+            "failed": self.failed,
+        }
+
+
+async def batch_api_requests(
+    repo_url: str, files: List[Dict], description: str, level: str
+) -> List[str]:
+    """
+    Encodes the review of one repository as OpenAI Batch API input lines.
+
+    The files go through the same pre-analysis as a direct review first.
+    Every token-budgeted part of the repository becomes one request whose
+    custom_id is "<owner>/<repo>#<part>/<parts>". Parts of a repository that
+    needed several are not merged; their answers are combined by the caller.
+
+    Args:
+        repo_url (str): Repository the files belong to.
+        files (List[Dict]): Fetched files with path and content.
+        description (str): Assignment description.
+        level (str): Candidate level.
+
+    Returns:
+        List[str]: JSONL lines for a Batch API input file.
+    """
+    owner, repo = parse_repo_url(repo_url)
+    files, _ = await pre_analyzer.run(files)
+    plan = plan_batches(files)
+    parts = len(plan.batches)
+    return [
+        json.dumps(
+            {
+                "custom_id": f"{owner}/{repo}#{index}/{parts}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": completion_request(
+                    build_prompt(batch, description, level, part=(index, parts)),
+                    ReviewAnswer,
+                ),
+            }
+        )
+        for index, batch in enumerate(plan.batches, start=1)
+    ]
@@ -0,0 +1,433 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis is optional
+    aioredis = None
+
+from app import metrics
+from app.files import ContentStore, RepoFile
+
+# Bytes of file bodies a snapshot read or write holds at once
+SNAPSHOT_BATCH_BYTES = int(os.getenv("SNAPSHOT_BATCH_BYTES", str(1024 * 1024)))
+
+
+class CacheBackend(ABC):
+    """
+    Minimal async key/value interface shared by the cache backends.
+    """
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[0]
+
+    async def set(self, key: str, value: bytes) -> None:
+        await self.set_many({key: value})
+
+    async def aclose(self) -> None:
+        pass
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process LRU cache bounded by the total size of the stored values.
+
+    Args:
+        max_bytes (int): Values are evicted least-recently-used first once
+            their combined size exceeds this budget.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values = []
+        for key in keys:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            values.append(value)
+        return values
+
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        for key, value in items.items():
+            if len(value) > self.max_bytes:
+                continue
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = value
+            self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class RedisCacheBackend(CacheBackend):
+    """
+    Redis-backed cache shared between application instances.
+
+    Args:
+        client: A redis.asyncio client (or a compatible stand-in such as
+            fakeredis).
+        ttl (int, optional): Expiry in seconds applied to every stored key.
+    """
+
+    def __init__(self, client, ttl: Optional[int] = None):
+        self.client = client
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url: str, ttl: Optional[int] = None) -> "RedisCacheBackend":
+        if aioredis is None:
+            raise RuntimeError("The redis package is required for the Redis cache")
+        return cls(aioredis.from_url(url), ttl=ttl)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        return await self.client.mget(keys)
+
+    async def set_many(self, items: Dict[str, bytes]) -> None:
+        async with self.client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(key, value, ex=self.ttl)
+            await pipe.execute()
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def git_blob_sha(content: Union[str, bytes]) -> str:
+    """
+    Computes the git blob SHA-1 of a file body, as reported by the GitHub API.
+
+    Args:
+        content (Union[str, bytes]): File contents, or their UTF-8 bytes.
+
+    Returns:
+        str: Hex digest identifying the blob.
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class SnapshotCache:
+    """
+    Content-addressed cache of repository snapshots.
+
+    A snapshot manifest keyed by (owner, repo, commit SHA) lists the path,
+    size and blob SHA of every fetched file. File bodies are stored once per
+    blob SHA, so files unchanged between commits share a single entry.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _snapshot_key(owner: str, repo: str, sha: str) -> str:
+        return f"snapshot:{owner}/{repo}:{sha}"
+
+    @staticmethod
+    def _blob_key(sha: str) -> str:
+        return f"blob:{sha}"
+
+    async def get_snapshot(
+        self, owner: str, repo: str, sha: str, store: Optional[ContentStore] = None
+    ) -> Optional[List[RepoFile]]:
+        """
+        Returns the cached files of a commit, or None if any part is missing.
+
+        Blobs are read a batch at a time into the review's content store, so
+        a cached snapshot is held under the same memory budget as a fetched
+        one.
+
+        Args:
+            owner (str): Repository owner.
+            repo (str): Repository name.
+            sha (str): Commit SHA the snapshot was taken at.
+            store (ContentStore, optional): Holds the bodies (default: a new
+                store with the REVIEW_MEMORY_BUDGET).
+
+        Returns:
+            Optional[List[RepoFile]]: Files with path, content, size and sha.
+        """
+        manifest = await self.backend.get(self._snapshot_key(owner, repo, sha))
+        if manifest is None:
+            self.misses += 1
+            metrics.record_cache_lookup("snapshot", hits=0, misses=1)
+            return None
+
+        store = store or ContentStore()
+        files = []
+        for batch in _batches(json.loads(manifest)):
+            blobs = await self.backend.get_many(
+                [self._blob_key(entry["sha"]) for entry in batch]
+            )
+            if any(blob is None for blob in blobs):
+                # A blob was evicted; the snapshot has to be fetched again
+                self.misses += 1
+                metrics.record_cache_lookup("snapshot", hits=0, misses=1)
+                return None
+            files += [
+                RepoFile(entry["path"], entry["size"], entry["sha"], store.add(blob))
+                for entry, blob in zip(batch, blobs)
+            ]
+
+        self.hits += 1
+        metrics.record_cache_lookup("snapshot", hits=1)
+        return files
+
+    async def put_snapshot(
+        self, owner: str, repo: str, sha: str, files: List[Dict]
+    ) -> None:
+        """
+        Stores the files of a commit.
+
+        Bodies are read from the files a batch at a time, without decoding
+        them; the files themselves are left unchanged.
+
+        Args:
+            owner (str): Repository owner.
+            repo (str): Repository name.
+            sha (str): Commit SHA the files were fetched at.
+            files (List[Dict]): RepoFile records or file objects with path,
+                content, size and optionally sha.
+        """
+        entries = []
+        blobs: Dict[str, bytes] = {}
+        held = 0
+        for file in files:
+            if isinstance(file, RepoFile):
+                data = file.read()
+            else:
+                data = file["content"].encode("utf-8")
+            blob_sha = file.get("sha") or git_blob_sha(data)
+            entries.append(
+                {"path": file["path"], "size": file["size"], "sha": blob_sha}
+            )
+            blobs[self._blob_key(blob_sha)] = data
+            held += len(data)
+            if held >= SNAPSHOT_BATCH_BYTES:
+                await self.backend.set_many(blobs)
+                blobs, held = {}, 0
+
+        # Blobs go in first so a visible manifest always points at stored bodies
+        await self.backend.set_many(blobs)
+        await self.backend.set(
+            self._snapshot_key(owner, repo, sha), json.dumps(entries).encode("utf-8")
+        )
+
+    def stats(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def _batches(entries: List[Dict]) -> List[List[Dict]]:
+    """
+    Splits manifest entries into runs of about SNAPSHOT_BATCH_BYTES.
+    """
+    batches: List[List[Dict]] = [[]]
+    held = 0
+    for entry in entries:
+        if batches[-1] and held + (entry["size"] or 0) > SNAPSHOT_BATCH_BYTES:
+            batches.append([])
+            held = 0
+        batches[-1].append(entry)
+        held += entry["size"] or 0
+    return batches
+
+
+def snapshot_digest(files: List[Dict]) -> str:
+    """
+    Identifies a set of files by their paths and blob SHAs.
+
+    Two file sets with the same digest have identical contents, which makes
+    the digest a stand-in for the commit SHA of the reviewed files.
+
+    Args:
+        files (List[Dict]): File objects with path and content (and
+            optionally sha).
+
+    Returns:
+        str: Hex digest of the sorted (path, blob SHA) pairs.
+    """
+    pairs = sorted(
+        (file["path"], file.get("sha") or git_blob_sha(file["content"]))
+        for file in files
+    )
+    return hashlib.sha256(json.dumps(pairs).encode("utf-8")).hexdigest()
+
+
+class ReviewResultCache:
+    """
+    In-process memo of review results with TTL and LRU eviction.
+
+    Concurrent lookups of a key that is still being computed wait on the
+    same in-flight computation instead of starting their own (single-flight).
+
+    Args:
+        max_entries (int): Least-recently-used results are dropped beyond this.
+        ttl (float): Seconds a stored result stays valid.
+        clock (Callable[[], float], optional): Time source, for tests.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @classmethod
+    def from_env(cls) -> "ReviewResultCache":
+        """
+        Builds a cache from RESULT_CACHE_MAX_ENTRIES and RESULT_CACHE_TTL.
+        """
+        return cls(
+            max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024")),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", "3600")),
+        )
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """
+        Hashes the parts that fully determine a review result.
+        """
+        return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        should_cache: Callable[[Any], bool] = lambda value: True,
+    ) -> Tuple[Any, bool]:
+        """
+        Returns the cached value for key, computing it at most once.
+
+        Args:
+            key (str): Cache key, usually from make_key.
+            compute (Callable[[], Awaitable[Any]]): Produces the value on a miss.
+            should_cache (Callable[[Any], bool], optional): Results rejected by
+                this predicate are returned but not stored.
+
+        Returns:
+            Tuple[Any, bool]: The value and whether it was reused rather than
+            computed by this call.
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                metrics.record_cache_lookup("result", hits=1)
+                return value, True
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # Waiting does not cancel the computation when this caller is
+            # cancelled; when the computing caller is, the value is computed
+            # again by one of the waiters
+            await asyncio.wait([inflight])
+            if not inflight.cancelled():
+                self.coalesced += 1
+                metrics.record_cache_lookup("result", hits=1)
+                return inflight.result(), True
+
+        self.misses += 1
+        metrics.record_cache_lookup("result", hits=0, misses=1)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        if should_cache(value):
+            self.set(key, value)
+        future.set_result(value)
+        return value, False
+
+    def stats(self) -> Dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+        }
+
+
+def create_cache_backend() -> Optional[CacheBackend]:
+    """
+    Builds the cache backend selected by the CACHE_BACKEND environment variable.
+
+    "memory" (default) keeps an in-process LRU bounded by CACHE_MAX_BYTES,
+    "redis" connects to REDIS_URL, and "none" disables caching.
+
+    Returns:
+        Optional[CacheBackend]: The configured backend, or None when disabled.
+    """
+    backend = os.getenv("CACHE_BACKEND", "memory").lower()
+    if backend == "none":
+        return None
+    if backend == "redis":
+        ttl = int(os.getenv("CACHE_TTL", "604800")) or None
+        return RedisCacheBackend.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"), ttl=ttl
+        )
+    if backend == "memory":
+        return MemoryCacheBackend(int(os.getenv("CACHE_MAX_BYTES", "268435456")))
+    raise ValueError(f"Unknown cache backend: {backend}")
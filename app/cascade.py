@@ -0,0 +1,103 @@
+import os
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+
+# Set to "true" to have a small model triage every file first; only the files
+# it flags are reviewed by the review model
+LLM_CASCADE = os.getenv("LLM_CASCADE", "false").lower() == "true"
+
+# Triage verdicts, from least to most serious
+VERDICTS = ("trivial", "needs_attention", "critical")
+
+# Policy defaults that differ by candidate level; CASCADE_{LEVEL}_* variables
+# take precedence over them, and they over the shared CASCADE_* ones
+LEVEL_DEFAULTS: Dict[str, Dict[str, str]] = {
+    "junior": {"ESCALATE": "critical", "REVIEW_MAX_TOKENS": "1500"},
+    "middle": {},
+    "senior": {"REVIEW_MAX_TOKENS": "2500"},
+}
+
+
+@dataclass(frozen=True)
+class CascadePolicy:
+    """
+    How a review is split between a cheap triage tier and an expensive
+    review tier.
+
+    Attributes:
+        triage_model (str): Model classifying every file as one of VERDICTS.
+        review_model (str): Model reviewing the escalated files in detail.
+        synthesis_model (str): Model merging the tiers into the final verdict.
+        escalate (str): Least serious verdict that is escalated to the review
+            model; "trivial" escalates every file.
+        triage_max_tokens (int): Completion cap of a triage answer.
+        review_max_tokens (int): Completion cap of a review answer.
+    """
+
+    triage_model: str = "gpt-4o-mini"
+    review_model: str = "gpt-4o"
+    synthesis_model: str = "gpt-4o"
+    escalate: str = "needs_attention"
+    triage_max_tokens: int = 1000
+    review_max_tokens: int = 2000
+
+    def __post_init__(self):
+        if self.escalate not in VERDICTS:
+            raise ValueError(
+                f"Unknown cascade verdict {self.escalate!r}, expected one of "
+                f"{', '.join(VERDICTS)}"
+            )
+
+    @classmethod
+    def from_env(cls, level: str) -> "CascadePolicy":
+        """
+        Builds the policy for a candidate level from CASCADE_{LEVEL}_*
+        variables, falling back to the level's LEVEL_DEFAULTS, then to the
+        shared CASCADE_* variables and then to the class defaults.
+
+        Args:
+            level (str): Candidate level, e.g. "Junior".
+        """
+        level = level.strip().lower()
+        defaults = LEVEL_DEFAULTS.get(level, {})
+
+        def setting(key: str, default: str) -> str:
+            return (
+                os.getenv(f"CASCADE_{level.upper()}_{key}")
+                or defaults.get(key)
+                or os.getenv(f"CASCADE_{key}")
+                or default
+            )
+
+        return cls(
+            triage_model=setting("TRIAGE_MODEL", cls.triage_model),
+            review_model=setting("REVIEW_MODEL", cls.review_model),
+            synthesis_model=setting("SYNTHESIS_MODEL", cls.synthesis_model),
+            escalate=setting("ESCALATE", cls.escalate),
+            triage_max_tokens=int(
+                setting("TRIAGE_MAX_TOKENS", str(cls.triage_max_tokens))
+            ),
+            review_max_tokens=int(
+                setting("REVIEW_MAX_TOKENS", str(cls.review_max_tokens))
+            ),
+        )
+
+    def escalates(self, verdict: str) -> bool:
+        """
+        Tells whether a file with the given triage verdict gets a detailed
+        review.
+        """
+        return VERDICTS.index(verdict) >= VERDICTS.index(self.escalate)
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+def cascade_policy(level: str) -> Optional[CascadePolicy]:
+    """
+    Returns the cascade policy for a candidate level, or None when
+    LLM_CASCADE is off and reviews go straight to the review model.
+    """
+    if not LLM_CASCADE:
+        return None
+    return CascadePolicy.from_env(level)
@@ -0,0 +1,158 @@
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken is optional
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Token budget of the repository contents sent in a single completion
+BATCH_TOKENS = int(os.getenv("REVIEW_BATCH_TOKENS", "12000"))
+# Files longer than this are truncated before packing
+FILE_TOKENS = int(os.getenv("REVIEW_FILE_TOKENS", "4000"))
+# Upper bound on the contents tokens sent across all batches of one review
+MAX_TOTAL_TOKENS = int(os.getenv("REVIEW_MAX_TOTAL_TOKENS", "60000"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Rough characters-per-token ratio used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+_encoder = None
+_encoder_loaded = False
+
+
+def _get_encoder():
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        _encoder_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoder = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            except Exception as e:
+                # The encoding file is downloaded on first use; work offline too
+                logger.warning("Tokenizer unavailable, estimating tokens: %s", e)
+    return _encoder
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the tokens of a text with the local tokenizer.
+
+    Falls back to a characters-per-token estimate when tiktoken or its
+    encoding data is unavailable.
+
+    Args:
+        text (str): Text to measure.
+
+    Returns:
+        int: Number of tokens.
+    """
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """
+    Cuts a text down to at most `limit` tokens.
+
+    Args:
+        text (str): Text to truncate.
+        limit (int): Maximum number of tokens to keep.
+
+    Returns:
+        str: The text, shortened if it exceeded the limit.
+    """
+    encoder = _get_encoder()
+    if encoder is not None:
+        tokens = encoder.encode(text, disallowed_special=())
+        return text if len(tokens) <= limit else encoder.decode(tokens[:limit])
+    return text[: limit * CHARS_PER_TOKEN]
+
+
+@dataclass
+class BatchPlan:
+    """
+    Files grouped into token-budgeted batches for one review.
+
+    Attributes:
+        batches (List[List[Dict]]): Files per batch; each file carries its
+            token count and whether its content was truncated.
+        skipped (List[str]): Paths left out because the total budget ran out.
+        tokens (int): Contents tokens across all batches.
+    """
+
+    batches: List[List[Dict]] = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    tokens: int = 0
+
+    @property
+    def files(self) -> List[Dict]:
+        return [file for batch in self.batches for file in batch]
+
+
+def plan_batches(
+    files: List[Dict],
+    batch_tokens: Optional[int] = None,
+    file_tokens: Optional[int] = None,
+    max_total_tokens: Optional[int] = None,
+) -> BatchPlan:
+    """
+    Packs files into batches that each fit within a token budget.
+
+    Files keep their path order and are added to the current batch until the
+    next one would overflow it. Once the total budget is spent, the remaining
+    files are reported as skipped.
+
+    Args:
+        files (List[Dict]): File objects with path and content.
+        batch_tokens (int, optional): Budget per batch (default: BATCH_TOKENS).
+        file_tokens (int, optional): Per-file cap (default: FILE_TOKENS).
+        max_total_tokens (int, optional): Budget across all batches
+            (default: MAX_TOTAL_TOKENS).
+
+    Returns:
+        BatchPlan: The packed batches and the skipped paths.
+    """
+    batch_tokens = batch_tokens or BATCH_TOKENS
+    file_tokens = min(file_tokens or FILE_TOKENS, batch_tokens)
+    max_total_tokens = max_total_tokens or MAX_TOTAL_TOKENS
+
+    plan = BatchPlan()
+    current: List[Dict] = []
+    current_tokens = 0
+    for file in sorted(files, key=lambda file: file["path"]):
+        if plan.tokens >= max_total_tokens:
+            # Budget spent: skip without reading the content
+            plan.skipped.append(file["path"])
+            continue
+        content = file["content"]
+        tokens = count_tokens(content)
+        truncated = tokens > file_tokens
+        if truncated:
+            content = truncate_to_tokens(content, file_tokens)
+            tokens = count_tokens(content)
+
+        if plan.tokens + tokens > max_total_tokens:
+            plan.skipped.append(file["path"])
+            continue
+        if current and current_tokens + tokens > batch_tokens:
+            plan.batches.append(current)
+            current, current_tokens = [], 0
+
+        # Copies every field but the content, which a lazily loaded file
+        # would otherwise decode a second time
+        entry = {key: file[key] for key in file if key != "content"}
+        entry.update(content=content, tokens=tokens, truncated=truncated)
+        current.append(entry)
+        current_tokens += tokens
+        plan.tokens += tokens
+
+    if current:
+        plan.batches.append(current)
+    return plan
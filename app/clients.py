@@ -0,0 +1,340 @@
+import importlib.util
+import os
+from dataclasses import dataclass, replace
+from typing import Dict, List, Optional, Tuple, Union
+
+import httpx
+from openai import AsyncOpenAI
+
+from app.backends import (
+    BackendRouter,
+    BackendSettings,
+    ConcurrencyLimitedTransport,
+    ConcurrencyLimiter,
+    LLMBackend,
+    backend_settings,
+)
+from app.credentials import CredentialPool, CredentialTrackingTransport
+from app.ratelimit import GitHubRateLimiter, RateLimitedTransport
+from app.resilience import CircuitBreaker, CircuitBreakerTransport
+
+
+@dataclass
+class ClientSettings:
+    """
+    Connection pool and timeout settings for the shared HTTP clients.
+
+    Attributes:
+        max_connections (int): Maximum open connections per client.
+        max_keepalive_connections (int): Idle connections kept for reuse.
+        keepalive_expiry (float): Seconds an idle connection is kept alive.
+        connect_timeout (float): Seconds allowed to establish a connection.
+        read_timeout (float): Seconds allowed between received bytes.
+        openai_timeout (float): Overall timeout for a single completion.
+        http2 (bool): Negotiate HTTP/2; needs the "h2" package from the
+            httpx[http2] extra, and falls back to HTTP/1.1 without it.
+    """
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    connect_timeout: float = 10.0
+    read_timeout: float = 30.0
+    openai_timeout: float = 120.0
+    http2: bool = True
+
+    @classmethod
+    def from_env(cls) -> "ClientSettings":
+        """
+        Builds settings from HTTP_* and OPENAI_TIMEOUT environment variables.
+        """
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+            read_timeout=float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+            openai_timeout=float(os.getenv("OPENAI_TIMEOUT", "120")),
+            http2=os.getenv("HTTP2", "true").lower() == "true",
+        )
+
+
+@dataclass
+class ConnectionStats:
+    """
+    Request and connection counters for one pooled client.
+
+    A reuse ratio close to 1 means most requests rode on an existing
+    keep-alive (or multiplexed HTTP/2) connection.
+    """
+
+    requests: int = 0
+    connections_opened: int = 0
+    http2_requests: int = 0
+
+    def as_dict(self) -> Dict:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "http2_requests": self.http2_requests,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+        }
+
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that counts requests and newly opened connections
+    using httpcore's trace extension.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, stats: ConnectionStats):
+        self._transport = transport
+        self.stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.requests += 1
+        upstream_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                self.stats.connections_opened += 1
+            if upstream_trace is not None:
+                await upstream_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        response = await self._transport.handle_async_request(request)
+        if response.extensions.get("http_version") == b"HTTP/2":
+            self.stats.http2_requests += 1
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def create_http_client(
+    settings: ClientSettings,
+    stats: ConnectionStats,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+    rate_limiter: Optional[GitHubRateLimiter] = None,
+    credentials: Optional[CredentialPool] = None,
+    breaker: Optional[CircuitBreaker] = None,
+    limiter: Optional[ConcurrencyLimiter] = None,
+) -> httpx.AsyncClient:
+    """
+    Creates a pooled, instrumented httpx client.
+
+    Args:
+        settings (ClientSettings): Pool size, keep-alive and timeout settings.
+        stats (ConnectionStats): Counters updated by the client's transport.
+        transport (httpx.AsyncBaseTransport, optional): Transport to wrap instead
+            of a real network transport (used by tests).
+        rate_limiter (GitHubRateLimiter, optional): Schedules every request of
+            the client against GitHub's rate limits.
+        credentials (CredentialPool, optional): Pool told about the rate-limit
+            state of each credential the client's requests are sent with.
+        breaker (CircuitBreaker, optional): Fails requests fast while the
+            remote service keeps erroring or answering slowly.
+        limiter (ConcurrencyLimiter, optional): Caps the client's requests in
+            flight; time spent waiting for a slot is not seen by the breaker.
+
+    Returns:
+        httpx.AsyncClient: A client meant to live for the whole application.
+    """
+    http2 = settings.http2 and importlib.util.find_spec("h2") is not None
+    if transport is None:
+        transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive_connections,
+                keepalive_expiry=settings.keepalive_expiry,
+            ),
+            http2=http2,
+        )
+    if breaker is not None:
+        transport = CircuitBreakerTransport(transport, breaker)
+    if credentials is not None:
+        transport = CredentialTrackingTransport(transport, credentials)
+    if rate_limiter is not None:
+        transport = RateLimitedTransport(transport, rate_limiter)
+    if limiter is not None:
+        transport = ConcurrencyLimitedTransport(transport, limiter)
+    return httpx.AsyncClient(
+        transport=InstrumentedTransport(transport, stats),
+        timeout=httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout),
+    )
+
+
+class ClientPool:
+    """
+    Long-lived HTTP clients shared by every review handled by the application.
+
+    Attributes:
+        settings (ClientSettings): Settings the clients were built with.
+        github (httpx.AsyncClient): Client used for GitHub API and raw downloads,
+            scheduled by `github_rate_limiter`.
+        openai_http (httpx.AsyncClient): Client underlying every OpenAI client
+            of the default LLM backend.
+        webhooks (httpx.AsyncClient): Plain client for job webhook deliveries,
+            kept apart from GitHub's breaker, rate limiter and credentials.
+        llm_backends (List[LLMBackend]): OpenAI-compatible backends, the
+            default one first; each other backend has its own HTTP client and
+            circuit breaker.
+        github_credentials (CredentialPool): GitHub tokens reviews are spread over.
+        openai_credentials (CredentialPool): OpenAI keys reviews are spread over.
+        github_breaker (CircuitBreaker): Circuit breaker of the GitHub client.
+        openai_breaker (CircuitBreaker): Circuit breaker of the OpenAI client.
+
+    The optional transports replace the network transports of the GitHub,
+    LLM and webhook clients, e.g. with the stand-in services of the
+    benchmarks; `backends` replaces the LLM_BACKENDS configuration.
+    """
+
+    def __init__(
+        self,
+        settings: Optional[ClientSettings] = None,
+        github_credentials: Optional[CredentialPool] = None,
+        openai_credentials: Optional[CredentialPool] = None,
+        github_transport: Optional[httpx.AsyncBaseTransport] = None,
+        openai_transport: Optional[httpx.AsyncBaseTransport] = None,
+        backends: Optional[List[BackendSettings]] = None,
+        webhook_transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.settings = settings or ClientSettings.from_env()
+        self.github_stats = ConnectionStats()
+        self.openai_stats = ConnectionStats()
+        self.webhook_stats = ConnectionStats()
+        self.github_credentials = github_credentials or CredentialPool.from_env(
+            "github"
+        )
+        self.openai_credentials = openai_credentials or CredentialPool.from_env(
+            "openai"
+        )
+        self.github_rate_limiter = GitHubRateLimiter.from_env()
+        self.github_breaker = CircuitBreaker.from_env("github", slow_seconds=10)
+        self.openai_breaker = CircuitBreaker.from_env("openai", slow_seconds=60)
+        backends = [
+            replace(backend, timeout=backend.timeout or self.settings.openai_timeout)
+            for backend in backends or backend_settings()
+        ]
+        limiters = [ConcurrencyLimiter(backend.max_concurrency) for backend in backends]
+        self.github = create_http_client(
+            self.settings,
+            self.github_stats,
+            transport=github_transport,
+            rate_limiter=self.github_rate_limiter,
+            credentials=self.github_credentials,
+            breaker=self.github_breaker,
+        )
+        self.openai_http = create_http_client(
+            self.settings,
+            self.openai_stats,
+            transport=openai_transport,
+            credentials=self.openai_credentials,
+            breaker=self.openai_breaker,
+            limiter=limiters[0],
+        )
+        self.llm_backends = [LLMBackend(backends[0], self.openai_http, limiters[0])]
+        self.llm_stats: Dict[str, ConnectionStats] = {}
+        self.llm_breakers: Dict[str, CircuitBreaker] = {}
+        for backend, limiter in zip(backends[1:], limiters[1:]):
+            stats = self.llm_stats[backend.name] = ConnectionStats()
+            breaker = self.llm_breakers[backend.name] = CircuitBreaker.from_env(
+                backend.name, slow_seconds=60
+            )
+            http = create_http_client(
+                self.settings,
+                stats,
+                transport=openai_transport,
+                breaker=breaker,
+                limiter=limiter,
+            )
+            self.llm_backends.append(LLMBackend(backend, http, limiter))
+        self.webhooks = create_http_client(
+            self.settings, self.webhook_stats, transport=webhook_transport
+        )
+        self._openai_clients: Dict[str, Union[AsyncOpenAI, BackendRouter]] = {}
+
+    def openai(self, api_key: str) -> Union[AsyncOpenAI, BackendRouter]:
+        """
+        Returns an AsyncOpenAI client for the key, backed by the shared pool.
+
+        With several LLM backends, the client is a BackendRouter sending each
+        completion to the backend serving its model.
+
+        Args:
+            api_key (str): OpenAI API key.
+
+        Returns:
+            Union[AsyncOpenAI, BackendRouter]: A client reused for every
+            request with this key.
+        """
+        client = self._openai_clients.get(api_key)
+        if client is None:
+            if len(self.llm_backends) == 1:
+                client = self.llm_backends[0].client(api_key)
+            else:
+                client = BackendRouter(self.llm_backends, api_key)
+            self._openai_clients[api_key] = client
+        return client
+
+    def choose_tokens(self) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Picks the GitHub token and OpenAI key for the next review.
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: The credentials with the most
+            remaining quota, or None where a pool is empty.
+        """
+        github = self.github_credentials.choose()
+        openai = self.openai_credentials.choose()
+        return (
+            github.secret if github else None,
+            openai.secret if openai else None,
+        )
+
+    def credential_stats(self) -> Dict:
+        """
+        Returns per-credential usage and rate-limit state, without secrets.
+        """
+        return {
+            "github": self.github_credentials.stats(),
+            "openai": self.openai_credentials.stats(),
+        }
+
+    def breaker_stats(self) -> Dict:
+        """
+        Returns the state of the circuit breakers of both clients.
+        """
+        return {
+            "github": self.github_breaker.stats(),
+            "openai": self.openai_breaker.stats(),
+            **{name: breaker.stats() for name, breaker in self.llm_breakers.items()},
+        }
+
+    def backend_stats(self) -> Dict:
+        """
+        Returns the settings and concurrency counters of every LLM backend.
+        """
+        return {backend.settings.name: backend.stats() for backend in self.llm_backends}
+
+    def stats(self) -> Dict:
+        """
+        Returns connection reuse counters for every pooled client.
+        """
+        return {
+            "github": self.github_stats.as_dict(),
+            "openai": self.openai_stats.as_dict(),
+            **{name: stats.as_dict() for name, stats in self.llm_stats.items()},
+            "webhooks": self.webhook_stats.as_dict(),
+        }
+
+    async def aclose(self) -> None:
+        """
+        Closes the pooled clients and their open connections.
+        """
+        self._openai_clients.clear()
+        await self.github.aclose()
+        for backend in self.llm_backends:
+            await backend.http.aclose()
+        await self.webhooks.aclose()
@@ -0,0 +1,226 @@
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from app import metrics
+from app.ratelimit import parse_retry_after
+
+# Seconds a credential is set aside after a rate-limited response that does
+# not say when the limit resets
+DEFAULT_EJECTION = 60.0
+
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: str) -> float:
+    """
+    Parses OpenAI's reset durations such as "20ms", "1s" or "6m0s" to seconds.
+    """
+    return sum(
+        float(amount) * _DURATION_UNITS[unit]
+        for amount, unit in _DURATION.findall(value)
+    )
+
+
+@dataclass
+class Credential:
+    """
+    One API token and what is known about its rate limit.
+
+    Attributes:
+        name (str): Label safe to show in metrics; never the secret itself.
+        secret (str): The token or API key.
+        remaining (int, optional): Requests left in the current window.
+        reset (float): Epoch seconds at which the window resets.
+        ejected_until (float): Epoch seconds until which it is not handed out.
+        assigned (int): Reviews the credential was handed to.
+        requests (int): Responses observed for the credential.
+        rate_limited (int): Rate-limited responses observed.
+    """
+
+    name: str
+    secret: str
+    remaining: Optional[int] = None
+    reset: float = 0.0
+    ejected_until: float = 0.0
+    assigned: int = 0
+    requests: int = 0
+    rate_limited: int = 0
+
+    def as_dict(self, now: float) -> Dict:
+        return {
+            "name": self.name,
+            "remaining": self.remaining,
+            "reset": self.reset,
+            "ejected": self.ejected_until > now,
+            "assigned": self.assigned,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class CredentialPool:
+    """
+    Spreads reviews across several credentials of one provider.
+
+    The credential with the most remaining quota is handed out, the least
+    used one on ties. A credential is ejected after a 429 (or a 403 that
+    reports an exhausted quota) and restored once its window resets.
+
+    Args:
+        kind (str): "github" or "openai"; selects how rate-limit headers are
+            read and labels the credentials.
+        secrets (List[str]): Tokens or API keys; duplicates are ignored.
+        clock (Callable[[], float]): Epoch time source, for tests.
+    """
+
+    ENV_VARS = {
+        "github": ("GITHUB_TOKENS", "GITHUB_TOKEN"),
+        "openai": ("OPENAI_API_KEYS", "OPENAI_API_KEY"),
+    }
+
+    def __init__(
+        self, kind: str, secrets: List[str], clock: Callable[[], float] = time.time
+    ):
+        self.kind = kind
+        self.clock = clock
+        self.credentials: List[Credential] = []
+        self._by_secret: Dict[str, Credential] = {}
+        self._from_env = False
+        self._raw_env: Optional[str] = None
+        self._set_secrets(secrets)
+
+    @classmethod
+    def from_env(cls, kind: str) -> "CredentialPool":
+        """
+        Reads a comma-separated GITHUB_TOKENS / OPENAI_API_KEYS list, falling
+        back to the single GITHUB_TOKEN / OPENAI_API_KEY.
+
+        The variables are re-read whenever a credential is chosen, so tokens
+        can be rotated without a restart; kept tokens keep their state.
+        """
+        pool = cls(kind, [])
+        pool._from_env = True
+        pool._reload()
+        return pool
+
+    def _set_secrets(self, secrets: List[str]) -> None:
+        self.credentials = [
+            self._by_secret.get(secret)
+            or Credential(name=f"{self.kind}-{index}", secret=secret)
+            for index, secret in enumerate(dict.fromkeys(secrets), start=1)
+        ]
+        self._by_secret = {
+            credential.secret: credential for credential in self.credentials
+        }
+
+    def _reload(self) -> None:
+        plural, single = self.ENV_VARS[self.kind]
+        raw = os.getenv(plural) or os.getenv(single) or ""
+        if raw != self._raw_env:
+            self._raw_env = raw
+            self._set_secrets(
+                [secret.strip() for secret in raw.split(",") if secret.strip()]
+            )
+
+    def __len__(self) -> int:
+        return len(self.credentials)
+
+    def choose(self) -> Optional[Credential]:
+        """
+        Picks the credential for the next review.
+
+        Returns:
+            Optional[Credential]: The available credential with the most
+            remaining quota; if all are ejected, the one restored soonest;
+            None for an empty pool.
+        """
+        if self._from_env:
+            self._reload()
+        if not self.credentials:
+            return None
+        now = self.clock()
+        available = [c for c in self.credentials if c.ejected_until <= now]
+        if not available:
+            credential = min(self.credentials, key=lambda c: c.ejected_until)
+        else:
+            # Unknown quota counts as full: the credential has not been used yet
+            credential = max(
+                available,
+                key=lambda c: (
+                    float("inf") if c.remaining is None else c.remaining,
+                    -c.assigned,
+                ),
+            )
+        credential.assigned += 1
+        return credential
+
+    def observe(self, secret: str, response: httpx.Response) -> None:
+        """
+        Updates a credential from the rate-limit headers and status of a
+        response that was sent with it.
+        """
+        credential = self._by_secret.get(secret)
+        if credential is None:
+            return
+        credential.requests += 1
+        # Labelled by name: the secret must never reach the metrics
+        labels = {"provider": self.kind, "credential": credential.name}
+        metrics.credential_requests.inc(**labels)
+        now = self.clock()
+        headers = response.headers
+        if self.kind == "github":
+            remaining = headers.get("x-ratelimit-remaining")
+            reset = headers.get("x-ratelimit-reset")
+            if reset is not None:
+                credential.reset = float(reset)
+        else:
+            remaining = headers.get("x-ratelimit-remaining-requests")
+            reset = headers.get("x-ratelimit-reset-requests")
+            if reset is not None:
+                credential.reset = now + parse_duration(reset)
+        if remaining is not None:
+            credential.remaining = int(remaining)
+            metrics.credential_remaining.set(credential.remaining, **labels)
+
+        exhausted = remaining == "0" or "retry-after" in headers
+        if response.status_code == 429 or (response.status_code == 403 and exhausted):
+            credential.rate_limited += 1
+            metrics.credential_rate_limited.inc(**labels)
+            retry_after = parse_retry_after(headers.get("retry-after"), now)
+            if retry_after is not None:
+                until = now + retry_after
+            elif credential.reset > now:
+                until = credential.reset
+            else:
+                until = now + DEFAULT_EJECTION
+            credential.ejected_until = max(credential.ejected_until, until)
+
+    def stats(self) -> List[Dict]:
+        now = self.clock()
+        return [credential.as_dict(now) for credential in self.credentials]
+
+
+class CredentialTrackingTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that reports every response to the credential pool,
+    matching credentials by the request's bearer token.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, pool: CredentialPool):
+        self._transport = transport
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        response = await self._transport.handle_async_request(request)
+        authorization = request.headers.get("Authorization", "")
+        self.pool.observe(authorization.removeprefix("Bearer ").strip(), response)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,349 @@
+import bisect
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app import chunking
+from app.chunking import count_tokens
+
+# Unchanged lines between two hunks of a file up to which they are reviewed
+# together as one group
+PR_HUNK_GAP = int(os.getenv("PR_HUNK_GAP", "20"))
+
+# Tokens of one hunk group; longer hunks are cut at this size
+PR_GROUP_TOKENS = int(os.getenv("PR_GROUP_TOKENS", "3000"))
+
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$")
+_DIFF_HEADER = re.compile(r"^diff --git a/(.+) b/(.+)$")
+
+
+@dataclass
+class Hunk:
+    """
+    One hunk of a unified diff.
+
+    Attributes:
+        old_start (int): First line of the hunk in the old file.
+        new_start (int): First line of the hunk in the new file.
+        section (str): Heading after the line ranges, usually the enclosing
+            function or class.
+        lines (List[str]): Diff lines with their " ", "+" or "-" marker.
+    """
+
+    old_start: int
+    new_start: int
+    section: str = ""
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def new_end(self) -> int:
+        """
+        Last line of the new file the hunk shows.
+        """
+        shown = sum(1 for line in self.lines if not line.startswith("-"))
+        return self.new_start + shown - 1
+
+    def numbered(self) -> Iterator[Tuple[Optional[int], str]]:
+        """
+        Yields every line with its number in the new file; removed lines have
+        none.
+        """
+        number = self.new_start
+        for line in self.lines:
+            if line.startswith("-"):
+                yield None, line
+            else:
+                yield number, line
+                number += 1
+
+    def header(self) -> str:
+        old = sum(1 for line in self.lines if not line.startswith("+"))
+        new = sum(1 for line in self.lines if not line.startswith("-"))
+        header = f"@@ -{self.old_start},{old} +{self.new_start},{new} @@"
+        return f"{header} {self.section}" if self.section else header
+
+    def render(self) -> str:
+        """
+        Renders the hunk for a prompt, each line prefixed with its number in
+        the new file so comments can refer to it.
+        """
+        rendered = [self.header()]
+        for number, line in self.numbered():
+            rendered.append(f"{'' if number is None else number:>5} {line}")
+        return "\n".join(rendered)
+
+
+@dataclass
+class FileDiff:
+    """
+    The changes a pull request makes to one file.
+
+    Attributes:
+        path (str): Path in the head commit (the old path for removed files).
+        status (str): "added", "modified", "removed" or "renamed".
+        previous_path (str, optional): Path before a rename.
+        hunks (List[Hunk]): Changed regions; empty for binary files and
+            for diffs GitHub does not include because they are too large.
+        size (int): Length of the diff text in bytes.
+    """
+
+    path: str
+    status: str = "modified"
+    previous_path: Optional[str] = None
+    hunks: List[Hunk] = field(default_factory=list)
+    size: int = 0
+
+    @property
+    def additions(self) -> int:
+        return sum(line.startswith("+") for hunk in self.hunks for line in hunk.lines)
+
+    @property
+    def deletions(self) -> int:
+        return sum(line.startswith("-") for hunk in self.hunks for line in hunk.lines)
+
+
+@dataclass
+class HunkGroup:
+    """
+    Neighbouring hunks of one file, reviewed together.
+
+    Attributes:
+        path (str): Path in the head commit.
+        status (str): Status of the file in the pull request.
+        hunks (List[Hunk]): The hunks, in file order.
+        tokens (int): Tokens of the rendered group.
+        truncated (bool): True when the last hunk was cut to fit
+            PR_GROUP_TOKENS.
+    """
+
+    path: str
+    status: str
+    hunks: List[Hunk] = field(default_factory=list)
+    tokens: int = 0
+    truncated: bool = False
+
+    def anchors(self) -> Set[int]:
+        """
+        Lines of the new file shown by the group, which comments can be
+        anchored to.
+        """
+        return {
+            number
+            for hunk in self.hunks
+            for number, _ in hunk.numbered()
+            if number is not None
+        }
+
+    def render(self) -> str:
+        return "\n".join(hunk.render() for hunk in self.hunks)
+
+
+class DiffParser:
+    """
+    Incremental parser of unified diffs, fed one line at a time so a diff
+    can be parsed while it streams in.
+
+    Args:
+        current (FileDiff, optional): File the first hunks belong to, for
+            patches that carry no file headers (as listed by the pull request
+            files API).
+    """
+
+    def __init__(self, current: Optional[FileDiff] = None):
+        self.files: List[FileDiff] = [current] if current is not None else []
+        self._file = current
+        self._hunk: Optional[Hunk] = None
+        # Old and new lines the current hunk still has to receive
+        self._remaining = (0, 0)
+
+    def feed(self, line: str) -> None:
+        line = line.rstrip("\n")
+        old, new = self._remaining
+        if self._hunk is not None and (old or new):
+            self._file.size += len(line) + 1
+            if line.startswith("\\"):
+                return  # "\ No newline at end of file"
+            marker = line[:1] or " "
+            self._hunk.lines.append(line or " ")
+            self._remaining = (old - (marker != "+"), new - (marker != "-"))
+            return
+        self._hunk = None
+
+        match = _DIFF_HEADER.match(line)
+        if match:
+            self._file = FileDiff(match.group(2))
+            if match.group(1) != match.group(2):
+                self._file.previous_path = match.group(1)
+            self.files.append(self._file)
+        if self._file is None:
+            return
+        self._file.size += len(line) + 1
+
+        match = _HUNK_HEADER.match(line)
+        if match:
+            old_start, old_lines, new_start, new_lines, section = match.groups()
+            self._hunk = Hunk(int(old_start), int(new_start), section.strip())
+            self._file.hunks.append(self._hunk)
+            self._remaining = (
+                1 if old_lines is None else int(old_lines),
+                1 if new_lines is None else int(new_lines),
+            )
+        elif line.startswith("new file mode"):
+            self._file.status = "added"
+        elif line.startswith("deleted file mode"):
+            self._file.status = "removed"
+        elif line.startswith("rename from "):
+            self._file.previous_path = line[len("rename from ") :]
+        elif line.startswith("rename to "):
+            self._file.path = line[len("rename to ") :]
+        elif line.startswith("+++ b/"):
+            self._file.path = line[len("+++ b/") :]
+
+    def close(self) -> List[FileDiff]:
+        """
+        Returns the parsed files.
+        """
+        for file in self.files:
+            if file.status == "modified" and file.previous_path:
+                file.status = "renamed"
+        return self.files
+
+
+def parse_patch(path: str, patch: Optional[str], status: str = "modified") -> FileDiff:
+    """
+    Parses the hunks of one file's patch.
+
+    Args:
+        path (str): Path of the file.
+        patch (str, optional): Hunks as listed by the pull request files API;
+            None when GitHub left them out.
+        status (str): Status of the file.
+
+    Returns:
+        FileDiff: The file with its hunks.
+    """
+    parser = DiffParser(FileDiff(path, status))
+    for line in (patch or "").splitlines():
+        parser.feed(line)
+    return parser.close()[0]
+
+
+def group_hunks(
+    files: List[FileDiff],
+    gap: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+) -> List[HunkGroup]:
+    """
+    Groups the hunks of each file with the hunks close to them.
+
+    A hunk joins the group of the previous hunk of its file when at most
+    `gap` unchanged lines lie between them and the group stays within
+    `max_tokens`, so related changes are reviewed side by side while each
+    group only carries the diff's own context lines.
+
+    Args:
+        files (List[FileDiff]): Files of the pull request.
+        gap (int, optional): Unchanged lines bridged (default: PR_HUNK_GAP).
+        max_tokens (int, optional): Token cap per group (default:
+            PR_GROUP_TOKENS); longer hunks are cut to it.
+
+    Returns:
+        List[HunkGroup]: Groups in file and line order.
+    """
+    gap = PR_HUNK_GAP if gap is None else gap
+    max_tokens = max_tokens or PR_GROUP_TOKENS
+    groups: List[HunkGroup] = []
+    for file in files:
+        group: Optional[HunkGroup] = None
+        for hunk in file.hunks:
+            hunk, tokens, truncated = _fit(hunk, max_tokens)
+            if (
+                group is None
+                or hunk.new_start - group.hunks[-1].new_end - 1 > gap
+                or group.tokens + tokens > max_tokens
+            ):
+                group = HunkGroup(file.path, file.status)
+                groups.append(group)
+            group.hunks.append(hunk)
+            group.tokens += tokens
+            group.truncated = group.truncated or truncated
+    return groups
+
+
+def plan_diff_batches(
+    groups: List[HunkGroup],
+    batch_tokens: Optional[int] = None,
+    max_total_tokens: Optional[int] = None,
+) -> Tuple[List[List[HunkGroup]], List[str]]:
+    """
+    Packs hunk groups into token-budgeted batches, keeping the groups of a
+    file together where they fit.
+
+    Args:
+        groups (List[HunkGroup]): Groups from group_hunks.
+        batch_tokens (int, optional): Budget per batch (default:
+            REVIEW_BATCH_TOKENS).
+        max_total_tokens (int, optional): Budget across batches (default:
+            REVIEW_MAX_TOTAL_TOKENS).
+
+    Returns:
+        Tuple[List[List[HunkGroup]], List[str]]: The batches, and the paths
+        with groups left out because the total budget ran out.
+    """
+    batch_tokens = batch_tokens or chunking.BATCH_TOKENS
+    max_total_tokens = max_total_tokens or chunking.MAX_TOTAL_TOKENS
+    batches: List[List[HunkGroup]] = []
+    skipped: List[str] = []
+    batch: List[HunkGroup] = []
+    used = total = 0
+    for group in groups:
+        if total + group.tokens > max_total_tokens:
+            if group.path not in skipped:
+                skipped.append(group.path)
+            continue
+        if batch and used + group.tokens > batch_tokens:
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(group)
+        used += group.tokens
+        total += group.tokens
+    if batch:
+        batches.append(batch)
+    return batches, skipped
+
+
+def nearest_anchor(anchors: List[int], line: int) -> int:
+    """
+    Returns the anchor closest to `line` from a sorted, non-empty list.
+    """
+    index = bisect.bisect_left(anchors, line)
+    if index == len(anchors):
+        return anchors[-1]
+    if index == 0 or anchors[index] == line:
+        return anchors[index]
+    before, after = anchors[index - 1], anchors[index]
+    return before if line - before <= after - line else after
+
+
+def anchors_by_path(groups: List[HunkGroup]) -> Dict[str, List[int]]:
+    """
+    Collects the sorted anchorable lines of every file in the groups.
+    """
+    anchors: Dict[str, Set[int]] = {}
+    for group in groups:
+        anchors.setdefault(group.path, set()).update(group.anchors())
+    return {path: sorted(lines) for path, lines in anchors.items() if lines}
+
+
+def _fit(hunk: Hunk, max_tokens: int) -> Tuple[Hunk, int, bool]:
+    """
+    Cuts a hunk down to `max_tokens`, returning it with its token count and
+    whether it was cut.
+    """
+    tokens = count_tokens(hunk.render())
+    if tokens <= max_tokens:
+        return hunk, tokens, False
+    keep = max(1, len(hunk.lines) * max_tokens // tokens)
+    cut = Hunk(hunk.old_start, hunk.new_start, hunk.section, hunk.lines[:keep])
+    return cut, count_tokens(cut.render()), True
@@ -0,0 +1,34 @@
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+# Receives (event name, event data) as a review advances
+ProgressCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+
+
+async def emit(
+    progress: Optional[ProgressCallback], event: str, data: Dict[str, Any]
+) -> None:
+    """
+    Reports a progress event if a callback was supplied.
+
+    Args:
+        progress (ProgressCallback, optional): Callback to notify.
+        event (str): Event name, e.g. "file_fetched".
+        data (Dict[str, Any]): JSON-serializable event payload.
+    """
+    if progress is not None:
+        await progress(event, data)
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """
+    Encodes one Server-Sent Events message.
+
+    Args:
+        event (str): Event name.
+        data (Dict[str, Any]): JSON-serializable payload.
+
+    Returns:
+        str: The message, terminated by a blank line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
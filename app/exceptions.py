@@ -1,3 +1,6 @@
+import math
+
+
 class ReviewServiceError(Exception):
     """
     Custom exception for review service-related errors.
@@ -5,19 +8,23 @@ class ReviewServiceError(Exception):
     Attributes:
         message (str): The error message describing the issue.
         details (Optional[dict]): Additional context or metadata about the error.
+        category (str): Coarse kind of failure, e.g. "not_found" or "openai",
+            used to count errors in the metrics.
     """
 
-    def __init__(self, message: str, details: dict = None):
+    def __init__(self, message: str, details: dict = None, category: str = None):
         """
         Initialize the ReviewServiceError with a message and optional details.
 
         Args:
             message (str): The error message.
             details (dict, optional): Additional details or context for debugging (default: None).
+            category (str, optional): Kind of failure (default: "internal").
         """
         super().__init__(message)
         self.message = message
         self.details = details
+        self.category = category or "internal"
 
     def __str__(self):
         """
@@ -29,3 +36,40 @@ class ReviewServiceError(Exception):
         if self.details:
             return f"{self.message} | Details: {self.details}"
         return self.message
+
+
+class CircuitOpenError(ReviewServiceError):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open.
+
+    Attributes:
+        service (str): Name of the unavailable dependency.
+        retry_after (float): Seconds until a probe request is allowed again.
+    """
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(
+            f"{service} is temporarily unavailable after repeated failed or slow "
+            f"requests. Retry in {math.ceil(retry_after)}s",
+            category="circuit_open",
+        )
+        self.service = service
+        self.retry_after = retry_after
+
+
+class AdmissionRejected(ReviewServiceError):
+    """
+    Raised when a review is not admitted: its tenant is over its rate limit
+    or queue share (429), or the service is overloaded (503).
+
+    Attributes:
+        status_code (int): HTTP status to answer with, 429 or 503.
+        reason (str): Why the review was rejected, e.g. "rate_limited".
+        retry_after (float): Seconds after which a retry may be admitted.
+    """
+
+    def __init__(self, message: str, status_code: int, reason: str, retry_after: float):
+        super().__init__(message, category="admission")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
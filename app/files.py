@@ -0,0 +1,247 @@
+import mmap
+import os
+import tempfile
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+# Bytes of file bodies one review keeps in memory before spilling to disk
+REVIEW_MEMORY_BUDGET = int(os.getenv("REVIEW_MEMORY_BUDGET", str(32 * 1024 * 1024)))
+
+
+class ContentStore:
+    """
+    Holds the file bodies fetched for one review under a memory budget.
+
+    Bodies are kept as the raw bytes received from GitHub. Once the bytes
+    held in memory would exceed the budget, further bodies are appended to a
+    single anonymous temporary file and read back through a memory map, so
+    the pages of spilled files are only resident while they are being read.
+
+    Args:
+        budget (int, optional): Bytes kept in memory (default:
+            REVIEW_MEMORY_BUDGET).
+    """
+
+    def __init__(self, budget: Optional[int] = None):
+        self.budget = REVIEW_MEMORY_BUDGET if budget is None else budget
+        self.memory_bytes = 0
+        self.spilled_bytes = 0
+        self._spill = None
+        self._map: Optional[mmap.mmap] = None
+
+    def writer(self) -> "ContentWriter":
+        """
+        Starts a body that arrives in chunks.
+        """
+        return ContentWriter(self)
+
+    def add(self, data: bytes) -> "ContentHandle":
+        """
+        Stores a complete body.
+        """
+        writer = self.writer()
+        writer.write(data)
+        return writer.close()
+
+    def _reserve(self, size: int) -> bool:
+        """
+        Claims `size` bytes of the budget, or returns False when they do not
+        fit and the body has to be spilled.
+        """
+        if self.memory_bytes + size > self.budget:
+            return False
+        self.memory_bytes += size
+        return True
+
+    def _append(self, data: bytes) -> int:
+        """
+        Appends spilled bytes to the temporary file, returning their offset.
+        """
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(prefix="review-")
+        offset = self._spill.seek(0, os.SEEK_END)
+        self._spill.write(data)
+        self.spilled_bytes += len(data)
+        return offset
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self._map is None or len(self._map) < offset + length:
+            # The file grew since it was mapped; map its current extent
+            self._spill.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._spill.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset : offset + length]
+
+    def close(self) -> None:
+        """
+        Releases the memory map and deletes the temporary file.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def stats(self) -> Dict:
+        return {
+            "budget": self.budget,
+            "memory_bytes": self.memory_bytes,
+            "spilled_bytes": self.spilled_bytes,
+        }
+
+
+class ContentWriter:
+    """
+    Accumulates a streamed body in memory while it fits the store's budget
+    and moves it to the spill file as soon as it does not.
+
+    Bodies downloaded concurrently share the spill file, so a spilled body
+    is recorded as the (offset, length) segments its chunks were written to.
+    """
+
+    __slots__ = ("_store", "_buffer", "_segments", "_length")
+
+    def __init__(self, store: ContentStore):
+        self._store = store
+        self._buffer: Optional[bytearray] = bytearray()
+        self._segments: List[Tuple[int, int]] = []
+        self._length = 0
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        self._length += len(chunk)
+        if self._buffer is not None:
+            if self._store._reserve(len(chunk)):
+                self._buffer += chunk
+                return
+            # Over budget: hand back what was held and continue on disk
+            self._store.memory_bytes -= len(self._buffer)
+            held, self._buffer = bytes(self._buffer), None
+            self._spill(held)
+        self._spill(chunk)
+
+    def _spill(self, data: bytes) -> None:
+        if not data:
+            return
+        offset = self._store._append(data)
+        if self._segments and sum(self._segments[-1]) == offset:
+            # Contiguous with the previous chunk
+            self._segments[-1] = (
+                self._segments[-1][0],
+                self._segments[-1][1] + len(data),
+            )
+        else:
+            self._segments.append((offset, len(data)))
+
+    def close(self) -> "ContentHandle":
+        if self._buffer is not None:
+            return ContentHandle(self._store, bytes(self._buffer), (), self._length)
+        return ContentHandle(self._store, None, tuple(self._segments), self._length)
+
+
+class ContentHandle:
+    """
+    Lazy reference to a stored body; nothing is decoded until it is read.
+    """
+
+    __slots__ = ("_store", "_data", "_segments", "_length")
+
+    def __init__(
+        self,
+        store: ContentStore,
+        data: Optional[bytes],
+        segments: Tuple[Tuple[int, int], ...],
+        length: int,
+    ):
+        self._store = store
+        self._data = data
+        self._segments = segments
+        self._length = length
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def spilled(self) -> bool:
+        return self._data is None
+
+    def read(self) -> bytes:
+        if self._data is not None:
+            return self._data
+        return b"".join(
+            self._store._read(offset, length) for offset, length in self._segments
+        )
+
+    def text(self) -> str:
+        return self.read().decode("utf-8", errors="replace")
+
+
+class RepoFile(Mapping):
+    """
+    A fetched repository file.
+
+    Exposes the same keys as the plain file dicts used throughout the review
+    ("path", "content", "size" and "sha") so either can be passed around,
+    but stores its body behind a ContentHandle that is decoded only when
+    "content" is read.
+
+    Args:
+        path (str): Path within the repository.
+        size (int): Size of the body in bytes.
+        sha (str, optional): Git blob SHA, when known.
+        content (Union[ContentHandle, str]): The body or a handle to it.
+    """
+
+    __slots__ = ("path", "size", "sha", "_content")
+    KEYS = ("path", "content", "size", "sha")
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        sha: Optional[str],
+        content: Union[ContentHandle, str],
+    ):
+        self.path = path
+        self.size = size
+        self.sha = sha
+        self._content = content
+
+    @property
+    def content(self) -> str:
+        if isinstance(self._content, str):
+            return self._content
+        return self._content.text()
+
+    def read(self) -> bytes:
+        """
+        Returns the body as bytes, without decoding it.
+        """
+        if isinstance(self._content, str):
+            return self._content.encode("utf-8")
+        return self._content.read()
+
+    def __getitem__(self, key: str):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key not in self.KEYS:
+            raise KeyError(key)
+        if key == "content":
+            self._content = value
+        else:
+            setattr(self, key, value)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.KEYS)
+
+    def __len__(self) -> int:
+        return len(self.KEYS)
+
+    def __repr__(self) -> str:
+        return f"RepoFile(path={self.path!r}, size={self.size}, sha={self.sha!r})"
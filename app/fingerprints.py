@@ -0,0 +1,369 @@
+import asyncio
+import heapq
+import os
+import re
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from zlib import crc32
+
+from app import metrics
+from app.cache import git_blob_sha
+from app.github import parse_repo_url
+
+# Set to "false" to stop fingerprinting fetched files
+FINGERPRINT_INDEX = os.getenv("FINGERPRINT_INDEX", "true").lower() == "true"
+
+# Estimated similarity from which a file counts as a near duplicate
+FINGERPRINT_SIMILARITY = float(os.getenv("FINGERPRINT_SIMILARITY", "0.8"))
+
+# Similarity from which a near duplicate reuses the other file's review
+# fragment; unset by default, so only identical blobs reuse fragments and near
+# duplicates are reported only (an estimate of 1.0 does not mean identical)
+FINGERPRINT_REUSE_SIMILARITY = (
+    float(os.environ["FINGERPRINT_REUSE_SIMILARITY"])
+    if os.getenv("FINGERPRINT_REUSE_SIMILARITY")
+    else None
+)
+
+# Files kept in the index; the oldest are forgotten first
+FINGERPRINT_MAX_ENTRIES = int(os.getenv("FINGERPRINT_MAX_ENTRIES", "100000"))
+
+# Tokens per shingle
+SHINGLE_TOKENS = 5
+# Files with fewer shingles are too short to tell copies from coincidences
+MIN_SHINGLES = 16
+# One-permutation MinHash: each shingle lands in one of SIGNATURE_BINS bins,
+# which keeps the minimum of the hashes it received
+SIGNATURE_BINS = 32
+# Locality-sensitive hashing over BANDS bands of SIGNATURE_BINS / BANDS bins
+BANDS = 8
+# Candidates compared per lookup, bounding lookups of widely copied files
+MAX_CANDIDATES = 64
+
+_EMPTY = 0xFFFFFFFF
+_MASK = 0xFFFFFFFFFFFFFFFF
+_BAND_BYTES = SIGNATURE_BINS * 4 // BANDS
+_TOKEN = re.compile(r"[A-Za-z_]\w*|\d+|[^\w\s]")
+
+# A bucket holds a single entry id until a second one joins it
+Bucket = Union[int, List[int]]
+
+
+def fingerprint(content: str) -> Optional[bytes]:
+    """
+    Computes the MinHash signature of a file's token shingles.
+
+    Identifiers, numbers and punctuation are tokens; whitespace and layout
+    are ignored, so reformatting a file does not change its signature.
+
+    Args:
+        content (str): File body.
+
+    Returns:
+        Optional[bytes]: SIGNATURE_BINS unsigned 32-bit minima, or None for
+        files shorter than MIN_SHINGLES shingles.
+    """
+    tokens = _TOKEN.findall(content)
+    if len(tokens) - SHINGLE_TOKENS + 1 < MIN_SHINGLES:
+        return None
+    # Tokens are hashed once; a shingle's hash is the hash of the tuple of
+    # its token hashes, which for ints does not depend on PYTHONHASHSEED
+    ids = [crc32(token.encode()) for token in tokens]
+    minima = [_EMPTY] * SIGNATURE_BINS
+    shingles = zip(*(ids[offset:] for offset in range(SHINGLE_TOKENS)))
+    for value in map(hash, shingles):
+        value &= _MASK
+        index, value = value & (SIGNATURE_BINS - 1), value >> 32
+        if value < minima[index]:
+            minima[index] = value
+    return b"".join(value.to_bytes(4, "little") for value in minima)
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    """
+    Estimates the Jaccard similarity of the shingle sets behind two
+    signatures from the share of bins holding the same minimum.
+    """
+    same = compared = 0
+    for a, b in zip(memoryview(first).cast("I"), memoryview(second).cast("I")):
+        if a == b == _EMPTY:
+            continue
+        compared += 1
+        same += a == b
+    return same / compared if compared else 0.0
+
+
+@dataclass
+class DuplicateMatch:
+    """
+    A fetched file that matches a file indexed for another repository.
+    """
+
+    path: str
+    repository: str
+    matched_path: str
+    matched_sha: str
+    similarity: float
+    exact: bool
+
+    def as_dict(self) -> Dict:
+        return asdict(self)
+
+
+class FingerprintIndex:
+    """
+    In-memory index of the files fetched for reviews, for finding exact and
+    near duplicates across repositories.
+
+    Exact copies are found by blob SHA. Near copies are found through the
+    MinHash signature of each file: the signature is split into bands and
+    files sharing any band become candidates, whose similarity is then
+    estimated from the full signatures. A lookup costs a dictionary probe
+    per band plus a comparison per candidate, independent of the index size.
+
+    Args:
+        threshold (float): Similarity from which files are near duplicates.
+        max_entries (int): Files kept; the oldest are evicted first.
+    """
+
+    def __init__(
+        self,
+        threshold: float = FINGERPRINT_SIMILARITY,
+        max_entries: int = FINGERPRINT_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Entry id -> (repository, path, sha, signature), oldest first
+        self._entries: Dict[int, Tuple[str, str, str, bytes]] = {}
+        self._by_file: Dict[Tuple[str, str], int] = {}
+        self._by_sha: Dict[str, Bucket] = {}
+        self._bands: List[Dict[int, Bucket]] = [{} for _ in range(BANDS)]
+        self._next_id = 0
+        self.lookups = 0
+        self.exact_matches = 0
+        self.near_matches = 0
+
+    @classmethod
+    def from_env(cls) -> "FingerprintIndex":
+        """
+        Builds an index from FINGERPRINT_SIMILARITY and FINGERPRINT_MAX_ENTRIES.
+        """
+        return cls(
+            threshold=FINGERPRINT_SIMILARITY, max_entries=FINGERPRINT_MAX_ENTRIES
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _band_keys(signature: bytes) -> List[int]:
+        return [
+            hash(signature[start : start + _BAND_BYTES])
+            for start in range(0, len(signature), _BAND_BYTES)
+        ]
+
+    def lookup(
+        self, repository: str, sha: str, signature: bytes
+    ) -> Optional[DuplicateMatch]:
+        """
+        Finds the indexed file of another repository most similar to a file.
+
+        Args:
+            repository (str): Repository of the file, as "owner/repo".
+            sha (str): Blob SHA of the file.
+            signature (bytes): Its fingerprint.
+
+        Returns:
+            Optional[DuplicateMatch]: The best match, preferring exact copies,
+            or None when nothing reaches the threshold. The match's path is
+            left empty for the caller to fill in.
+        """
+        self.lookups += 1
+        for entry_id in _members(self._by_sha.get(sha)):
+            other, path, _, _ = self._entries[entry_id]
+            if other != repository:
+                self.exact_matches += 1
+                return DuplicateMatch("", other, path, sha, 1.0, True)
+
+        # Candidates sharing the most bands are the likeliest near copies
+        shared: Dict[int, int] = {}
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            for entry_id in _members(band.get(key)):
+                shared[entry_id] = shared.get(entry_id, 0) + 1
+        candidates = shared
+        if len(shared) > MAX_CANDIDATES:
+            candidates = heapq.nlargest(MAX_CANDIDATES, shared, key=shared.get)
+
+        best: Optional[DuplicateMatch] = None
+        for entry_id in candidates:
+            other, path, other_sha, other_signature = self._entries[entry_id]
+            if other == repository:
+                continue
+            score = similarity(signature, other_signature)
+            if score >= self.threshold and (best is None or score > best.similarity):
+                best = DuplicateMatch("", other, path, other_sha, score, False)
+        if best is not None:
+            self.near_matches += 1
+        return best
+
+    def add(self, repository: str, path: str, sha: str, signature: bytes) -> None:
+        """
+        Indexes a file, replacing an earlier version of the same path.
+        """
+        previous = self._by_file.get((repository, path))
+        if previous is not None:
+            if self._entries[previous][2] == sha:
+                return
+            self._remove(previous)
+        while self._entries and len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (repository, path, sha, signature)
+        self._by_file[(repository, path)] = entry_id
+        _bucket_add(self._by_sha, sha, entry_id)
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            _bucket_add(band, key, entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        repository, path, sha, signature = self._entries.pop(entry_id)
+        del self._by_file[(repository, path)]
+        _bucket_remove(self._by_sha, sha, entry_id)
+        for band, key in zip(self._bands, self._band_keys(signature)):
+            _bucket_remove(band, key, entry_id)
+
+    async def register(
+        self, repository: str, files: Iterable[Dict]
+    ) -> List[DuplicateMatch]:
+        """
+        Matches a repository's fetched files against the index, then indexes
+        them.
+
+        Signatures are computed off the event loop; files too short to
+        fingerprint are neither matched nor indexed.
+
+        Args:
+            repository (str): Repository the files belong to, as "owner/repo".
+            files (Iterable[Dict]): File dicts with "path", "content" and
+                optionally "sha".
+
+        Returns:
+            List[DuplicateMatch]: One match per duplicated file, in file order.
+        """
+        fingerprints = await asyncio.to_thread(_fingerprint_files, list(files))
+        matches = []
+        # Match before indexing so files of one repository never match each other
+        for path, sha, signature in fingerprints:
+            match = self.lookup(repository, sha, signature)
+            if match is not None:
+                match.path = path
+                matches.append(match)
+                metrics.duplicate_files.inc(kind="exact" if match.exact else "near")
+        for path, sha, signature in fingerprints:
+            self.add(repository, path, sha, signature)
+        return matches
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "lookups": self.lookups,
+            "exact_matches": self.exact_matches,
+            "near_matches": self.near_matches,
+        }
+
+
+def create_fingerprint_index() -> Optional[FingerprintIndex]:
+    """
+    Builds the duplicate index unless FINGERPRINT_INDEX is "false".
+    """
+    return FingerprintIndex.from_env() if FINGERPRINT_INDEX else None
+
+
+def duplicate_report(matches: List[DuplicateMatch], files: int) -> Dict:
+    """
+    Summarizes the duplicates found for a review.
+
+    Args:
+        matches (List[DuplicateMatch]): Matches returned by register.
+        files (int): Files checked.
+
+    Returns:
+        Dict: "files" lists every duplicated file; "repositories" lists the
+        repositories they were copied from or to, with the share of the
+        checked files each one matches, most similar first.
+    """
+    counts: Dict[str, int] = {}
+    for match in matches:
+        counts[match.repository] = counts.get(match.repository, 0) + 1
+    return {
+        "files": [match.as_dict() for match in matches],
+        "repositories": [
+            {
+                "repository": repository,
+                "files": count,
+                "share": round(count / files, 3) if files else 0.0,
+            }
+            for repository, count in sorted(counts.items(), key=lambda item: -item[1])
+        ],
+    }
+
+
+async def check_duplicates(
+    index: Optional[FingerprintIndex], repo_url: str, files: List[Dict]
+) -> Tuple[List[DuplicateMatch], Optional[Dict]]:
+    """
+    Registers a review's fetched files with the index.
+
+    Args:
+        index (FingerprintIndex, optional): The index; None disables the check.
+        repo_url (str): URL of the reviewed repository.
+        files (List[Dict]): Its fetched files.
+
+    Returns:
+        Tuple[List[DuplicateMatch], Optional[Dict]]: The matches and their
+        duplicate_report, or no matches and None without an index.
+    """
+    if index is None:
+        return [], None
+    owner, repo = parse_repo_url(repo_url)
+    matches = await index.register(f"{owner}/{repo}".lower(), files)
+    return matches, duplicate_report(matches, len(files))
+
+
+def _fingerprint_files(files: List[Dict]) -> List[Tuple[str, str, bytes]]:
+    fingerprints = []
+    for file in files:
+        content = file["content"]
+        signature = fingerprint(content)
+        if signature is not None:
+            sha = file.get("sha") or git_blob_sha(content)
+            fingerprints.append((file["path"], sha, signature))
+    return fingerprints
+
+
+def _members(bucket: Optional[Bucket]) -> List[int]:
+    if bucket is None:
+        return []
+    return bucket if isinstance(bucket, list) else [bucket]
+
+
+def _bucket_add(buckets: Dict, key, entry_id: int) -> None:
+    bucket = buckets.get(key)
+    if bucket is None:
+        buckets[key] = entry_id
+    elif isinstance(bucket, list):
+        bucket.append(entry_id)
+    else:
+        buckets[key] = [bucket, entry_id]
+
+
+def _bucket_remove(buckets: Dict, key, entry_id: int) -> None:
+    bucket = buckets.get(key)
+    if isinstance(bucket, list):
+        bucket.remove(entry_id)
+        if len(bucket) == 1:
+            buckets[key] = bucket[0]
+    elif bucket == entry_id:
+        del buckets[key]
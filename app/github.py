@@ -1,11 +1,25 @@
-from typing import Dict, List
+import asyncio
+import logging
+import os
+import tarfile
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import httpx
 
-from app.exceptions import ReviewServiceError
+from app import metrics
+from app.cache import SnapshotCache
+from app.diffs import DiffParser, FileDiff, parse_patch
+from app.events import ProgressCallback, emit
+from app.exceptions import CircuitOpenError, ReviewServiceError
+from app.files import ContentHandle, ContentStore, RepoFile
+from app.selection import FileSelector
 
 GITHUB_API_BASE = "https://api.github.com"
+GITHUB_RAW_BASE = "https://raw.githubusercontent.com"
 SUPPORTED_EXTENSIONS = {
     ".py",
     ".js",
@@ -17,101 +31,925 @@ SUPPORTED_EXTENSIONS = {
     ".rb",
     ".php",
 }
+# Upper bound on simultaneous GitHub requests issued by a single crawl
+MAX_CONCURRENCY = int(os.getenv("GITHUB_MAX_CONCURRENCY", "10"))
+# "contents" walks the contents API, "tree" uses git-tree listing + tarball
+FETCH_STRATEGIES = ("contents", "tree")
+FETCH_STRATEGY = os.getenv("GITHUB_FETCH_STRATEGY", "contents")
+# The compare API lists at most this many changed files
+COMPARE_FILE_LIMIT = 300
+# "files" pages through the pull request files API, "diff" streams the
+# pull request in the diff media type
+DIFF_SOURCES = ("files", "diff")
+PR_DIFF_SOURCE = os.getenv("PR_DIFF_SOURCE", "files")
+# Files per page of the pull request files API, and how many it lists at most
+PULL_FILES_PER_PAGE = 100
+PULL_FILES_LIMIT = 3000
 
+logger = logging.getLogger(__name__)
 
-async def fetch_repository_files(repo_url: str, token: str) -> List[Dict]:
+
+@dataclass
+class CrawlStats:
+    """
+    Counters collected while crawling a repository.
+
+    Attributes:
+        files (int): Number of file bodies downloaded.
+        directories (int): Number of sub-directory listings fetched.
+        requests (int): Total HTTP requests issued by the crawl.
+        elapsed (float): Wall-clock duration of the crawl in seconds.
+    """
+
+    files: int = 0
+    directories: int = 0
+    requests: int = 0
+    elapsed: float = 0.0
+
+
+@dataclass
+class _RepoFetch:
+    """
+    Everything the fetch strategies need to talk to one repository.
+    """
+
+    user: str
+    repo: str
+    client: httpx.AsyncClient
+    headers: Dict
+    max_concurrency: int
+    selector: FileSelector
+    store: ContentStore
+    progress: Optional[ProgressCallback] = None
+
+    @property
+    def api_url(self) -> str:
+        return f"{GITHUB_API_BASE}/repos/{self.user}/{self.repo}"
+
+
+async def fetch_repository_files(
+    repo_url: str,
+    token: str,
+    max_concurrency: Optional[int] = None,
+    strategy: Optional[str] = None,
+    client: Optional[httpx.AsyncClient] = None,
+    cache: Optional[SnapshotCache] = None,
+    progress: Optional[ProgressCallback] = None,
+    selector: Optional[FileSelector] = None,
+    store: Optional[ContentStore] = None,
+) -> List[RepoFile]:
     """
-    Fetches all files in the specified GitHub repository.
+    Fetches the reviewable files in the specified GitHub repository.
+
+    Files are chosen from the repository listing before any body is
+    downloaded; vendored, generated, ignored and oversized files are skipped
+    and the rest are ranked under the review's budget (see FileSelector).
+
+    With a snapshot cache, the HEAD commit SHA is resolved first and a cached
+    snapshot of that commit is returned without touching any other endpoint.
 
     Args:
         repo_url (str): Full GitHub repository URL
         token (str): GitHub authentication token
+        max_concurrency (int, optional): Cap on parallel GitHub requests
+            (default: GITHUB_MAX_CONCURRENCY)
+        strategy (str, optional): "contents" to walk the contents API or "tree"
+            to use one git-tree listing plus one tarball download
+            (default: GITHUB_FETCH_STRATEGY)
+        client (httpx.AsyncClient, optional): Client to issue requests with;
+            a short-lived client is created when omitted
+        cache (SnapshotCache, optional): Snapshot cache keyed by commit SHA
+        progress (ProgressCallback, optional): Receives "files_discovered" and
+            "file_fetched" events as the crawl advances
+        selector (FileSelector, optional): Decides which files to download and
+            keeps a report of the skipped ones (default: supported extensions
+            with the SELECTION_* budgets)
+        store (ContentStore, optional): Holds the downloaded bodies under the
+            review's memory budget (default: REVIEW_MEMORY_BUDGET)
 
     Returns:
-        List[Dict]: List of file objects containing path and content
+        List[RepoFile]: Files with path, content, size and sha; bodies are
+        streamed into the store and decoded when their content is read
 
     Raises:
         ReviewServiceError: If there are issues accessing the repository
     """
-    GITHUB_API_BASE = "https://api.github.com"
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "Accept": "application/vnd.github.v3+json",
-    }
+    headers = github_headers(token)
+    started = time.perf_counter()
 
     try:
-        # Parse and validate the GitHub URL
-        parsed_url = urlparse(repo_url)
-        if parsed_url.netloc != "github.com":
+        user, repo = parse_repo_url(repo_url)
+
+        strategy = strategy or FETCH_STRATEGY
+        if strategy not in FETCH_STRATEGIES:
             raise ReviewServiceError(
-                "Invalid GitHub URL. Must be a github.com repository"
+                f"Unknown fetch strategy: {strategy}", category="validation"
             )
 
-        # Extract the user and repo name from the URL
-        path_parts = parsed_url.path.strip("/").split("/")
-        if len(path_parts) < 2:
-            raise ReviewServiceError("Invalid repository path")
-        user, repo = path_parts[:2]
-
-        # Fetch repository contents
-        api_url = f"{GITHUB_API_BASE}/repos/{user}/{repo}/contents"
-        async with httpx.AsyncClient() as client:
-            response = await client.get(api_url, headers=headers, timeout=30.0)
-
-            if response.status_code == 404:
-                raise ReviewServiceError("Repository not found")
-            elif response.status_code == 403:
-                raise ReviewServiceError(
-                    "Access denied. Check GitHub token permissions"
-                )
-            elif response.status_code != 200:
-                error_data = response.json()
-                raise ReviewServiceError(
-                    f"GitHub API Error: {error_data.get('message', 'Unknown error')}"
+        selector = selector or FileSelector(extensions=SUPPORTED_EXTENSIONS)
+        store = store or ContentStore()
+        max_concurrency = max_concurrency or MAX_CONCURRENCY
+
+        if client is None:
+            async with httpx.AsyncClient() as client:
+                fetch = _RepoFetch(
+                    user,
+                    repo,
+                    client,
+                    headers,
+                    max_concurrency,
+                    selector,
+                    store,
+                    progress,
                 )
+                files = await _fetch_repository(fetch, strategy, cache)
+        else:
+            fetch = _RepoFetch(
+                user, repo, client, headers, max_concurrency, selector, store, progress
+            )
+            files = await _fetch_repository(fetch, strategy, cache)
 
-            contents = response.json()
-            return await _process_repository_contents(contents, client, headers)
+        metrics.github_crawl_seconds.observe(
+            time.perf_counter() - started, strategy=strategy
+        )
+        for skipped in selector.report.skipped:
+            metrics.github_files_skipped.inc(reason=skipped["reason"])
+        return files
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        raise ReviewServiceError(f"An unexpected error occurred: {str(e)}")
+        raise ReviewServiceError(
+            f"An unexpected error occurred: {str(e)}",
+            category=getattr(e, "category", "github"),
+        )
+
+
+def github_headers(token: str) -> Dict:
+    """
+    Builds the headers sent with every GitHub API request.
+    """
+    return {
+        "Authorization": f"Bearer {token}",
+        "Accept": "application/vnd.github.v3+json",
+    }
+
+
+def parse_repo_url(repo_url: str) -> Tuple[str, str]:
+    """
+    Extracts the owner and repository name from a GitHub URL.
+
+    Args:
+        repo_url (str): Full GitHub repository URL
+
+    Returns:
+        Tuple[str, str]: The repository owner and name
+
+    Raises:
+        ReviewServiceError: If the URL is not a github.com repository URL
+    """
+    parsed_url = urlparse(repo_url)
+    if parsed_url.netloc != "github.com":
+        raise ReviewServiceError(
+            "Invalid GitHub URL. Must be a github.com repository",
+            category="validation",
+        )
+
+    path_parts = parsed_url.path.strip("/").split("/")
+    if len(path_parts) < 2:
+        raise ReviewServiceError("Invalid repository path", category="validation")
+    return path_parts[0], path_parts[1]
+
+
+def parse_pull_url(pull_url: str) -> Tuple[str, str, int]:
+    """
+    Extracts the owner, repository name and number from a pull request URL.
+
+    Args:
+        pull_url (str): URL such as https://github.com/owner/repo/pull/42
+
+    Returns:
+        Tuple[str, str, int]: The repository owner, name and pull request number
+
+    Raises:
+        ReviewServiceError: If the URL is not a github.com pull request URL
+    """
+    owner, repo = parse_repo_url(pull_url)
+    path_parts = urlparse(pull_url).path.strip("/").split("/")
+    if len(path_parts) < 4 or path_parts[2] != "pull" or not path_parts[3].isdigit():
+        raise ReviewServiceError("Invalid pull request path", category="validation")
+    return owner, repo, int(path_parts[3])
+
+
+def _raise_for_status(response: httpx.Response) -> None:
+    """
+    Translates a failed GitHub API response into a ReviewServiceError.
+
+    Args:
+        response (httpx.Response): Response returned by the GitHub API
+
+    Raises:
+        ReviewServiceError: If the response status is not 200
+    """
+    if response.status_code == 404:
+        raise ReviewServiceError("Repository not found", category="not_found")
+    elif response.status_code in (403, 429) and (
+        response.headers.get("X-RateLimit-Remaining") == "0"
+        or "Retry-After" in response.headers
+    ):
+        raise ReviewServiceError(
+            "GitHub API rate limit exceeded. Try again later", category="rate_limit"
+        )
+    elif response.status_code == 403:
+        raise ReviewServiceError(
+            "Access denied. Check GitHub token permissions", category="access_denied"
+        )
+    elif response.status_code != 200:
+        error_data = response.json()
+        raise ReviewServiceError(
+            f"GitHub API Error: {error_data.get('message', 'Unknown error')}",
+            category="github",
+        )
+
+
+async def resolve_head_sha(
+    user: str, repo: str, client: httpx.AsyncClient, headers: Dict
+) -> str:
+    """
+    Resolves the commit SHA of the repository's default branch.
+
+    Uses the "application/vnd.github.sha" media type, which returns the bare
+    SHA instead of the full commit object.
+
+    Args:
+        user (str): Repository owner
+        repo (str): Repository name
+        client (httpx.AsyncClient): HTTP client for making requests
+        headers (Dict): GitHub API headers
+
+    Returns:
+        str: The 40-character commit SHA
+    """
+    response = await client.get(
+        f"{GITHUB_API_BASE}/repos/{user}/{repo}/commits/HEAD",
+        headers={**headers, "Accept": "application/vnd.github.sha"},
+        timeout=30.0,
+    )
+    _raise_for_status(response)
+    return response.text.strip()
+
+
+async def compare_commits(
+    user: str,
+    repo: str,
+    base: str,
+    head: str,
+    client: httpx.AsyncClient,
+    headers: Dict,
+) -> Optional[List[Dict]]:
+    """
+    Lists the files that differ between two commits.
+
+    Args:
+        user (str): Repository owner
+        repo (str): Repository name
+        base (str): Commit SHA to compare from
+        head (str): Commit SHA to compare to
+        client (httpx.AsyncClient): HTTP client for making requests
+        headers (Dict): GitHub API headers
+
+    Returns:
+        Optional[List[Dict]]: Changed files with filename, status, sha and
+        previous_filename (for renames), or None when the commits cannot be
+        compared or the diff is too large to be listed completely
+    """
+    response = await client.get(
+        f"{GITHUB_API_BASE}/repos/{user}/{repo}/compare/{base}...{head}",
+        headers=headers,
+        timeout=30.0,
+    )
+    if response.status_code != 200:
+        logger.info("Cannot compare %s/%s %s...%s", user, repo, base[:7], head[:7])
+        return None
+    files = response.json().get("files", [])
+    if len(files) >= COMPARE_FILE_LIMIT:
+        return None
+    return files
+
+
+async def list_tree(
+    user: str, repo: str, ref: str, client: httpx.AsyncClient, headers: Dict
+) -> Optional[List[Dict]]:
+    """
+    Lists the files of a commit with one recursive git-tree call.
+
+    Args:
+        user (str): Repository owner
+        repo (str): Repository name
+        ref (str): Commit SHA or branch to list
+        client (httpx.AsyncClient): HTTP client for making requests
+        headers (Dict): GitHub API headers
+
+    Returns:
+        Optional[List[Dict]]: Blob entries with path, sha and size, or None
+        when the tree is too large to be listed in one call
+    """
+    response = await client.get(
+        f"{GITHUB_API_BASE}/repos/{user}/{repo}/git/trees/{ref}",
+        headers=headers,
+        params={"recursive": "1"},
+        timeout=30.0,
+    )
+    _raise_for_status(response)
+
+    tree = response.json()
+    if tree.get("truncated"):
+        return None
+    return [entry for entry in tree.get("tree", []) if entry["type"] == "blob"]
+
+
+async def fetch_pull_request(
+    user: str,
+    repo: str,
+    number: int,
+    client: httpx.AsyncClient,
+    headers: Dict,
+    source: Optional[str] = None,
+) -> List[FileDiff]:
+    """
+    Fetches the changes of a pull request, without the unchanged code.
+
+    Args:
+        user (str): Repository owner
+        repo (str): Repository name
+        number (int): Pull request number
+        client (httpx.AsyncClient): HTTP client for making requests
+        headers (Dict): GitHub API headers
+        source (str, optional): "files" to page through the pull request
+            files API, "diff" to stream the whole diff (default: PR_DIFF_SOURCE)
+
+    Returns:
+        List[FileDiff]: Changed files with their hunks, in diff order
+
+    Raises:
+        ReviewServiceError: If the pull request cannot be read
+    """
+    source = source or PR_DIFF_SOURCE
+    if source not in DIFF_SOURCES:
+        raise ReviewServiceError(
+            f"Unknown diff source {source!r}; expected one of {DIFF_SOURCES}",
+            category="validation",
+        )
+    started = time.perf_counter()
+    if source == "diff":
+        files = await _stream_pull_diff(user, repo, number, client, headers)
+    else:
+        files = await _list_pull_files(user, repo, number, client, headers)
+    metrics.github_crawl_seconds.observe(
+        time.perf_counter() - started, strategy=f"pull_{source}"
+    )
+    metrics.github_bytes.inc(sum(file.size for file in files), source="diff")
+    return files
+
+
+async def _list_pull_files(
+    user: str, repo: str, number: int, client: httpx.AsyncClient, headers: Dict
+) -> List[FileDiff]:
+    files = []
+    for page in range(1, PULL_FILES_LIMIT // PULL_FILES_PER_PAGE + 1):
+        response = await client.get(
+            f"{GITHUB_API_BASE}/repos/{user}/{repo}/pulls/{number}/files",
+            params={"per_page": PULL_FILES_PER_PAGE, "page": page},
+            headers=headers,
+            timeout=30.0,
+        )
+        _raise_for_status(response)
+        entries = response.json()
+        for entry in entries:
+            file = parse_patch(entry["filename"], entry.get("patch"), entry["status"])
+            file.previous_path = entry.get("previous_filename")
+            files.append(file)
+        if len(entries) < PULL_FILES_PER_PAGE:
+            break
+    return files
+
+
+async def _stream_pull_diff(
+    user: str, repo: str, number: int, client: httpx.AsyncClient, headers: Dict
+) -> List[FileDiff]:
+    parser = DiffParser()
+    async with client.stream(
+        "GET",
+        f"{GITHUB_API_BASE}/repos/{user}/{repo}/pulls/{number}",
+        headers={**headers, "Accept": "application/vnd.github.diff"},
+        timeout=60.0,
+    ) as response:
+        if response.status_code != 200:
+            await response.aread()
+            _raise_for_status(response)
+        async for line in response.aiter_lines():
+            parser.feed(line)
+    return parser.close()
+
+
+async def fetch_files_at(
+    user: str,
+    repo: str,
+    ref: str,
+    entries: List[Dict],
+    client: httpx.AsyncClient,
+    headers: Dict,
+    max_concurrency: Optional[int] = None,
+    progress: Optional[ProgressCallback] = None,
+    store: Optional[ContentStore] = None,
+) -> List[RepoFile]:
+    """
+    Downloads specific files of a commit, concurrently.
+
+    Args:
+        user (str): Repository owner
+        repo (str): Repository name
+        ref (str): Commit SHA to read the files at
+        entries (List[Dict]): Files to download, each with path and sha
+        client (httpx.AsyncClient): HTTP client for making requests
+        headers (Dict): GitHub API headers
+        max_concurrency (int, optional): Cap on parallel downloads
+            (default: GITHUB_MAX_CONCURRENCY)
+        progress (ProgressCallback, optional): Receives "file_fetched" events
+        store (ContentStore, optional): Holds the downloaded bodies
+
+    Returns:
+        List[RepoFile]: Files with path, content, size and sha, in path
+        order; files that cannot be downloaded are left out
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or MAX_CONCURRENCY)
+    store = store or ContentStore()
+
+    async def download(entry: Dict) -> Optional[RepoFile]:
+        async with semaphore:
+            with metrics.github_file_fetch_seconds.time():
+                body = await stream_body(
+                    client,
+                    f"{GITHUB_RAW_BASE}/{user}/{repo}/{ref}/{entry['path']}",
+                    headers,
+                    store,
+                    timeout=30.0,
+                )
+        if body is None:
+            return None
+        size = len(body)
+        metrics.github_files_fetched.inc()
+        metrics.github_bytes.inc(size, source="raw")
+        await emit(progress, "file_fetched", {"path": entry["path"], "size": size})
+        return RepoFile(entry["path"], size, entry.get("sha"), body)
+
+    files = await asyncio.gather(*map(download, entries))
+    return sorted(
+        (file for file in files if file is not None), key=lambda file: file.path
+    )
+
+
+async def stream_body(
+    client: httpx.AsyncClient,
+    url: str,
+    headers: Dict,
+    store: ContentStore,
+    timeout: Optional[float] = None,
+) -> Optional[ContentHandle]:
+    """
+    Streams a file body into the store chunk by chunk, so it never has to be
+    held in full next to its decoded text.
+
+    Args:
+        client (httpx.AsyncClient): HTTP client for making requests
+        url (str): Raw download URL of the file
+        headers (Dict): GitHub API headers
+        store (ContentStore): Store receiving the body
+        timeout (float, optional): Request timeout in seconds
+
+    Returns:
+        Optional[ContentHandle]: Handle to the stored body, or None when the
+        file cannot be downloaded
+    """
+    kwargs = {"headers": headers}
+    if timeout is not None:
+        kwargs["timeout"] = timeout
+    async with client.stream("GET", url, **kwargs) as response:
+        if response.status_code != 200:
+            return None
+        writer = store.writer()
+        async for chunk in response.aiter_bytes():
+            writer.write(chunk)
+    return writer.close()
+
+
+async def _fetch_repository(
+    fetch: _RepoFetch, strategy: str, cache: Optional[SnapshotCache]
+) -> List[RepoFile]:
+    """
+    Serves the repository from the snapshot cache when possible, otherwise
+    fetches it at a pinned commit and stores the result.
+    """
+    if cache is None:
+        return await _fetch_with_strategy(fetch, strategy)
+
+    sha = await resolve_head_sha(fetch.user, fetch.repo, fetch.client, fetch.headers)
+    files = await cache.get_snapshot(fetch.user, fetch.repo, sha, fetch.store)
+    if files is not None:
+        logger.info("Snapshot cache hit for %s/%s@%s", fetch.user, fetch.repo, sha[:7])
+        fetch.selector.mark_cached(files)
+        await emit(
+            fetch.progress,
+            "files_discovered",
+            {"paths": [file["path"] for file in files], "cached": True},
+        )
+        return files
+
+    files = await _fetch_with_strategy(fetch, strategy, ref=sha)
+    await cache.put_snapshot(fetch.user, fetch.repo, sha, files)
+    return files
+
+
+async def _fetch_with_strategy(
+    fetch: _RepoFetch, strategy: str, ref: Optional[str] = None
+) -> List[RepoFile]:
+    """
+    Runs the selected fetch strategy, falling back to the contents walker
+    when the tree strategy cannot serve the repository.
+    """
+    if strategy == "tree":
+        files = await _fetch_via_tree(fetch, ref or "HEAD")
+        if files is not None:
+            return files
+        logger.warning(
+            "Tree fetch unavailable for %s/%s, falling back to contents API",
+            fetch.user,
+            fetch.repo,
+        )
+    return await _fetch_via_contents(fetch, ref)
+
+
+async def _fetch_via_contents(
+    fetch: _RepoFetch, ref: Optional[str] = None
+) -> List[RepoFile]:
+    """
+    Walks the repository with one contents API call per directory and one
+    raw download per file.
+    """
+    api_url = f"{fetch.api_url}/contents"
+    if ref:
+        # Directory URLs returned by the API carry the ref forward themselves
+        response = await fetch.client.get(
+            api_url, headers=fetch.headers, params={"ref": ref}, timeout=30.0
+        )
+    else:
+        response = await fetch.client.get(api_url, headers=fetch.headers, timeout=30.0)
+    _raise_for_status(response)
+
+    contents = response.json()
+    stats = CrawlStats(requests=1)
+    semaphore = asyncio.Semaphore(fetch.max_concurrency)
+    started = time.perf_counter()
+    await load_selection_rules(
+        fetch.selector,
+        {
+            item["name"]: item["download_url"]
+            for item in contents
+            if item["type"] == "file" and item["name"] in FileSelector.CONFIG_FILES
+        },
+        fetch.client,
+        fetch.headers,
+    )
+    files = await _process_repository_contents(
+        contents,
+        fetch.client,
+        fetch.headers,
+        semaphore,
+        stats,
+        fetch.progress,
+        fetch.selector,
+        fetch.store,
+    )
+    stats.elapsed = time.perf_counter() - started
+    logger.info(
+        "Crawled %s/%s: %d files, %d directories, %d requests in %.2fs",
+        fetch.user,
+        fetch.repo,
+        stats.files,
+        stats.directories,
+        stats.requests,
+        stats.elapsed,
+    )
+    return sorted(files, key=lambda file: file.path)
+
+
+async def _fetch_via_tree(fetch: _RepoFetch, ref: str) -> Optional[List[RepoFile]]:
+    """
+    Lists the repository with one recursive git-tree call and reads every
+    file body from a single streamed tarball download.
+
+    Returns:
+        Optional[List[RepoFile]]: The fetched files, or None when the tree is
+        truncated or the archive cannot be downloaded
+    """
+    started = time.perf_counter()
+    blobs = await list_tree(fetch.user, fetch.repo, ref, fetch.client, fetch.headers)
+    if blobs is None:
+        return None
+
+    await load_selection_rules(
+        fetch.selector,
+        {
+            entry["path"]: f"{GITHUB_RAW_BASE}/{fetch.user}/{fetch.repo}/{ref}/"
+            + entry["path"]
+            for entry in blobs
+            if entry["path"] in FileSelector.CONFIG_FILES
+        },
+        fetch.client,
+        fetch.headers,
+    )
+    wanted = {entry["path"]: entry for entry in fetch.selector.select(blobs)}
+    await emit(
+        fetch.progress,
+        "files_discovered",
+        {"paths": sorted(wanted), "skipped": len(fetch.selector.report.skipped)},
+    )
+    if not wanted:
+        return []
+
+    reader = TarStreamReader(wanted.keys(), fetch.store)
+    async with fetch.client.stream(
+        "GET",
+        f"{fetch.api_url}/tarball/{ref}",
+        headers=fetch.headers,
+        follow_redirects=True,
+        timeout=60.0,
+    ) as archive:
+        if archive.status_code != 200:
+            return None
+        async for chunk in archive.aiter_bytes():
+            for path in reader.feed(chunk):
+                await emit(
+                    fetch.progress,
+                    "file_fetched",
+                    {"path": path, "size": len(reader.files[path])},
+                )
+    reader.close()
+    metrics.github_bytes.inc(reader.bytes_read, source="tarball")
+    metrics.github_files_fetched.inc(len(reader.files))
+
+    files = [
+        RepoFile(
+            path,
+            wanted[path].get("size", len(reader.files[path])),
+            wanted[path]["sha"],
+            reader.files[path],
+        )
+        for path in sorted(reader.files)
+    ]
+    logger.info(
+        "Fetched %s/%s via tree+tarball: %d files, %d bytes archived in %.2fs",
+        fetch.user,
+        fetch.repo,
+        len(files),
+        reader.bytes_read,
+        time.perf_counter() - started,
+    )
+    return files
+
+
+async def load_selection_rules(
+    selector: FileSelector,
+    urls: Dict[str, str],
+    client: httpx.AsyncClient,
+    headers: Dict,
+) -> None:
+    """
+    Downloads the root .gitignore and .gitattributes (when present) and hands
+    them to the file selector.
+
+    Args:
+        selector (FileSelector): Selector receiving the rules
+        urls (Dict[str, str]): Raw download URL per configuration file name
+        client (httpx.AsyncClient): HTTP client for making requests
+        headers (Dict): GitHub API headers
+    """
+    names = list(urls)
+    responses = await asyncio.gather(
+        *(client.get(urls[name], headers=headers, timeout=30.0) for name in names)
+    )
+    texts = {
+        name: response.text
+        for name, response in zip(names, responses)
+        if response.status_code == 200
+    }
+    selector.load_rules(texts.get(".gitignore", ""), texts.get(".gitattributes", ""))
+
+
+class TarStreamReader:
+    """
+    Incrementally decompresses and parses a gzipped tar stream, keeping only
+    the bodies of the requested paths.
+
+    GitHub archives prefix every member with a "<owner>-<repo>-<sha>/"
+    directory, which is stripped so names match git-tree paths.
+
+    Args:
+        paths (Iterable[str]): Paths whose bodies are kept
+        store (ContentStore, optional): Holds the kept bodies
+    """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self, paths: Iterable[str], store: Optional[ContentStore] = None):
+        self.wanted = set(paths)
+        self.store = store or ContentStore()
+        self.files: Dict[str, ContentHandle] = {}
+        self.bytes_read = 0
+        self._inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = bytearray()
+        self._pending_name: Optional[str] = None
+        self._finished = False
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """
+        Consumes a chunk of the compressed archive.
+
+        Args:
+            chunk (bytes): Raw bytes as received from the network
+
+        Returns:
+            List[str]: Wanted paths whose bodies were completed by this chunk
+        """
+        self.bytes_read += len(chunk)
+        if self._finished:
+            return []
+        self._buffer += self._inflater.decompress(chunk)
+        return self._drain()
+
+    def close(self) -> List[str]:
+        """
+        Flushes the decompressor once the download is complete.
+        """
+        if self._finished:
+            return []
+        self._buffer += self._inflater.flush()
+        return self._drain()
+
+    def _drain(self) -> List[str]:
+        completed = []
+        while len(self._buffer) >= self.BLOCK_SIZE:
+            header = bytes(self._buffer[: self.BLOCK_SIZE])
+            if header == b"\0" * self.BLOCK_SIZE:
+                self._finished = True
+                self._buffer.clear()
+                break
+
+            info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+            padded = -(-info.size // self.BLOCK_SIZE) * self.BLOCK_SIZE
+            if len(self._buffer) < self.BLOCK_SIZE + padded:
+                return
+
+            del self._buffer[: self.BLOCK_SIZE]
+            body = bytes(self._buffer[: info.size])
+            del self._buffer[:padded]
+            path = self._handle_member(info, body)
+            if path is not None:
+                completed.append(path)
+        return completed
+
+    def _handle_member(self, info: tarfile.TarInfo, body: bytes) -> Optional[str]:
+        if info.type == tarfile.XHDTYPE:
+            # Per-member pax header: a long path overrides the next member's name
+            self._pending_name = _parse_pax_path(body)
+            return None
+        if info.type == tarfile.GNUTYPE_LONGNAME:
+            self._pending_name = body.rstrip(b"\0").decode("utf-8", "surrogateescape")
+            return None
+        if info.type == tarfile.XGLTYPE:
+            return None
+
+        name = self._pending_name or info.name
+        self._pending_name = None
+        if not info.isreg():
+            return None
+
+        path = name.split("/", 1)[1] if "/" in name else name
+        if path not in self.wanted:
+            return None
+        self.files[path] = self.store.add(body)
+        return path
+
+
+def _parse_pax_path(body: bytes) -> Optional[str]:
+    """
+    Extracts the "path" record from a pax extended header body.
+    """
+    position = 0
+    while position < len(body):
+        space = body.find(b" ", position)
+        if space == -1:
+            break
+        length = int(body[position:space])
+        start, end = space + 1, position + length - 1
+        record = body[start:end]
+        key, _, value = record.partition(b"=")
+        if key == b"path":
+            return value.decode("utf-8", "surrogateescape")
+        position += length
+    return None
 
 
 async def _process_repository_contents(
-    contents: List[Dict], client: httpx.AsyncClient, headers: Dict
-) -> List[Dict]:
+    contents: List[Dict],
+    client: httpx.AsyncClient,
+    headers: Dict,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    stats: Optional[CrawlStats] = None,
+    progress: Optional[ProgressCallback] = None,
+    selector: Optional[FileSelector] = None,
+    store: Optional[ContentStore] = None,
+) -> List[RepoFile]:
     """
-    Recursively processes repository contents, fetching file contents when needed.
+    Recursively lists repository contents, then fetches the selected files.
+
+    The whole listing is collected first so the selector can rank every file
+    before any body is downloaded; directories it rules out (vendored or
+    ignored) are never listed. Sibling directories and file downloads run
+    concurrently; the semaphore bounds the requests in flight.
 
     Args:
         contents (List[Dict]): List of file/directory objects from GitHub API
         client (httpx.AsyncClient): HTTP client for making requests
         headers (Dict): GitHub API headers
+        semaphore (asyncio.Semaphore, optional): Shared concurrency limiter
+        stats (CrawlStats, optional): Counters updated as requests complete
+        progress (ProgressCallback, optional): Receives crawl progress events
+        selector (FileSelector, optional): Chooses the files to download
+            (default: every file with a supported extension, within budget)
+        store (ContentStore, optional): Holds the downloaded bodies
 
     Returns:
-        List[Dict]: Processed list of file objects with contents
+        List[RepoFile]: The fetched files
     """
-    processed_files = []
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    if stats is None:
+        stats = CrawlStats()
+    if selector is None:
+        selector = FileSelector(extensions=SUPPORTED_EXTENSIONS)
+    if store is None:
+        store = ContentStore()
 
-    for item in contents:
-        if item["type"] == "file":
-            # Only process supported file types
-            if any(item["name"].endswith(ext) for ext in SUPPORTED_EXTENSIONS):
-                response = await client.get(item["download_url"], headers=headers)
-                if response.status_code == 200:
-                    processed_files.append(
-                        {
-                            "path": item["path"],
-                            "content": response.text,
-                            "size": item["size"],
-                        }
-                    )
-        elif item["type"] == "dir":
-            # Recursively fetch directory contents
-            response = await client.get(item["url"], headers=headers)
-            if response.status_code == 200:
-                sub_contents = response.json()
-                processed_files.extend(
-                    await _process_repository_contents(sub_contents, client, headers)
-                )
+    async def fetch(url: str) -> httpx.Response:
+        # Only the request itself holds a slot, never the recursion below it
+        async with semaphore:
+            stats.requests += 1
+            return await client.get(url, headers=headers)
+
+    async def list_items(items: List[Dict]) -> List[Dict]:
+        files = [item for item in items if item["type"] == "file"]
+        directories = [
+            item
+            for item in items
+            if item["type"] == "dir" and not selector.skip_directory(item["path"])
+        ]
+        for listing in await asyncio.gather(*map(list_dir, directories)):
+            files.extend(listing)
+        return files
+
+    async def list_dir(item: Dict) -> List[Dict]:
+        response = await fetch(item["url"])
+        if response.status_code != 200:
+            return []
+        stats.directories += 1
+        return await list_items(response.json())
 
+    async def process_file(item: Dict) -> List[RepoFile]:
+        async with semaphore:
+            stats.requests += 1
+            with metrics.github_file_fetch_seconds.time():
+                body = await stream_body(client, item["download_url"], headers, store)
+        if body is None:
+            return []
+        stats.files += 1
+        metrics.github_files_fetched.inc()
+        metrics.github_bytes.inc(item["size"], source="raw")
+        await emit(
+            progress, "file_fetched", {"path": item["path"], "size": item["size"]}
+        )
+        return [RepoFile(item["path"], item["size"], item.get("sha"), body)]
+
+    selected = selector.select(await list_items(contents))
+    await emit(
+        progress,
+        "files_discovered",
+        {
+            "paths": [item["path"] for item in selected],
+            "skipped": len(selector.report.skipped),
+        },
+    )
+
+    processed_files = []
+    for files in await asyncio.gather(*map(process_file, selected)):
+        processed_files.extend(files)
     return processed_files
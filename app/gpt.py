@@ -1,127 +1,1336 @@
+import asyncio
 import json
-from typing import Dict, List
+import os
+import re
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Type
 
-from openai import OpenAI, OpenAIError
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAIError,
+)
 
+from app import metrics
+from app.backends import backend_settings
+from app.cache import ReviewResultCache, snapshot_digest
+from app.cascade import CascadePolicy, cascade_policy
+from app.chunking import BatchPlan, plan_batches
+from app.diffs import HunkGroup, anchors_by_path, nearest_anchor, plan_diff_batches
+from app.events import ProgressCallback, emit
 from app.exceptions import ReviewServiceError
+from app.jsonstream import JSONStream
+from app.models import (
+    Answer,
+    DiffAnswer,
+    ReviewAnswer,
+    TriageAnswer,
+    VerdictAnswer,
+    response_format,
+)
+from app.preanalysis import pre_analyzer
+from app.resilience import Hedger, HedgerPool
+
+MODEL = "gpt-4o"
+TEMPERATURE = 0.7
+MAX_TOKENS = 2000
+SYSTEM_PROMPT = (
+    "You are an experienced technical lead performing a detailed code review."
+)
+FORMAT_ERROR = "Error: AI response was not in the expected format"
+# Batches of one review that may be sent to the model at the same time
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Seconds one review may spend on completions in total; 0 disables the budget
+LLM_REVIEW_TIMEOUT = float(os.getenv("LLM_REVIEW_TIMEOUT", "600"))
+# Errors after which a completion is worth sending again
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError)
+# Set to "false" for backends without structured outputs; answers are then
+# only asked for as JSON in the prompt
+LLM_STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
+# Completions requested again when an answer cannot be used even after local
+# repair
+LLM_FORMAT_RETRIES = int(os.getenv("LLM_FORMAT_RETRIES", "1"))
+
+# Times every completion and, with LLM_HEDGE=true, hedges the slow ones;
+# keyed by hedge_key, as completion latency depends on the model and length
+completion_hedgers = HedgerPool(Hedger.from_env)
+
+# One AsyncOpenAI client per API key, reused across reviews
+_clients: Dict[str, AsyncOpenAI] = {}
+
+
+def get_openai_client(api_key: str) -> AsyncOpenAI:
+    """
+    Returns the shared async OpenAI client for the given API key, sending
+    completions to the default LLM backend. Unlike ClientPool.openai, the
+    client is not routed by model and not limited in concurrency.
+
+    Args:
+        api_key (str): OpenAI API key.
+
+    Returns:
+        AsyncOpenAI: A client that is created on first use and then reused.
+    """
+    client = _clients.get(api_key)
+    if client is None:
+        backend = backend_settings()[0]
+        options = {} if backend.timeout is None else {"timeout": backend.timeout}
+        client = _clients[api_key] = AsyncOpenAI(
+            api_key=backend.api_key or api_key, base_url=backend.base_url, **options
+        )
+    return client
+
+
+async def close_openai_clients() -> None:
+    """
+    Closes every shared OpenAI client, releasing their connection pools.
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
 
 
 async def analyze_code(
-    contents: List[dict], description: str, level: str, api_key: str
+    contents: List[dict],
+    description: str,
+    level: str,
+    api_key: str,
+    client: Optional[AsyncOpenAI] = None,
+    result_cache: Optional[ReviewResultCache] = None,
+    progress: Optional[ProgressCallback] = None,
 ) -> Dict:
     """
     Use OpenAI GPT to analyze the provided repository contents.
 
+    Files are packed into token-budgeted batches that are reviewed
+    concurrently (map); with more than one batch, the partial reviews are
+    merged into a single result (reduce). With LLM_CASCADE, the batches are
+    first triaged by a cheap model and only the files the level's
+    CascadePolicy escalates are reviewed by the review model.
+
     Args:
         contents (List[dict]): List of files with their contents.
         description (str): Assignment description.
         level (str): Expected candidate level.
         api_key (str): OpenAI API key.
+        client (AsyncOpenAI, optional): Pooled client to use; the shared client
+            for api_key is used when omitted.
+        result_cache (ReviewResultCache, optional): Memoizes results of
+            identical prompts; concurrent identical calls share one completion.
+        progress (ProgressCallback, optional): Receives batch events and each
+            review comment as soon as it has streamed in; completions are
+            streamed only when a callback is given.
 
     Returns:
-        Dict: Analysis results, including code quality, issues, and rating.
+        Dict: Analysis results, including code quality, issues, and rating,
+        plus token "usage", a "cached" flag telling whether the completion
+        was reused, and the "preanalysis" report (see PreAnalyzer.run).
+        Cascaded reviews add the usage, cost and latency of every tier under
+        usage["tiers"] and the triage verdicts under "cascade".
 
     Raises:
         ReviewServiceError: If analysis fails or API issues occur.
     """
-    try:
-        # Prepare the code content for analysis
-        code_contents = [
-            f"File: {file['path']}\n" f"```\n{file['content'][:1000]}...\n```\n"
-            for file in contents
-        ]
+    with _analysis_errors():
+        contents, preanalysis = await pre_analyzer.run(contents)
+        policy = cascade_policy(level)
+        build = build_prompt if policy is None else build_triage_prompt
+        with metrics.prompt_build_seconds.time():
+            plan = plan_batches(contents)
+            if not plan.batches:
+                raise ReviewServiceError(
+                    "No file fits in the review's token budget",
+                    details={"skipped_files": plan.skipped},
+                    category="empty_repository",
+                )
+            prompts = [
+                build(batch, description, level, part=(index, len(plan.batches)))
+                for index, batch in enumerate(plan.batches, start=1)
+            ]
+        client = client or get_openai_client(api_key)
 
-        # Create a structured prompt
-        prompt = (
-            f"You are performing a code review for a candidate's assignment.\n\n"
-            f"Assignment Details:\n"
-            f"- Description: {description}\n"
-            f"- Expected Level: {level}\n\n"
-            f"Repository Contents:\n"
-            f"{chr(10).join(code_contents)}\n\n"
-            f"Please provide a detailed technical analysis including:\n"
-            f"1. Code Quality Assessment:\n"
-            f"   - Code organization and structure\n"
-            f"   - Naming conventions and readability\n"
-            f"   - Error handling and edge cases\n"
-            f"   - Documentation and comments\n\n"
-            f"2. Technical Issues:\n"
-            f"   - Potential bugs or vulnerabilities\n"
-            f"   - Performance concerns\n"
-            f"   - Architecture problems\n"
-            f"   - Missing tests or validation\n\n"
-            f"3. Improvement Suggestions:\n"
-            f"   - Specific recommendations for better code quality\n"
-            f"   - Best practices that should be applied\n"
-            f"   - Additional features or enhancements\n\n"
-            f"4. Overall Rating:\n"
-            f"   - Score out of 10\n"
-            f"   - Brief justification for the score\n\n"
-            f"Please provide a code review analysis in the following JSON format:\n"
-            "{\n"
-            '  "found_files": ["list of all analyzed files"],\n'
-            '  "comments": ["detailed list of comments and suggestions about code quality, '
-            'technical issues, and improvement suggestions"],\n'
-            '  "rating": "score out of 10 with brief justification",\n'
-            '  "conclusion": "detailed technical conclusion summarizing the review"\n'
-            "}\n\n"
-            "Ensure the response is properly formatted JSON."
-        )
-
-        client = OpenAI(api_key=api_key)
-        MODEL = "gpt-4o"
-        completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an experienced technical lead performing a detailed code review.",
-                },
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.7,
-            max_tokens=2000,
-        )
-        raw_analysis = completion.choices[0].message.content
-
-        # Clean up the response by removing code block markers if present
-        cleaned_response = raw_analysis.strip()
-        if cleaned_response.startswith("```json"):
-            cleaned_response = cleaned_response[7:]
-        if cleaned_response.endswith("```"):
-            cleaned_response = cleaned_response[:-3]
-
-        try:
-            # Parse the response as JSON
-            parsed_analysis = json.loads(cleaned_response)
-            # Return the structured response
-            return {
-                "found_files": [file["path"] for file in contents],
-                "comments": parsed_analysis.get("comments", []),
-                "rating": parsed_analysis.get("rating", "N/A"),
-                "conclusion": parsed_analysis.get(
-                    "conclusion", "Analysis failed to provide a conclusion"
+        async def complete() -> Dict:
+            if policy is None:
+                review = _map_reduce(
+                    client, plan, prompts, description, level, progress
+                )
+            else:
+                review = _cascade(
+                    client, policy, plan, prompts, description, level, progress
+                )
+            return await asyncio.wait_for(review, timeout=LLM_REVIEW_TIMEOUT or None)
+
+        if result_cache is None:
+            return {**await complete(), "cached": False, "preanalysis": preanalysis}
+
+        key = result_cache.make_key(
+            snapshot_digest(contents),
+            prompts,
+            MODEL if policy is None else policy.as_dict(),
+            TEMPERATURE,
+        )
+        result, cached = await result_cache.get_or_compute(
+            key,
+            complete,
+            should_cache=lambda result: FORMAT_ERROR not in result["comments"],
+        )
+        return {**result, "cached": cached, "preanalysis": preanalysis}
+
+
+async def analyze_diff(
+    groups: List[HunkGroup],
+    description: str,
+    level: str,
+    api_key: str,
+    client: Optional[AsyncOpenAI] = None,
+    result_cache: Optional[ReviewResultCache] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict:
+    """
+    Use OpenAI GPT to review the changes of a pull request.
+
+    Hunk groups are packed into token-budgeted batches that are reviewed
+    concurrently, so the prompts grow with the diff rather than with the
+    repository. The model anchors its comments to lines of the new files;
+    comments on a line the diff does not show are moved to the nearest line
+    it does. With more than one batch, one short completion merges the
+    verdicts as in analyze_code.
+
+    Args:
+        groups (List[HunkGroup]): Changes to review, from group_hunks.
+        description (str): Assignment description.
+        level (str): Expected candidate level.
+        api_key (str): OpenAI API key.
+        client (AsyncOpenAI, optional): Pooled client to use.
+        result_cache (ReviewResultCache, optional): Memoizes results of
+            identical prompts.
+        progress (ProgressCallback, optional): Receives batch events.
+
+    Returns:
+        Dict: found_files, comments, file_comments, rating, conclusion, usage
+        and cached as analyze_code, plus "review_comments" with the path,
+        line, side and body of every anchored comment.
+
+    Raises:
+        ReviewServiceError: If analysis fails or API issues occur.
+    """
+    with _analysis_errors():
+        with metrics.prompt_build_seconds.time():
+            batches, skipped = plan_diff_batches(groups)
+            prompts = [
+                build_diff_prompt(batch, description, level, part=(index, len(batches)))
+                for index, batch in enumerate(batches, start=1)
+            ]
+        client = client or get_openai_client(api_key)
+
+        async def complete() -> Dict:
+            return await asyncio.wait_for(
+                _review_diff(
+                    client, batches, prompts, skipped, description, level, progress
                 ),
-            }
-        except json.JSONDecodeError as json_err:
-            # Handle case where response isn't valid JSON
-            return {
-                "found_files": [file["path"] for file in contents],
-                "comments": ["Error: AI response was not in the expected format"],
-                "rating": "N/A",
-                "conclusion": raw_analysis,
-            }
+                timeout=LLM_REVIEW_TIMEOUT or None,
+            )
+
+        if result_cache is None:
+            return {**await complete(), "cached": False}
+
+        key = result_cache.make_key("diff", prompts, MODEL, TEMPERATURE)
+        result, cached = await result_cache.get_or_compute(
+            key,
+            complete,
+            should_cache=lambda result: FORMAT_ERROR not in result["comments"],
+        )
+        return {**result, "cached": cached}
+
 
+@contextmanager
+def _analysis_errors():
+    """
+    Translates the errors of a model-backed analysis into ReviewServiceErrors.
+    """
+    try:
+        yield
+    except ReviewServiceError:
+        raise
+    except asyncio.TimeoutError as timeout_err:
+        raise ReviewServiceError(
+            f"Code analysis exceeded its time budget of {LLM_REVIEW_TIMEOUT:.0f}s",
+            category="timeout",
+        ) from timeout_err
     except OpenAIError as req_err:
         # Handle general communication errors, such as connection or DNS issues
         raise ReviewServiceError(
-            f"Unable to connect to OpenAI API: {str(req_err)}"
+            f"Unable to connect to OpenAI API: {str(req_err)}", category="openai"
         ) from req_err
     except KeyError as key_err:
         # Handle unexpected structure in the API response
         raise ReviewServiceError(
-            f"Unexpected API response format: {str(key_err)}"
+            f"Unexpected API response format: {str(key_err)}",
+            category="openai_response",
         ) from key_err
     except Exception as e:
         # Handle any other unforeseen exceptions
-        raise ReviewServiceError(f"Error during code analysis: {str(e)}") from e
+        raise ReviewServiceError(
+            f"Error during code analysis: {str(e)}", category="analysis"
+        ) from e
+
+
+async def _map_reduce(
+    client: AsyncOpenAI,
+    plan: BatchPlan,
+    prompts: List[str],
+    description: str,
+    level: str,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict:
+    """
+    Reviews every batch concurrently and merges the partial reviews.
+    """
+    usage = _new_usage()
+    partials = await _review_batches(client, plan.batches, prompts, usage, progress)
+    if len(partials) == 1:
+        result = partials[0]
+    else:
+        await emit(progress, "merging", {"batches": len(partials)})
+        result = await _reduce(
+            client,
+            partials,
+            description,
+            level,
+            usage,
+            f"You reviewed a candidate's repository in {len(partials)} parts.",
+        )
+
+    result["found_files"] = [file["path"] for file in plan.files]
+    result["usage"] = {
+        **usage,
+        "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+        "contents_tokens": plan.tokens,
+        "batches": len(plan.batches),
+        "truncated_files": [file["path"] for file in plan.files if file["truncated"]],
+        "skipped_files": plan.skipped,
+    }
+    return result
+
+
+async def _review_batches(
+    client: AsyncOpenAI,
+    batches: List[List[Dict]],
+    prompts: List[str],
+    usage: Dict,
+    progress: Optional[ProgressCallback] = None,
+    model: str = MODEL,
+    max_tokens: int = MAX_TOKENS,
+    tier: Optional[str] = None,
+) -> List[Dict]:
+    """
+    Reviews batches of files concurrently, returning one partial review per
+    batch; `tier` is added to the batch events of cascaded reviews.
+    """
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    labels = {} if tier is None else {"tier": tier}
+
+    async def review(index: int, batch: List[Dict], prompt: str) -> Dict:
+        async def stream_comment(comment: str) -> None:
+            await progress("comment", {"batch": index, "text": comment, **labels})
+
+        async with semaphore:
+            await emit(
+                progress,
+                "batch_started",
+                {
+                    "batch": index,
+                    "batches": len(batches),
+                    "files": [file["path"] for file in batch],
+                    **labels,
+                },
+            )
+            answer, raw_analysis = await _request_answer(
+                client,
+                prompt,
+                ReviewAnswer,
+                usage,
+                stream_comment if progress else None,
+                model=model,
+                max_tokens=max_tokens,
+            )
+        partial = _analysis(answer, raw_analysis, batch)
+        await emit(
+            progress,
+            "batch_completed",
+            {"batch": index, "rating": partial["rating"], **labels},
+        )
+        return partial
+
+    return list(
+        await asyncio.gather(
+            *[
+                review(index, batch, prompt)
+                for index, (batch, prompt) in enumerate(zip(batches, prompts), 1)
+            ]
+        )
+    )
+
+
+async def _cascade(
+    client: AsyncOpenAI,
+    policy: CascadePolicy,
+    plan: BatchPlan,
+    prompts: List[str],
+    description: str,
+    level: str,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict:
+    """
+    Reviews a repository in tiers: the triage model classifies every file,
+    the review model reviews the files the policy escalates, and the
+    synthesis model merges triage notes and reviews into the final verdict.
+    Files the triage answer leaves out are escalated.
+    """
+    tiers: Dict[str, Dict] = {}
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    usage = _new_usage()
+    started = time.perf_counter()
+
+    async def triage(index: int, batch: List[Dict], prompt: str):
+        async with semaphore:
+            await emit(
+                progress,
+                "batch_started",
+                {
+                    "batch": index,
+                    "batches": len(plan.batches),
+                    "files": [file["path"] for file in batch],
+                    "tier": "triage",
+                },
+            )
+            answer, _ = await _request_answer(
+                client,
+                prompt,
+                TriageAnswer,
+                usage,
+                model=policy.triage_model,
+                max_tokens=policy.triage_max_tokens,
+            )
+        await emit(
+            progress,
+            "batch_completed",
+            {
+                "batch": index,
+                "rating": "N/A" if answer is None else answer.rating,
+                "tier": "triage",
+            },
+        )
+        return answer
+
+    answers = await asyncio.gather(
+        *[
+            triage(index, batch, prompt)
+            for index, (batch, prompt) in enumerate(zip(plan.batches, prompts), 1)
+        ]
+    )
+    tiers["triage"] = _tier_report(
+        "triage", policy.triage_model, usage, started, len(plan.files)
+    )
+
+    verdicts: Dict[str, str] = {}
+    escalated: List[Dict] = []
+    partials: List[Dict] = []
+    for batch, answer in zip(plan.batches, answers):
+        triaged = {} if answer is None else {item.path: item for item in answer.files}
+        notes: Dict[str, List[str]] = {}
+        for file in batch:
+            item = triaged.get(file["path"])
+            escalate = item is None or policy.escalates(item.verdict)
+            if escalate:
+                escalated.append(file)
+            elif item.reason.strip():
+                notes[file["path"]] = [f"{item.verdict}: {item.reason.strip()}"]
+            verdict = "untriaged" if item is None else item.verdict
+            verdicts[file["path"]] = verdict
+            metrics.cascade_files.inc(verdict=verdict, escalated=str(escalate).lower())
+        if answer is not None:
+            partials.append(
+                {
+                    "comments": format_file_comments(notes),
+                    "file_comments": notes,
+                    "rating": answer.rating,
+                    "conclusion": answer.conclusion,
+                }
+            )
+
+    review_batches = 0
+    if escalated:
+        usage = _new_usage()
+        started = time.perf_counter()
+        truncated = {file["path"] for file in escalated if file["truncated"]}
+        review_plan = plan_batches(escalated)
+        review_batches = len(review_plan.batches)
+        for file in review_plan.files:
+            file["truncated"] = file["truncated"] or file["path"] in truncated
+        partials += await _review_batches(
+            client,
+            review_plan.batches,
+            [
+                build_prompt(batch, description, level, part=(index, review_batches))
+                for index, batch in enumerate(review_plan.batches, start=1)
+            ],
+            usage,
+            progress,
+            model=policy.review_model,
+            max_tokens=policy.review_max_tokens,
+            tier="review",
+        )
+        tiers["review"] = _tier_report(
+            "review", policy.review_model, usage, started, len(escalated)
+        )
+
+    if len(partials) == 1:
+        result = partials[0]
+    else:
+        usage = _new_usage()
+        started = time.perf_counter()
+        await emit(progress, "merging", {"batches": len(partials)})
+        result = await _reduce(
+            client,
+            partials,
+            description,
+            level,
+            usage,
+            "You reviewed a candidate's repository in several parts: a quick "
+            "triage of every file and detailed reviews of the files it flagged.",
+            model=policy.synthesis_model,
+        )
+        tiers["synthesis"] = _tier_report(
+            "synthesis", policy.synthesis_model, usage, started, len(plan.files)
+        )
+
+    totals = {
+        key: sum(tier[key] for tier in tiers.values())
+        for key in ("prompt_tokens", "completion_tokens", "requests", "format_retries")
+    }
+    result["found_files"] = [file["path"] for file in plan.files]
+    result["usage"] = {
+        **totals,
+        "total_tokens": totals["prompt_tokens"] + totals["completion_tokens"],
+        "contents_tokens": plan.tokens,
+        "batches": len(plan.batches) + review_batches,
+        "truncated_files": [file["path"] for file in plan.files if file["truncated"]],
+        "skipped_files": plan.skipped,
+        "tiers": tiers,
+    }
+    result["cascade"] = {
+        "policy": policy.as_dict(),
+        "verdicts": verdicts,
+        "escalated": [file["path"] for file in escalated],
+    }
+    return result
+
+
+def _tier_report(
+    tier: str, model: str, usage: Dict, started: float, files: int
+) -> Dict:
+    """
+    Summarizes the completions of one cascade tier, recording its latency.
+    """
+    seconds = time.perf_counter() - started
+    metrics.cascade_tier_seconds.observe(seconds, tier=tier)
+    return {
+        "model": model,
+        "files": files,
+        **usage,
+        "cost_usd": round(
+            metrics.estimate_cost(
+                model, usage["prompt_tokens"], usage["completion_tokens"]
+            ),
+            6,
+        ),
+        "seconds": round(seconds, 3),
+    }
+
+
+async def _reduce(
+    client: AsyncOpenAI,
+    partials: List[Dict],
+    description: str,
+    level: str,
+    usage: Dict,
+    heading: str,
+    model: str = MODEL,
+) -> Dict:
+    """
+    Merges partial reviews: comments are concatenated locally, and one short
+    completion turns the partial ratings and conclusions into a final verdict.
+    """
+    comments = list(
+        dict.fromkeys(
+            comment for partial in partials for comment in partial["comments"]
+        )
+    )
+    file_comments = {
+        path: notes
+        for partial in partials
+        for path, notes in partial.get("file_comments", {}).items()
+    }
+    summaries = "\n\n".join(
+        f"Part {index}:\n- Rating: {partial['rating']}\n"
+        f"- Conclusion: {partial['conclusion']}"
+        for index, partial in enumerate(partials, start=1)
+    )
+    prompt = (
+        f"{heading}\n\n"
+        f"Assignment Details:\n"
+        f"- Description: {' '.join(description.split())}\n"
+        f"- Expected Level: {level.strip()}\n\n"
+        f"Partial Reviews:\n{summaries}\n\n"
+        "Combine them into one overall assessment in the following JSON format:\n"
+        "{\n"
+        '  "rating": "score out of 10 with brief justification",\n'
+        '  "conclusion": "detailed technical conclusion summarizing the review"\n'
+        "}\n\n"
+        "Ensure the response is properly formatted JSON."
+    )
+    merged, _ = await _request_answer(client, prompt, VerdictAnswer, usage, model=model)
+    if merged is None:
+        rating = _average_rating(partial["rating"] for partial in partials)
+        conclusion = "\n\n".join(partial["conclusion"] for partial in partials)
+    else:
+        rating, conclusion = merged.rating, merged.conclusion
+    return {
+        "comments": comments,
+        "file_comments": file_comments,
+        "rating": rating,
+        "conclusion": conclusion,
+    }
+
+
+async def _review_diff(
+    client: AsyncOpenAI,
+    batches: List[List[HunkGroup]],
+    prompts: List[str],
+    skipped: List[str],
+    description: str,
+    level: str,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict:
+    """
+    Reviews every batch of hunk groups concurrently and merges the results;
+    anchored comments are collected locally, only the verdict needs the model.
+    """
+    semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    usage = _new_usage()
+
+    async def review(index: int, batch: List[HunkGroup], prompt: str) -> Dict:
+        async with semaphore:
+            await emit(
+                progress,
+                "batch_started",
+                {
+                    "batch": index,
+                    "batches": len(batches),
+                    "files": sorted({group.path for group in batch}),
+                },
+            )
+            answer, raw_analysis = await _request_answer(
+                client, prompt, DiffAnswer, usage
+            )
+        partial = _diff_analysis(answer, raw_analysis, batch)
+        await emit(
+            progress, "batch_completed", {"batch": index, "rating": partial["rating"]}
+        )
+        return partial
+
+    partials = await asyncio.gather(
+        *[
+            review(index, batch, prompt)
+            for index, (batch, prompt) in enumerate(zip(batches, prompts), 1)
+        ]
+    )
+    verdict = partials[0]
+    if len(partials) > 1:
+        await emit(progress, "merging", {"batches": len(batches)})
+        verdict = await _reduce(
+            client,
+            partials,
+            description,
+            level,
+            usage,
+            f"You reviewed the changes of a candidate's pull request in "
+            f"{len(partials)} parts.",
+        )
+
+    review_comments = sorted(
+        (comment for partial in partials for comment in partial["review_comments"]),
+        key=lambda comment: (comment["path"], comment["line"]),
+    )
+    file_comments: Dict[str, List[str]] = {}
+    for comment in review_comments:
+        file_comments.setdefault(comment["path"], []).append(
+            f"line {comment['line']}: {comment['body']}"
+        )
+    general = list(
+        dict.fromkeys(
+            comment for partial in partials for comment in partial["comments"]
+        )
+    )
+    groups = [group for batch in batches for group in batch]
+    return {
+        "found_files": sorted({group.path for group in groups}),
+        "comments": general + format_file_comments(file_comments),
+        "file_comments": file_comments,
+        "review_comments": review_comments,
+        "rating": verdict["rating"],
+        "conclusion": verdict["conclusion"],
+        "usage": {
+            **usage,
+            "total_tokens": usage["prompt_tokens"] + usage["completion_tokens"],
+            "contents_tokens": sum(group.tokens for group in groups),
+            "batches": len(batches),
+            "truncated_files": sorted(
+                {group.path for group in groups if group.truncated}
+            ),
+            "skipped_files": skipped,
+        },
+    }
+
+
+async def merge_reviews(
+    client: AsyncOpenAI,
+    partials: List[Dict],
+    description: str,
+    level: str,
+    heading: str,
+) -> Dict:
+    """
+    Combines separately produced reviews into one verdict.
+
+    Args:
+        client (AsyncOpenAI): Client used for the merging completion.
+        partials (List[Dict]): Reviews with comments, rating and conclusion.
+        description (str): Assignment description.
+        level (str): Expected candidate level.
+        heading (str): Opening line telling the model how the parts relate.
+
+    Returns:
+        Dict: Merged comments, file_comments, rating and conclusion, plus the
+        token "usage" of the merge.
+    """
+    usage = _new_usage()
+    merged = await _reduce(client, partials, description, level, usage, heading)
+    return {**merged, "usage": usage}
+
+
+def _new_usage() -> Dict:
+    """
+    Returns the counters of the completions one review makes; requests
+    includes the format_retries.
+    """
+    return {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "requests": 0,
+        "format_retries": 0,
+    }
+
+
+def _average_rating(ratings) -> str:
+    scores = []
+    for rating in ratings:
+        match = re.search(r"(\d+(?:\.\d+)?)\s*/\s*10", str(rating))
+        if match:
+            scores.append(float(match.group(1)))
+    if not scores:
+        return "N/A"
+    return f"{sum(scores) / len(scores):.1f}/10"
+
+
+def build_prompt(
+    contents: List[dict],
+    description: str,
+    level: str,
+    part: Optional[Tuple[int, int]] = None,
+) -> str:
+    """
+    Builds the review prompt for a set of files.
+
+    Whitespace in the description and level is normalized so that resubmissions
+    differing only in formatting produce the same prompt.
+
+    Args:
+        contents (List[dict]): List of files with their (token-budgeted) contents.
+        description (str): Assignment description.
+        level (str): Expected candidate level.
+        part (Tuple[int, int], optional): Batch number and batch count when the
+            repository is reviewed in several parts.
+
+    Returns:
+        str: The user prompt sent to the model.
+    """
+    description = " ".join(description.split())
+    return _files_prompt(
+        review_instructions(description, level.strip()), contents, part
+    )
+
+
+def build_triage_prompt(
+    contents: List[dict],
+    description: str,
+    level: str,
+    part: Optional[Tuple[int, int]] = None,
+) -> str:
+    """
+    Builds the prompt asking the triage model of a cascade to classify a set
+    of files; it is laid out like build_prompt.
+
+    Args:
+        contents (List[dict]): List of files with their (token-budgeted) contents.
+        description (str): Assignment description.
+        level (str): Expected candidate level.
+        part (Tuple[int, int], optional): Batch number and batch count.
+
+    Returns:
+        str: The user prompt sent to the triage model.
+    """
+    description = " ".join(description.split())
+    return _files_prompt(
+        triage_instructions(description, level.strip()), contents, part
+    )
+
+
+def _files_prompt(
+    instructions: str, contents: List[dict], part: Optional[Tuple[int, int]]
+) -> str:
+    heading = "Repository Contents"
+    if part and part[1] > 1:
+        heading += f" (part {part[0]} of {part[1]})"
+
+    # The assignment and instructions come first so that reviews of several
+    # repositories for the same assignment share a cacheable prompt prefix.
+    # File contents are joined once at the end instead of being copied into
+    # intermediate strings per file.
+    pieces = [instructions, "\n\n", heading, ":\n"]
+    for index, file in enumerate(contents):
+        if index:
+            pieces.append("\n")
+        pieces += ["File: ", file["path"], "\n```\n", file["content"]]
+        pieces.append("...\n```\n" if file.get("truncated") else "\n```\n")
+    return "".join(pieces)
+
+
+def review_instructions(description: str, level: str) -> str:
+    """
+    Returns the part of the review prompt that precedes the repository
+    contents; it depends only on the assignment and level.
+
+    Args:
+        description (str): Normalized assignment description.
+        level (str): Normalized candidate level.
+
+    Returns:
+        str: Assignment details, review criteria and answer format.
+    """
+    return (
+        f"You are performing a code review for a candidate's assignment.\n\n"
+        f"Assignment Details:\n"
+        f"- Description: {description}\n"
+        f"- Expected Level: {level}\n\n"
+        f"Please provide a detailed technical analysis including:\n"
+        f"1. Code Quality Assessment:\n"
+        f"   - Code organization and structure\n"
+        f"   - Naming conventions and readability\n"
+        f"   - Error handling and edge cases\n"
+        f"   - Documentation and comments\n\n"
+        f"2. Technical Issues:\n"
+        f"   - Potential bugs or vulnerabilities\n"
+        f"   - Performance concerns\n"
+        f"   - Architecture problems\n"
+        f"   - Missing tests or validation\n\n"
+        f"3. Improvement Suggestions:\n"
+        f"   - Specific recommendations for better code quality\n"
+        f"   - Best practices that should be applied\n"
+        f"   - Additional features or enhancements\n\n"
+        f"4. Overall Rating:\n"
+        f"   - Score out of 10\n"
+        f"   - Brief justification for the score\n\n"
+        f"Please provide a code review analysis in the following JSON format:\n"
+        "{\n"
+        '  "comments": ["detailed list of comments and suggestions about code quality, '
+        'technical issues, and improvement suggestions that span several files"],\n'
+        '  "file_comments": [{"path": "path/of/file", "comments": ["comments that '
+        'concern only this file"]}],\n'
+        '  "rating": "score out of 10 with brief justification",\n'
+        '  "conclusion": "detailed technical conclusion summarizing the review"\n'
+        "}\n\n"
+        "Ensure the response is properly formatted JSON."
+    )
+
+
+def triage_instructions(description: str, level: str) -> str:
+    """
+    Returns the part of the triage prompt that precedes the repository
+    contents; it depends only on the assignment and level.
+
+    Args:
+        description (str): Normalized assignment description.
+        level (str): Normalized candidate level.
+
+    Returns:
+        str: Assignment details, verdicts and answer format.
+    """
+    return (
+        f"You are triaging the files of a candidate's assignment before a "
+        f"detailed code review.\n\n"
+        f"Assignment Details:\n"
+        f"- Description: {description}\n"
+        f"- Expected Level: {level}\n\n"
+        f"Classify every file with one verdict:\n"
+        f'- "trivial": boilerplate, configuration or simple code without '
+        f"notable issues\n"
+        f'- "needs_attention": code with issues or design choices worth a '
+        f"detailed review\n"
+        f'- "critical": likely bugs or vulnerabilities, or the core logic of '
+        f"the assignment\n\n"
+        f"Please provide the triage in the following JSON format:\n"
+        "{\n"
+        '  "files": [{"path": "path/of/file", "verdict": "trivial, '
+        'needs_attention or critical", "reason": "one sentence"}],\n'
+        '  "rating": "score out of 10 with brief justification",\n'
+        '  "conclusion": "short overall impression of the repository"\n'
+        "}\n\n"
+        "Ensure the response is properly formatted JSON."
+    )
+
+
+def build_diff_prompt(
+    groups: List[HunkGroup],
+    description: str,
+    level: str,
+    part: Optional[Tuple[int, int]] = None,
+) -> str:
+    """
+    Builds the review prompt for a batch of hunk groups.
+
+    Args:
+        groups (List[HunkGroup]): Changes to review.
+        description (str): Assignment description.
+        level (str): Expected candidate level.
+        part (Tuple[int, int], optional): Batch number and batch count when the
+            pull request is reviewed in several parts.
+
+    Returns:
+        str: The user prompt sent to the model.
+    """
+    heading = "Pull Request Changes"
+    if part and part[1] > 1:
+        heading += f" (part {part[0]} of {part[1]})"
+
+    pieces = [
+        diff_instructions(" ".join(description.split()), level.strip()),
+        "\n\n",
+        heading,
+        ":\n",
+    ]
+    for index, group in enumerate(groups):
+        if index:
+            pieces.append("\n")
+        pieces += ["File: ", group.path, " (", group.status, ")\n```diff\n"]
+        pieces.append(group.render())
+        pieces.append("\n...\n```\n" if group.truncated else "\n```\n")
+    return "".join(pieces)
+
+
+def diff_instructions(description: str, level: str) -> str:
+    """
+    Returns the part of the pull request review prompt that precedes the
+    changes; it depends only on the assignment and level.
+
+    Args:
+        description (str): Normalized assignment description.
+        level (str): Normalized candidate level.
+
+    Returns:
+        str: Assignment details, review criteria and answer format.
+    """
+    return (
+        f"You are reviewing the changes a candidate's pull request makes for an "
+        f"assignment.\n\n"
+        f"Assignment Details:\n"
+        f"- Description: {description}\n"
+        f"- Expected Level: {level}\n\n"
+        f"Every changed region is shown as a unified diff hunk. Lines starting "
+        f'with "+" were added and lines starting with "-" were removed; the '
+        f"number in front of a line is its line number in the new version of the "
+        f"file. Review the changes, using the unchanged lines only as context, "
+        f"for correctness, potential bugs or vulnerabilities, error handling, "
+        f"readability, performance and missing tests.\n\n"
+        f"Please provide the review in the following JSON format:\n"
+        "{\n"
+        '  "comments": ["comments about the changes as a whole"],\n'
+        '  "line_comments": [{"path": "path/of/file", "line": line number in '
+        'the new file, "comment": "comment about that line"}],\n'
+        '  "rating": "score out of 10 with brief justification",\n'
+        '  "conclusion": "detailed technical conclusion summarizing the review"\n'
+        "}\n\n"
+        "Ensure the response is properly formatted JSON."
+    )
+
+
+def completion_request(
+    prompt: str,
+    answer: Optional[Type[Answer]] = None,
+    model: str = MODEL,
+    max_tokens: int = MAX_TOKENS,
+) -> Dict:
+    """
+    Builds the chat completion parameters for a review prompt.
+
+    Args:
+        prompt (str): User prompt from build_prompt.
+        answer (Type[Answer], optional): Model of the expected answer; with
+            LLM_STRUCTURED_OUTPUT, the completion is constrained to its JSON
+            schema.
+        model (str): Model to complete the prompt.
+        max_tokens (int): Cap on the completion's length.
+
+    Returns:
+        Dict: Keyword arguments for chat.completions.create, which are also
+        the request body of the Chat Completions API.
+    """
+    request = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": max_tokens,
+    }
+    if answer is not None and LLM_STRUCTURED_OUTPUT:
+        request["response_format"] = response_format(answer)
+    return request
+
+
+async def _request_answer(
+    client: AsyncOpenAI,
+    prompt: str,
+    answer: Type[Answer],
+    usage: Optional[Dict] = None,
+    on_comment: Optional[Callable[[str], Awaitable[None]]] = None,
+    model: str = MODEL,
+    max_tokens: int = MAX_TOKENS,
+) -> Tuple[Optional[Answer], str]:
+    """
+    Requests a completion for the prompt and decodes it into `answer`.
+
+    An answer that does not decode is repaired locally first (see
+    decode_answer); only when that fails too is the completion requested
+    again, up to LLM_FORMAT_RETRIES times. Every outcome is counted in the
+    llm_answers metric and retries in usage["format_retries"].
+
+    With `on_comment`, the first completion is streamed and every entry of
+    its "comments" array is passed to the callback as soon as it is
+    complete. Retries are not streamed, so no comment is passed twice.
+
+    Returns:
+        Tuple[Optional[Answer], str]: The decoded answer, None if every
+        attempt failed, and the raw text of the last attempt.
+    """
+    for attempt in range(LLM_FORMAT_RETRIES + 1):
+        extractor = CommentExtractor()
+        streamed = on_comment is not None and not attempt
+
+        async def stream_comments(delta: str) -> None:
+            for comment in extractor.feed(delta):
+                await on_comment(comment)
+
+        raw_analysis = await _request_completion(
+            client,
+            prompt,
+            usage,
+            stream_comments if streamed else None,
+            answer,
+            model,
+            max_tokens,
+        )
+        if not streamed:
+            extractor.stream.feed(raw_analysis)
+        decoded, outcome = decode_answer(raw_analysis, answer, extractor.stream)
+        if decoded is not None:
+            metrics.llm_answers.inc(outcome=outcome)
+            return decoded, raw_analysis
+        retry = attempt < LLM_FORMAT_RETRIES
+        metrics.llm_answers.inc(outcome="retried" if retry else "failed")
+        if retry and usage is not None:
+            usage["format_retries"] += 1
+    return None, raw_analysis
+
+
+def decode_answer(
+    raw_analysis: str, answer: Type[Answer], stream: Optional[JSONStream] = None
+) -> Tuple[Optional[Answer], str]:
+    """
+    Decodes and validates the model's JSON answer.
+
+    The first JSON document in the text is used, so code fences and prose
+    around it do not matter. A document cut off (e.g. at max_tokens) is
+    closed by JSONStream.repair and kept when it got as far as the
+    conclusion, the last field of every answer, even if the conclusion
+    itself was cut short; otherwise the answer is unusable.
+
+    Args:
+        raw_analysis (str): Raw message content returned by the model.
+        answer (Type[Answer]): Model of the expected answer.
+        stream (JSONStream, optional): Scanner already fed the text, e.g.
+            while it streamed in.
+
+    Returns:
+        Tuple[Optional[Answer], str]: The answer, or None if it is unusable,
+        and the outcome: "valid", "repaired" or "invalid".
+    """
+    if stream is None:
+        stream = JSONStream()
+        stream.feed(raw_analysis)
+    document = stream.document()
+    if document is not None:
+        decoded = _validate(document, answer)
+        if decoded is not None:
+            return decoded, "valid"
+    repaired = stream.repair()
+    if repaired is not None and repaired != document:
+        decoded = _validate(repaired, answer, reached="conclusion")
+        if decoded is not None:
+            return decoded, "repaired"
+    return None, "invalid"
+
+
+def _validate(
+    document: str, answer: Type[Answer], reached: Optional[str] = None
+) -> Optional[Answer]:
+    """
+    Loads a JSON document into `answer`; with `reached`, only if it has
+    that field.
+    """
+    try:
+        loaded = json.loads(document, strict=False)
+        if reached is not None and not (isinstance(loaded, dict) and reached in loaded):
+            return None
+        return answer.model_validate(loaded)
+    except ValueError:
+        return None
+
+
+def hedge_key(model: str, max_tokens: int) -> str:
+    """
+    Names the latency window of a completion: its model and its max_tokens
+    rounded up to a power of two, e.g. "gpt-4o/2048".
+    """
+    return f"{model}/{1 << max(max_tokens - 1, 0).bit_length()}"
+
+
+async def _request_completion(
+    client: AsyncOpenAI,
+    prompt: str,
+    usage: Optional[Dict] = None,
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    answer: Optional[Type[Answer]] = None,
+    model: str = MODEL,
+    max_tokens: int = MAX_TOKENS,
+) -> str:
+    """
+    Sends the review prompt to the model and returns the raw message content,
+    adding the reported token usage to `usage` when given. With `answer`,
+    the completion is constrained to its schema (see completion_request).
+
+    With `on_delta`, the completion is streamed and every content fragment is
+    passed to the callback as it arrives. Only unstreamed completions are
+    hedged, since a backup stream would repeat fragments already passed on.
+
+    The latency of every attempt, and the time to the first fragment of a
+    streamed completion, are recorded in the metrics.
+    """
+    request = completion_request(prompt, answer, model, max_tokens)
+
+    async def attempt():
+        if usage is not None:
+            usage["requests"] += 1
+        return await client.chat.completions.create(**request)
+
+    if on_delta is None:
+
+        async def timed_attempt():
+            with metrics.llm_seconds.time(model=model, stream="false"):
+                return await attempt()
+
+        hedger = completion_hedgers.get(hedge_key(model, max_tokens))
+        completion = await hedger.run(
+            timed_attempt, lambda error: isinstance(error, RETRYABLE_ERRORS)
+        )
+        _add_usage(usage, completion.usage, model)
+        return completion.choices[0].message.content
+
+    request.update(stream=True, stream_options={"include_usage": True})
+    fragments = []
+    with metrics.llm_seconds.time(model=model, stream="true"):
+        started = time.perf_counter()
+        stream = await attempt()
+        async for chunk in stream:
+            _add_usage(usage, chunk.usage, model)
+            if chunk.choices and chunk.choices[0].delta.content:
+                if not fragments:
+                    metrics.llm_first_token_seconds.observe(
+                        time.perf_counter() - started, model=model
+                    )
+                fragments.append(chunk.choices[0].delta.content)
+                await on_delta(chunk.choices[0].delta.content)
+    return "".join(fragments)
+
+
+def _add_usage(usage: Optional[Dict], reported, model: str = MODEL) -> None:
+    if reported is None:
+        return
+    metrics.record_llm_usage(model, reported.prompt_tokens, reported.completion_tokens)
+    if usage is not None:
+        usage["prompt_tokens"] += reported.prompt_tokens
+        usage["completion_tokens"] += reported.completion_tokens
+
+
+class CommentExtractor:
+    """
+    Pulls complete entries of the "comments" array out of a JSON answer
+    while it is still streaming in.
+    """
+
+    def __init__(self):
+        self.stream = JSONStream()
+
+    def feed(self, delta: str) -> List[str]:
+        """
+        Appends a streamed fragment.
+
+        Args:
+            delta (str): Next fragment of the model's answer.
+
+        Returns:
+            List[str]: Comments completed by this fragment.
+        """
+        return [
+            value
+            for path, value in self.stream.feed(delta)
+            if len(path) == 2 and path[0] == "comments"
+        ]
+
+
+def parse_analysis(raw_analysis: str, contents: List[dict]) -> Dict:
+    """
+    Parses the model's JSON answer into the review response shape.
+
+    Args:
+        raw_analysis (str): Raw message content returned by the model.
+        contents (List[dict]): Files that were reviewed.
+
+    Returns:
+        Dict: found_files, comments, file_comments, rating and conclusion.
+        Per-file comments are also appended to comments as "path: comment".
+        If the answer cannot be decoded (see decode_answer), the raw text is
+        returned as the conclusion.
+    """
+    answer, _ = decode_answer(raw_analysis, ReviewAnswer)
+    return _analysis(answer, raw_analysis, contents)
+
+
+def _analysis(
+    answer: Optional[ReviewAnswer], raw_analysis: str, contents: List[dict]
+) -> Dict:
+    found_files = [file["path"] for file in contents]
+    if answer is None:
+        return {
+            "found_files": found_files,
+            "comments": [FORMAT_ERROR],
+            "file_comments": {},
+            "rating": "N/A",
+            "conclusion": raw_analysis,
+        }
+    # Keep the per-file comments that refer to files of this review
+    paths = set(found_files)
+    file_comments: Dict[str, List[str]] = {}
+    for notes in answer.file_comments:
+        if notes.path in paths or not paths:
+            file_comments.setdefault(notes.path, []).extend(notes.comments)
+    return {
+        "found_files": found_files,
+        "comments": answer.comments + format_file_comments(file_comments),
+        "file_comments": file_comments,
+        "rating": answer.rating,
+        "conclusion": answer.conclusion,
+    }
+
+
+def parse_diff_analysis(raw_analysis: str, groups: List[HunkGroup]) -> Dict:
+    """
+    Parses the model's JSON answer to a pull request review prompt.
+
+    Args:
+        raw_analysis (str): Raw message content returned by the model.
+        groups (List[HunkGroup]): Changes that were reviewed.
+
+    Returns:
+        Dict: General comments, review_comments anchored to a line the diff
+        shows, rating and conclusion. Line comments on files outside the
+        batch become general "path: comment" entries. If the answer cannot
+        be decoded, the raw text is returned as the conclusion.
+    """
+    answer, _ = decode_answer(raw_analysis, DiffAnswer)
+    return _diff_analysis(answer, raw_analysis, groups)
+
+
+def _diff_analysis(
+    answer: Optional[DiffAnswer], raw_analysis: str, groups: List[HunkGroup]
+) -> Dict:
+    if answer is None:
+        return {
+            "comments": [FORMAT_ERROR],
+            "review_comments": [],
+            "rating": "N/A",
+            "conclusion": raw_analysis,
+        }
+
+    anchors = anchors_by_path(groups)
+    comments = list(answer.comments)
+    review_comments = []
+    for item in answer.line_comments:
+        path, body = item.path, item.comment.strip()
+        if not body:
+            continue
+        if path not in anchors:
+            comments.append(f"{path}: {body}" if path else body)
+            continue
+        line = anchors[path][0] if item.line is None else item.line
+        review_comments.append(
+            {
+                "path": path,
+                "line": nearest_anchor(anchors[path], line),
+                "side": "RIGHT",
+                "body": body,
+            }
+        )
+    return {
+        "comments": comments,
+        "review_comments": review_comments,
+        "rating": answer.rating,
+        "conclusion": answer.conclusion,
+    }
+
+
+def format_file_comments(file_comments: Dict[str, List[str]]) -> List[str]:
+    """
+    Flattens per-file comments into "path: comment" entries, in path order.
+    """
+    return [
+        f"{path}: {comment}"
+        for path in sorted(file_comments)
+        for comment in file_comments[path]
+    ]
@@ -0,0 +1,555 @@
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import httpx
+from openai import AsyncOpenAI
+
+from app import metrics
+from app.cache import CacheBackend, ReviewResultCache, SnapshotCache, git_blob_sha
+from app.cascade import cascade_policy
+from app.events import ProgressCallback, emit
+from app.exceptions import ReviewServiceError
+from app.files import ContentStore
+from app.fingerprints import (
+    FINGERPRINT_REUSE_SIMILARITY,
+    DuplicateMatch,
+    FingerprintIndex,
+    check_duplicates,
+)
+from app.github import (
+    GITHUB_RAW_BASE,
+    compare_commits,
+    fetch_files_at,
+    fetch_repository_files,
+    github_headers,
+    list_tree,
+    load_selection_rules,
+    parse_repo_url,
+    resolve_head_sha,
+)
+from app.gpt import (
+    FORMAT_ERROR,
+    MODEL,
+    TEMPERATURE,
+    analyze_code,
+    format_file_comments,
+    get_openai_client,
+    merge_reviews,
+)
+from app.selection import FileSelector
+
+logger = logging.getLogger(__name__)
+
+DELTA_HEADING = (
+    "You reviewed an earlier commit of a candidate's repository (part 1) and "
+    "then only the files changed since (part 2). Where they disagree, part 2 "
+    "reflects the current code."
+)
+
+
+class FragmentStore:
+    """
+    Per-file review fragments keyed by blob SHA, plus a record of the last
+    review of every repository.
+
+    Everything is scoped by a review context (assignment, level, and the
+    model or the cascade policy of the level), so a file reviewed against a
+    different assignment or by different models is reviewed again.
+
+    Args:
+        backend (CacheBackend): Storage shared with the snapshot cache.
+    """
+
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+        self.reused_files = 0
+        self.reviewed_files = 0
+
+    @staticmethod
+    def context_key(description: str, level: str) -> str:
+        policy = cascade_policy(level)
+        return ReviewResultCache.make_key(
+            " ".join(description.split()),
+            level.strip(),
+            MODEL if policy is None else policy.as_dict(),
+            TEMPERATURE,
+        )
+
+    @staticmethod
+    def _fragment_key(context: str, sha: str) -> str:
+        return f"fragment:{context}:{sha}"
+
+    @staticmethod
+    def _review_key(owner: str, repo: str, context: str) -> str:
+        return f"review:{owner}/{repo}:{context}"
+
+    async def get_fragments(
+        self, context: str, shas: List[str]
+    ) -> Dict[str, List[str]]:
+        """
+        Returns the stored comments per blob SHA; unknown SHAs are left out.
+        """
+        values = await self.backend.get_many(
+            [self._fragment_key(context, sha) for sha in shas]
+        )
+        fragments = {
+            sha: json.loads(value)
+            for sha, value in zip(shas, values)
+            if value is not None
+        }
+        metrics.record_cache_lookup(
+            "fragment", hits=len(fragments), misses=len(shas) - len(fragments)
+        )
+        return fragments
+
+    async def put_fragments(self, context: str, fragments: Dict[str, List[str]]):
+        if fragments:
+            await self.backend.set_many(
+                {
+                    self._fragment_key(context, sha): json.dumps(notes).encode("utf-8")
+                    for sha, notes in fragments.items()
+                }
+            )
+
+    async def get_review(self, owner: str, repo: str, context: str) -> Optional[Dict]:
+        raw = await self.backend.get(self._review_key(owner, repo, context))
+        return json.loads(raw) if raw is not None else None
+
+    async def put_review(self, owner: str, repo: str, context: str, review: Dict):
+        await self.backend.set(
+            self._review_key(owner, repo, context), json.dumps(review).encode("utf-8")
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "reused_files": self.reused_files,
+            "reviewed_files": self.reviewed_files,
+        }
+
+
+def create_fragment_store(backend: Optional[CacheBackend]) -> Optional[FragmentStore]:
+    """
+    Builds a fragment store on the cache backend when INCREMENTAL_REVIEWS is
+    "true" and caching is enabled.
+    """
+    if backend is None or os.getenv("INCREMENTAL_REVIEWS", "false").lower() != "true":
+        return None
+    return FragmentStore(backend)
+
+
+async def review_incrementally(
+    request: dict,
+    github_token: str,
+    openai_key: str,
+    store: FragmentStore,
+    http_client: Optional[httpx.AsyncClient] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
+    snapshot_cache: Optional[SnapshotCache] = None,
+    result_cache: Optional[ReviewResultCache] = None,
+    progress: Optional[ProgressCallback] = None,
+    selector: Optional[FileSelector] = None,
+    fingerprint_index: Optional[FingerprintIndex] = None,
+    content_store: Optional[ContentStore] = None,
+) -> Dict:
+    """
+    Reviews a repository, re-reviewing only what changed since its last review.
+
+    The last reviewed commit is compared with the current HEAD; changed files
+    are fetched and reviewed, unchanged files contribute their stored
+    fragments, and one short completion merges the previous verdict with the
+    review of the changes. Changed files are selected by their size at the
+    head commit and its root .gitignore and .gitattributes. Without a
+    previous review, or when the commits cannot be compared or the head tree
+    cannot be listed in one call, the whole repository is reviewed.
+
+    Args:
+        request (dict): Validated review request.
+        github_token (str): GitHub authentication token.
+        openai_key (str): OpenAI API key.
+        store (FragmentStore): Fragments and previous reviews.
+        http_client (httpx.AsyncClient, optional): Client for GitHub calls.
+        openai_client (AsyncOpenAI, optional): Client for OpenAI calls.
+        snapshot_cache (SnapshotCache, optional): Used by full reviews.
+        result_cache (ReviewResultCache, optional): Memo of analyses.
+        progress (ProgressCallback, optional): Receives progress events.
+        selector (FileSelector, optional): Filters the files to review.
+        fingerprint_index (FingerprintIndex, optional): Index of files fetched
+            for other repositories; full reviews reuse the fragments of files
+            copied from a reviewed repository instead of reviewing them again.
+        content_store (ContentStore, optional): Holds the downloaded bodies;
+            closing it is left to the caller.
+
+    Returns:
+        Dict: The analysis result plus a "delta" block (None for full reviews)
+        naming the base and head commits and the reviewed, reused and removed
+        files, and a "duplicates" block (None without an index) listing the
+        fetched files that copy files of other repositories.
+    """
+    if http_client is None:
+        async with httpx.AsyncClient() as client:
+            return await review_incrementally(
+                request,
+                github_token,
+                openai_key,
+                store,
+                client,
+                openai_client,
+                snapshot_cache,
+                result_cache,
+                progress,
+                selector,
+                fingerprint_index,
+                content_store,
+            )
+
+    owner, repo = parse_repo_url(request["github_repo_url"])
+    headers = github_headers(github_token)
+    context = store.context_key(
+        request["assignment_description"], request["candidate_level"]
+    )
+    head = await resolve_head_sha(owner, repo, http_client, headers)
+    previous = await store.get_review(owner, repo, context)
+
+    changes = None
+    blobs: List[Dict] = []
+    if previous is not None:
+        if previous["sha"] == head:
+            changes = []
+        else:
+            changes = await compare_commits(
+                owner, repo, previous["sha"], head, http_client, headers
+            )
+        if changes:
+            # The compare API carries no sizes: the selector reads them, and
+            # the root ignore rules, from the head commit's tree
+            blobs = await list_tree(owner, repo, head, http_client, headers)
+            if blobs is None:
+                changes = None
+
+    if changes is None:
+        files = await fetch_repository_files(
+            request["github_repo_url"],
+            github_token,
+            strategy=request.get("fetch_strategy"),
+            client=http_client,
+            cache=snapshot_cache,
+            progress=progress,
+            selector=selector,
+            store=content_store,
+        )
+        if not files:
+            raise ReviewServiceError(
+                "No files found in repository", category="empty_repository"
+            )
+        matches, duplicates = await check_duplicates(
+            fingerprint_index, request["github_repo_url"], files
+        )
+        shas = _blob_shas(files)
+        reused = {}
+        if fingerprint_index is not None:
+            reused = await _reuse_fragments(store, context, shas, matches)
+        fresh = [file for file in files if file["path"] not in reused]
+        if not fresh:
+            # Nothing of its own: review the copies for a verdict on them
+            fresh, reused = files, {}
+        result = await analyze_code(
+            contents=fresh,
+            description=request["assignment_description"],
+            level=request["candidate_level"],
+            api_key=openai_key,
+            client=openai_client,
+            result_cache=result_cache,
+            progress=progress,
+        )
+        if reused:
+            result = _with_fragments(result, reused)
+            store.reused_files += len(reused)
+            logger.info(
+                "Full review of %s/%s reused fragments of %d copied files",
+                owner,
+                repo,
+                len(reused),
+            )
+        await _remember(
+            store,
+            owner,
+            repo,
+            context,
+            head,
+            result,
+            {file["path"]: shas[file["path"]] for file in fresh},
+            {path: shas[path] for path in reused},
+        )
+        return {**result, "delta": None, "duplicates": duplicates}
+
+    tree = dict(previous["files"])
+    changed: Dict[str, str] = {}
+    removed = []
+    for change in changes:
+        for path in (change.get("previous_filename"), change["filename"]):
+            if path and tree.pop(path, None) is not None:
+                removed.append(path)
+        if change["status"] != "removed":
+            changed[change["filename"]] = change["sha"]
+
+    selector = selector or FileSelector()
+    sizes = {entry["path"]: entry.get("size", 0) for entry in blobs}
+    if changed:
+        await load_selection_rules(
+            selector,
+            {
+                name: f"{GITHUB_RAW_BASE}/{owner}/{repo}/{head}/{name}"
+                for name in FileSelector.CONFIG_FILES
+                if name in sizes
+            },
+            http_client,
+            headers,
+        )
+    candidates = selector.select(
+        [
+            {"path": path, "sha": sha, "size": sizes.get(path, 0)}
+            for path, sha in changed.items()
+        ]
+    )
+    fragments = await store.get_fragments(context, sorted(set(tree.values())))
+    # Unchanged files whose fragment was evicted are reviewed again
+    candidates += [
+        {"path": path, "sha": sha} for path, sha in tree.items() if sha not in fragments
+    ]
+    reused = {path: fragments[sha] for path, sha in tree.items() if sha in fragments}
+    removed = [path for path in removed if path not in changed]
+    await emit(
+        progress,
+        "files_discovered",
+        {"paths": sorted(entry["path"] for entry in candidates), "reused": len(reused)},
+    )
+
+    files = await fetch_files_at(
+        owner,
+        repo,
+        head,
+        candidates,
+        http_client,
+        headers,
+        progress=progress,
+        store=content_store,
+    )
+    for file in files:
+        file["sha"] = file["sha"] or git_blob_sha(file["content"])
+    _, duplicates = await check_duplicates(
+        fingerprint_index, request["github_repo_url"], files
+    )
+
+    if files:
+        delta = await analyze_code(
+            contents=files,
+            description=request["assignment_description"],
+            level=request["candidate_level"],
+            api_key=openai_key,
+            client=openai_client,
+            result_cache=result_cache,
+            progress=progress,
+        )
+        await emit(progress, "merging", {"batches": 2})
+        verdict = await merge_reviews(
+            openai_client or get_openai_client(openai_key),
+            [
+                {
+                    "comments": previous["comments"],
+                    "rating": previous["rating"],
+                    "conclusion": previous["conclusion"],
+                },
+                delta,
+            ],
+            request["assignment_description"],
+            request["candidate_level"],
+            DELTA_HEADING,
+        )
+        # Repository-wide comments of the previous review carry over
+        general = _general_comments(
+            {"comments": verdict["comments"], "file_comments": delta["file_comments"]}
+        )
+        usage = dict(delta["usage"])
+        for key in ("prompt_tokens", "completion_tokens", "requests", "format_retries"):
+            usage[key] = usage.get(key, 0) + verdict["usage"][key]
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        cached = delta["cached"]
+    else:
+        delta = {"file_comments": {}, "found_files": [], "preanalysis": None}
+        verdict = previous
+        general = previous["comments"]
+        usage = {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "requests": 0,
+            "format_retries": 0,
+            "total_tokens": 0,
+            "contents_tokens": 0,
+            "batches": 0,
+            "truncated_files": [],
+            "skipped_files": [],
+        }
+        cached = True
+
+    reviewed = _blob_shas(files)
+    file_comments = {
+        **reused,
+        **{path: delta["file_comments"].get(path, []) for path in delta["found_files"]},
+    }
+    result = {
+        "found_files": sorted({*reused, *delta["found_files"]}),
+        "comments": general + format_file_comments(file_comments),
+        "file_comments": file_comments,
+        "rating": verdict["rating"],
+        "conclusion": verdict["conclusion"],
+        "usage": usage,
+        "cached": cached,
+        "preanalysis": delta.get("preanalysis"),
+    }
+    store.reused_files += len(reused)
+    await _remember(
+        store,
+        owner,
+        repo,
+        context,
+        head,
+        result,
+        reviewed,
+        {path: tree[path] for path in reused},
+    )
+    logger.info(
+        "Delta review of %s/%s %s...%s: %d files reviewed, %d reused",
+        owner,
+        repo,
+        previous["sha"][:7],
+        head[:7],
+        len(files),
+        len(reused),
+    )
+    return {
+        **result,
+        "delta": {
+            "base": previous["sha"],
+            "head": head,
+            "reviewed_files": sorted(reviewed),
+            "reused_files": sorted(reused),
+            "removed_files": sorted(removed),
+        },
+        "duplicates": duplicates,
+    }
+
+
+def _blob_shas(files: List[Dict]) -> Dict[str, str]:
+    return {
+        file["path"]: file.get("sha") or git_blob_sha(file["content"]) for file in files
+    }
+
+
+async def _reuse_fragments(
+    store: FragmentStore,
+    context: str,
+    shas: Dict[str, str],
+    matches: List[DuplicateMatch],
+) -> Dict[str, List[str]]:
+    """
+    Looks up stored comments for files already reviewed in this context:
+    identical blobs of any repository, and, when FINGERPRINT_REUSE_SIMILARITY
+    is set, near duplicates at least that alike.
+
+    Comments borrowed from a near duplicate are also stored under the file's
+    own SHA, so a later delta review of the repository finds them.
+
+    Args:
+        shas (Dict[str, str]): Blob SHA per fetched path.
+        matches (List[DuplicateMatch]): Duplicates found by the index.
+
+    Returns:
+        Dict[str, List[str]]: Stored comments per reusable path.
+    """
+    sources = dict(shas)
+    if FINGERPRINT_REUSE_SIMILARITY is not None:
+        for match in matches:
+            if not match.exact and match.similarity >= FINGERPRINT_REUSE_SIMILARITY:
+                sources[match.path] = match.matched_sha
+    fragments = await store.get_fragments(context, sorted(set(sources.values())))
+    reused = {path: fragments[sha] for path, sha in sources.items() if sha in fragments}
+    await store.put_fragments(
+        context,
+        {
+            shas[path]: notes
+            for path, notes in reused.items()
+            if sources[path] != shas[path]
+        },
+    )
+    return reused
+
+
+def _with_fragments(result: Dict, reused: Dict[str, List[str]]) -> Dict:
+    """
+    Adds reused per-file comments to the result of reviewing the other files.
+    """
+    file_comments = {
+        **reused,
+        **{
+            path: result["file_comments"].get(path, [])
+            for path in result["found_files"]
+        },
+    }
+    return {
+        **result,
+        "found_files": sorted({*reused, *result["found_files"]}),
+        "comments": _general_comments(result) + format_file_comments(file_comments),
+        "file_comments": file_comments,
+    }
+
+
+def _general_comments(result: Dict) -> List[str]:
+    """
+    Returns the comments of a result that are not tied to a single file.
+    """
+    per_file = set(format_file_comments(result.get("file_comments", {})))
+    return [comment for comment in result["comments"] if comment not in per_file]
+
+
+async def _remember(
+    store: FragmentStore,
+    owner: str,
+    repo: str,
+    context: str,
+    head: str,
+    result: Dict,
+    reviewed: Dict[str, str],
+    reused: Dict[str, str],
+) -> None:
+    """
+    Stores fragments of the freshly reviewed files and makes this review the
+    base of the next one.
+
+    Args:
+        reviewed (Dict[str, str]): Blob SHA per path reviewed by this call.
+        reused (Dict[str, str]): Blob SHA per path whose fragment was reused.
+    """
+    if FORMAT_ERROR in result["comments"]:
+        return
+    found = set(result["found_files"])
+    # Files skipped by the token budget were not reviewed and get no fragment
+    reviewed = {path: sha for path, sha in reviewed.items() if path in found}
+    await store.put_fragments(
+        context,
+        {sha: result["file_comments"].get(path, []) for path, sha in reviewed.items()},
+    )
+    store.reviewed_files += len(reviewed)
+    await store.put_review(
+        owner,
+        repo,
+        context,
+        {
+            "sha": head,
+            "files": {**reused, **reviewed},
+            "comments": _general_comments(result),
+            "rating": result["rating"],
+            "conclusion": result["conclusion"],
+        },
+    )
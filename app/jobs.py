@@ -0,0 +1,525 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.cache import ReviewResultCache, SnapshotCache
+from app.clients import ClientPool
+from app.exceptions import ReviewServiceError
+from app.fingerprints import FingerprintIndex
+from app.incremental import FragmentStore
+from app.review_service import perform_code_review
+from app.webhooks import WEBHOOK_SIGNATURE_HEADER, WebhookPolicy, WebhookRejected
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # pragma: no cover - redis is optional
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+def new_job(request: dict, webhook_url: Optional[str] = None) -> Dict:
+    """
+    Creates a job record for a review request.
+
+    Args:
+        request (dict): Review request as accepted by perform_code_review.
+        webhook_url (str, optional): URL notified when the job finishes.
+
+    Returns:
+        Dict: The job with a fresh id and "queued" status.
+    """
+    return {
+        "job_id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "request": request,
+        "webhook_url": webhook_url,
+        "result": None,
+        "error": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+
+class JobQueue(ABC):
+    """
+    Job storage plus a FIFO of job ids waiting to be processed.
+
+    A dequeued job is claimed by its worker until it is acknowledged (ack)
+    or handed back (release); a claim its worker stopped renewing (touch)
+    is requeued by requeue_stale.
+    """
+
+    # Seconds a claim lasts without being renewed
+    claim_ttl: float = 60
+
+    @abstractmethod
+    async def enqueue(self, job: Dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def dequeue(self, timeout: float = 1.0) -> Optional[str]:
+        raise NotImplementedError
+
+    async def touch(self, job_id: str) -> None:
+        pass
+
+    @abstractmethod
+    async def ack(self, job_id: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def release(self, job_id: str) -> None:
+        raise NotImplementedError
+
+    async def requeue_stale(self) -> int:
+        return 0
+
+    @abstractmethod
+    async def get(self, job_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update(self, job_id: str, **fields) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def depth(self) -> int:
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+class MemoryJobQueue(JobQueue):
+    """
+    In-process queue; API and workers must share the same process.
+
+    Like the Redis queue, a job record expires `ttl` seconds after its last
+    update; beyond `max_jobs` records, the least recently updated go first.
+
+    Args:
+        ttl (float): Seconds a job record is kept after its last update.
+        max_jobs (int): Job records kept at most.
+        clock (Callable[[], float], optional): Time source, for tests.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 86400,
+        max_jobs: int = 10000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.clock = clock
+        # Expiry time and record per job id, least recently updated first
+        self._jobs: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def _store(self, job: Dict) -> None:
+        self._jobs[job["job_id"]] = (self.clock() + self.ttl, job)
+        self._jobs.move_to_end(job["job_id"])
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    def _find(self, job_id: str) -> Optional[Dict]:
+        now = self.clock()
+        while self._jobs:
+            expires, _ = next(iter(self._jobs.values()))
+            if expires > now:
+                break
+            self._jobs.popitem(last=False)
+        entry = self._jobs.get(job_id)
+        return entry[1] if entry is not None else None
+
+    async def enqueue(self, job: Dict) -> None:
+        self._store(job)
+        await self._queue.put(job["job_id"])
+
+    async def dequeue(self, timeout: float = 1.0) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def ack(self, job_id: str) -> None:
+        # Claims live and die with the process that holds the queue
+        pass
+
+    async def release(self, job_id: str) -> None:
+        if await self.update(job_id, status=QUEUED, started_at=None) is not None:
+            await self._queue.put(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        job = self._find(job_id)
+        return dict(job) if job is not None else None
+
+    async def update(self, job_id: str, **fields) -> Optional[Dict]:
+        job = self._find(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        self._store(job)
+        return dict(job)
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    async def depth(self) -> int:
+        return self._queue.qsize()
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Redis-backed queue so API nodes and worker nodes can scale separately.
+
+    Job records are JSON strings under "<prefix>:job:<id>" and pending ids
+    live in the "<prefix>:pending" list. Dequeuing moves an id atomically
+    into the "<prefix>:processing" list (BLMOVE), where it stays until the
+    job is acknowledged, and sets a "<prefix>:claim:<id>" key that the
+    worker renews while it runs the job. Ids in the processing list whose
+    claim has lapsed on two requeue_stale passes in a row belong to a
+    worker that died, and are pushed back to the pending list.
+
+    Args:
+        client: A redis.asyncio client (or a compatible stand-in).
+        prefix (str): Key namespace.
+        ttl (int): Seconds a job record is kept after its last update.
+        claim_ttl (int): Seconds a claim lasts without being renewed.
+    """
+
+    def __init__(
+        self, client, prefix: str = "reviews", ttl: int = 86400, claim_ttl: int = 60
+    ):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self._suspects: set = set()
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisJobQueue":
+        if aioredis is None:
+            raise RuntimeError("The redis package is required for the Redis queue")
+        return cls(aioredis.from_url(url), **kwargs)
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _claim_key(self, job_id: str) -> str:
+        return f"{self.prefix}:claim:{job_id}"
+
+    @property
+    def _pending_key(self) -> str:
+        return f"{self.prefix}:pending"
+
+    @property
+    def _processing_key(self) -> str:
+        return f"{self.prefix}:processing"
+
+    async def enqueue(self, job: Dict) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.set(self._job_key(job["job_id"]), json.dumps(job), ex=self.ttl)
+            pipe.lpush(self._pending_key, job["job_id"])
+            await pipe.execute()
+
+    async def dequeue(self, timeout: float = 1.0) -> Optional[str]:
+        job_id = await self.client.blmove(
+            self._pending_key, self._processing_key, timeout, "RIGHT", "LEFT"
+        )
+        if job_id is None:
+            return None
+        job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+        await self.touch(job_id)
+        return job_id
+
+    async def touch(self, job_id: str) -> None:
+        await self.client.set(self._claim_key(job_id), b"1", ex=self.claim_ttl)
+
+    async def ack(self, job_id: str) -> None:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.lrem(self._processing_key, 1, job_id)
+            pipe.delete(self._claim_key(job_id))
+            await pipe.execute()
+
+    async def release(self, job_id: str) -> None:
+        await self.update(job_id, status=QUEUED, started_at=None)
+        await self._requeue(job_id)
+
+    async def _requeue(self, job_id: str) -> bool:
+        # Only the caller that takes the id off the processing list pushes it
+        # back, so concurrent reapers requeue a job once
+        if not await self.client.lrem(self._processing_key, 1, job_id):
+            return False
+        async with self.client.pipeline(transaction=True) as pipe:
+            # Next in line: dequeue pops from the right
+            pipe.rpush(self._pending_key, job_id)
+            pipe.delete(self._claim_key(job_id))
+            await pipe.execute()
+        return True
+
+    async def requeue_stale(self) -> int:
+        """
+        Pushes back the jobs of workers that stopped renewing their claims.
+
+        An id is only requeued when its claim is missing on two passes in a
+        row, which leaves a worker that has just dequeued it the time to set
+        the claim.
+
+        Returns:
+            int: Number of jobs requeued.
+        """
+        ids = [
+            job_id.decode() if isinstance(job_id, bytes) else job_id
+            for job_id in await self.client.lrange(self._processing_key, 0, -1)
+        ]
+        claims = (
+            await self.client.mget([self._claim_key(i) for i in ids]) if ids else []
+        )
+        unclaimed = {job_id for job_id, claim in zip(ids, claims) if claim is None}
+        stale, self._suspects = unclaimed & self._suspects, unclaimed - self._suspects
+
+        requeued = 0
+        for job_id in stale:
+            job = await self.get(job_id)
+            if job is None or job["status"] in (SUCCEEDED, FAILED):
+                # Finished before its worker could acknowledge it
+                await self.ack(job_id)
+                continue
+            await self.update(job_id, status=QUEUED, started_at=None)
+            if await self._requeue(job_id):
+                requeued += 1
+                logger.warning("Requeued job %s of a stopped worker", job_id)
+        return requeued
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        raw = await self.client.get(self._job_key(job_id))
+        return json.loads(raw) if raw is not None else None
+
+    async def update(self, job_id: str, **fields) -> Optional[Dict]:
+        job = await self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        await self.client.set(self._job_key(job_id), json.dumps(job), ex=self.ttl)
+        return job
+
+    async def depth(self) -> int:
+        return await self.client.llen(self._pending_key)
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def create_job_queue() -> JobQueue:
+    """
+    Builds the queue selected by JOB_QUEUE_BACKEND ("memory" or "redis").
+
+    Both keep job records for JOB_TTL seconds after their last update; the
+    memory queue also keeps at most JOB_MAX_RECORDS of them.
+    """
+    backend = os.getenv("JOB_QUEUE_BACKEND", "memory").lower()
+    ttl = int(os.getenv("JOB_TTL", "86400"))
+    if backend == "redis":
+        return RedisJobQueue.from_url(
+            os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            ttl=ttl,
+            claim_ttl=int(os.getenv("JOB_CLAIM_TTL", "60")),
+        )
+    if backend == "memory":
+        return MemoryJobQueue(
+            ttl=ttl, max_jobs=int(os.getenv("JOB_MAX_RECORDS", "10000"))
+        )
+    raise ValueError(f"Unknown job queue backend: {backend}")
+
+
+class WorkerPool:
+    """
+    Drains a job queue with a fixed number of concurrent workers.
+
+    Args:
+        queue (JobQueue): Queue to take jobs from.
+        handler (Callable[[dict], Awaitable[Dict]]): Runs a review request.
+        concurrency (int): Number of jobs processed at the same time.
+        http_client (httpx.AsyncClient, optional): Client for webhook delivery.
+        webhook_attempts (int): Delivery attempts before giving up.
+        webhooks (WebhookPolicy, optional): Checks webhook destinations and
+            signs payloads; built from the environment by default.
+        heartbeat (float, optional): Seconds between renewals of a running
+            job's claim, and between passes requeuing the jobs of stopped
+            workers. Defaults to a quarter of the queue's claim_ttl.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        handler: Callable[[dict], Awaitable[Dict]],
+        concurrency: int = 4,
+        http_client: Optional[httpx.AsyncClient] = None,
+        webhook_attempts: int = 3,
+        webhooks: Optional[WebhookPolicy] = None,
+        heartbeat: Optional[float] = None,
+    ):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.http_client = http_client
+        self.webhook_attempts = webhook_attempts
+        self.webhooks = webhooks or WebhookPolicy.from_env()
+        self.heartbeat = heartbeat or queue.claim_ttl / 4
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.concurrency)
+        ]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self.queue.dequeue()
+            if job_id is not None:
+                await self.process(job_id)
+
+    async def _reaper(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.queue.requeue_stale()
+            except Exception:
+                logger.exception("Requeuing stale jobs failed")
+
+    async def _renew(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            await self.queue.touch(job_id)
+
+    async def process(self, job_id: str) -> Optional[Dict]:
+        """
+        Runs one job and records its outcome.
+
+        The job's claim is renewed while it runs. A job cancelled by stop()
+        is handed back to the queue, so another worker runs it again.
+
+        Args:
+            job_id (str): Id of a dequeued job.
+
+        Returns:
+            Optional[Dict]: The finished job, or None if it no longer exists.
+        """
+        job = await self.queue.update(job_id, status=RUNNING, started_at=time.time())
+        if job is None:
+            await self.queue.ack(job_id)
+            return None
+
+        renewal = asyncio.create_task(self._renew(job_id))
+        try:
+            result = await self.handler(job["request"])
+            fields = {"status": SUCCEEDED, "result": result}
+        except ReviewServiceError as e:
+            fields = {"status": FAILED, "error": str(e)}
+        except asyncio.CancelledError:
+            await asyncio.shield(self.queue.release(job_id))
+            raise
+        except Exception:
+            logger.exception("Review job %s failed", job_id)
+            fields = {"status": FAILED, "error": "Internal server error"}
+        finally:
+            renewal.cancel()
+
+        job = await self.queue.update(job_id, finished_at=time.time(), **fields)
+        await self.queue.ack(job_id)
+        if job is not None and job.get("webhook_url"):
+            delivered = await self._deliver_webhook(job)
+            job = await self.queue.update(job_id, webhook_delivered=delivered)
+        return job
+
+    async def _deliver_webhook(self, job: Dict) -> bool:
+        payload = {key: value for key, value in job.items() if key != "request"}
+        body = json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        signature = self.webhooks.sign(body)
+        if signature is not None:
+            headers[WEBHOOK_SIGNATURE_HEADER] = signature
+
+        for attempt in range(self.webhook_attempts):
+            try:
+                # Checked again on each attempt: the host's addresses may have
+                # changed since the job was submitted
+                await self.webhooks.check_destination(job["webhook_url"])
+            except WebhookRejected as e:
+                logger.warning("Webhook for job %s rejected: %s", job["job_id"], e)
+                return False
+            try:
+                if self.http_client is not None:
+                    response = await self.http_client.post(
+                        job["webhook_url"], content=body, headers=headers
+                    )
+                else:
+                    async with httpx.AsyncClient() as client:
+                        response = await client.post(
+                            job["webhook_url"], content=body, headers=headers
+                        )
+                if response.status_code < 300:
+                    return True
+            except httpx.HTTPError as e:
+                logger.warning("Webhook for job %s failed: %s", job["job_id"], e)
+            if attempt + 1 < self.webhook_attempts:
+                await asyncio.sleep(0.5 * 2**attempt)
+        return False
+
+
+def build_review_handler(
+    clients: ClientPool,
+    snapshot_cache: Optional[SnapshotCache] = None,
+    result_cache: Optional[ReviewResultCache] = None,
+    fragment_store: Optional[FragmentStore] = None,
+    fingerprint_index: Optional[FingerprintIndex] = None,
+) -> Callable[[dict], Awaitable[Dict]]:
+    """
+    Returns a job handler that runs perform_code_review with shared resources.
+
+    Credentials are chosen from the worker's own credential pools when a job
+    runs, so they are never stored alongside queued jobs.
+    """
+
+    async def handler(request: dict) -> Dict:
+        github_token, openai_key = clients.choose_tokens()
+        if not github_token or not openai_key:
+            raise ReviewServiceError(
+                "Missing required environment variables", category="configuration"
+            )
+        return await perform_code_review(
+            request=request,
+            github_token=github_token,
+            openai_key=openai_key,
+            http_client=clients.github,
+            openai_client=clients.openai(openai_key),
+            snapshot_cache=snapshot_cache,
+            result_cache=result_cache,
+            fragment_store=fragment_store,
+            fingerprint_index=fingerprint_index,
+        )
+
+    return handler
@@ -0,0 +1,216 @@
+import json
+import re
+from typing import List, Optional, Tuple, Union
+
+_STRING_STOP = re.compile(r'["\\]')
+_UNFINISHED_UNICODE = re.compile(r"(\\+)u[0-9a-fA-F]{0,3}$")
+_WHITESPACE = " \t\r\n"
+
+Path = Tuple[Union[str, int, None], ...]
+
+
+class JSONStream:
+    """
+    Incremental scanner of one JSON document arriving in fragments, such as
+    a streamed completion.
+
+    Every character is looked at once: the scanner keeps the open
+    containers, the key or index being filled and whether a string is open,
+    so string values are reported as soon as they complete, and a document
+    cut off mid-way can be closed without scanning it again. Text before the
+    document (e.g. a "```json" fence) and after it is ignored.
+    """
+
+    def __init__(self):
+        self._parts: List[str] = []
+        self._length = 0
+        # "{" or "[" of every open container, with the key or index filled
+        self._stack: List[str] = []
+        self._path: List[Union[str, int, None]] = []
+        self._state = "start"
+        self._string: List[str] = []
+        self._string_is_key = False
+        self._escaped = False
+        self._start: Optional[int] = None
+        self._end: Optional[int] = None
+        # Longest prefix that forms a valid document once closed, and the
+        # brackets closing it
+        self._safe: Tuple[int, str] = (0, "")
+
+    @property
+    def done(self) -> bool:
+        """
+        True once the document's outermost container has closed.
+        """
+        return self._end is not None
+
+    def feed(self, delta: str) -> List[Tuple[Path, str]]:
+        """
+        Scans the next fragment.
+
+        Args:
+            delta (str): Next fragment of the document.
+
+        Returns:
+            List[Tuple[Path, str]]: String values completed by the fragment,
+            with the keys and array indices leading to them, e.g.
+            (("comments", 0), "Add tests").
+        """
+        completed: List[Tuple[Path, str]] = []
+        offset, self._length = self._length, self._length + len(delta)
+        self._parts.append(delta)
+        index, size = 0, len(delta)
+        while index < size:
+            if self._state == "string":
+                index = self._scan_string(delta, index, offset, completed)
+                continue
+            char = delta[index]
+            position = offset + index
+            index += 1
+            state = self._state
+            if state in ("start", "end"):
+                if state == "start" and char in "{[":
+                    self._start = position
+                    self._open(char, position)
+                continue
+            if state == "literal":
+                if char not in _WHITESPACE and char not in ",]}":
+                    continue
+                self._after_value(position)
+                state = "after"
+            if char in _WHITESPACE:
+                continue
+            if state == "value":
+                if char == '"':
+                    self._begin_string(key=False)
+                elif char in "{[":
+                    self._open(char, position)
+                elif char == "]":
+                    self._close(position)
+                else:
+                    self._state = "literal"
+            elif state == "key":
+                if char == '"':
+                    self._begin_string(key=True)
+                elif char == "}":
+                    self._close(position)
+            elif state == "colon":
+                if char == ":":
+                    self._state = "value"
+            elif state == "after":
+                if char == ",":
+                    if self._stack[-1] == "[":
+                        self._path[-1] += 1
+                        self._state = "value"
+                    else:
+                        self._state = "key"
+                elif char in "]}":
+                    self._close(position)
+        return completed
+
+    def text(self) -> str:
+        """
+        Returns everything fed so far.
+        """
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def document(self) -> Optional[str]:
+        """
+        Returns the complete document without surrounding text, or None while
+        it is still open.
+        """
+        if self._end is None:
+            return None
+        return self.text()[self._start : self._end]
+
+    def repair(self) -> Optional[str]:
+        """
+        Closes a document that was cut off.
+
+        An open string value is ended where the text stops; anything after
+        the last complete value (a half-written key, number or escape
+        sequence) is dropped. The open containers are then closed.
+
+        Returns:
+            str, optional: The document, closed; None if it never started.
+        """
+        if self._start is None:
+            return None
+        if self._end is not None:
+            return self.document()
+        text = self.text()
+        if self._state == "string" and not self._string_is_key:
+            cut = self._length - (1 if self._escaped else 0)
+            prefix = text[self._start : cut]
+            match = _UNFINISHED_UNICODE.search(prefix)
+            if match and len(match.group(1)) % 2:
+                prefix = prefix[: match.start() + len(match.group(1)) - 1]
+            return prefix + '"' + self._closing()
+        length, closing = self._safe
+        return text[self._start : length] + closing
+
+    def _scan_string(
+        self, delta: str, index: int, offset: int, completed: List[Tuple[Path, str]]
+    ) -> int:
+        """
+        Consumes string contents up to the closing quote or the end of the
+        fragment, returning where scanning continues.
+        """
+        if self._escaped:
+            self._string.append(delta[index])
+            self._escaped = False
+            return index + 1
+        match = _STRING_STOP.search(delta, index)
+        if match is None:
+            self._string.append(delta[index:])
+            return len(delta)
+        stop = match.start()
+        self._string.append(delta[index:stop])
+        if delta[stop] == "\\":
+            self._string.append("\\")
+            self._escaped = True
+            return stop + 1
+        value = _decode_string("".join(self._string))
+        self._string = []
+        if self._string_is_key:
+            self._path[-1] = value
+            self._state = "colon"
+        else:
+            completed.append((tuple(self._path), value))
+            self._after_value(offset + stop + 1)
+        return stop + 1
+
+    def _begin_string(self, key: bool) -> None:
+        self._state = "string"
+        self._string_is_key = key
+
+    def _open(self, char: str, position: int) -> None:
+        self._stack.append(char)
+        self._path.append(0 if char == "[" else None)
+        self._state = "value" if char == "[" else "key"
+        self._safe = (position + 1, self._closing())
+
+    def _close(self, position: int) -> None:
+        self._stack.pop()
+        self._path.pop()
+        if self._stack:
+            self._after_value(position + 1)
+        else:
+            self._state = "end"
+            self._end = position + 1
+
+    def _after_value(self, end: int) -> None:
+        self._state = "after"
+        self._safe = (end, self._closing())
+
+    def _closing(self) -> str:
+        return "".join("}" if char == "{" else "]" for char in reversed(self._stack))
+
+
+def _decode_string(raw: str) -> str:
+    try:
+        return json.loads(f'"{raw}"', strict=False)
+    except ValueError:
+        return raw
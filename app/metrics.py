@@ -0,0 +1,380 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Buckets in seconds for GitHub requests and local work
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Buckets in seconds for completions and whole reviews
+SLOW_BUCKETS = (0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+# USD per million (prompt, completion) tokens, used to estimate spend
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    """
+    Base of the metric types: a name, help text and a fixed set of labels.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+            *self._samples(),
+        ]
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing total, one per combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + float(amount)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down, one per combination of label values.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in sorted(self._values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values over cumulative buckets.
+
+    Args:
+        buckets (Sequence[float]): Upper bounds of the buckets; "+Inf" is
+            added automatically.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # Per label values: (count per bucket, sum, count)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        counts, total, count = self._series.get(key) or ([0] * len(self.buckets), 0, 0)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        self._series[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observes the seconds spent in the with-block, including on errors.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: str) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def sum(self, **labels: str) -> float:
+        series = self._series.get(self._key(labels))
+        return series[1] if series else 0.0
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(
+                    self.labels + ("le",), key + (_format_value(bound),)
+                )
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            samples.append(f"{self.name}_count{labels} {count}")
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics rendered together by the /metrics endpoint.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def counter(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def _register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = [line for metric in self._metrics.values() for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+review_seconds = registry.histogram(
+    "review_duration_seconds",
+    "Time spent on a whole review, from validation to the final result",
+    buckets=SLOW_BUCKETS,
+)
+review_errors = registry.counter(
+    "review_errors_total", "Failed reviews by error category", ["category"]
+)
+github_crawl_seconds = registry.histogram(
+    "github_crawl_duration_seconds",
+    "Time spent listing and fetching the files of a repository",
+    ["strategy"],
+    buckets=SLOW_BUCKETS,
+)
+github_file_fetch_seconds = registry.histogram(
+    "github_file_fetch_duration_seconds", "Time spent downloading one file body"
+)
+github_bytes = registry.counter(
+    "github_downloaded_bytes_total",
+    "Bytes of file bodies and archives downloaded from GitHub",
+    ["source"],
+)
+github_files_fetched = registry.counter(
+    "github_files_fetched_total", "File bodies downloaded from GitHub"
+)
+github_files_skipped = registry.counter(
+    "github_files_skipped_total",
+    "Files left out by the file selection, by reason",
+    ["reason"],
+)
+prompt_build_seconds = registry.histogram(
+    "llm_prompt_build_duration_seconds",
+    "Time spent packing files into batches and building their prompts",
+)
+llm_seconds = registry.histogram(
+    "llm_request_duration_seconds",
+    "Time until a completion has fully arrived",
+    ["model", "stream"],
+    buckets=SLOW_BUCKETS,
+)
+llm_first_token_seconds = registry.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time until the first content fragment of a streamed completion",
+    ["model"],
+    buckets=SLOW_BUCKETS,
+)
+llm_answers = registry.counter(
+    "llm_answers_total",
+    "JSON answers of completions by outcome: valid, repaired locally, "
+    "retried with a new completion, or failed",
+    ["outcome"],
+)
+llm_tokens = registry.counter(
+    "llm_tokens_total", "Tokens reported by the model provider", ["model", "kind"]
+)
+llm_cost = registry.counter(
+    "llm_estimated_cost_usd_total",
+    "Estimated spend on completions, from MODEL_PRICES",
+    ["model"],
+)
+cascade_files = registry.counter(
+    "cascade_files_total",
+    "Files triaged by the cascade, by verdict and whether they were escalated",
+    ["verdict", "escalated"],
+)
+cascade_tier_seconds = registry.histogram(
+    "cascade_tier_duration_seconds",
+    "Time one tier of a cascaded review took",
+    ["tier"],
+    buckets=SLOW_BUCKETS,
+)
+preanalysis_seconds = registry.histogram(
+    "preanalysis_duration_seconds",
+    "Time spent on the local static analysis of a review's files",
+)
+preanalysis_tokens = registry.counter(
+    "preanalysis_tokens_total",
+    "Contents tokens of analyzed files before and after compression",
+    ["stage"],
+)
+duplicate_files = registry.counter(
+    "duplicate_files_total",
+    "Fetched files matching a file of another repository",
+    ["kind"],
+)
+admission_requests = registry.counter(
+    "admission_requests_total",
+    "Reviews by priority lane and admission outcome: admitted at once, "
+    "admitted after queuing, or the reason they were rejected",
+    ["lane", "outcome"],
+)
+admission_wait_seconds = registry.histogram(
+    "admission_wait_seconds",
+    "Time admitted reviews waited in the admission queue",
+    ["lane"],
+    buckets=SLOW_BUCKETS,
+)
+credential_requests = registry.counter(
+    "credential_requests_total",
+    "Responses received per provider credential, labelled by credential name",
+    ["provider", "credential"],
+)
+credential_rate_limited = registry.counter(
+    "credential_rate_limited_total",
+    "Rate-limited responses per provider credential",
+    ["provider", "credential"],
+)
+credential_remaining = registry.gauge(
+    "credential_remaining_requests",
+    "Requests left in the current rate-limit window of a provider credential",
+    ["provider", "credential"],
+)
+cache_requests = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result", ["cache", "result"]
+)
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimates the price of a completion in USD.
+
+    Args:
+        model (str): Model name; unknown models are priced at zero.
+        prompt_tokens (int): Tokens sent.
+        completion_tokens (int): Tokens generated.
+
+    Returns:
+        float: Estimated cost in USD.
+    """
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+def record_llm_usage(model: str, prompt_tokens: int, completion_tokens: int) -> None:
+    """
+    Counts the tokens and estimated cost of one completion.
+    """
+    prompt_tokens, completion_tokens = int(prompt_tokens), int(completion_tokens)
+    llm_tokens.inc(prompt_tokens, model=model, kind="prompt")
+    llm_tokens.inc(completion_tokens, model=model, kind="completion")
+    llm_cost.inc(estimate_cost(model, prompt_tokens, completion_tokens), model=model)
+
+
+def record_cache_lookup(cache: str, hits: int, misses: int = 0) -> None:
+    """
+    Counts cache hits and misses.
+
+    Args:
+        cache (str): Cache name, e.g. "snapshot".
+        hits (int): Lookups answered from the cache.
+        misses (int, optional): Lookups that were not.
+    """
+    if hits:
+        cache_requests.inc(hits, cache=cache, result="hit")
+    if misses:
+        cache_requests.inc(misses, cache=cache, result="miss")
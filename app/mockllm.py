@@ -0,0 +1,353 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from app.models import ReviewAnswer, response_format
+
+# Characters per token, as estimated by the rest of the service
+CHARS_PER_TOKEN = 4
+# Content characters sent per chunk of a streamed completion
+STREAM_CHUNK_CHARS = 16
+
+
+@dataclass
+class MockLLMSettings:
+    """
+    Behaviour of the mock chat completions server.
+
+    Attributes:
+        latency (float): Seconds before the first token of every completion.
+        tokens_per_second (float): Generation speed; 0 sends the whole
+            completion at once.
+        error_rate (float): Share of requests answered with a 500 error.
+        rate_limit_rate (float): Share of requests answered with a 429 error.
+        truncate_rate (float): Share of completions cut off half way, as if
+            max_tokens had been reached.
+        retry_after (float): Seconds advertised in the Retry-After header of
+            429 errors.
+        seed (int): Seed of the answers and of the injected errors.
+    """
+
+    latency: float = 0.5
+    tokens_per_second: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    truncate_rate: float = 0.0
+    retry_after: float = 1.0
+    seed: int = 0
+
+    @classmethod
+    def from_env(cls) -> "MockLLMSettings":
+        """
+        Builds settings from MOCK_LLM_* environment variables.
+        """
+        return cls(
+            latency=float(os.getenv("MOCK_LLM_LATENCY", "0.5")),
+            tokens_per_second=float(os.getenv("MOCK_LLM_TOKENS_PER_SECOND", "0")),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+            rate_limit_rate=float(os.getenv("MOCK_LLM_RATE_LIMIT_RATE", "0")),
+            truncate_rate=float(os.getenv("MOCK_LLM_TRUNCATE_RATE", "0")),
+            retry_after=float(os.getenv("MOCK_LLM_RETRY_AFTER", "1")),
+            seed=int(os.getenv("MOCK_LLM_SEED", "0")),
+        )
+
+
+class MockChatCompletions:
+    """
+    Deterministic stand-in for an OpenAI-compatible chat completions API.
+
+    Answers are built from the JSON schema of the request's response_format
+    (the ReviewAnswer schema when there is none), with one entry per "File:"
+    of the prompt wherever the schema asks for per-file objects. The answer
+    and the fate of a request (answered, failed, rate limited or truncated)
+    only depend on the seed, the request body and how many times that same
+    body was sent before: a run replays identically whatever the arrival
+    order, and a retried request draws again.
+
+    Args:
+        settings (MockLLMSettings): Latency, throughput and error injection.
+        respond (Callable[[Dict], Union[Dict, str]], optional): Builds the
+            answer to a request body instead, as a dict sent as JSON or a
+            raw string.
+    """
+
+    def __init__(
+        self,
+        settings: MockLLMSettings,
+        respond: Optional[Callable[[Dict], Union[Dict, str]]] = None,
+    ):
+        self.settings = settings
+        self.respond = respond
+        self.counts: Counter = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._seen: Counter = Counter()
+
+    async def complete(self, payload: bytes) -> Response:
+        """
+        Answers one POST /v1/chat/completions request body.
+        """
+        self.counts["requests"] += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await self._complete(payload)
+        finally:
+            self.in_flight -= 1
+
+    async def _complete(self, payload: bytes) -> Response:
+        settings = self.settings
+        try:
+            body = json.loads(payload)
+            prompt = body["messages"][-1]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            self.counts["invalid"] += 1
+            return _error(400, "invalid_request_error", "Malformed request body")
+
+        digest = hashlib.sha256(b"%d:" % settings.seed + payload).hexdigest()
+        draw = random.Random(f"{digest}:{self._seen[digest]}")
+        self._seen[digest] += 1
+        roll = draw.random()
+        if roll < settings.rate_limit_rate:
+            self.counts["rate_limited"] += 1
+            response = _error(429, "rate_limit_exceeded", "Rate limit reached")
+            response.headers["Retry-After"] = f"{settings.retry_after:g}"
+            return response
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            await asyncio.sleep(settings.latency)
+            self.counts["errors"] += 1
+            return _error(500, "server_error", "Injected server error")
+
+        if self.respond is not None:
+            answer = self.respond(body)
+        else:
+            answer = build_answer(_schema(body), prompt, random.Random(digest))
+        content = answer if isinstance(answer, str) else json.dumps(answer, indent=2)
+        finish_reason = "stop"
+        limit = body.get("max_tokens")
+        if draw.random() < settings.truncate_rate:
+            content = content[: len(content) // 2]
+            finish_reason = "length"
+        elif limit and len(content) > limit * CHARS_PER_TOKEN:
+            content = content[: limit * CHARS_PER_TOKEN]
+            finish_reason = "length"
+        if finish_reason == "length":
+            self.counts["truncated"] += 1
+        usage = {
+            "prompt_tokens": sum(
+                len(message.get("content") or "") for message in body["messages"]
+            )
+            // CHARS_PER_TOKEN,
+            "completion_tokens": len(content) // CHARS_PER_TOKEN,
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        self.counts["prompt_tokens"] += usage["prompt_tokens"]
+        self.counts["completion_tokens"] += usage["completion_tokens"]
+        completion = {
+            "id": f"chatcmpl-mock-{digest[:24]}",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+        }
+
+        if body.get("stream"):
+            self.counts["streamed"] += 1
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            return StreamingResponse(
+                self._stream(completion, content, finish_reason, usage, include_usage),
+                media_type="text/event-stream",
+            )
+        await asyncio.sleep(settings.latency + self._generation_seconds(content))
+        self.counts["completed"] += 1
+        return JSONResponse(
+            {
+                **completion,
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": finish_reason,
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    async def _stream(
+        self,
+        completion: Dict,
+        content: str,
+        finish_reason: str,
+        usage: Dict,
+        include_usage: bool,
+    ):
+        def event(choices: List[Dict], **extra) -> str:
+            chunk = {
+                **completion,
+                "object": "chat.completion.chunk",
+                "choices": choices,
+                **extra,
+            }
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        # The request handler has returned; the stream is in flight until sent
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.settings.latency)
+            yield event([{"index": 0, "delta": {"role": "assistant", "content": ""}}])
+            for start in range(0, len(content), STREAM_CHUNK_CHARS):
+                fragment = content[start : start + STREAM_CHUNK_CHARS]
+                await asyncio.sleep(self._generation_seconds(fragment))
+                yield event([{"index": 0, "delta": {"content": fragment}}])
+            yield event([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+            if include_usage:
+                yield event([], usage=usage)
+            yield "data: [DONE]\n\n"
+            self.counts["completed"] += 1
+        finally:
+            self.in_flight -= 1
+
+    def _generation_seconds(self, content: str) -> float:
+        if not self.settings.tokens_per_second:
+            return 0.0
+        return len(content) / CHARS_PER_TOKEN / self.settings.tokens_per_second
+
+    def stats(self) -> Dict:
+        return {
+            "requests": self.counts["requests"],
+            "completed": self.counts["completed"],
+            "streamed": self.counts["streamed"],
+            "errors": self.counts["errors"],
+            "rate_limited": self.counts["rate_limited"],
+            "truncated": self.counts["truncated"],
+            "invalid": self.counts["invalid"],
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "prompt_tokens": self.counts["prompt_tokens"],
+            "completion_tokens": self.counts["completion_tokens"],
+        }
+
+
+def build_answer(schema: Dict, prompt: str, draw: random.Random):
+    """
+    Builds an answer matching a JSON schema for the files of a prompt.
+
+    Arrays of objects with a "path" property get one object per file of the
+    prompt, other arrays two entries; enum values, ratings and line numbers
+    are drawn from `draw`.
+
+    Args:
+        schema (Dict): JSON schema of the answer, with its "$defs".
+        prompt (str): Prompt whose "File: <path>" lines name the files.
+        draw (random.Random): Source of the varying parts of the answer.
+    """
+    paths = list(dict.fromkeys(re.findall(r"^File: (\S+)", prompt, re.MULTILINE)))
+    definitions = schema.get("$defs", {})
+
+    def resolve(node: Dict) -> Dict:
+        if "$ref" in node:
+            node = definitions[node["$ref"].rsplit("/", 1)[-1]]
+        for option in node.get("anyOf", ()):
+            if option.get("type") != "null":
+                return resolve(option)
+        return node
+
+    def value(node: Dict, name: str, path: Optional[str]):
+        node = resolve(node)
+        if "enum" in node:
+            return draw.choice(node["enum"])
+        kind = node.get("type")
+        if kind == "object":
+            return {
+                key: value(item, key, path)
+                for key, item in node.get("properties", {}).items()
+            }
+        if kind == "array":
+            items = resolve(node.get("items", {}))
+            if "path" in items.get("properties", {}) and path is None:
+                return [value(items, name, file) for file in paths]
+            return [value(items, name, path) for _ in range(2)]
+        if kind == "integer":
+            return draw.randint(1, 200)
+        if kind in ("number", "boolean"):
+            return draw.random() if kind == "number" else draw.random() < 0.5
+        if name == "path":
+            return path or "README.md"
+        if name == "rating":
+            return f"{draw.randint(4, 9)}/10"
+        subject = name.rstrip("s").replace("_", " ")
+        where = f" in {path}" if path else ""
+        return f"Mock {subject}{where} #{draw.randint(1, 999)}"
+
+    return value(schema, "answer", None)
+
+
+def _schema(body: Dict) -> Dict:
+    requested = body.get("response_format") or {}
+    if requested.get("type") == "json_schema":
+        return requested["json_schema"]["schema"]
+    return response_format(ReviewAnswer)["json_schema"]["schema"]
+
+
+def _error(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"message": message, "type": code, "code": code}},
+        status_code=status,
+    )
+
+
+def create_app(
+    settings: Optional[MockLLMSettings] = None,
+    respond: Optional[Callable[[Dict], Union[Dict, str]]] = None,
+) -> FastAPI:
+    """
+    Creates the mock server application.
+
+    Served in process through httpx.ASGITransport, it also stands in for the
+    chat completions API in the tests and the benchmarks.
+
+    Args:
+        settings (MockLLMSettings, optional): Server behaviour; read from the
+            MOCK_LLM_* variables when omitted.
+        respond (Callable[[Dict], Union[Dict, str]], optional): Answers
+            requests instead of the schema (see MockChatCompletions).
+    """
+    mock = MockChatCompletions(settings or MockLLMSettings.from_env(), respond)
+    mock_app = FastAPI(title="Mock chat completions")
+    mock_app.state.mock = mock
+
+    @mock_app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        return await mock.complete(await request.body())
+
+    @mock_app.get("/stats")
+    async def stats():
+        return mock.stats()
+
+    return mock_app
+
+
+def main():
+    load_dotenv()
+    uvicorn.run(
+        create_app(),
+        host=os.getenv("MOCK_LLM_HOST", "127.0.0.1"),
+        port=int(os.getenv("MOCK_LLM_PORT", "8001")),
+    )
+
+
+if __name__ == "__main__":
+    main()
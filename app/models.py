@@ -1,6 +1,9 @@
-from typing import Dict, List, Literal
+from functools import lru_cache
+from typing import Dict, List, Literal, Optional, Type
 
-from pydantic import BaseModel, HttpUrl, field_validator
+from pydantic import BaseModel, ConfigDict, HttpUrl, field_validator
+
+from app.cascade import VERDICTS
 
 
 class ReviewRequest(BaseModel):
@@ -20,3 +23,156 @@ class ReviewResponse(BaseModel):
     comments: Dict[str, List[str]]
     rating: int
     conclusion: str
+
+
+class Answer(BaseModel):
+    """
+    Base of the JSON answers requested from the model.
+
+    Validation is lenient so that answers of backends without structured
+    outputs still load: numbers are accepted for strings and list entries
+    are turned into strings.
+    """
+
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+    @field_validator("comments", mode="before", check_fields=False)
+    def stringify_comments(cls, v):
+        if isinstance(v, list):
+            return [item if isinstance(item, str) else str(item) for item in v]
+        return v
+
+
+class FileNotes(Answer):
+    path: str
+    comments: List[str]
+
+
+class ReviewAnswer(Answer):
+    """
+    Answer to a review prompt built by build_prompt.
+    """
+
+    comments: List[str] = []
+    file_comments: List[FileNotes] = []
+    rating: str = "N/A"
+    conclusion: str = "Analysis failed to provide a conclusion"
+
+    @field_validator("file_comments", mode="before")
+    def file_comments_by_path(cls, v):
+        # Older prompts asked for an object keyed by path
+        if isinstance(v, dict):
+            return [
+                {"path": path, "comments": notes}
+                for path, notes in v.items()
+                if isinstance(notes, list)
+            ]
+        return v
+
+
+class LineComment(Answer):
+    path: str
+    line: Optional[int]
+    comment: str
+
+    @field_validator("line", mode="before")
+    def line_number(cls, v):
+        try:
+            return int(v)
+        except (TypeError, ValueError):
+            return None
+
+
+class DiffAnswer(Answer):
+    """
+    Answer to a pull request review prompt built by build_diff_prompt.
+    """
+
+    comments: List[str] = []
+    line_comments: List[LineComment] = []
+    rating: str = "N/A"
+    conclusion: str = "Analysis failed to provide a conclusion"
+
+    @field_validator("line_comments", mode="before")
+    def drop_malformed(cls, v):
+        if isinstance(v, list):
+            return [item for item in v if isinstance(item, dict)]
+        return v
+
+
+class VerdictAnswer(Answer):
+    """
+    Answer to the prompt merging partial reviews.
+    """
+
+    rating: str = "N/A"
+    conclusion: str = "Analysis failed to provide a conclusion"
+
+
+@lru_cache(maxsize=None)
+def response_format(answer: Type[Answer]) -> Dict:
+    """
+    Builds the structured output format constraining completions to an
+    answer model.
+
+    The JSON schema generated by pydantic is made strict: every property is
+    required, no others are allowed, and titles, docstrings and defaults are
+    left out.
+
+    Args:
+        answer (Type[Answer]): Model of the expected answer.
+
+    Returns:
+        Dict: The response_format parameter of the Chat Completions API.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": answer.__name__,
+            "strict": True,
+            "schema": _strict_schema(answer.model_json_schema()),
+        },
+    }
+
+
+def _strict_schema(node):
+    if isinstance(node, list):
+        return [_strict_schema(item) for item in node]
+    if not isinstance(node, dict):
+        return node
+    strict = {}
+    for key, value in node.items():
+        if key in ("title", "description", "default"):
+            continue
+        if key in ("properties", "$defs"):
+            strict[key] = {name: _strict_schema(item) for name, item in value.items()}
+        else:
+            strict[key] = _strict_schema(value)
+    if "properties" in strict:
+        strict["required"] = list(strict["properties"])
+        strict["additionalProperties"] = False
+    return strict
+
+
+class FileTriage(Answer):
+    path: str
+    verdict: Literal[VERDICTS]
+    reason: str
+
+    @field_validator("verdict", mode="before")
+    def known_verdict(cls, v):
+        verdict = "_".join(str(v).lower().split())
+        # Anything unclear is looked at more closely rather than waved through
+        if verdict not in VERDICTS:
+            return "needs_attention"
+        return verdict
+
+
+class TriageAnswer(Answer):
+    """
+    Answer to a triage prompt built by build_triage_prompt.
+    """
+
+    files: List[FileTriage] = []
+    rating: str = "N/A"
+    conclusion: str = "Analysis failed to provide a conclusion"
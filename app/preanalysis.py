@@ -0,0 +1,740 @@
+import ast
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Tuple
+
+from app import chunking, metrics
+from app.chunking import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# "false" sends file contents to the model unchanged
+PREANALYSIS = os.getenv("PREANALYSIS", "true").lower() == "true"
+# Functions at least this complex keep their bodies
+KEEP_COMPLEXITY = int(os.getenv("PREANALYSIS_KEEP_COMPLEXITY", "5"))
+# Bodies shorter than this many lines are never elided; the saving is too small
+MIN_ELIDED_LINES = int(os.getenv("PREANALYSIS_MIN_ELIDED_LINES", "5"))
+# Worker processes analyzing files; 0 analyzes them in a thread instead
+WORKERS = int(os.getenv("PREANALYSIS_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Reviews with fewer files are analyzed in a thread, where shipping the
+# files to worker processes would cost more than it saves
+POOL_MIN_FILES = int(os.getenv("PREANALYSIS_POOL_MIN_FILES", "16"))
+# Functions above this complexity are reported by the linter
+LINT_COMPLEXITY = 10
+# Lint findings kept per file in the prompt and the report
+MAX_FINDINGS = 20
+
+LANGUAGES = {
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "typescript",
+    ".java": "java",
+    ".cpp": "cpp",
+    ".cs": "csharp",
+    ".go": "go",
+    ".php": "php",
+}
+# Functions that keep their bodies regardless of complexity: entry points,
+# and constructors, which show the state an object holds
+KEEP_NAMES = {"main", "handler", "run", "app", "__init__", "constructor"}
+
+
+@dataclass
+class FunctionInfo:
+    """
+    A function or method found in a file.
+
+    Attributes:
+        name (str): Name qualified by its enclosing classes and functions.
+        line (int): First line of the definition.
+        end_line (int): Last line of the body.
+        complexity (int): Cyclomatic complexity, nested functions excluded.
+        elided (bool): Whether the body was left out of the compressed file.
+    """
+
+    name: str
+    line: int
+    end_line: int
+    complexity: int
+    elided: bool = False
+
+
+@dataclass
+class FileAnalysis:
+    """
+    Result of analyzing one file.
+
+    Attributes:
+        path (str): Path within the repository.
+        language (str): Language the file was parsed as.
+        content (str): Compressed representation sent to the model.
+        functions (List[FunctionInfo]): Functions and methods, in line order.
+        classes (List[str]): Classes, interfaces and structs.
+        lint (List[str]): Findings as "line N: message".
+        tokens_before (int): Tokens of the original content.
+        tokens_after (int): Tokens of the compressed content.
+        error (str, optional): Why the file could not be parsed; it is then
+            passed through unchanged.
+    """
+
+    path: str
+    language: str
+    content: str
+    functions: List[FunctionInfo] = field(default_factory=list)
+    classes: List[str] = field(default_factory=list)
+    lint: List[str] = field(default_factory=list)
+    tokens_before: int = 0
+    tokens_after: int = 0
+    error: Optional[str] = None
+
+    @property
+    def elided(self) -> int:
+        return sum(function.elided for function in self.functions)
+
+
+def language_of(path: str) -> Optional[str]:
+    """
+    Returns the language the pre-analysis parses a file as, if any.
+    """
+    return LANGUAGES.get(os.path.splitext(path)[1].lower())
+
+
+def analyze_source(path: str, content: str) -> FileAnalysis:
+    """
+    Parses one file, measures its functions and lints it, then builds the
+    compressed representation: the file's skeleton (imports, signatures,
+    docstrings and comments outside bodies) with the bodies of simple
+    functions replaced by a one-line placeholder. Complex functions, entry
+    points and functions with lint findings keep their bodies.
+
+    Args:
+        path (str): Path within the repository.
+        content (str): Source of the file.
+
+    Returns:
+        FileAnalysis: The analysis; files that cannot be parsed come back
+        unchanged with `error` set.
+    """
+    language = language_of(path) or "unknown"
+    tokens = count_tokens(content)
+    try:
+        if language == "python":
+            analysis = _analyze_python(path, content)
+        elif language != "unknown":
+            analysis = _analyze_braces(path, content, language)
+        else:
+            raise ValueError("unsupported language")
+    except (SyntaxError, ValueError, RecursionError) as e:
+        return FileAnalysis(
+            path,
+            language,
+            content,
+            tokens_before=tokens,
+            tokens_after=tokens,
+            error=str(e),
+        )
+
+    analysis.tokens_before = tokens
+    analysis.tokens_after = (
+        count_tokens(analysis.content) if analysis.content != content else tokens
+    )
+    if analysis.tokens_after >= tokens:
+        # The summary cost more than the elided bodies saved
+        analysis.content, analysis.tokens_after = content, tokens
+        for function in analysis.functions:
+            function.elided = False
+    return analysis
+
+
+def analyze_sources(items: List[Tuple[str, str]]) -> List[FileAnalysis]:
+    """
+    Analyzes several files; the unit of work sent to a worker process.
+    """
+    return [analyze_source(path, content) for path, content in items]
+
+
+def _keep_body(function: FunctionInfo, lint_lines: List[int], lines: int) -> bool:
+    if lines < MIN_ELIDED_LINES or function.complexity >= KEEP_COMPLEXITY:
+        return True
+    if function.name.rsplit(".", 1)[-1] in KEEP_NAMES:
+        return True
+    return any(function.line <= line <= function.end_line for line in lint_lines)
+
+
+def _header(functions: List[FunctionInfo], lint: List[str], comment: str) -> List[str]:
+    """
+    Summary lines put in front of a compressed file, so the model still sees
+    what was measured about the parts it does not get to read.
+    """
+    lines = []
+    elided = [function for function in functions if function.elided]
+    if elided:
+        kept = [
+            f"{function.name} ({function.complexity})"
+            for function in functions
+            if not function.elided and function.complexity >= KEEP_COMPLEXITY
+        ]
+        summary = (
+            f"{comment} pre-analysis: {len(elided)} of {len(functions)} "
+            "function bodies elided"
+        )
+        if kept:
+            summary += "; complex: " + ", ".join(kept)
+        lines.append(summary)
+    lines += [f"{comment} lint: {finding}" for finding in lint]
+    return lines
+
+
+def _splice(lines: List[str], replacements: List[Tuple[int, int, str]]) -> List[str]:
+    """
+    Replaces the 1-based inclusive line ranges with their placeholders.
+    """
+    for start, end, placeholder in sorted(replacements, reverse=True):
+        lines[start - 1 : end] = [placeholder]
+    return lines
+
+
+# Python
+
+
+def _python_complexity(function: ast.AST) -> int:
+    complexity = 1
+    stack = list(ast.iter_child_nodes(function))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        if isinstance(
+            node,
+            (ast.If, ast.For, ast.AsyncFor, ast.While, ast.IfExp, ast.ExceptHandler),
+        ):
+            complexity += 1
+        elif isinstance(node, ast.BoolOp):
+            complexity += len(node.values) - 1
+        elif isinstance(node, ast.comprehension):
+            complexity += 1 + len(node.ifs)
+        elif isinstance(node, getattr(ast, "match_case", ())):
+            complexity += 1
+        stack.extend(ast.iter_child_nodes(node))
+    return complexity
+
+
+def _python_definitions(
+    tree: ast.Module,
+) -> Tuple[List[Tuple[ast.AST, str]], List[str]]:
+    """
+    Lists the functions (with qualified names) and classes of a module.
+    """
+    functions: List[Tuple[ast.AST, str]] = []
+    classes: List[str] = []
+
+    def visit(node: ast.AST, prefix: str) -> None:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                functions.append((child, prefix + child.name))
+                visit(child, f"{prefix}{child.name}.")
+            elif isinstance(child, ast.ClassDef):
+                classes.append(prefix + child.name)
+                visit(child, f"{prefix}{child.name}.")
+            else:
+                visit(child, prefix)
+
+    visit(tree, "")
+    functions.sort(key=lambda item: item[0].lineno)
+    return functions, classes
+
+
+def _python_lint(
+    path: str, tree: ast.Module, functions: List[FunctionInfo]
+) -> List[Tuple[int, str]]:
+    findings = []
+    if not path.endswith("__init__.py"):
+        used = {node.id for node in ast.walk(tree) if isinstance(node, ast.Name)}
+        for node in tree.body:
+            if isinstance(node, ast.ImportFrom) and node.module == "__future__":
+                continue
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    name = alias.asname or alias.name.split(".")[0]
+                    if name != "*" and name not in used:
+                        findings.append((node.lineno, f"unused import '{name}'"))
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ExceptHandler) and node.type is None:
+            findings.append((node.lineno, "bare 'except:'"))
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            defaults = node.args.defaults + [
+                default for default in node.args.kw_defaults if default is not None
+            ]
+            if any(isinstance(d, (ast.List, ast.Dict, ast.Set)) for d in defaults):
+                findings.append(
+                    (node.lineno, f"mutable default argument in '{node.name}'")
+                )
+        elif isinstance(node, ast.Compare):
+            for op, right in zip(node.ops, node.comparators):
+                if (
+                    isinstance(op, (ast.Eq, ast.NotEq))
+                    and isinstance(right, ast.Constant)
+                    and right.value is None
+                ):
+                    findings.append((node.lineno, "comparison to None with '=='"))
+
+    for function in functions:
+        if function.complexity > LINT_COMPLEXITY:
+            findings.append(
+                (
+                    function.line,
+                    f"'{function.name}' is too complex ({function.complexity})",
+                )
+            )
+    return sorted(findings)
+
+
+def _analyze_python(path: str, content: str) -> FileAnalysis:
+    tree = ast.parse(content)
+    definitions, classes = _python_definitions(tree)
+    functions = [
+        FunctionInfo(name, node.lineno, node.end_lineno, _python_complexity(node))
+        for node, name in definitions
+    ]
+    findings = _python_lint(path, tree, functions)[:MAX_FINDINGS]
+    lint_lines = [line for line, _ in findings]
+
+    replacements = []
+    elided_until = 0
+    for (node, _), function in zip(definitions, functions):
+        if function.line <= elided_until:
+            # Inside a body that is already left out
+            continue
+        body = node.body
+        if ast.get_docstring(node, clean=False) is not None:
+            body = body[1:]
+        if not body or body[0].lineno <= node.lineno:
+            continue
+        start, end = body[0].lineno, node.end_lineno
+        if _keep_body(function, lint_lines, end - start + 1):
+            continue
+        function.elided = True
+        elided_until = end
+        replacements.append(
+            (
+                start,
+                end,
+                f"{' ' * body[0].col_offset}...  # {end - start + 1} lines elided, "
+                f"complexity {function.complexity}",
+            )
+        )
+
+    lint = [f"line {line}: {message}" for line, message in findings]
+    compressed = content
+    if replacements or lint:
+        lines = _splice(content.split("\n"), replacements)
+        compressed = "\n".join(_header(functions, lint, "#") + lines)
+    return FileAnalysis(path, "python", compressed, functions, classes, lint)
+
+
+# Brace languages (JavaScript, TypeScript, Java, C++, C#, Go, PHP)
+
+_STRINGS_AND_COMMENTS = re.compile(
+    r"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`",
+    re.S,
+)
+_HASH_COMMENTS = re.compile(r"#[^\n]*")
+_CONTROL = {
+    "if",
+    "for",
+    "foreach",
+    "while",
+    "switch",
+    "catch",
+    "else",
+    "do",
+    "try",
+    "finally",
+    "synchronized",
+    "using",
+    "lock",
+    "with",
+    "return",
+    "select",
+    "defer",
+    "go",
+    "new",
+}
+_CLASS = re.compile(
+    r"\b(?:class|interface|struct|enum|namespace|trait|record)\s+([A-Za-z_$][\w$]*)"
+    r"|\btype\s+([A-Za-z_]\w*)\s+(?:struct|interface)\b"
+)
+_GO_FUNCTION = re.compile(r"\bfunc\s*(?:\([^()]*\)\s*)?([A-Za-z_]\w*)?\s*\(")
+_FUNCTION = re.compile(
+    r"\b([A-Za-z_$][\w$]*)\s*(?:<[^<>]*>)?\s*\((?:[^()]|\([^()]*\))*\)[^(){};=]*$",
+    re.S,
+)
+_ARROW = re.compile(
+    r"(?:\b([A-Za-z_$][\w$]*)\s*[:=]\s*)?(?:async\s*)?"
+    r"(?:\((?:[^()]|\([^()]*\))*\)|[A-Za-z_$][\w$]*)\s*(?::[^=]+)?=>\s*$",
+    re.S,
+)
+_DECISIONS = re.compile(
+    r"\b(?:if|for|foreach|while|case|catch|elseif)\b|&&|\|\||\?(?![?.:])"
+)
+
+
+def _mask(content: str, language: str) -> str:
+    """
+    Blanks out strings and comments (keeping newlines and offsets) so braces
+    and keywords inside them are not mistaken for code.
+    """
+
+    def blank(match: re.Match) -> str:
+        return re.sub(r"[^\n]", " ", match.group())
+
+    masked = _STRINGS_AND_COMMENTS.sub(blank, content)
+    if language == "php":
+        masked = _HASH_COMMENTS.sub(blank, masked)
+    return masked
+
+
+def _classify(header: str, language: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Tells what a block opened after `header` is.
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: ("function", name), ("class",
+        name) or (None, None) for control blocks and literals
+    """
+    header = header[-300:].strip()
+    if not header:
+        return None, None
+    first = re.match(r"[A-Za-z_]+", header.split("\n")[-1].strip())
+    if first and first.group() in _CONTROL - {"new", "return"}:
+        return None, None
+    match = _CLASS.search(header)
+    if match and not header.endswith(")") and "=>" not in header:
+        return "class", match.group(1) or match.group(2)
+    if header.endswith("=>"):
+        match = _ARROW.search(header)
+        return "function", (match.group(1) if match else None) or "(anonymous)"
+    if language == "go":
+        match = _GO_FUNCTION.search(header)
+        if match:
+            return "function", match.group(1) or "(anonymous)"
+        return None, None
+    match = _FUNCTION.search(header)
+    if match:
+        name = match.group(1)
+        if name in _CONTROL:
+            return None, None
+        if name == "function":
+            return "function", "(anonymous)"
+        return "function", name
+    return None, None
+
+
+def _blocks(masked: str) -> List[Tuple[int, int, str]]:
+    """
+    Finds every {...} block as (open offset, close offset, header), where
+    the header is the code between the previous statement and the brace.
+    """
+    blocks = []
+    stack: List[Tuple[int, int]] = []
+    header_start = 0
+    for offset, char in enumerate(masked):
+        if char == "{":
+            stack.append((offset, header_start))
+            header_start = offset + 1
+        elif char == "}":
+            if stack:
+                start, header = stack.pop()
+                blocks.append((start, offset, masked[header:start]))
+            header_start = offset + 1
+        elif char == ";":
+            header_start = offset + 1
+    return sorted(blocks)
+
+
+def _brace_lint(
+    content: str, masked: str, language: str, functions: List[FunctionInfo]
+) -> List[Tuple[int, str]]:
+    def line_of(offset: int) -> int:
+        return masked.count("\n", 0, offset) + 1
+
+    findings = []
+    for match in re.finditer(r"\bcatch\s*(?:\([^()]*\))?\s*\{\s*\}", masked):
+        findings.append((line_of(match.start()), "empty catch block"))
+    if language in ("javascript", "typescript"):
+        for match in re.finditer(r"\bconsole\.(?:log|debug)\s*\(", masked):
+            findings.append((line_of(match.start()), "leftover console output"))
+        for match in re.finditer(r"(?<![=!<>])[=!]=(?!=)", masked):
+            findings.append((line_of(match.start()), "loose equality, use === / !=="))
+        for match in re.finditer(r"\bvar\s", masked):
+            findings.append((line_of(match.start()), "'var' declaration"))
+    for match in re.finditer(r"\b(?:TODO|FIXME)\b", content):
+        findings.append((line_of(match.start()), "TODO left in code"))
+    for function in functions:
+        if function.complexity > LINT_COMPLEXITY:
+            findings.append(
+                (
+                    function.line,
+                    f"'{function.name}' is too complex ({function.complexity})",
+                )
+            )
+    return sorted(set(findings))
+
+
+def _analyze_braces(path: str, content: str, language: str) -> FileAnalysis:
+    masked = _mask(content, language)
+    if masked.count("{") != masked.count("}"):
+        raise ValueError("unbalanced braces")
+
+    def line_of(offset: int) -> int:
+        return masked.count("\n", 0, offset) + 1
+
+    functions: List[FunctionInfo] = []
+    classes: List[str] = []
+    bodies: List[Tuple[int, int, FunctionInfo]] = []
+    for start, end, header in _blocks(masked):
+        kind, name = _classify(header, language)
+        if kind == "class":
+            classes.append(name)
+        elif kind == "function":
+            decisions = len(_DECISIONS.findall(masked, start, end))
+            function = FunctionInfo(name, line_of(start), line_of(end), decisions)
+            functions.append(function)
+            bodies.append((start, end, function))
+
+    # Decisions of nested functions count for them, not for their parent
+    decisions = [function.complexity for _, _, function in bodies]
+    for index, (start, end, function) in enumerate(bodies):
+        own = decisions[index]
+        enclosed_until = start
+        for inner, (inner_start, inner_end, _) in enumerate(bodies[index + 1 :]):
+            if inner_start > end:
+                break
+            if inner_start > enclosed_until:
+                # A direct child; its own children are inside its total
+                own -= decisions[index + 1 + inner]
+                enclosed_until = inner_end
+        function.complexity = 1 + own
+
+    findings = _brace_lint(content, masked, language, functions)[:MAX_FINDINGS]
+    lint_lines = [line for line, _ in findings]
+
+    lines = content.split("\n")
+    replacements = []
+    elided_until = 0
+    for start, end, function in bodies:
+        open_line, close_line = line_of(start), line_of(end)
+        if open_line <= elided_until:
+            continue
+        first, last = open_line + 1, close_line - 1
+        if last < first or _keep_body(function, lint_lines, last - first + 1):
+            continue
+        function.elided = True
+        elided_until = close_line
+        indent = re.match(r"\s*", lines[first - 1]).group()
+        replacements.append(
+            (
+                first,
+                last,
+                f"{indent}// ... {last - first + 1} lines elided, "
+                f"complexity {function.complexity}",
+            )
+        )
+
+    lint = [f"line {line}: {message}" for line, message in findings]
+    compressed = content
+    if replacements or lint:
+        compressed = "\n".join(
+            _header(functions, lint, "//") + _splice(lines, replacements)
+        )
+    return FileAnalysis(path, language, compressed, functions, classes, lint)
+
+
+class PreAnalyzer:
+    """
+    Local static analysis run between fetching a repository and prompting
+    the model.
+
+    Every file in a supported language that fits in the review's token
+    budget is parsed, its functions measured and linted, and the bodies of
+    simple functions elided, so the model reads skeletons plus the code
+    worth its attention. Files are analyzed in a process pool, since
+    parsing is CPU-bound; small reviews use a thread instead.
+
+    Args:
+        enabled (bool): When False, files pass through unchanged.
+        workers (int): Worker processes; 0 always analyzes in a thread.
+        pool_min_files (int): Fewest files analyzed in the process pool.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        workers: int = WORKERS,
+        pool_min_files: int = POOL_MIN_FILES,
+    ):
+        self.enabled = enabled
+        self.workers = workers
+        self.pool_min_files = pool_min_files
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # ast.parse is not safe to run in several threads at once (it can fail
+        # with "AST constructor recursion depth mismatch"), and the GIL would
+        # serialize the parsing anyway
+        self._thread_lock = threading.Lock()
+        self.files = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    @classmethod
+    def from_env(cls) -> "PreAnalyzer":
+        """
+        Builds an analyzer from PREANALYSIS, PREANALYSIS_WORKERS and
+        PREANALYSIS_POOL_MIN_FILES.
+        """
+        return cls(enabled=PREANALYSIS, workers=WORKERS, pool_min_files=POOL_MIN_FILES)
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Forking a process that runs an event loop and threads is unsafe
+            self._pool = ProcessPoolExecutor(
+                self.workers, mp_context=get_context("spawn")
+            )
+        return self._pool
+
+    def _analyze_in_thread(self, items: List[Tuple[str, str]]) -> List[FileAnalysis]:
+        with self._thread_lock:
+            return analyze_sources(items)
+
+    async def _analyze(self, items: List[Tuple[str, str]]) -> List[FileAnalysis]:
+        if not (self.workers and len(items) >= self.pool_min_files):
+            return await asyncio.to_thread(self._analyze_in_thread, items)
+        loop = asyncio.get_running_loop()
+        size = -(-len(items) // (self.workers * 4))
+        chunks = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    self._get_pool(), analyze_sources, items[start : start + size]
+                )
+                for start in range(0, len(items), size)
+            )
+        )
+        return [analysis for chunk in chunks for analysis in chunk]
+
+    async def run(
+        self, files: List[Dict], max_total_tokens: Optional[int] = None
+    ) -> Tuple[List[Dict], Optional[Dict]]:
+        """
+        Replaces the content of every analyzable file by its compressed
+        representation.
+
+        Files are taken in the path order plan_batches packs them in, a
+        window at a time, and only until their compressed contents fill the
+        review's token budget: the files past it are skipped by the packing
+        anyway, so their contents are never decoded. Files that are left
+        unchanged are returned as they were passed in.
+
+        Args:
+            files (List[Dict]): Files with path and content.
+            max_total_tokens (int, optional): Budget across all batches
+                (default: MAX_TOTAL_TOKENS).
+
+        Returns:
+            Tuple[List[Dict], Optional[Dict]]: The files to review, and a
+            report with the files analyzed, the contents tokens before and
+            after, the elided function bodies and the lint findings per path
+            (None when the stage is disabled).
+        """
+        if not self.enabled:
+            return files, None
+
+        started = time.perf_counter()
+        max_total_tokens = max_total_tokens or chunking.MAX_TOTAL_TOKENS
+        file_tokens = min(chunking.FILE_TOKENS, chunking.BATCH_TOKENS)
+        window = max(self.pool_min_files, self.workers * 4, 1)
+        order = sorted(range(len(files)), key=lambda index: files[index]["path"])
+        files = list(files)
+        report = {
+            "files": 0,
+            "tokens_before": 0,
+            "tokens_after": 0,
+            "elided_functions": 0,
+            "lint": {},
+        }
+        # Mirrors the budget accounting of plan_batches
+        spent = position = 0
+        while spent < max_total_tokens and position < len(order):
+            indices, targets = [], []
+            while position < len(order) and len(targets) < window:
+                index = order[position]
+                indices.append(index)
+                if language_of(files[index]["path"]):
+                    targets.append(index)
+                position += 1
+            items = [
+                (files[index]["path"], files[index]["content"]) for index in targets
+            ]
+            analyses = dict(zip(targets, await self._analyze(items)))
+            del items
+
+            for index in indices:
+                analysis = analyses.get(index)
+                if analysis is None:
+                    tokens = count_tokens(files[index]["content"])
+                else:
+                    tokens = analysis.tokens_after
+                    # analyze_source keeps the original whenever the summary
+                    # saves nothing, so fewer tokens means a new content
+                    if analysis.tokens_after < analysis.tokens_before:
+                        file = files[index]
+                        files[index] = {
+                            "path": file["path"],
+                            "size": file.get("size"),
+                            "sha": file.get("sha"),
+                            "content": analysis.content,
+                        }
+                    report["files"] += 1
+                    report["tokens_before"] += analysis.tokens_before
+                    report["tokens_after"] += analysis.tokens_after
+                    report["elided_functions"] += analysis.elided
+                    if analysis.lint:
+                        report["lint"][analysis.path] = analysis.lint
+                tokens = min(tokens, file_tokens)
+                if spent + tokens <= max_total_tokens:
+                    spent += tokens
+
+        self.files += report["files"]
+        self.tokens_before += report["tokens_before"]
+        self.tokens_after += report["tokens_after"]
+        metrics.preanalysis_seconds.observe(time.perf_counter() - started)
+        metrics.preanalysis_tokens.inc(report["tokens_before"], stage="before")
+        metrics.preanalysis_tokens.inc(report["tokens_after"], stage="after")
+        return files, report
+
+    def close(self) -> None:
+        """
+        Stops the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "workers": self.workers,
+            "files": self.files,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+        }
+
+
+# Shared by every review in the process, like the completion hedgers
+pre_analyzer = PreAnalyzer.from_env()
@@ -0,0 +1,379 @@
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Only idempotent requests are retried or revalidated
+SAFE_METHODS = ("GET", "HEAD")
+# Host of the REST API, whose requests count against a token's quota; raw
+# downloads and other hosts are neither charged nor paced
+GITHUB_API_HOST = "api.github.com"
+# Hop-by-hop and encoding headers that no longer apply to a re-served body
+_STALE_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+def parse_retry_after(value: Optional[str], now: float) -> Optional[float]:
+    """
+    Parses a Retry-After header, given either as delay seconds or as an
+    HTTP-date, to the seconds left to wait.
+
+    Args:
+        value (str, optional): The header value.
+        now (float): Current epoch seconds, for HTTP-dates.
+
+    Returns:
+        Optional[float]: Seconds to wait, 0 for a date in the past; None for
+        a missing or malformed header.
+    """
+    if value is None:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        delay = date.timestamp() - now
+    return max(delay, 0.0) if math.isfinite(delay) else None
+
+
+@dataclass
+class Quota:
+    """
+    Primary rate-limit state of one credential, as last reported by GitHub.
+
+    Attributes:
+        limit (int, optional): Requests allowed per window.
+        remaining (int, optional): Requests left, minus those sent since.
+        reset (float): Epoch seconds at which the window resets.
+    """
+
+    limit: Optional[int] = None
+    remaining: Optional[int] = None
+    reset: float = 0.0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+
+class GitHubRateLimiter:
+    """
+    Central scheduler for GitHub requests.
+
+    Tracks the remaining quota of every token from the X-RateLimit-* headers.
+    Once a token's quota drops to the reserve, its requests are queued and
+    spread evenly until the reset; an exhausted token waits for the reset.
+    Rate-limited responses (Retry-After, an exhausted quota, or a secondary
+    rate limit) are retried with jittered exponential backoff. JSON API
+    responses carrying an ETag are remembered, so repeated requests are
+    revalidated with If-None-Match and a 304, which GitHub does not count
+    against the quota, is served from memory.
+
+    Args:
+        reserve (int): Remaining quota below which requests are paced.
+        max_wait (float): Longest single wait; beyond it the rate-limited
+            response is returned to the caller instead.
+        max_retries (int): Retries of a rate-limited request.
+        backoff_base (float): First backoff delay when GitHub gives no hint.
+        etag_cache_bytes (int): Total size of the bodies remembered for
+            revalidation; the least recently used ones are dropped beyond it.
+        etag_max_bytes (int): Larger bodies are not remembered.
+        clock (Callable[[], float]): Epoch time source, for tests.
+        sleep (Callable[[float], Awaitable]): Sleep function, for tests.
+        rng (random.Random, optional): Jitter source, for tests.
+    """
+
+    def __init__(
+        self,
+        reserve: int = 100,
+        max_wait: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 5.0,
+        etag_cache_bytes: int = 8 * 1024 * 1024,
+        etag_max_bytes: int = 256 * 1024,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], Awaitable] = asyncio.sleep,
+        rng: Optional[random.Random] = None,
+    ):
+        self.reserve = reserve
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.etag_cache_bytes = etag_cache_bytes
+        self.etag_max_bytes = min(etag_max_bytes, etag_cache_bytes)
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.quotas: Dict[str, Quota] = {}
+        self.waits = 0
+        self.waited = 0.0
+        self.retries = 0
+        self.revalidated = 0
+        self._etags: "OrderedDict[Tuple[str, str], Tuple[str, int, list, bytes]]" = (
+            OrderedDict()
+        )
+        self._etag_bytes = 0
+
+    @classmethod
+    def from_env(cls) -> "GitHubRateLimiter":
+        """
+        Builds a limiter from the GITHUB_RATE_LIMIT_* environment variables.
+        """
+        return cls(
+            reserve=int(os.getenv("GITHUB_RATE_LIMIT_RESERVE", "100")),
+            max_wait=float(os.getenv("GITHUB_RATE_LIMIT_MAX_WAIT", "60")),
+            max_retries=int(os.getenv("GITHUB_RATE_LIMIT_RETRIES", "3")),
+            backoff_base=float(os.getenv("GITHUB_RATE_LIMIT_BACKOFF", "5")),
+            etag_cache_bytes=int(
+                os.getenv("GITHUB_ETAG_CACHE_BYTES", str(8 * 1024 * 1024))
+            ),
+        )
+
+    @staticmethod
+    def credential(request: httpx.Request) -> str:
+        """
+        Identifies the token of a request without keeping the token itself.
+        """
+        authorization = request.headers.get("Authorization", "")
+        return hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:12]
+
+    async def acquire(self, key: str) -> None:
+        """
+        Waits until a request may be sent with the given credential and
+        reserves one unit of its quota.
+        """
+        quota = self.quotas.setdefault(key, Quota())
+        async with quota.lock:
+            now = self.clock()
+            if quota.remaining is not None and now >= quota.reset:
+                quota.remaining = quota.limit
+            delay = 0.0
+            if quota.remaining is not None:
+                if quota.remaining <= 0:
+                    delay = quota.reset - now
+                elif quota.remaining <= self.reserve:
+                    # Spread what is left evenly over the rest of the window
+                    delay = (quota.reset - now) / quota.remaining
+            if 0 < delay <= self.max_wait:
+                # The lock is held, so later requests queue up behind this one
+                await self.wait(delay)
+            if quota.remaining is not None:
+                quota.remaining -= 1
+
+    def observe(self, key: str, response: httpx.Response) -> None:
+        """
+        Updates the credential's quota from a response's rate-limit headers.
+        """
+        headers = response.headers
+        if "x-ratelimit-remaining" not in headers:
+            return
+        quota = self.quotas.setdefault(key, Quota())
+        remaining = int(headers["x-ratelimit-remaining"])
+        reset = float(headers.get("x-ratelimit-reset", quota.reset))
+        if "x-ratelimit-limit" in headers:
+            quota.limit = int(headers["x-ratelimit-limit"])
+        # GitHub's count is authoritative: it corrects the local estimate in
+        # both directions, e.g. after requests that were charged but failed
+        quota.reset = reset
+        quota.remaining = remaining
+
+    async def retry_delay(
+        self, response: httpx.Response, attempt: int
+    ) -> Optional[float]:
+        """
+        Returns how long to wait before retrying a rate-limited response, or
+        None if the response is final.
+        """
+        if response.status_code not in (403, 429):
+            return None
+        headers = response.headers
+        retry_after = parse_retry_after(headers.get("retry-after"), self.clock())
+        if retry_after is not None:
+            delay = retry_after
+        elif headers.get("x-ratelimit-remaining") == "0":
+            delay = float(headers.get("x-ratelimit-reset", 0)) - self.clock()
+        elif (
+            response.status_code == 429
+            or "retry-after" in headers
+            or await self._is_secondary_limit(response)
+        ):
+            # A Retry-After that cannot be parsed still marks a rate limit
+            delay = self.backoff_base * 2**attempt
+        else:
+            return None  # A genuine permission error
+        # Jitter keeps concurrent retries from firing at the same instant
+        return max(delay, 0.0) * self.rng.uniform(1.0, 1.25)
+
+    @staticmethod
+    async def _is_secondary_limit(response: httpx.Response) -> bool:
+        body = await response.aread()
+        return b"secondary rate limit" in body.lower()
+
+    async def wait(self, delay: float) -> None:
+        self.waits += 1
+        self.waited += delay
+        await self.sleep(delay)
+
+    def conditional_headers(self, key: str, request: httpx.Request) -> Dict:
+        entry = self._etags.get((key, str(request.url)))
+        return {"If-None-Match": entry[0]} if entry else {}
+
+    def cacheable(self, request: httpx.Request, response: httpx.Response) -> bool:
+        """
+        Tells whether a response is worth remembering for revalidation: a 200
+        JSON answer of the REST API with an ETag and a small declared size.
+        Raw downloads, archives and diffs are left to stream.
+        """
+        content_type = response.headers.get("content-type", "").split(";")[0]
+        size = response.headers.get("content-length")
+        return (
+            request.url.host == GITHUB_API_HOST
+            and response.status_code == 200
+            and "etag" in response.headers
+            and (content_type == "application/json" or content_type.endswith("+json"))
+            and size is not None
+            and int(size) <= self.etag_max_bytes
+        )
+
+    def remember(self, key: str, request: httpx.Request, response: httpx.Response):
+        """
+        Keeps a read 200 response with an ETag for later revalidation.
+        """
+        etag = response.headers.get("etag")
+        if etag is None or len(response.content) > self.etag_max_bytes:
+            return
+        cache_key = (key, str(request.url))
+        self._forget(cache_key)
+        self._etags[cache_key] = (
+            etag,
+            response.status_code,
+            _fresh_headers(response.headers),
+            response.content,
+        )
+        self._etag_bytes += len(response.content)
+        while self._etag_bytes > self.etag_cache_bytes:
+            self._forget(next(iter(self._etags)))
+
+    def _forget(self, cache_key: Tuple[str, str]) -> None:
+        entry = self._etags.pop(cache_key, None)
+        if entry is not None:
+            self._etag_bytes -= len(entry[3])
+
+    def revalidated_response(
+        self, key: str, request: httpx.Request, not_modified: httpx.Response
+    ) -> Optional[httpx.Response]:
+        """
+        Rebuilds the remembered response for a 304 answer.
+        """
+        entry = self._etags.get((key, str(request.url)))
+        if entry is None:
+            return None
+        self._etags.move_to_end((key, str(request.url)))
+        self.revalidated += 1
+        _, status_code, headers, content = entry
+        return httpx.Response(
+            status_code,
+            headers=headers,
+            content=content,
+            request=request,
+            extensions=not_modified.extensions,
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "credentials": {
+                key: {
+                    "limit": quota.limit,
+                    "remaining": quota.remaining,
+                    "reset": quota.reset,
+                }
+                for key, quota in self.quotas.items()
+            },
+            "waits": self.waits,
+            "waited_seconds": round(self.waited, 3),
+            "retries": self.retries,
+            "revalidated": self.revalidated,
+            "etag_entries": len(self._etags),
+            "etag_bytes": self._etag_bytes,
+        }
+
+
+def _fresh_headers(headers: httpx.Headers) -> list:
+    return [
+        (name, value)
+        for name, value in headers.items()
+        if name.lower() not in _STALE_HEADERS
+    ]
+
+
+class RateLimitedTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that routes every request through a GitHubRateLimiter;
+    only REST API requests are charged to their token's quota.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: GitHubRateLimiter):
+        self._transport = transport
+        self.limiter = limiter
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = self.limiter
+        key = limiter.credential(request)
+        safe = request.method in SAFE_METHODS
+        metered = request.url.host == GITHUB_API_HOST
+        if safe:
+            request.headers.update(limiter.conditional_headers(key, request))
+
+        attempt = 0
+        while True:
+            if metered:
+                await limiter.acquire(key)
+            response = await self._transport.handle_async_request(request)
+            if metered:
+                limiter.observe(key, response)
+            delay = await limiter.retry_delay(response, attempt) if safe else None
+            if delay is None or attempt >= limiter.max_retries:
+                break
+            if delay > limiter.max_wait:
+                logger.warning("GitHub rate limited for %.0fs, giving up", delay)
+                break
+            await response.aclose()
+            limiter.retries += 1
+            attempt += 1
+            await limiter.wait(delay)
+
+        if not safe:
+            return response
+        if response.status_code == 304:
+            revalidated = limiter.revalidated_response(key, request, response)
+            if revalidated is not None:
+                await response.aclose()
+                return revalidated
+        if limiter.cacheable(request, response):
+            content = await response.aread()
+            fresh = httpx.Response(
+                200,
+                headers=_fresh_headers(response.headers),
+                content=content,
+                request=request,
+                extensions=response.extensions,
+            )
+            limiter.remember(key, request, fresh)
+            return fresh
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,354 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+import httpx
+
+from app.exceptions import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Fails calls to a dependency fast once it is erroring or too slow.
+
+    Outcomes of the calls made within the last `window` seconds are kept.
+    Once at least `min_requests` were made and the share of failed or of
+    slow calls reaches its threshold, the circuit opens: calls raise
+    CircuitOpenError without being sent. After `open_seconds` a single probe
+    is let through; it closes the circuit if it succeeds in time and opens it
+    again otherwise.
+
+    Args:
+        name (str): Dependency name used in errors and stats.
+        error_rate (float): Share of failed calls that opens the circuit.
+        slow_rate (float): Share of slow calls that opens the circuit.
+        slow_seconds (float): Calls taking at least this long count as slow.
+        min_requests (int): Calls in the window needed before it can open.
+        window (float): Seconds of history the rates are computed over.
+        open_seconds (float): Seconds the circuit stays open before a probe.
+        clock (Callable[[], float]): Monotonic time source, for tests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        error_rate: float = 0.5,
+        slow_rate: float = 0.5,
+        slow_seconds: float = 30.0,
+        min_requests: int = 10,
+        window: float = 60.0,
+        open_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probing = False
+        # (finished at, failed, slow) per call
+        self._outcomes: Deque[Tuple[float, bool, bool]] = deque()
+
+    @classmethod
+    def from_env(cls, name: str, slow_seconds: float) -> "CircuitBreaker":
+        """
+        Builds a breaker from {NAME}_CIRCUIT_* variables, falling back to the
+        shared CIRCUIT_* ones.
+
+        Args:
+            name (str): Dependency name, e.g. "github"; also the variable prefix.
+            slow_seconds (float): Default latency threshold for the dependency.
+        """
+
+        def setting(key: str, default: str) -> float:
+            return float(
+                os.getenv(f"{name.upper()}_CIRCUIT_{key}")
+                or os.getenv(f"CIRCUIT_{key}", default)
+            )
+
+        return cls(
+            name,
+            error_rate=setting("ERROR_RATE", "0.5"),
+            slow_rate=setting("SLOW_RATE", "0.5"),
+            slow_seconds=setting("SLOW_SECONDS", str(slow_seconds)),
+            min_requests=int(setting("MIN_REQUESTS", "10")),
+            window=setting("WINDOW", "60"),
+            open_seconds=setting("OPEN_SECONDS", "30"),
+        )
+
+    def before(self) -> None:
+        """
+        Admits a call or raises CircuitOpenError.
+        """
+        if self.state == CLOSED:
+            return
+        now = self.clock()
+        if self.state == OPEN and now >= self.opened_at + self.open_seconds:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(
+            self.name, max(self.opened_at + self.open_seconds - now, 0.0)
+        )
+
+    def record(self, elapsed: float, failed: bool) -> None:
+        """
+        Records the outcome of an admitted call.
+
+        Args:
+            elapsed (float): Seconds the call took.
+            failed (bool): Whether the dependency failed to answer properly.
+        """
+        now = self.clock()
+        slow = elapsed >= self.slow_seconds
+        if self.state == HALF_OPEN:
+            self._probing = False
+            if failed or slow:
+                self._open(now)
+            else:
+                logger.info("Circuit for %s closed", self.name)
+                self.state = CLOSED
+                self._outcomes.clear()
+            return
+
+        self._outcomes.append((now, failed, slow))
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._outcomes.popleft()
+        calls = len(self._outcomes)
+        if calls < self.min_requests:
+            return
+        failures = sum(1 for _, failed, _ in self._outcomes if failed)
+        slow_calls = sum(1 for _, _, slow in self._outcomes if slow)
+        if failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate:
+            self._open(now)
+
+    def release(self) -> None:
+        """
+        Forgets an admitted call that was cancelled before it finished.
+        """
+        self._probing = False
+
+    def _open(self, now: float) -> None:
+        logger.warning("Circuit for %s opened for %.0fs", self.name, self.open_seconds)
+        self.state = OPEN
+        self.opened_at = now
+        self.trips += 1
+        self._outcomes.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "window_requests": len(self._outcomes),
+            "window_failures": sum(1 for _, failed, _ in self._outcomes if failed),
+            "window_slow": sum(1 for _, _, slow in self._outcomes if slow),
+        }
+
+
+class CircuitBreakerTransport(httpx.AsyncBaseTransport):
+    """
+    Transport wrapper that guards every request with a CircuitBreaker.
+
+    Connection errors, timeouts and 5xx responses count as failures; the
+    latency is measured up to the response headers.
+    """
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, breaker: CircuitBreaker):
+        self._transport = transport
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        breaker = self.breaker
+        breaker.before()
+        started = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception:
+            breaker.record(time.monotonic() - started, failed=True)
+            raise
+        breaker.record(time.monotonic() - started, failed=response.status_code >= 500)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+class Hedger:
+    """
+    Sends a backup request when the first one is slower than usual.
+
+    Once the first attempt has run for the hedge delay (the `quantile` of
+    recent latencies, or `initial_delay` until `min_samples` were seen), a
+    second attempt is started and whichever finishes first wins; the other
+    is cancelled. An attempt that fails with a retryable error before that
+    starts the backup at once.
+
+    Args:
+        enabled (bool): Without it, calls are only timed.
+        quantile (float): Latency quantile used as hedge delay.
+        min_samples (int): Latencies needed before the quantile is trusted.
+        initial_delay (float): Hedge delay until then.
+        min_delay (float): Lower bound of the hedge delay.
+        samples (int): Recent latencies kept.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        quantile: float = 0.95,
+        min_samples: int = 20,
+        initial_delay: float = 30.0,
+        min_delay: float = 1.0,
+        samples: int = 200,
+    ):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.latencies: Deque[float] = deque(maxlen=samples)
+        self.calls = 0
+        self.hedged = 0
+        self.retried = 0
+        self.backup_wins = 0
+
+    @classmethod
+    def from_env(cls) -> "Hedger":
+        """
+        Builds a hedger from the LLM_HEDGE* environment variables.
+        """
+        return cls(
+            enabled=os.getenv("LLM_HEDGE", "false").lower() == "true",
+            quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+            initial_delay=float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "30")),
+            min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")),
+        )
+
+    def delay(self) -> float:
+        if len(self.latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self.latencies)
+        index = min(math.ceil(self.quantile * len(ordered)) - 1, len(ordered) - 1)
+        return max(ordered[max(index, 0)], self.min_delay)
+
+    async def run(
+        self,
+        attempt: Callable[[], Awaitable[T]],
+        retryable: Callable[[Exception], bool] = lambda error: False,
+    ) -> T:
+        """
+        Runs `attempt`, hedging or retrying it once when enabled.
+
+        Args:
+            attempt (Callable[[], Awaitable[T]]): Starts one request.
+            retryable (Callable[[Exception], bool]): Whether a failed attempt
+                may be retried with the backup.
+
+        Returns:
+            T: Result of the first attempt to succeed.
+
+        Raises:
+            Exception: The error of the last attempt if none succeeded.
+        """
+        self.calls += 1
+
+        async def timed() -> T:
+            started = time.monotonic()
+            result = await attempt()
+            self.latencies.append(time.monotonic() - started)
+            return result
+
+        if not self.enabled:
+            return await timed()
+
+        first = asyncio.ensure_future(timed())
+        pending = {first}
+        hedge_at = time.monotonic() + self.delay()
+        backup: Optional[asyncio.Future] = None
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = None
+                if backup is None:
+                    timeout = max(hedge_at - time.monotonic(), 0.0)
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    error = task.exception()
+                    if error is None:
+                        if task is backup:
+                            self.backup_wins += 1
+                        return task.result()
+                    if not isinstance(error, Exception) or not retryable(error):
+                        raise error
+                if backup is None:
+                    if done:
+                        self.retried += 1
+                    else:
+                        self.hedged += 1
+                    backup = asyncio.ensure_future(timed())
+                    pending.add(backup)
+            raise error
+        finally:
+            for task in (first, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "delay_seconds": round(self.delay(), 3),
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "retried": self.retried,
+            "backup_wins": self.backup_wins,
+        }
+
+
+class HedgerPool:
+    """
+    One Hedger per kind of request, each with its own latency window, so the
+    hedge delay of slow requests is not taken from the latencies of fast ones.
+
+    Args:
+        factory (Callable[[], Hedger]): Builds the hedger of a new key.
+    """
+
+    def __init__(self, factory: Callable[[], Hedger] = Hedger):
+        self.factory = factory
+        self.hedgers: Dict[str, Hedger] = {}
+
+    def get(self, key: str) -> Hedger:
+        hedger = self.hedgers.get(key)
+        if hedger is None:
+            hedger = self.hedgers[key] = self.factory()
+        return hedger
+
+    def stats(self) -> Dict:
+        return {key: hedger.stats() for key, hedger in sorted(self.hedgers.items())}
@@ -1,27 +1,102 @@
-from typing import Dict
+from typing import Dict, Optional
 
+import httpx
+from openai import AsyncOpenAI
+
+from app import metrics
+from app.cache import ReviewResultCache, SnapshotCache
+from app.diffs import group_hunks
+from app.events import ProgressCallback, emit
 from app.exceptions import ReviewServiceError
-from app.github import fetch_repository_files
-from app.gpt import analyze_code
+from app.files import ContentStore
+from app.fingerprints import FingerprintIndex, check_duplicates
+from app.github import (
+    SUPPORTED_EXTENSIONS,
+    fetch_pull_request,
+    fetch_repository_files,
+    github_headers,
+    parse_pull_url,
+)
+from app.gpt import analyze_code, analyze_diff
+from app.incremental import FragmentStore, review_incrementally
+from app.selection import FileSelector
 
 
 async def perform_code_review(
-    request: dict, github_token: str, openai_key: str
+    request: dict,
+    github_token: str,
+    openai_key: str,
+    http_client: Optional[httpx.AsyncClient] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
+    snapshot_cache: Optional[SnapshotCache] = None,
+    result_cache: Optional[ReviewResultCache] = None,
+    progress: Optional[ProgressCallback] = None,
+    fragment_store: Optional[FragmentStore] = None,
+    fingerprint_index: Optional[FingerprintIndex] = None,
 ) -> Dict:
     """
     Main service for performing the code review.
 
     Args:
         request (dict): Contains 'github_repo_url', 'assignment_description', and 'candidate_level'
+            and optionally 'fetch_strategy'
         github_token (str): GitHub authentication token
         openai_key (str): OpenAI API key
+        http_client (httpx.AsyncClient, optional): Pooled client for GitHub calls
+        openai_client (AsyncOpenAI, optional): Pooled client for OpenAI calls
+        snapshot_cache (SnapshotCache, optional): Cache of fetched repository files
+        result_cache (ReviewResultCache, optional): Memo of completed analyses
+        progress (ProgressCallback, optional): Receives progress events from the
+            GitHub crawl and the model calls
+        fragment_store (FragmentStore, optional): Per-file fragments of earlier
+            reviews; when given, only files changed since the last review of
+            the repository are fetched and reviewed again
+        fingerprint_index (FingerprintIndex, optional): Index of files fetched
+            for earlier reviews, used to flag files copied between repositories
 
     Returns:
-        Dict: Review results containing analysis and recommendations
+        Dict: Review results containing analysis and recommendations, plus a
+            "selection" report of the files skipped before download and why,
+            a "duplicates" report of files shared with other repositories
+            and a "delta" block (None for full reviews, see
+            review_incrementally)
 
     Raises:
         ReviewServiceError: If required fields are missing or service errors occur
     """
+    with metrics.review_seconds.time():
+        try:
+            return await _perform_code_review(
+                request,
+                github_token,
+                openai_key,
+                http_client,
+                openai_client,
+                snapshot_cache,
+                result_cache,
+                progress,
+                fragment_store,
+                fingerprint_index,
+            )
+        except ReviewServiceError as e:
+            metrics.review_errors.inc(category=e.category)
+            raise
+
+
+async def _perform_code_review(
+    request: dict,
+    github_token: str,
+    openai_key: str,
+    http_client: Optional[httpx.AsyncClient],
+    openai_client: Optional[AsyncOpenAI],
+    snapshot_cache: Optional[SnapshotCache],
+    result_cache: Optional[ReviewResultCache],
+    progress: Optional[ProgressCallback],
+    fragment_store: Optional[FragmentStore],
+    fingerprint_index: Optional[FingerprintIndex],
+) -> Dict:
+    # File bodies live until the review is over
+    store = ContentStore()
     try:
         # Validate required fields
         required_fields = [
@@ -31,14 +106,50 @@ async def perform_code_review(
         ]
         for field in required_fields:
             if not request.get(field):
-                raise ReviewServiceError(f"Missing required field: {field}")
+                raise ReviewServiceError(
+                    f"Missing required field: {field}", category="validation"
+                )
+
+        selector = FileSelector(extensions=SUPPORTED_EXTENSIONS)
+        if fragment_store is not None:
+            review_result = await review_incrementally(
+                request,
+                github_token,
+                openai_key,
+                fragment_store,
+                http_client=http_client,
+                openai_client=openai_client,
+                snapshot_cache=snapshot_cache,
+                result_cache=result_cache,
+                progress=progress,
+                selector=selector,
+                fingerprint_index=fingerprint_index,
+                content_store=store,
+            )
+            return {
+                "status": "success",
+                **review_result,
+                "selection": selector.report.as_dict(),
+            }
 
         # Fetch the contents of the GitHub repository
         repo_contents = await fetch_repository_files(
-            request["github_repo_url"], github_token
+            request["github_repo_url"],
+            github_token,
+            strategy=request.get("fetch_strategy"),
+            client=http_client,
+            cache=snapshot_cache,
+            progress=progress,
+            selector=selector,
+            store=store,
         )
         if not repo_contents:
-            raise ReviewServiceError("No files found in repository")
+            raise ReviewServiceError(
+                "No files found in repository", category="empty_repository"
+            )
+        _, duplicates = await check_duplicates(
+            fingerprint_index, request["github_repo_url"], repo_contents
+        )
 
         # Call OpenAI GPT for an analysis based on the repository and description
         review_result = await analyze_code(
@@ -46,11 +157,170 @@ async def perform_code_review(
             description=request["assignment_description"],
             level=request["candidate_level"],
             api_key=openai_key,
+            client=openai_client,
+            result_cache=result_cache,
+            progress=progress,
         )
 
-        return {"status": "success", **review_result}
+        return {
+            "status": "success",
+            **review_result,
+            "delta": None,
+            "duplicates": duplicates,
+            "selection": selector.report.as_dict(),
+        }
 
     except ReviewServiceError as e:
         raise e
     except Exception as e:
-        raise ReviewServiceError(f"Error performing code review: {str(e)}")
+        raise ReviewServiceError(
+            f"Error performing code review: {str(e)}", category="internal"
+        )
+    finally:
+        store.close()
+
+
+async def perform_pull_review(
+    request: dict,
+    github_token: str,
+    openai_key: str,
+    http_client: Optional[httpx.AsyncClient] = None,
+    openai_client: Optional[AsyncOpenAI] = None,
+    result_cache: Optional[ReviewResultCache] = None,
+    progress: Optional[ProgressCallback] = None,
+) -> Dict:
+    """
+    Reviews only the changes of a pull request.
+
+    The diff is fetched without the unchanged code, its hunks are grouped
+    with their neighbours and the groups are reviewed concurrently, so the
+    cost of a review follows the size of the diff.
+
+    Args:
+        request (dict): Contains 'pull_request_url', 'assignment_description'
+            and 'candidate_level', and optionally 'diff_source'
+        github_token (str): GitHub authentication token
+        openai_key (str): OpenAI API key
+        http_client (httpx.AsyncClient, optional): Pooled client for GitHub calls
+        openai_client (AsyncOpenAI, optional): Pooled client for OpenAI calls
+        result_cache (ReviewResultCache, optional): Memo of completed analyses
+        progress (ProgressCallback, optional): Receives progress events
+
+    Returns:
+        Dict: Review results as for perform_code_review, plus
+            "review_comments" anchored to a file and line, a "pull_request"
+            summary of the diff and the "selection" of reviewed files
+
+    Raises:
+        ReviewServiceError: If required fields are missing or service errors occur
+    """
+    with metrics.review_seconds.time():
+        try:
+            if http_client is None:
+                async with httpx.AsyncClient() as client:
+                    return await _perform_pull_review(
+                        request,
+                        github_token,
+                        openai_key,
+                        client,
+                        openai_client,
+                        result_cache,
+                        progress,
+                    )
+            return await _perform_pull_review(
+                request,
+                github_token,
+                openai_key,
+                http_client,
+                openai_client,
+                result_cache,
+                progress,
+            )
+        except ReviewServiceError as e:
+            metrics.review_errors.inc(category=e.category)
+            raise
+        except Exception as e:
+            metrics.review_errors.inc(category="internal")
+            raise ReviewServiceError(
+                f"Error performing pull request review: {str(e)}", category="internal"
+            )
+
+
+async def _perform_pull_review(
+    request: dict,
+    github_token: str,
+    openai_key: str,
+    http_client: httpx.AsyncClient,
+    openai_client: Optional[AsyncOpenAI],
+    result_cache: Optional[ReviewResultCache],
+    progress: Optional[ProgressCallback],
+) -> Dict:
+    for field in ("pull_request_url", "assignment_description", "candidate_level"):
+        if not request.get(field):
+            raise ReviewServiceError(
+                f"Missing required field: {field}", category="validation"
+            )
+
+    owner, repo, number = parse_pull_url(request["pull_request_url"])
+    diffs = await fetch_pull_request(
+        owner,
+        repo,
+        number,
+        http_client,
+        github_headers(github_token),
+        source=request.get("diff_source"),
+    )
+
+    selector = FileSelector(extensions=SUPPORTED_EXTENSIONS)
+    reviewable, unreviewable = [], []
+    for diff in diffs:
+        if diff.status == "removed":
+            unreviewable.append({"path": diff.path, "reason": "removed"})
+        elif not diff.hunks:
+            # Binary files, and diffs GitHub leaves out for their size
+            unreviewable.append({"path": diff.path, "reason": "no_patch"})
+        else:
+            reviewable.append(diff)
+    selected = {
+        entry["path"]
+        for entry in selector.select(
+            [{"path": diff.path, "size": diff.size} for diff in reviewable]
+        )
+    }
+    selector.report.skipped = sorted(
+        selector.report.skipped + unreviewable, key=lambda item: item["path"]
+    )
+    groups = group_hunks([diff for diff in reviewable if diff.path in selected])
+    if not groups:
+        raise ReviewServiceError(
+            "No reviewable changes in pull request", category="empty_diff"
+        )
+    await emit(
+        progress,
+        "files_discovered",
+        {"paths": sorted(selected), "hunk_groups": len(groups)},
+    )
+
+    review_result = await analyze_diff(
+        groups,
+        description=request["assignment_description"],
+        level=request["candidate_level"],
+        api_key=openai_key,
+        client=openai_client,
+        result_cache=result_cache,
+        progress=progress,
+    )
+    return {
+        "status": "success",
+        **review_result,
+        "pull_request": {
+            "owner": owner,
+            "repo": repo,
+            "number": number,
+            "files": len(diffs),
+            "hunks": sum(len(diff.hunks) for diff in diffs),
+            "additions": sum(diff.additions for diff in diffs),
+            "deletions": sum(diff.deletions for diff in diffs),
+        },
+        "selection": selector.report.as_dict(),
+    }
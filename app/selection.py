@@ -0,0 +1,376 @@
+import os
+import posixpath
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple
+
+from app import chunking
+
+# Directories whose contents are third-party, built or otherwise not authored
+VENDORED_DIRS = {
+    "node_modules",
+    "bower_components",
+    "vendor",
+    "third_party",
+    "thirdparty",
+    "site-packages",
+    ".venv",
+    "venv",
+    "dist",
+    "build",
+    "target",
+    "coverage",
+    "__pycache__",
+    "migrations",
+}
+# File name patterns produced by code generators and bundlers
+GENERATED_PATTERNS = [
+    re.compile(pattern)
+    for pattern in (
+        r"\.min\.js$",
+        r"[.-]bundle\.js$",
+        r"_pb2(_grpc)?\.py$",
+        r"\.pb(\.gw)?\.go$",
+        r"_grpc\.pb\.go$",
+        r"\.generated\.\w+$",
+        r"\.g\.cs$",
+        r"\.designer\.cs$",
+        r"_generated\.go$",
+        r"(^|/)zz_generated[^/]*\.go$",
+    )
+]
+ENTRY_POINTS = {
+    "main.py",
+    "app.py",
+    "__main__.py",
+    "manage.py",
+    "wsgi.py",
+    "asgi.py",
+    "server.py",
+    "index.js",
+    "index.ts",
+    "server.js",
+    "server.ts",
+    "app.js",
+    "app.ts",
+    "main.go",
+    "main.java",
+    "application.java",
+    "program.cs",
+    "startup.cs",
+    "main.cpp",
+    "index.php",
+    "config.ru",
+}
+CORE_DIRS = {"src", "app", "lib", "pkg", "core", "internal", "cmd", "api", "server"}
+PERIPHERAL_DIRS = {"examples", "example", "docs", "doc", "scripts", "benchmarks"}
+
+TEST_NAME = re.compile(r"^(test_|tests?\.|conftest\.)|(_test|\.test|\.spec)\.\w+$")
+TEST_DIRS = {"test", "tests", "spec", "__tests__"}
+
+# Files larger than this are never downloaded
+MAX_FILE_BYTES = int(os.getenv("SELECTION_MAX_FILE_BYTES", "200000"))
+# Combined size of the files selected for one review
+MAX_TOTAL_BYTES = int(os.getenv("SELECTION_MAX_TOTAL_BYTES", "2000000"))
+
+
+def _pattern_to_regex(pattern: str) -> Pattern:
+    """
+    Translates a gitignore-style glob into a regular expression over paths.
+    """
+    anchored = pattern.startswith("/") or "/" in pattern.rstrip("/")
+    pattern = pattern.strip("/")
+    parts = []
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            parts.append("(?:.*/)?")
+            index += 3
+        elif pattern.startswith("/**", index):
+            parts.append("/.*")
+            index += 3
+        elif pattern[index] == "*":
+            parts.append("[^/]*")
+            index += 1
+        elif pattern[index] == "?":
+            parts.append("[^/]")
+            index += 1
+        else:
+            parts.append(re.escape(pattern[index]))
+            index += 1
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return re.compile(prefix + "".join(parts) + "$")
+
+
+class GitIgnore:
+    """
+    Matches paths against the patterns of a root .gitignore file.
+
+    Supports comments, negation, directory-only patterns, anchoring and "**".
+    """
+
+    def __init__(self, text: str = ""):
+        self.rules: List[Tuple[Pattern, bool, bool]] = []
+        for line in text.splitlines():
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            self.rules.append((_pattern_to_regex(line), negated, line.endswith("/")))
+
+    def _match(self, path: str, is_dir: bool) -> Optional[bool]:
+        ignored = None
+        for regex, negated, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(path):
+                ignored = not negated
+        return ignored
+
+    def ignores(self, path: str) -> bool:
+        """
+        Returns True if the file, or any directory containing it, is ignored.
+        """
+        parts = path.split("/")
+        for depth in range(1, len(parts)):
+            # Git cannot re-include a file whose parent directory is excluded
+            if self._match("/".join(parts[:depth]), is_dir=True):
+                return True
+        return bool(self._match(path, is_dir=False))
+
+
+class GitAttributes:
+    """
+    Reads linguist-generated, linguist-vendored and linguist-documentation
+    markers from a root .gitattributes file.
+    """
+
+    ATTRIBUTES = ("linguist-generated", "linguist-vendored", "linguist-documentation")
+
+    def __init__(self, text: str = ""):
+        self.rules: List[Tuple[Pattern, Dict[str, bool]]] = []
+        for line in text.splitlines():
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            values = {}
+            for attribute in fields[1:]:
+                name, _, value = attribute.lstrip("-!").partition("=")
+                if name in self.ATTRIBUTES:
+                    unset = attribute.startswith(("-", "!")) or value == "false"
+                    values[name] = not unset
+            if values:
+                self.rules.append((_pattern_to_regex(fields[0]), values))
+
+    def marked(self, path: str) -> Optional[str]:
+        """
+        Returns the linguist attribute set for the path, if any.
+        """
+        state: Dict[str, bool] = {}
+        for regex, values in self.rules:
+            if regex.match(path):
+                state.update(values)
+        for name in self.ATTRIBUTES:
+            if state.get(name):
+                return name
+        return None
+
+
+def is_generated_path(path: str) -> bool:
+    """
+    Detects generated or minified files by their name.
+    """
+    lowered = path.lower()
+    return any(pattern.search(lowered) for pattern in GENERATED_PATTERNS)
+
+
+def importance(path: str) -> int:
+    """
+    Scores how central a file is likely to be to the candidate's solution.
+
+    Entry points rank highest, then core modules, then tests; examples,
+    docs and scripts rank lowest. Deeply nested files lose a little weight.
+    """
+    lowered = path.lower()
+    name = posixpath.basename(lowered)
+    directories = lowered.split("/")[:-1]
+    if name in ENTRY_POINTS:
+        score = 100
+    elif TEST_NAME.search(name) or any(part in TEST_DIRS for part in directories):
+        score = 30
+    elif any(part in PERIPHERAL_DIRS for part in directories):
+        score = 10
+    elif not directories or directories[0] in CORE_DIRS:
+        score = 60
+    else:
+        score = 50
+    return score - 2 * len(directories)
+
+
+@dataclass
+class SelectionReport:
+    """
+    Outcome of a file selection.
+
+    Attributes:
+        selected (List[str]): Paths chosen for download, in path order.
+        skipped (List[Dict]): Paths left out, each with the reason why.
+        selected_bytes (int): Combined size of the selected files.
+        cached (bool): True when the files came from the snapshot cache and
+            no selection ran for this review.
+    """
+
+    selected: List[str] = field(default_factory=list)
+    skipped: List[Dict] = field(default_factory=list)
+    selected_bytes: int = 0
+    cached: bool = False
+
+    def as_dict(self) -> Dict:
+        return {
+            "selected": self.selected,
+            "skipped": self.skipped,
+            "selected_bytes": self.selected_bytes,
+            "cached": self.cached,
+        }
+
+
+class FileSelector:
+    """
+    Chooses which files of a repository to download, using only tree
+    metadata (path and size) plus the root .gitignore and .gitattributes.
+
+    Files are ranked by importance and admitted until either the byte budget
+    or the estimated token budget of the review is spent. Token estimates
+    mirror plan_batches: characters per token, capped at the per-file limit.
+
+    Args:
+        extensions (Iterable[str], optional): Accepted file extensions; other
+            files are ignored without being reported.
+        max_file_bytes (int, optional): Files larger than this are skipped
+            (default: SELECTION_MAX_FILE_BYTES).
+        max_total_bytes (int, optional): Byte budget across selected files
+            (default: SELECTION_MAX_TOTAL_BYTES).
+        max_total_tokens (int, optional): Token budget across selected files
+            (default: REVIEW_MAX_TOTAL_TOKENS).
+    """
+
+    CONFIG_FILES = (".gitignore", ".gitattributes")
+
+    def __init__(
+        self,
+        extensions: Optional[Iterable[str]] = None,
+        max_file_bytes: Optional[int] = None,
+        max_total_bytes: Optional[int] = None,
+        max_total_tokens: Optional[int] = None,
+    ):
+        self.extensions = tuple(extensions) if extensions else None
+        self.max_file_bytes = max_file_bytes or MAX_FILE_BYTES
+        self.max_total_bytes = max_total_bytes or MAX_TOTAL_BYTES
+        self.max_total_tokens = max_total_tokens or chunking.MAX_TOTAL_TOKENS
+        self.gitignore = GitIgnore()
+        self.gitattributes = GitAttributes()
+        self.report = SelectionReport()
+        self._pruned: List[Dict] = []
+
+    def load_rules(self, gitignore: str = "", gitattributes: str = "") -> None:
+        """
+        Applies the contents of the repository's root .gitignore and
+        .gitattributes to later decisions.
+        """
+        self.gitignore = GitIgnore(gitignore)
+        self.gitattributes = GitAttributes(gitattributes)
+
+    def skip_directory(self, path: str) -> bool:
+        """
+        Decides whether a directory can be left unlisted altogether.
+
+        Args:
+            path (str): Directory path relative to the repository root.
+
+        Returns:
+            bool: True if nothing below the directory would be selected.
+        """
+        reason = None
+        if posixpath.basename(path).lower() in VENDORED_DIRS:
+            reason = "vendored"
+        elif self.gitignore.ignores(path + "/"):
+            reason = "gitignored"
+        if reason is not None:
+            self._pruned.append({"path": path + "/", "reason": reason})
+        return reason is not None
+
+    def _skip_reason(self, entry: Dict) -> Optional[str]:
+        path = entry["path"]
+        if self.extensions and not path.endswith(self.extensions):
+            return "unsupported"
+        if any(part.lower() in VENDORED_DIRS for part in path.split("/")[:-1]):
+            return "vendored"
+        attribute = self.gitattributes.marked(path)
+        if attribute:
+            return attribute
+        if self.gitignore.ignores(path):
+            return "gitignored"
+        if is_generated_path(path):
+            return "generated"
+        if entry.get("size", 0) > self.max_file_bytes:
+            return "too_large"
+        return None
+
+    def _estimate_tokens(self, size: int) -> int:
+        return min(-(-size // chunking.CHARS_PER_TOKEN), chunking.FILE_TOKENS)
+
+    def select(self, entries: List[Dict]) -> List[Dict]:
+        """
+        Filters and ranks file entries, recording the outcome in `report`.
+
+        Args:
+            entries (List[Dict]): File entries with at least path and size.
+
+        Returns:
+            List[Dict]: The selected entries, in path order.
+        """
+        candidates = []
+        skipped = list(self._pruned)
+        for entry in entries:
+            reason = self._skip_reason(entry)
+            if reason is None:
+                candidates.append(entry)
+            elif reason != "unsupported":
+                skipped.append({"path": entry["path"], "reason": reason})
+
+        selected = []
+        total_bytes = total_tokens = 0
+        candidates.sort(key=lambda entry: (-importance(entry["path"]), entry["path"]))
+        for entry in candidates:
+            size = entry.get("size", 0)
+            tokens = self._estimate_tokens(size)
+            if (
+                total_bytes + size > self.max_total_bytes
+                or total_tokens + tokens > self.max_total_tokens
+            ):
+                skipped.append({"path": entry["path"], "reason": "budget"})
+                continue
+            selected.append(entry)
+            total_bytes += size
+            total_tokens += tokens
+
+        selected.sort(key=lambda entry: entry["path"])
+        self.report = SelectionReport(
+            selected=[entry["path"] for entry in selected],
+            skipped=sorted(skipped, key=lambda item: item["path"]),
+            selected_bytes=total_bytes,
+        )
+        return selected
+
+    def mark_cached(self, files: List[Dict]) -> None:
+        """
+        Records that the files were served from the snapshot cache, where the
+        selection was made when the snapshot was first taken.
+        """
+        self.report = SelectionReport(
+            selected=[file["path"] for file in files],
+            selected_bytes=sum(file.get("size", 0) for file in files),
+            cached=True,
+        )
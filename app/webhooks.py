@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import os
+import socket
+from typing import Awaitable, Callable, Iterable, List, Optional
+from urllib.parse import urlsplit
+
+# Hosts job webhooks may be sent to, separated by commas; an entry starting
+# with "." also allows its subdomains. When set, only these hosts are allowed
+# (private ones included); otherwise any host with a public address is
+WEBHOOK_ALLOWED_HOSTS = os.getenv("WEBHOOK_ALLOWED_HOSTS", "")
+# Key of the HMAC-SHA256 signature sent with each webhook payload
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Header carrying the payload signature, "sha256=<hex digest>"
+WEBHOOK_SIGNATURE_HEADER = "X-Webhook-Signature-256"
+
+Resolver = Callable[[str, int], Awaitable[List[str]]]
+
+
+class WebhookRejected(ValueError):
+    """
+    Raised for a webhook URL the service must not send requests to.
+    """
+
+
+async def _resolve(host: str, port: int) -> List[str]:
+    infos = await asyncio.get_running_loop().getaddrinfo(
+        host, port, type=socket.SOCK_STREAM
+    )
+    return [info[4][0] for info in infos]
+
+
+def _is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+class WebhookPolicy:
+    """
+    Decides which URLs job webhooks may be sent to, and signs their payloads.
+
+    Webhooks must use https. Without an allowlist, the host must resolve to
+    public addresses only, so a webhook cannot reach loopback, private,
+    link-local (cloud metadata) or otherwise reserved addresses; the check
+    runs when a job is submitted and again before each delivery.
+
+    Args:
+        allowed_hosts (Iterable[str]): Hosts webhooks are restricted to; an
+            entry starting with "." also matches its subdomains.
+        secret (str, optional): Key of the payloads' HMAC-SHA256 signature.
+        resolve (Resolver, optional): Returns the addresses of a host and port
+            (used by tests); defaults to the event loop's getaddrinfo.
+    """
+
+    def __init__(
+        self,
+        allowed_hosts: Iterable[str] = (),
+        secret: Optional[str] = None,
+        resolve: Optional[Resolver] = None,
+    ):
+        self.allowed_hosts = [
+            host.strip().lower() for host in allowed_hosts if host.strip()
+        ]
+        self.secret = secret or None
+        self.resolve = resolve or _resolve
+
+    @classmethod
+    def from_env(cls) -> "WebhookPolicy":
+        """
+        Builds a policy from WEBHOOK_ALLOWED_HOSTS and WEBHOOK_SECRET.
+        """
+        return cls(WEBHOOK_ALLOWED_HOSTS.split(","), secret=WEBHOOK_SECRET)
+
+    def _allowed(self, host: str) -> bool:
+        return any(
+            host == allowed or (allowed.startswith(".") and host.endswith(allowed))
+            for allowed in self.allowed_hosts
+        )
+
+    def check_url(self, url: str) -> None:
+        """
+        Checks a webhook URL without resolving its host.
+
+        Raises:
+            WebhookRejected: If the URL is not https, or names a host that is
+                not allowed or an address that is not public.
+        """
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+        if parts.scheme != "https" or not host:
+            raise WebhookRejected("Webhook URL must be an https URL")
+        if parts.username or parts.password:
+            raise WebhookRejected("Webhook URL must not carry credentials")
+        if self.allowed_hosts:
+            if not self._allowed(host):
+                raise WebhookRejected(f"Webhook host {host} is not allowed")
+            return
+        try:
+            public = _is_public(host)
+        except ValueError:
+            # A hostname; its addresses are checked by check_destination
+            public = not (host == "localhost" or host.endswith(".localhost"))
+        if not public:
+            raise WebhookRejected(f"Webhook host {host} is not a public address")
+
+    async def check_destination(self, url: str) -> None:
+        """
+        Checks a webhook URL and every address its host resolves to.
+
+        Raises:
+            WebhookRejected: If the URL fails check_url, its host does not
+                resolve, or any of its addresses is not public.
+        """
+        self.check_url(url)
+        if self.allowed_hosts:
+            return
+        parts = urlsplit(url)
+        try:
+            addresses = await self.resolve(parts.hostname, parts.port or 443)
+        except OSError:
+            raise WebhookRejected(f"Webhook host {parts.hostname} does not resolve")
+        if not addresses or not all(_is_public(address) for address in addresses):
+            raise WebhookRejected(
+                f"Webhook host {parts.hostname} resolves to a non-public address"
+            )
+
+    def sign(self, body: bytes) -> Optional[str]:
+        """
+        Returns the signature header value of a payload, or None without a
+        secret. Receivers recompute the HMAC-SHA256 of the raw request body.
+        """
+        if self.secret is None:
+            return None
+        digest = hmac.new(self.secret.encode("utf-8"), body, hashlib.sha256)
+        return f"sha256={digest.hexdigest()}"
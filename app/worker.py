@@ -0,0 +1,52 @@
+import asyncio
+import logging
+import os
+
+from dotenv import load_dotenv
+
+from app.cache import ReviewResultCache, SnapshotCache, create_cache_backend
+from app.clients import ClientPool
+from app.fingerprints import create_fingerprint_index
+from app.incremental import create_fragment_store
+from app.jobs import WorkerPool, build_review_handler, create_job_queue
+
+
+async def run_worker() -> None:
+    """
+    Runs a standalone worker node that drains the shared job queue.
+    """
+    clients = ClientPool()
+    cache_backend = create_cache_backend()
+    snapshot_cache = SnapshotCache(cache_backend) if cache_backend else None
+    queue = create_job_queue()
+    pool = WorkerPool(
+        queue,
+        build_review_handler(
+            clients,
+            snapshot_cache,
+            ReviewResultCache.from_env(),
+            create_fragment_store(cache_backend),
+            create_fingerprint_index(),
+        ),
+        concurrency=int(os.getenv("JOB_WORKERS", "4")),
+        http_client=clients.webhooks,
+    )
+    pool.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+        await queue.aclose()
+        await clients.aclose()
+        if cache_backend is not None:
+            await cache_backend.aclose()
+
+
+def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import json
+import logging
+from dataclasses import fields
+from pathlib import Path
+
+from benchmarks.harness import SIZES, BenchmarkConfig, compare, run_benchmarks
+
+RESULTS = Path(__file__).parent / "results"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Offline benchmarks of the /review path against stand-in "
+        "GitHub and OpenAI services.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmarks and store a report")
+    defaults = BenchmarkConfig()
+    run.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    run.add_argument("--requests", type=int, default=defaults.requests)
+    run.add_argument("--concurrency", type=int, default=defaults.concurrency)
+    run.add_argument(
+        "--strategy", choices=("contents", "tree"), default=defaults.strategy
+    )
+    run.add_argument("--github-latency", type=float, default=defaults.github_latency)
+    run.add_argument("--openai-latency", type=float, default=defaults.openai_latency)
+    run.add_argument(
+        "--tokens-per-second", type=float, default=defaults.tokens_per_second
+    )
+    run.add_argument(
+        "--no-isolate",
+        dest="isolate",
+        action="store_false",
+        help="Run every size in this process (peak RSS covers the whole run)",
+    )
+    run.add_argument(
+        "--output",
+        type=Path,
+        help="Report path (default: benchmarks/results/<commit>.json)",
+    )
+
+    diff = commands.add_parser("compare", help="Compare two stored reports")
+    diff.add_argument("base", type=Path)
+    diff.add_argument("head", type=Path)
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        base = json.loads(args.base.read_text())
+        head = json.loads(args.head.read_text())
+        print("\n".join(compare(base, head)))
+        return
+
+    logging.basicConfig(level=logging.WARNING)
+    config = BenchmarkConfig(
+        **{
+            item.name: getattr(args, item.name)
+            for item in fields(BenchmarkConfig)
+            if item.name != "sizes"
+        },
+        sizes=args.sizes,
+    )
+    report = run_benchmarks(config)
+    output = args.output or RESULTS / f"{(report['commit'] or 'local')[:12]}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2) + "\n")
+    for scenario in report["scenarios"]:
+        latency = scenario["latency_seconds"]
+        print(
+            f"{scenario['files']:>6} files: {scenario['throughput_rps']:.2f} rps, "
+            f"p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s "
+            f"p99 {latency['p99']:.3f}s, peak RSS {scenario['peak_rss_mb']:.0f} MiB, "
+            f"{sum(scenario['github_requests'].values())} GitHub / "
+            f"{scenario['openai_requests']} OpenAI requests, "
+            f"{scenario['errors']} errors"
+        )
+    print(f"Report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import asyncio
+import math
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.api import app
+from app.clients import ClientPool
+from app.credentials import CredentialPool
+from benchmarks.standins import StandInGitHub, StandInOpenAI
+from benchmarks.synthetic import synthetic_repo
+
+SIZES = (10, 100, 1000, 10000)
+
+
+@dataclass
+class BenchmarkConfig:
+    """
+    Settings of one benchmark run.
+
+    Attributes:
+        sizes (List[int]): Repository sizes (in files) to benchmark.
+        requests (int): Reviews sent per size, each for a distinct repository.
+        concurrency (int): Reviews in flight at the same time.
+        strategy (str): Fetch strategy, "contents" or "tree".
+        github_latency (float): Seconds added to every GitHub response.
+        openai_latency (float): Seconds before a completion's first token.
+        tokens_per_second (float): Completion generation speed; 0 for instant.
+        isolate (bool): Run every size in a fresh process so peak RSS is
+            measured per size rather than for the whole run.
+    """
+
+    sizes: List[int] = field(default_factory=lambda: list(SIZES))
+    requests: int = 20
+    concurrency: int = 4
+    strategy: str = "contents"
+    github_latency: float = 0.02
+    openai_latency: float = 0.5
+    tokens_per_second: float = 0.0
+    isolate: bool = True
+
+
+def percentile(values: List[float], quantile: float) -> float:
+    """
+    Nearest-rank percentile of the values (0 for an empty list).
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(math.ceil(quantile * len(ordered)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of the current process, in MiB.
+
+    On Linux ru_maxrss survives exec, so a freshly spawned worker would
+    report the RSS of the process that forked it; the high-water mark of the
+    worker's own address space is read from /proc instead.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in KiB elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def run_scenario(config: BenchmarkConfig, size: int) -> Dict:
+    """
+    Sends `config.requests` reviews of a synthetic repository of `size`
+    files through the /review endpoint, against the stand-in services.
+
+    Args:
+        config (BenchmarkConfig): Benchmark settings.
+        size (int): Files in the synthetic repository.
+
+    Returns:
+        Dict: Throughput, latency percentiles, peak RSS and request counts.
+    """
+    github = StandInGitHub(synthetic_repo(size), latency=config.github_latency)
+    openai = StandInOpenAI(
+        latency=config.openai_latency, tokens_per_second=config.tokens_per_second
+    )
+    clients = ClientPool(
+        github_credentials=CredentialPool("github", ["benchmark-github-token"]),
+        openai_credentials=CredentialPool("openai", ["benchmark-openai-key"]),
+        github_transport=github,
+        openai_transport=openai,
+    )
+    # Caches stay off so every review takes the cold path
+    app.state.clients = clients
+    semaphore = asyncio.Semaphore(config.concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def review(client: httpx.AsyncClient, index: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(
+                "/review",
+                json={
+                    "github_repo_url": f"https://github.com/bench/repo-{index}",
+                    "assignment_description": "Build a data processing library",
+                    "candidate_level": "Middle",
+                    "fetch_strategy": config.strategy,
+                },
+            )
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                errors += 1
+
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(review(client, index) for index in range(config.requests))
+            )
+            elapsed = time.perf_counter() - started
+    finally:
+        del app.state.clients
+        await clients.aclose()
+
+    llm = openai.mock.stats()
+    return {
+        "files": size,
+        "requests": config.requests,
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(config.requests / elapsed, 3) if elapsed else 0.0,
+        "latency_seconds": {
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "max": round(max(latencies, default=0.0), 4),
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "github_requests": dict(sorted(github.calls.items())),
+        "github_bytes_sent": github.bytes_sent,
+        "openai_requests": llm["requests"],
+        "prompt_tokens": llm["prompt_tokens"],
+        "completion_tokens": llm["completion_tokens"],
+    }
+
+
+def _run_scenario_sync(config: BenchmarkConfig, size: int) -> Dict:
+    return asyncio.run(run_scenario(config, size))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(config: BenchmarkConfig) -> Dict:
+    """
+    Runs every configured size and collects the report.
+
+    Args:
+        config (BenchmarkConfig): Benchmark settings.
+
+    Returns:
+        Dict: The commit, environment, configuration and one result per size.
+    """
+    scenarios = []
+    for size in config.sizes:
+        if config.isolate:
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                scenarios.append(pool.submit(_run_scenario_sync, config, size).result())
+        else:
+            scenarios.append(_run_scenario_sync(config, size))
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": asdict(config),
+        "scenarios": scenarios,
+    }
+
+
+def compare(base: Dict, head: Dict) -> List[str]:
+    """
+    Lines comparing two reports, one per repository size they share.
+
+    Args:
+        base (Dict): Report of the earlier commit.
+        head (Dict): Report of the later commit.
+
+    Returns:
+        List[str]: Throughput, p95 latency and peak RSS with relative change.
+    """
+
+    def change(old: float, new: float) -> str:
+        if not old:
+            return "n/a"
+        return f"{(new - old) / old:+.1%}"
+
+    previous = {scenario["files"]: scenario for scenario in base["scenarios"]}
+    lines = [
+        f"{'files':>6}  {'throughput (rps)':<27}  {'p95 latency (s)':<27}  "
+        f"{'peak RSS (MiB)':<27}"
+    ]
+    for scenario in head["scenarios"]:
+        old = previous.get(scenario["files"])
+        if old is None:
+            continue
+        columns = []
+        for old_value, new_value in (
+            (old["throughput_rps"], scenario["throughput_rps"]),
+            (old["latency_seconds"]["p95"], scenario["latency_seconds"]["p95"]),
+            (old["peak_rss_mb"], scenario["peak_rss_mb"]),
+        ):
+            columns.append(
+                f"{old_value:>8g} -> {new_value:<8g} {change(old_value, new_value):>6}"
+            )
+        lines.append(f"{scenario['files']:>6}  " + "  ".join(columns))
+    return lines
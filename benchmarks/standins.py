@@ -0,0 +1,169 @@
+import asyncio
+import copy
+import gzip
+import hashlib
+import io
+import json
+import tarfile
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+import httpx
+
+from app.mockllm import MockLLMSettings, create_app
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def load_fixture(name: str):
+    """
+    Reads a recorded response body from benchmarks/fixtures.
+    """
+    return json.loads((FIXTURES / name).read_text())
+
+
+def blob_sha(content: str) -> str:
+    data = content.encode("utf-8")
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class StandInGitHub(httpx.AsyncBaseTransport):
+    """
+    Offline replacement for api.github.com and raw.githubusercontent.com.
+
+    Every repository requested is served with the same file set, so
+    concurrent reviews of distinct repositories do not share caches.
+    Responses are built from the recorded bodies in benchmarks/fixtures,
+    and each one is delayed by `latency` seconds.
+
+    Args:
+        files (Dict[str, str]): Content per path.
+        latency (float): Seconds added to every response.
+    """
+
+    API = "https://api.github.com"
+    RAW = "https://raw.githubusercontent.com"
+
+    def __init__(self, files: Dict[str, str], latency: float = 0.0):
+        self.files = files
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.bytes_sent = 0
+        self.headers = load_fixture("github_headers.json")
+        self.head = hashlib.sha1(repr(sorted(files.items())).encode()).hexdigest()
+        self._shas = {path: blob_sha(content) for path, content in files.items()}
+        self._file_entry = load_fixture("github_contents_file.json")
+        self._dir_entry = load_fixture("github_contents_dir.json")
+        self._tree_entry = load_fixture("github_tree_entry.json")
+        self._directories = self._index_directories()
+        self._tarball: bytes = b""
+
+    def _index_directories(self) -> Dict[str, Dict[str, str]]:
+        """
+        Maps every directory to its children and their kind ("file"/"dir").
+        """
+        directories: Dict[str, Dict[str, str]] = {"": {}}
+        for path in self.files:
+            parts = path.split("/")
+            for depth in range(len(parts)):
+                parent = "/".join(parts[:depth])
+                child = "/".join(parts[: depth + 1])
+                kind = "file" if depth == len(parts) - 1 else "dir"
+                directories.setdefault(parent, {})[child] = kind
+        return directories
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(self.latency)
+        response = self._route(request)
+        self.bytes_sent += len(response.content)
+        return response
+
+    def _route(self, request: httpx.Request) -> httpx.Response:
+        if request.url.host == "raw.githubusercontent.com":
+            self.calls["raw"] += 1
+            _owner, _repo, _ref, path = request.url.path.lstrip("/").split("/", 3)
+            if path not in self.files:
+                return httpx.Response(404, headers=self.headers)
+            return httpx.Response(200, text=self.files[path], headers=self.headers)
+
+        parts = request.url.path.lstrip("/").split("/")
+        if parts[0] != "repos" or len(parts) < 4:
+            self.calls["not_found"] += 1
+            return httpx.Response(404, json={"message": "Not Found"})
+        owner, repo, kind, rest = parts[1], parts[2], parts[3], parts[4:]
+        self.calls[kind] += 1
+        if kind == "commits":
+            return httpx.Response(200, text=self.head, headers=self.headers)
+        if kind == "contents":
+            return self._contents(owner, repo, "/".join(rest))
+        if kind == "git" and rest[:1] == ["trees"]:
+            return self._tree()
+        if kind == "tarball":
+            return self._archive(owner, repo)
+        return httpx.Response(404, json={"message": "Not Found"})
+
+    def _contents(self, owner: str, repo: str, directory: str) -> httpx.Response:
+        children = self._directories.get(directory)
+        if children is None:
+            return httpx.Response(404, json={"message": "Not Found"})
+        listing: List[Dict] = []
+        for path, kind in children.items():
+            name = path.rsplit("/", 1)[-1]
+            if kind == "dir":
+                entry = copy.deepcopy(self._dir_entry)
+                entry["url"] = f"{self.API}/repos/{owner}/{repo}/contents/{path}"
+            else:
+                entry = copy.deepcopy(self._file_entry)
+                entry["sha"] = self._shas[path]
+                entry["size"] = len(self.files[path].encode("utf-8"))
+                entry["download_url"] = f"{self.RAW}/{owner}/{repo}/main/{path}"
+            entry.update(name=name, path=path)
+            listing.append(entry)
+        return httpx.Response(200, json=listing, headers=self.headers)
+
+    def _tree(self) -> httpx.Response:
+        tree = []
+        for path, content in self.files.items():
+            entry = dict(self._tree_entry)
+            entry.update(
+                path=path, sha=self._shas[path], size=len(content.encode("utf-8"))
+            )
+            tree.append(entry)
+        body = {"sha": self.head, "tree": tree, "truncated": False}
+        return httpx.Response(200, json=body, headers=self.headers)
+
+    def _archive(self, owner: str, repo: str) -> httpx.Response:
+        if not self._tarball:
+            buffer = io.BytesIO()
+            root = f"{owner}-{repo}-{self.head[:7]}"
+            with tarfile.open(fileobj=buffer, mode="w") as tar:
+                for path, content in self.files.items():
+                    data = content.encode("utf-8")
+                    info = tarfile.TarInfo(f"{root}/{path}")
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+            self._tarball = gzip.compress(buffer.getvalue(), compresslevel=1)
+        return httpx.Response(200, content=self._tarball)
+
+
+class StandInOpenAI(httpx.ASGITransport):
+    """
+    Offline replacement for the chat completions endpoint: the mock server
+    of app.mockllm, called in process without injected errors.
+
+    Every completion answers the request's schema after `latency` seconds
+    plus the time it would take to generate at `tokens_per_second`; request
+    and token counts are in `mock.stats()`.
+
+    Args:
+        latency (float): Seconds before the first token.
+        tokens_per_second (float): Generation speed; 0 disables the delay.
+    """
+
+    def __init__(self, latency: float = 0.0, tokens_per_second: float = 0.0):
+        mock_app = create_app(
+            MockLLMSettings(latency=latency, tokens_per_second=tokens_per_second)
+        )
+        super().__init__(app=mock_app)
+        self.mock = mock_app.state.mock
@@ -0,0 +1,84 @@
+import random
+from typing import Dict
+
+# Files per directory before the generator opens a new package
+FILES_PER_DIRECTORY = 25
+
+PYTHON_FUNCTION = '''
+
+def {name}(items, limit={limit}):
+    """
+    Returns the first entries of items that pass the {name} check.
+    """
+    selected = []
+    for index, item in enumerate(items):
+        if index >= limit:
+            break
+        if item is None or item == {constant}:
+            continue
+        selected.append(item * {factor})
+    return selected
+'''
+
+JS_FUNCTION = """
+export function {name}(items, limit = {limit}) {{
+  const selected = [];
+  for (const [index, item] of items.entries()) {{
+    if (index >= limit) break;
+    if (item === null || item === {constant}) continue;
+    selected.push(item * {factor});
+  }}
+  return selected;
+}}
+"""
+
+
+def _module(rng: random.Random, template: str, header: str) -> str:
+    functions = [
+        template.format(
+            name=f"process_{rng.randrange(10**6)}",
+            limit=rng.randint(5, 500),
+            constant=rng.randint(0, 99),
+            factor=rng.randint(2, 9),
+        )
+        for _ in range(rng.randint(2, 12))
+    ]
+    return header + "".join(functions)
+
+
+def synthetic_repo(files: int, seed: int = 0) -> Dict[str, str]:
+    """
+    Generates a repository of the given size.
+
+    Most files are Python and JavaScript modules of varying length spread
+    over packages; a README, a package.json and a vendored node_modules
+    directory exercise the file selection.
+
+    Args:
+        files (int): Number of files in the repository.
+        seed (int): Seed making the contents reproducible.
+
+    Returns:
+        Dict[str, str]: Content per path.
+    """
+    rng = random.Random(seed)
+    repo = {
+        "README.md": "# Synthetic benchmark repository\n",
+        "package.json": '{"name": "synthetic", "version": "1.0.0"}\n',
+        "main.py": "from src.pkg0 import module0\n\nmodule0.process_0([])\n",
+        "node_modules/left-pad/index.js": "module.exports = (s) => s;\n",
+    }
+    index = 0
+    while len(repo) < files:
+        package = f"src/pkg{index // FILES_PER_DIRECTORY}"
+        if index % 4 == 3:
+            path = f"{package}/module{index}.js"
+            repo[path] = _module(rng, JS_FUNCTION, "'use strict';\n")
+        elif index % 10 == 9:
+            path = f"tests/test_module{index}.py"
+            repo[path] = _module(rng, PYTHON_FUNCTION, "import pytest\n")
+        else:
+            path = f"{package}/module{index}.py"
+            repo[path] = _module(rng, PYTHON_FUNCTION, "import itertools\n")
+        index += 1
+    return dict(sorted(repo.items())[:files])
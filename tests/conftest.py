@@ -1,12 +1,272 @@
+import difflib
+import gzip
+import hashlib
+import io
+import tarfile
+import textwrap
+from collections import Counter
+from unittest.mock import MagicMock
+
+import httpx
 import pytest
 from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
 
 from app.api import app
+from app.mockllm import MockLLMSettings
+from app.mockllm import create_app as create_mock_llm
+
+
+class FakeGitHub:
+    """
+    Local stand-in for the GitHub REST API, served through httpx.MockTransport.
+
+    Repositories are plain {path: content} mappings; every request is counted
+    by endpoint kind so tests can assert on request volume.
+    """
+
+    API = "https://api.github.com"
+    RAW = "https://raw.githubusercontent.com"
+
+    def __init__(self):
+        self.repos = {}
+        self.history = {}
+        self.calls = Counter()
+        self.truncated = False
+        self.pulls = {}
+
+    def add_repo(self, owner, repo, files):
+        """Adds a repository, or pushes a new commit when it already exists."""
+        self.repos[f"{owner}/{repo}"] = dict(files)
+        self.history[self.head_sha(owner, repo)] = dict(files)
+
+    def add_pull(self, owner, repo, number, changes):
+        """
+        Adds a pull request; changes map paths to (old, new) contents, with
+        None for a file that does not exist on that side.
+        """
+        self.repos.setdefault(f"{owner}/{repo}", {})
+        self.pulls[f"{owner}/{repo}#{number}"] = changes
+
+    def client(self):
+        return httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+
+    @staticmethod
+    def blob_sha(content):
+        data = content.encode()
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+    def head_sha(self, owner, repo):
+        files = sorted(self.repos[f"{owner}/{repo}"].items())
+        return hashlib.sha1(repr(files).encode()).hexdigest()
+
+    def handler(self, request):
+        if request.url.host == "raw.githubusercontent.com":
+            self.calls["raw"] += 1
+            owner, repo, _ref, path = request.url.path.lstrip("/").split("/", 3)
+            files = self.repos.get(f"{owner}/{repo}", {})
+            if path not in files:
+                return httpx.Response(404)
+            return httpx.Response(200, text=files[path])
+
+        parts = request.url.path.lstrip("/").split("/")
+        if parts[0] != "repos" or f"{parts[1]}/{parts[2]}" not in self.repos:
+            self.calls["not_found"] += 1
+            return httpx.Response(404, json={"message": "Not Found"})
+        owner, repo, kind, rest = parts[1], parts[2], parts[3], parts[4:]
+        files = self.repos[f"{owner}/{repo}"]
+        self.calls[kind] += 1
+
+        if kind == "commits":
+            return httpx.Response(200, text=self.head_sha(owner, repo))
+        if kind == "contents":
+            return self._contents(owner, repo, files, "/".join(rest))
+        if kind == "git" and rest[0] == "trees":
+            return self._tree(files)
+        if kind == "tarball":
+            return self._tarball(owner, repo, files)
+        if kind == "pulls":
+            changes = self.pulls.get(f"{owner}/{repo}#{rest[0]}")
+            if changes is None:
+                return httpx.Response(404, json={"message": "Not Found"})
+            if rest[1:] == ["files"]:
+                return self._pull_files(request, changes)
+            if request.headers.get("Accept") == "application/vnd.github.diff":
+                return httpx.Response(200, text=self._pull_diff(changes))
+            return httpx.Response(200, json={"number": int(rest[0])})
+        if kind == "compare":
+            base, _, head = rest[0].partition("...")
+            return self._compare(base, head)
+        return httpx.Response(404, json={"message": "Not Found"})
+
+    def _contents(self, owner, repo, files, directory):
+        prefix = f"{directory}/" if directory else ""
+        entries = {}
+        for path, content in files.items():
+            if not path.startswith(prefix):
+                continue
+            name, _, remainder = path.removeprefix(prefix).partition("/")
+            if remainder:
+                entries[name] = {
+                    "type": "dir",
+                    "name": name,
+                    "path": prefix + name,
+                    "url": f"{self.API}/repos/{owner}/{repo}/contents/{prefix}{name}",
+                }
+            else:
+                entries[name] = {
+                    "type": "file",
+                    "name": name,
+                    "path": path,
+                    "sha": self.blob_sha(content),
+                    "size": len(content.encode()),
+                    "download_url": f"{self.RAW}/{owner}/{repo}/main/{path}",
+                }
+        return httpx.Response(200, json=list(entries.values()))
+
+    def _tree(self, files):
+        tree = [
+            {
+                "path": path,
+                "type": "blob",
+                "sha": self.blob_sha(content),
+                "size": len(content.encode()),
+            }
+            for path, content in files.items()
+        ]
+        return httpx.Response(
+            200, json={"sha": "tree-sha", "tree": tree, "truncated": self.truncated}
+        )
+
+    @staticmethod
+    def _patch(old, new):
+        lines = difflib.unified_diff(
+            (old or "").splitlines(), (new or "").splitlines(), lineterm=""
+        )
+        # Drop the ---/+++ header, as the files API does
+        return "\n".join(list(lines)[2:])
+
+    @staticmethod
+    def _status(old, new):
+        if old is None:
+            return "added"
+        return "removed" if new is None else "modified"
+
+    def _pull_files(self, request, changes):
+        page = int(request.url.params.get("page", "1"))
+        per_page = int(request.url.params.get("per_page", "30"))
+        entries = [
+            {
+                "filename": path,
+                "status": self._status(old, new),
+                "patch": self._patch(old, new),
+            }
+            for path, (old, new) in sorted(changes.items())
+        ]
+        return httpx.Response(
+            200, json=entries[(page - 1) * per_page : page * per_page]
+        )
+
+    def _pull_diff(self, changes):
+        sections = []
+        for path, (old, new) in sorted(changes.items()):
+            header = [f"diff --git a/{path} b/{path}"]
+            status = self._status(old, new)
+            if status == "added":
+                header.append("new file mode 100644")
+            elif status == "removed":
+                header.append("deleted file mode 100644")
+            header += [
+                f"--- {'/dev/null' if old is None else 'a/' + path}",
+                f"+++ {'/dev/null' if new is None else 'b/' + path}",
+            ]
+            sections.append("\n".join(header + [self._patch(old, new)]))
+        return "\n".join(sections) + "\n"
+
+    def _compare(self, base, head):
+        if base not in self.history or head not in self.history:
+            return httpx.Response(404, json={"message": "Not Found"})
+        old, new = self.history[base], self.history[head]
+        changes = []
+        for path in sorted(old.keys() | new.keys()):
+            if path not in new:
+                changes.append({"filename": path, "status": "removed", "sha": None})
+            elif old.get(path) != new[path]:
+                changes.append(
+                    {
+                        "filename": path,
+                        "status": "added" if path not in old else "modified",
+                        "sha": self.blob_sha(new[path]),
+                    }
+                )
+        return httpx.Response(200, json={"status": "ahead", "files": changes})
+
+    def _tarball(self, owner, repo, files):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w", format=tarfile.PAX_FORMAT) as tar:
+            tar.pax_headers = {"comment": "0123456789abcdef"}
+            root = f"{owner}-{repo}-0123456"
+            for path, content in files.items():
+                data = content.encode()
+                info = tarfile.TarInfo(f"{root}/{path}")
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return httpx.Response(200, content=gzip.compress(buffer.getvalue()))
+
+
+class FakeChatCompletions:
+    """
+    The mock chat completions server of app.mockllm, served in process, with
+    answers from the test.
+
+    Answers come from `respond(model, prompt)`, returning a dict that is sent
+    as JSON or a raw string; every request body is kept so tests can assert
+    on the models and prompts used.
+    """
+
+    BASE_URL = "https://llm.test/v1"
+
+    def __init__(self):
+        self.respond = None
+        self.requests = []
+        self.app = create_mock_llm(MockLLMSettings(latency=0), self.answer)
+
+    def client(self):
+        return AsyncOpenAI(
+            api_key="test-openai-key",
+            base_url=self.BASE_URL,
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.ASGITransport(app=self.app)),
+        )
+
+    def prompts(self, model):
+        return [
+            body["messages"][-1]["content"]
+            for body in self.requests
+            if body["model"] == model
+        ]
+
+    def answer(self, body):
+        self.requests.append(body)
+        return self.respond(body["model"], body["messages"][-1]["content"])
 
 
 @pytest.fixture
-def test_client():
-    return TestClient(app)
+def fake_github():
+    return FakeGitHub()
+
+
+@pytest.fixture
+def fake_llm():
+    return FakeChatCompletions()
+
+
+@pytest.fixture
+def test_client(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "test-github-token")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    with TestClient(app) as client:
+        yield client
 
 
 @pytest.fixture
@@ -22,3 +282,21 @@ def mock_gpt_response():
         "rating": "8/10",
         "conclusion": "Overall good implementation",
     }
+
+
+@pytest.fixture
+def streamed_completion():
+    """Factory for fake streamed chat completions yielding `text` in fragments."""
+
+    def make(text, size=7):
+        async def chunks():
+            for fragment in textwrap.wrap(text, size, drop_whitespace=False):
+                delta = MagicMock(content=fragment)
+                yield MagicMock(choices=[MagicMock(delta=delta)], usage=None)
+            yield MagicMock(
+                choices=[], usage=MagicMock(prompt_tokens=50, completion_tokens=20)
+            )
+
+        return chunks()
+
+    return make
@@ -0,0 +1,306 @@
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+from app.admission import (
+    AdmissionController,
+    MemoryAdmissionState,
+    RedisAdmissionState,
+    tenant_of,
+)
+from app.api import app, event_stream_response
+from app.exceptions import AdmissionRejected
+
+REQUEST = {
+    "github_repo_url": "https://github.com/user/repo",
+    "assignment_description": "Test assignment",
+    "candidate_level": "Senior",
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "redis"])
+def state(request):
+    if request.param == "memory":
+        return MemoryAdmissionState()
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisAdmissionState(fakeredis.FakeAsyncRedis())
+
+
+async def settle(controller, queued):
+    """Waits until `queued` reviews wait in the controller's queues."""
+    for _ in range(200):
+        if sum(controller.stats()["queued"].values()) == queued:
+            return
+        await asyncio.sleep(0.001)
+    raise AssertionError(f"Expected {queued} queued reviews")
+
+
+async def admit_in_order(controller, requests):
+    """Queues (tenant, lane) requests, then returns the order they ran in."""
+    order = []
+
+    async def review(tenant, lane):
+        lease = await controller.admit(tenant, lane)
+        order.append(tenant)
+        await lease.release()
+
+    holder = await controller.admit("holder", "interactive")
+    tasks = []
+    for tenant, lane in requests:
+        tasks.append(asyncio.create_task(review(tenant, lane)))
+        await settle(controller, len(tasks))
+    await holder.release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_tenant_of_prefers_the_tenant_header():
+    assert tenant_of({"X-Tenant-ID": "team-a", "X-API-Key": "secret"}) == "team-a"
+    keyed = tenant_of({"Authorization": "Bearer secret"})
+    assert keyed.startswith("key-") and "secret" not in keyed
+    assert tenant_of({}) == "anonymous"
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_each_tenant(state):
+    clock = FakeClock()
+    controller = AdmissionController(state, tenant_rate=60, tenant_burst=2, clock=clock)
+
+    for _ in range(2):
+        await (await controller.admit("team-a", "interactive")).release()
+    with pytest.raises(AdmissionRejected) as rejected:
+        await controller.admit("team-a", "interactive")
+    await (await controller.admit("team-b", "interactive")).release()
+    clock.now += 1
+    await (await controller.admit("team-a", "interactive")).release()
+
+    assert (rejected.value.status_code, rejected.value.reason) == (429, "rate_limited")
+    assert rejected.value.retry_after == pytest.approx(1.0)
+    assert controller.stats()["outcomes"] == {"admitted": 4, "rate_limited": 1}
+
+
+@pytest.mark.asyncio
+async def test_weighted_fair_queuing_between_tenants(state):
+    controller = AdmissionController(
+        state, max_in_flight=1, weights={"light": 2}, poll_interval=0.01
+    )
+
+    order = await admit_in_order(
+        controller,
+        [("heavy", "interactive")] * 6 + [("light", "interactive")] * 3,
+    )
+
+    # The light tenant arrived last with a third of the reviews, yet is
+    # served at twice the heavy tenant's rate instead of after its backlog
+    assert order[:4].count("light") == 3
+    assert order[4:] == ["heavy"] * 5
+    assert controller.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_interactive_lane_goes_before_batch(state):
+    controller = AdmissionController(state, max_in_flight=1, poll_interval=0.01)
+
+    order = await admit_in_order(
+        controller,
+        [("bulk", "batch"), ("bulk", "batch"), ("user", "interactive")],
+    )
+
+    assert order == ["user", "bulk", "bulk"]
+
+
+@pytest.mark.asyncio
+async def test_full_queues_are_shed_with_retry_after(state):
+    controller = AdmissionController(
+        state,
+        max_in_flight=1,
+        lanes={"interactive": 2},
+        tenant_max_queue=1,
+        queue_timeout=0.05,
+        service_seconds=20,
+        poll_interval=0.01,
+    )
+    holder = await controller.admit("holder", "interactive")
+    queued = asyncio.create_task(controller.admit("team-a", "interactive"))
+    await settle(controller, 1)
+
+    with pytest.raises(AdmissionRejected) as tenant_full:
+        await controller.admit("team-a", "interactive")
+    other = asyncio.create_task(controller.admit("team-b", "interactive"))
+    await settle(controller, 2)
+    with pytest.raises(AdmissionRejected) as overloaded:
+        await controller.admit("team-c", "interactive")
+    results = await asyncio.gather(queued, other, return_exceptions=True)
+
+    assert (tenant_full.value.status_code, tenant_full.value.reason) == (
+        429,
+        "tenant_queue_full",
+    )
+    assert (overloaded.value.status_code, overloaded.value.reason) == (
+        503,
+        "overloaded",
+    )
+    # Two queued reviews ahead, one slot, 20s per review
+    assert overloaded.value.retry_after == pytest.approx(60)
+    assert [error.reason for error in results] == ["queue_timeout"] * 2
+    await holder.release()
+    assert controller.stats()["queued"] == {"interactive": 0}
+
+
+@pytest.mark.asyncio
+async def test_redis_state_is_shared_between_nodes():
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    nodes = [
+        AdmissionController(
+            RedisAdmissionState(fakeredis.FakeAsyncRedis(server=server)),
+            max_in_flight=1,
+            tenant_rate=60,
+            tenant_burst=2,
+            poll_interval=0.01,
+        )
+        for _ in range(2)
+    ]
+
+    lease = await nodes[0].admit("team-a", "interactive")
+    waiting = asyncio.create_task(nodes[1].admit("team-a", "interactive"))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+    await lease.release()
+    await (await waiting).release()
+
+    # The two reviews used up team-a's burst on both nodes
+    with pytest.raises(AdmissionRejected):
+        await nodes[1].admit("team-a", "interactive")
+
+
+def test_review_endpoint_rejects_tenants_over_their_rate(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "test-github-token")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    monkeypatch.setenv("ADMISSION_TENANT_RATE", "1")
+    monkeypatch.setenv("ADMISSION_TENANT_BURST", "1")
+
+    with TestClient(app) as client, patch(
+        "app.api.perform_code_review", new_callable=AsyncMock
+    ) as mock_review:
+        mock_review.return_value = {"status": "success"}
+
+        def post(tenant, **headers):
+            return client.post(
+                "/review", json=REQUEST, headers={"X-Tenant-ID": tenant, **headers}
+            )
+
+        first, second, other = post("team-a"), post("team-a"), post("team-b")
+        unknown_lane = post("team-c", **{"X-Priority": "urgent"})
+        stats = client.get("/stats").json()["admission"]
+
+    assert (first.status_code, second.status_code, other.status_code) == (
+        200,
+        429,
+        200,
+    )
+    assert second.headers["Retry-After"] == "60"
+    assert unknown_lane.status_code == 400
+    assert stats["outcomes"] == {"admitted": 2, "rate_limited": 1}
+    assert stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("spec_version", ["2.0", "2.4"])
+async def test_event_stream_releases_its_lease_on_early_disconnect(state, spec_version):
+    controller = AdmissionController(state, max_in_flight=1)
+    started = False
+
+    async def stream():
+        nonlocal started
+        started = True
+        yield "data: {}\n\n"
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # The client is gone before the headers go out
+        raise OSError("connection reset")
+
+    lease = await controller.admit("team-a", "interactive")
+    response = await event_stream_response(stream(), lease)
+    scope = {"type": "http", "asgi": {"spec_version": spec_version}}
+    with pytest.raises((OSError, ClientDisconnect)):
+        await response(scope, receive, send)
+
+    assert not started
+    assert controller.stats()["in_flight"] == 0
+    await (await controller.admit("team-a", "interactive")).release()
+
+
+def test_job_submissions_are_rate_limited_and_shed(monkeypatch):
+    monkeypatch.setenv("JOB_WORKERS", "0")
+    monkeypatch.setenv("ADMISSION_TENANT_RATE", "1")
+    monkeypatch.setenv("ADMISSION_TENANT_BURST", "1")
+    monkeypatch.setenv("ADMISSION_MAX_JOBS_QUEUED", "1")
+
+    with TestClient(app) as client:
+
+        def submit(tenant):
+            return client.post(
+                "/reviews", json=REQUEST, headers={"X-Tenant-ID": tenant}
+            )
+
+        queued, limited, shed = submit("team-a"), submit("team-a"), submit("team-b")
+        stats = client.get("/stats").json()["admission"]
+
+    assert (queued.status_code, limited.status_code, shed.status_code) == (
+        202,
+        429,
+        429,
+    )
+    assert limited.headers["Retry-After"] == "60"
+    assert int(shed.headers["Retry-After"]) >= 1
+    assert stats["outcomes"] == {
+        "job_queued": 1,
+        "rate_limited": 1,
+        "jobs_queue_full": 1,
+    }
+    assert stats["in_flight"] == 0
+
+
+def test_batch_api_file_holds_a_batch_lease(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "test-github-token")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    held = []
+
+    with TestClient(app) as client:
+
+        async def batch_api_lines(*args, **kwargs):
+            held.append(client.app.state.admission.stats()["in_flight"])
+            yield "{}"
+
+        with patch.object(
+            client.app.state.batch_scheduler, "batch_api_lines", batch_api_lines
+        ):
+            response = client.post(
+                "/review/batch/openai",
+                json={
+                    "github_repo_urls": [REQUEST["github_repo_url"]],
+                    "assignment_description": "Test assignment",
+                    "candidate_level": "Senior",
+                },
+            )
+        stats = client.get("/stats").json()["admission"]
+
+    assert response.status_code == 200
+    assert held == [1]
+    assert stats["outcomes"] == {"admitted": 1}
+    assert stats["in_flight"] == 0
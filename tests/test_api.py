@@ -1,8 +1,17 @@
-from unittest.mock import AsyncMock, patch
+import asyncio
+import json
+import re
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
 
+import httpx
 import pytest
+from fastapi.testclient import TestClient
 
-from app.exceptions import ReviewServiceError
+from app import gpt
+from app.api import app
+from app.clients import ClientPool
+from app.exceptions import CircuitOpenError, ReviewServiceError
 
 
 def test_health_check(test_client):
@@ -75,6 +84,27 @@ async def test_review_service_error(test_client):
         assert "Repository not found" in response.json()["detail"]
 
 
+@pytest.mark.asyncio
+async def test_open_circuit_returns_503_with_retry_after(test_client):
+    with patch(
+        "app.review_service.fetch_repository_files", new_callable=AsyncMock
+    ) as mock_fetch:
+        mock_fetch.side_effect = CircuitOpenError("github", 12.3)
+
+        response = test_client.post(
+            "/review",
+            json={
+                "github_repo_url": "https://github.com/user/repo",
+                "assignment_description": "Test assignment",
+                "candidate_level": "Senior",
+            },
+        )
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "13"
+        assert "github is temporarily unavailable" in response.json()["detail"]
+
+
 @pytest.mark.asyncio
 async def test_invalid_request_data(test_client):
     response = test_client.post(
@@ -86,3 +116,153 @@ async def test_invalid_request_data(test_client):
         },
     )
     assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_health_latency_stays_flat_during_reviews(monkeypatch):
+    """
+    Load test: while many reviews wait on a slow completion, /health must keep
+    answering immediately because the OpenAI call no longer blocks the loop.
+    """
+    monkeypatch.setenv("GITHUB_TOKEN", "token")
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+
+    async def slow_completion(**kwargs):
+        await asyncio.sleep(0.5)
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=json.dumps({"rating": "8"})))]
+        )
+
+    fake_openai = MagicMock()
+    fake_openai.chat.completions.create = slow_completion
+    gpt._clients.clear()
+
+    with patch(
+        "app.review_service.fetch_repository_files",
+        AsyncMock(return_value=[{"path": "main.py", "content": "x", "size": 1}]),
+    ), patch("app.gpt.AsyncOpenAI", return_value=fake_openai):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            payload = {
+                "github_repo_url": "https://github.com/user/repo",
+                "assignment_description": "Test assignment",
+                "candidate_level": "Senior",
+            }
+            reviews = [
+                asyncio.create_task(client.post("/review", json=payload))
+                for _ in range(30)
+            ]
+            await asyncio.sleep(0.05)
+
+            latencies = []
+            for _ in range(10):
+                started = time.perf_counter()
+                response = await client.get("/health")
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+
+            responses = await asyncio.gather(*reviews)
+
+    gpt._clients.clear()
+    assert all(response.status_code == 200 for response in responses)
+    assert max(latencies) < 0.2
+
+
+def test_stream_code_review_sends_sse_events(
+    test_client, mock_github_response, streamed_completion
+):
+    answer = json.dumps(
+        {"comments": ["Nice structure"], "rating": "9/10", "conclusion": "Great"}
+    )
+    fake_openai = MagicMock()
+    fake_openai.chat.completions.create = AsyncMock(
+        side_effect=lambda **kwargs: streamed_completion(answer)
+    )
+
+    async def fetch(*args, progress=None, **kwargs):
+        await progress("files_discovered", {"paths": ["main.py"]})
+        await progress("file_fetched", {"path": "main.py", "size": 100})
+        return mock_github_response
+
+    with patch("app.review_service.fetch_repository_files", fetch), patch.object(
+        ClientPool, "openai", return_value=fake_openai
+    ):
+        with test_client.stream(
+            "POST",
+            "/review/stream",
+            json={
+                "github_repo_url": "https://github.com/user/repo",
+                "assignment_description": "Test assignment",
+                "candidate_level": "Senior",
+            },
+        ) as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = "".join(response.iter_text())
+
+    messages = [block.split("\n") for block in body.strip().split("\n\n")]
+    events = [lines[0].removeprefix("event: ") for lines in messages]
+    assert events == [
+        "started",
+        "files_discovered",
+        "file_fetched",
+        "batch_started",
+        "comment",
+        "batch_completed",
+        "result",
+    ]
+    result = json.loads(messages[-1][1].removeprefix("data: "))
+    assert result["status"] == "success"
+    assert result["rating"] == "9/10"
+
+
+@pytest.mark.parametrize("incremental", [None, "true"])
+def test_repeat_reviews_keep_the_response_shape(
+    monkeypatch, fake_github, fake_llm, incremental
+):
+    monkeypatch.setenv("GITHUB_TOKEN", "test-github-token")
+    monkeypatch.setenv("OPENAI_API_KEY", "test-openai-key")
+    if incremental is not None:
+        monkeypatch.setenv("INCREMENTAL_REVIEWS", incremental)
+    fake_github.add_repo("user", "repo", {"main.py": "print(1)", "util.py": "X = 1"})
+
+    def respond(model, prompt):
+        paths = re.findall(r"^File: (\S+)", prompt, re.MULTILINE)
+        if not paths:
+            return {"rating": "8/10", "conclusion": "Merged"}
+        return {
+            "comments": [f"Overall {', '.join(paths)}"],
+            "file_comments": [
+                {"path": path, "comments": [f"Reviewed {path}"]} for path in paths
+            ],
+            "rating": "7/10",
+            "conclusion": "Solid",
+        }
+
+    fake_llm.respond = respond
+    pool = ClientPool(
+        github_transport=httpx.MockTransport(fake_github.handler),
+        openai_transport=httpx.ASGITransport(app=fake_llm.app),
+    )
+    payload = {
+        "github_repo_url": "https://github.com/user/repo",
+        "assignment_description": "Test assignment",
+        "candidate_level": "Senior",
+    }
+
+    with patch("app.api.ClientPool", return_value=pool), TestClient(app) as client:
+        first = client.post("/review", json=payload).json()
+        fake_github.add_repo(
+            "user", "repo", {"main.py": "print(1)", "util.py": "X = 2"}
+        )
+        second = client.post("/review", json=payload).json()
+
+    assert first["status"] == second["status"] == "success"
+    assert second.keys() == first.keys()
+    assert first["delta"] is None
+    assert "Overall main.py, util.py" in second["comments"]
+    if incremental:
+        assert second["delta"]["reviewed_files"] == ["util.py"]
+    else:
+        assert second["delta"] is None
@@ -0,0 +1,168 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+from app.backends import BackendSettings
+from app.clients import ClientPool, ClientSettings
+from app.credentials import CredentialPool
+from app.gpt import FORMAT_ERROR, analyze_code, completion_request
+from app.mockllm import MockLLMSettings, create_app
+from app.models import ReviewAnswer, TriageAnswer
+
+FILES = [
+    {"path": "app/main.py", "content": "print('hello')"},
+    {"path": "app/util.py", "content": "def add(a, b):\n    return a + b"},
+]
+
+
+def mock_client(mock_app):
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=mock_app), base_url="http://mock-llm/v1"
+    )
+
+
+def body(prompt, answer=ReviewAnswer, **extra):
+    return {**completion_request(prompt, answer), **extra}
+
+
+def mock_pool(mock_app, backends):
+    return ClientPool(
+        ClientSettings(openai_timeout=5),
+        github_credentials=CredentialPool("github", []),
+        openai_credentials=CredentialPool("openai", []),
+        openai_transport=httpx.ASGITransport(app=mock_app),
+        backends=backends,
+    )
+
+
+@pytest.mark.asyncio
+async def test_mock_server_answers_follow_the_requested_schema():
+    prompt = "Review these files\nFile: app/main.py\n```\n```\nFile: app/util.py\n"
+    mock_app = create_app(MockLLMSettings(latency=0))
+
+    async with mock_client(mock_app) as client:
+        review, again, triage = [
+            await client.post("/chat/completions", json=payload)
+            for payload in (body(prompt), body(prompt), body(prompt, TriageAnswer))
+        ]
+
+    content = review.json()["choices"][0]["message"]["content"]
+    assert again.json()["choices"][0]["message"]["content"] == content
+    answer = ReviewAnswer.model_validate_json(content)
+    assert [notes.path for notes in answer.file_comments] == [
+        "app/main.py",
+        "app/util.py",
+    ]
+    triaged = TriageAnswer.model_validate_json(
+        triage.json()["choices"][0]["message"]["content"]
+    )
+    assert [file.path for file in triaged.files] == ["app/main.py", "app/util.py"]
+    assert review.json()["usage"]["completion_tokens"] == len(content) // 4
+
+
+@pytest.mark.asyncio
+async def test_mock_server_injects_errors_deterministically():
+    settings = MockLLMSettings(latency=0, error_rate=0.3, rate_limit_rate=0.2, seed=7)
+    payloads = [body(f"File: m{index}.py\n") for index in range(40)]
+
+    async def statuses():
+        async with mock_client(create_app(settings)) as client:
+            responses = await asyncio.gather(
+                *(client.post("/chat/completions", json=p) for p in payloads)
+            )
+        return responses
+
+    first, second = await statuses(), await statuses()
+
+    assert [r.status_code for r in first] == [r.status_code for r in second]
+    assert {r.status_code for r in first} == {200, 429, 500}
+    limited = next(r for r in first if r.status_code == 429)
+    assert limited.headers["Retry-After"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_mock_server_streams_with_usage_and_truncates_at_max_tokens():
+    mock_app = create_app(MockLLMSettings(latency=0, tokens_per_second=10000))
+    openai = AsyncOpenAI(
+        api_key="mock", base_url="http://mock-llm/v1", http_client=mock_client(mock_app)
+    )
+
+    stream = await openai.chat.completions.create(
+        **body(
+            "File: app/main.py\n",
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+    )
+    chunks = [chunk async for chunk in stream]
+    short = await openai.chat.completions.create(
+        **{**body("File: app/main.py\n"), "max_tokens": 10}
+    )
+
+    content = "".join(c.choices[0].delta.content or "" for c in chunks if c.choices)
+    assert json.loads(content)["file_comments"][0]["path"] == "app/main.py"
+    assert chunks[-1].usage.completion_tokens == len(content) // 4
+    assert short.choices[0].finish_reason == "length"
+    assert len(short.choices[0].message.content) == 40
+    assert mock_app.state.mock.stats()["truncated"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_routes_models_within_backend_concurrency_limits():
+    mock_app = create_app(MockLLMSettings(latency=0.02))
+    pool = mock_pool(
+        mock_app,
+        [
+            BackendSettings("openai", base_url="http://hosted/v1", max_concurrency=2),
+            BackendSettings(
+                "local",
+                base_url="http://local/v1",
+                api_key="local-key",
+                max_concurrency=1,
+                models=("gpt-4o-mini",),
+                timeout=3,
+            ),
+        ],
+    )
+    client = pool.openai("key")
+    assert client is pool.openai("key")
+
+    await asyncio.gather(
+        *(
+            client.chat.completions.create(
+                **completion_request(f"File: m{index}.py\n", ReviewAnswer, model)
+            )
+            for index in range(4)
+            for model in ("gpt-4o", "gpt-4o", "gpt-4o-mini")
+        )
+    )
+    stats = pool.backend_stats()
+    await pool.aclose()
+
+    assert (stats["openai"]["requests"], stats["local"]["requests"]) == (8, 4)
+    assert stats["openai"]["peak_in_flight"] == 2
+    assert stats["local"]["peak_in_flight"] == 1
+    assert stats["local"]["waited"] == 3
+    assert stats["local"]["timeout"] == 3 and stats["openai"]["timeout"] == 5
+    assert set(pool.stats()) == {"github", "openai", "local", "webhooks"}
+    assert mock_app.state.mock.stats()["peak_in_flight"] <= 3
+
+
+@pytest.mark.asyncio
+async def test_review_against_mock_backend():
+    mock_app = create_app(MockLLMSettings(latency=0, tokens_per_second=5000))
+    pool = mock_pool(
+        mock_app, [BackendSettings("openai", base_url="http://mock-llm/v1")]
+    )
+
+    result = await analyze_code(
+        FILES, "Build a calculator", "Middle", "key", client=pool.openai("key")
+    )
+    await pool.aclose()
+
+    assert FORMAT_ERROR not in result["comments"]
+    assert any(comment.startswith("app/util.py") for comment in result["comments"])
+    assert result["usage"]["requests"] == 1
@@ -0,0 +1,205 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.batch import BatchScheduler, batch_api_requests
+from app.clients import ClientPool
+from app.exceptions import ReviewServiceError
+
+DESCRIPTION = "Build a CLI"
+LEVEL = "Middle"
+
+
+class SlowModel:
+    """Fake model that records how many completions overlap."""
+
+    def __init__(self):
+        self.active = 0
+        self.peak = 0
+        self.prompts = []
+        self.chat = MagicMock()
+        self.chat.completions.create = AsyncMock(side_effect=self.create)
+
+    async def create(self, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        self.prompts.append(kwargs["messages"][1]["content"])
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        answer = {"comments": ["Fine"], "rating": "7/10", "conclusion": "Ok"}
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=json.dumps(answer)))],
+            usage=MagicMock(prompt_tokens=10, completion_tokens=5),
+        )
+
+
+@pytest.mark.asyncio
+async def test_batch_streams_results_under_global_limits(fake_github):
+    for index in range(4):
+        fake_github.add_repo("cohort", f"repo-{index}", {"main.py": f"print({index})"})
+    model = SlowModel()
+    scheduler = BatchScheduler(fetch_concurrency=2, llm_concurrency=1)
+    repo_urls = [f"https://github.com/cohort/repo-{index}" for index in range(4)]
+    repo_urls.append("https://github.com/cohort/missing")
+
+    async with fake_github.client() as client:
+        events = [
+            event
+            async for event in scheduler.review(
+                repo_urls,
+                DESCRIPTION,
+                LEVEL,
+                lambda: ("token", "key"),
+                http_client=client,
+                openai_client=lambda key: model,
+            )
+        ]
+
+    results = [data for name, data in events if name == "result"]
+    errors = [data for name, data in events if name == "error"]
+    assert sorted(data["index"] for data in results) == [0, 1, 2, 3]
+    assert all(data["result"]["status"] == "success" for data in results)
+    assert errors == [
+        {
+            "index": 4,
+            "github_repo_url": "https://github.com/cohort/missing",
+            "detail": "An unexpected error occurred: Repository not found",
+        }
+    ]
+    assert model.peak == 1
+    assert scheduler.stats()["reviewed"] == 4
+    assert scheduler.stats()["failed"] == 1
+
+    # Everything before the repository contents is shared by the cohort
+    prefixes = {prompt.split("Repository Contents")[0] for prompt in model.prompts}
+    assert len(prefixes) == 1
+    assert DESCRIPTION in prefixes.pop()
+
+
+@pytest.mark.asyncio
+async def test_batch_api_requests_encode_each_part():
+    files = [{"path": "main.py", "content": "print(1)"}]
+
+    lines = await batch_api_requests(
+        "https://github.com/cohort/repo-1", files, DESCRIPTION, LEVEL
+    )
+
+    assert len(lines) == 1
+    request = json.loads(lines[0])
+    assert request["custom_id"] == "cohort/repo-1#1/1"
+    assert request["url"] == "/v1/chat/completions"
+    assert request["body"]["model"] == "gpt-4o"
+    assert "File: main.py" in request["body"]["messages"][1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_batch_api_requests_carry_the_pre_analyzed_contents():
+    body = "\n".join(f"    total += {index}" for index in range(8))
+    source = f"def add(total):\n{body}\n    return total\n"
+    files = [{"path": "main.py", "content": source}]
+
+    lines = await batch_api_requests(
+        "https://github.com/cohort/repo-1", files, DESCRIPTION, LEVEL
+    )
+
+    prompt = json.loads(lines[0])["body"]["messages"][1]["content"]
+    assert "lines elided" in prompt
+    assert "total += 7" not in prompt
+
+
+def test_batch_endpoint_streams_sse_events(test_client, mock_github_response):
+    model = SlowModel()
+
+    async def fetch(repo_url, *args, **kwargs):
+        return mock_github_response
+
+    with patch("app.batch.fetch_repository_files", fetch), patch.object(
+        ClientPool, "openai", return_value=model
+    ):
+        with test_client.stream(
+            "POST",
+            "/review/batch",
+            json={
+                "github_repo_urls": [
+                    "https://github.com/cohort/repo-1",
+                    "https://github.com/cohort/repo-2",
+                ],
+                "assignment_description": DESCRIPTION,
+                "candidate_level": LEVEL,
+            },
+        ) as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            body = "".join(response.iter_text())
+
+    messages = [block.split("\n") for block in body.strip().split("\n\n")]
+    events = [lines[0].removeprefix("event: ") for lines in messages]
+    assert events == ["started", "result", "result", "completed"]
+    completed = json.loads(messages[-1][1].removeprefix("data: "))
+    assert completed == {"succeeded": 2, "failed": 0}
+
+
+def test_batch_endpoint_returns_batch_api_file(test_client, mock_github_response):
+    async def fetch(repo_url, *args, **kwargs):
+        return mock_github_response
+
+    with patch("app.batch.fetch_repository_files", fetch):
+        response = test_client.post(
+            "/review/batch/openai",
+            json={
+                "github_repo_urls": ["https://github.com/cohort/repo-1"],
+                "assignment_description": DESCRIPTION,
+                "candidate_level": LEVEL,
+            },
+        )
+
+    assert response.status_code == 200
+    lines = response.text.strip().split("\n")
+    assert [json.loads(line)["custom_id"] for line in lines] == ["cohort/repo-1#1/1"]
+
+
+def test_batch_api_file_lists_repositories_that_failed(
+    test_client, mock_github_response
+):
+    async def fetch(repo_url, *args, **kwargs):
+        if repo_url.endswith("missing"):
+            raise ReviewServiceError("Repository not found", category="not_found")
+        return mock_github_response
+
+    with patch("app.batch.fetch_repository_files", fetch):
+        response = test_client.post(
+            "/review/batch/openai",
+            json={
+                "github_repo_urls": [
+                    "https://github.com/cohort/repo-1",
+                    "https://github.com/cohort/missing",
+                ],
+                "assignment_description": DESCRIPTION,
+                "candidate_level": LEVEL,
+            },
+        )
+
+    lines = [json.loads(line) for line in response.text.strip().split("\n")]
+    assert [line["custom_id"] for line in lines if "custom_id" in line] == [
+        "cohort/repo-1#1/1"
+    ]
+    assert [line for line in lines if "error" in line] == [
+        {
+            "github_repo_url": "https://github.com/cohort/missing",
+            "error": "Repository not found",
+        }
+    ]
+
+
+def test_batch_endpoint_rejects_empty_batches(test_client):
+    response = test_client.post(
+        "/review/batch",
+        json={
+            "github_repo_urls": [],
+            "assignment_description": DESCRIPTION,
+            "candidate_level": LEVEL,
+        },
+    )
+
+    assert response.status_code == 422
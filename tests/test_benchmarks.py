@@ -0,0 +1,61 @@
+import pytest
+
+from benchmarks.harness import BenchmarkConfig, compare, percentile, run_scenario
+from benchmarks.synthetic import synthetic_repo
+
+
+def test_synthetic_repo_is_reproducible():
+    repo = synthetic_repo(100, seed=1)
+
+    assert len(repo) == 100
+    assert repo == synthetic_repo(100, seed=1)
+    assert "node_modules/left-pad/index.js" in repo
+
+
+def test_percentile_uses_nearest_rank():
+    values = [float(value) for value in range(1, 101)]
+
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.95) == 0.0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", ["contents", "tree"])
+async def test_scenario_reviews_through_stand_ins(strategy):
+    config = BenchmarkConfig(
+        requests=3,
+        concurrency=2,
+        strategy=strategy,
+        github_latency=0,
+        openai_latency=0,
+        isolate=False,
+    )
+
+    result = await run_scenario(config, 10)
+
+    assert result["errors"] == 0
+    assert result["requests"] == 3
+    assert result["openai_requests"] == 3
+    assert result["throughput_rps"] > 0
+    assert result["latency_seconds"]["p50"] <= result["latency_seconds"]["p99"]
+    assert result["peak_rss_mb"] > 0
+    if strategy == "tree":
+        assert result["github_requests"]["tarball"] == 3
+    else:
+        assert result["github_requests"]["raw"] > 0
+
+
+def test_compare_reports_relative_change():
+    scenario = {
+        "files": 10,
+        "throughput_rps": 2.0,
+        "latency_seconds": {"p95": 1.0},
+        "peak_rss_mb": 100.0,
+    }
+    faster = {**scenario, "throughput_rps": 3.0}
+
+    lines = compare({"scenarios": [scenario]}, {"scenarios": [faster]})
+
+    assert len(lines) == 2
+    assert "+50.0%" in lines[1]
@@ -0,0 +1,229 @@
+import asyncio
+
+import pytest
+
+from app.cache import (
+    MemoryCacheBackend,
+    RedisCacheBackend,
+    ReviewResultCache,
+    SnapshotCache,
+    git_blob_sha,
+    snapshot_digest,
+)
+from app.files import ContentStore, RepoFile
+from app.github import fetch_repository_files
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryCacheBackend()
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisCacheBackend(fakeredis.FakeAsyncRedis())
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_evicts_least_recently_used():
+    backend = MemoryCacheBackend(max_bytes=10)
+    await backend.set("a", b"1234")
+    await backend.set("b", b"1234")
+    await backend.get("a")
+    await backend.set("c", b"1234")
+
+    assert await backend.get_many(["a", "b", "c"]) == [b"1234", None, b"1234"]
+    assert backend.size == 8
+
+
+@pytest.mark.asyncio
+async def test_snapshot_round_trip_shares_blobs(backend):
+    cache = SnapshotCache(backend)
+    shared = {"path": "lib.py", "content": "x = 1", "size": 5}
+
+    stored = [dict(shared)]
+    await cache.put_snapshot("user", "repo", "c1", stored)
+    await cache.put_snapshot(
+        "user",
+        "repo",
+        "c2",
+        [dict(shared), {"path": "new.py", "content": "y", "size": 1}],
+    )
+
+    snapshot = await cache.get_snapshot("user", "repo", "c1")
+    assert snapshot == [{**shared, "sha": git_blob_sha("x = 1")}]
+    # The stored files are left as they were
+    assert stored == [shared]
+    assert await cache.get_snapshot("user", "repo", "missing") is None
+    assert cache.stats() == {"hits": 1, "misses": 1}
+    if isinstance(backend, MemoryCacheBackend):
+        # Two manifests plus two distinct blobs
+        assert len(backend) == 4
+
+
+@pytest.mark.asyncio
+async def test_snapshot_hit_is_read_into_the_content_store(monkeypatch):
+    monkeypatch.setattr("app.cache.SNAPSHOT_BATCH_BYTES", 4)
+    backend = MemoryCacheBackend()
+    cache = SnapshotCache(backend)
+    source = ContentStore()
+    files = [
+        RepoFile(f"{name}.py", 5, None, source.add(b"x = 1" + name.encode()))
+        for name in "abc"
+    ]
+    await cache.put_snapshot("user", "repo", "c1", files)
+    store = ContentStore(budget=6)
+
+    snapshot = await cache.get_snapshot("user", "repo", "c1", store)
+
+    assert all(isinstance(file, RepoFile) for file in snapshot)
+    assert [file["content"] for file in snapshot] == ["x = 1a", "x = 1b", "x = 1c"]
+    assert snapshot[0]["sha"] == git_blob_sha("x = 1a")
+    assert store.stats()["spilled_bytes"] == 12
+
+
+@pytest.mark.asyncio
+async def test_snapshot_with_evicted_blob_is_a_miss():
+    backend = MemoryCacheBackend()
+    cache = SnapshotCache(backend)
+    await cache.put_snapshot(
+        "user", "repo", "c1", [{"path": "a.py", "content": "a", "size": 1}]
+    )
+    backend._items.pop(f"blob:{git_blob_sha('a')}")
+
+    assert await cache.get_snapshot("user", "repo", "c1") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", ["contents", "tree"])
+async def test_repeat_fetch_only_resolves_head(fake_github, backend, strategy):
+    fake_github.add_repo("user", "repo", {"a.py": "a = 1", "pkg/b.py": "b = 2"})
+    cache = SnapshotCache(backend)
+
+    async with fake_github.client() as client:
+        first = await fetch_repository_files(
+            "https://github.com/user/repo",
+            "token",
+            strategy=strategy,
+            client=client,
+            cache=cache,
+        )
+        fake_github.calls.clear()
+        second = await fetch_repository_files(
+            "https://github.com/user/repo",
+            "token",
+            strategy=strategy,
+            client=client,
+            cache=cache,
+        )
+
+    assert first == second
+    # Fetched and cached files are the same kind of record
+    assert all(isinstance(file, RepoFile) for file in first + second)
+    assert dict(fake_github.calls) == {"commits": 1}
+
+
+@pytest.mark.asyncio
+async def test_new_commit_refetches_snapshot(fake_github):
+    fake_github.add_repo("user", "repo", {"a.py": "a = 1"})
+    cache = SnapshotCache(MemoryCacheBackend())
+
+    async with fake_github.client() as client:
+        await fetch_repository_files(
+            "https://github.com/user/repo", "token", client=client, cache=cache
+        )
+        fake_github.add_repo("user", "repo", {"a.py": "a = 2"})
+        result = await fetch_repository_files(
+            "https://github.com/user/repo", "token", client=client, cache=cache
+        )
+
+    assert result[0]["content"] == "a = 2"
+
+
+@pytest.mark.asyncio
+async def test_result_cache_expires_and_evicts():
+    now = [0.0]
+    cache = ReviewResultCache(max_entries=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 11
+    assert cache.get("a") is None
+
+
+@pytest.mark.asyncio
+async def test_result_cache_single_flight():
+    cache = ReviewResultCache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return {"rating": "8"}
+
+    results = await asyncio.gather(
+        *[cache.get_or_compute("key", compute) for _ in range(5)]
+    )
+    again = await cache.get_or_compute("key", compute)
+
+    assert calls == 1
+    assert [cached for _, cached in results].count(False) == 1
+    assert again == ({"rating": "8"}, True)
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 4, "entries": 1}
+
+
+@pytest.mark.asyncio
+async def test_result_cache_shares_failures_without_storing_them():
+    cache = ReviewResultCache()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(
+        cache.get_or_compute("key", failing),
+        cache.get_or_compute("key", failing),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.get("key") is None
+
+
+@pytest.mark.asyncio
+async def test_result_cache_waiters_recompute_when_the_leader_is_cancelled():
+    cache = ReviewResultCache()
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return {"rating": "8"}
+
+    leader = asyncio.create_task(cache.get_or_compute("key", compute))
+    await asyncio.sleep(0)
+    waiters = [
+        asyncio.create_task(cache.get_or_compute("key", compute)) for _ in range(2)
+    ]
+    await asyncio.sleep(0.005)
+    leader.cancel()
+    results = await asyncio.gather(*waiters)
+
+    assert leader.cancelled()
+    assert calls == 2
+    assert [value for value, _ in results] == [{"rating": "8"}] * 2
+    assert sorted(cached for _, cached in results) == [False, True]
+    assert cache.get("key") == {"rating": "8"}
+
+
+def test_snapshot_digest_ignores_order():
+    files = [
+        {"path": "a.py", "content": "a"},
+        {"path": "b.py", "content": "b"},
+    ]
+    assert snapshot_digest(files) == snapshot_digest(files[::-1])
+    assert snapshot_digest(files) != snapshot_digest(files[:1])
@@ -0,0 +1,153 @@
+import re
+
+import pytest
+
+from app.cascade import CascadePolicy
+from app.gpt import analyze_code
+from app.incremental import FragmentStore
+
+CONTENTS = [
+    {"path": "settings.py", "content": "DEBUG = False\n", "size": 14},
+    {"path": "views.py", "content": "def index():\n    return render()\n", "size": 33},
+    {"path": "auth.py", "content": "def login(user):\n    return True\n", "size": 33},
+    {"path": "utils.py", "content": "def pad(text):\n    return text\n", "size": 30},
+]
+TRIAGE = {
+    "settings.py": "trivial",
+    "views.py": "needs_attention",
+    "auth.py": "critical",
+}
+
+
+def cascade_model(model, prompt):
+    """Answers as the triage, review and synthesis tiers would."""
+    paths = re.findall(r"^File: (\S+)", prompt, re.MULTILINE)
+    if model == "gpt-4o-mini":
+        # utils.py is left out of the triage
+        return {
+            "files": [
+                {"path": path, "verdict": TRIAGE[path], "reason": f"{path} reason"}
+                for path in paths
+                if path in TRIAGE
+            ],
+            "rating": "6/10",
+            "conclusion": "First look",
+        }
+    if paths:
+        return {
+            "comments": ["Detailed remark"],
+            "file_comments": [
+                {"path": path, "comments": [f"Reviewed {path}"]} for path in paths
+            ],
+            "rating": "5/10",
+            "conclusion": "Detailed",
+        }
+    return {"rating": "5/10 overall", "conclusion": "Synthesized"}
+
+
+@pytest.fixture
+def cascade(monkeypatch, fake_llm):
+    monkeypatch.setattr("app.cascade.LLM_CASCADE", True)
+    fake_llm.respond = cascade_model
+    return fake_llm
+
+
+def test_policy_per_level(monkeypatch):
+    monkeypatch.setenv("CASCADE_REVIEW_MODEL", "gpt-4.1")
+    monkeypatch.setenv("CASCADE_SENIOR_ESCALATE", "trivial")
+    # As in .env.example: shared settings do not replace the level defaults
+    monkeypatch.setenv("CASCADE_ESCALATE", "needs_attention")
+    monkeypatch.setenv("CASCADE_REVIEW_MAX_TOKENS", "2000")
+    monkeypatch.setenv("CASCADE_JUNIOR_REVIEW_MAX_TOKENS", "1200")
+
+    junior = CascadePolicy.from_env("Junior")
+    senior = CascadePolicy.from_env(" Senior")
+    middle = CascadePolicy.from_env("Middle")
+
+    assert (junior.escalate, junior.review_max_tokens) == ("critical", 1200)
+    assert not junior.escalates("needs_attention") and junior.escalates("critical")
+    assert (senior.escalate, senior.review_model) == ("trivial", "gpt-4.1")
+    assert senior.review_max_tokens == 2500
+    assert (middle.escalate, middle.review_max_tokens) == ("needs_attention", 2000)
+    with pytest.raises(ValueError, match="Unknown cascade verdict"):
+        CascadePolicy(escalate="severe")
+
+
+def test_fragment_context_follows_the_cascade_policy(monkeypatch):
+    single = FragmentStore.context_key("Build an API", "Middle")
+    monkeypatch.setattr("app.cascade.LLM_CASCADE", True)
+    cascaded = FragmentStore.context_key("Build an API", "Middle")
+    monkeypatch.setenv("CASCADE_REVIEW_MODEL", "gpt-4.1")
+
+    assert cascaded != single
+    assert FragmentStore.context_key("Build an API", "Middle") != cascaded
+
+
+@pytest.mark.asyncio
+async def test_only_flagged_files_reach_the_review_model(cascade):
+    async with cascade.client() as client:
+        result = await analyze_code(CONTENTS, "Build an API", "Middle", "key", client)
+
+    (triage_prompt,) = cascade.prompts("gpt-4o-mini")
+    review_prompt, synthesis_prompt = cascade.prompts("gpt-4o")
+    assert "File: settings.py" in triage_prompt
+    assert "settings.py" not in review_prompt
+    assert re.findall(r"^File: (\S+)", review_prompt, re.MULTILINE) == [
+        "auth.py",
+        "utils.py",
+        "views.py",
+    ]
+    assert "Partial Reviews" in synthesis_prompt
+    assert cascade.requests[0]["response_format"]["json_schema"]["name"] == (
+        "TriageAnswer"
+    )
+    assert cascade.requests[1]["max_tokens"] == 2000
+
+    assert result["found_files"] == ["auth.py", "settings.py", "utils.py", "views.py"]
+    assert result["file_comments"]["settings.py"] == ["trivial: settings.py reason"]
+    assert result["file_comments"]["auth.py"] == ["Reviewed auth.py"]
+    assert result["conclusion"] == "Synthesized"
+    assert result["cascade"]["verdicts"]["utils.py"] == "untriaged"
+    assert result["cascade"]["escalated"] == ["auth.py", "utils.py", "views.py"]
+
+    tiers = result["usage"]["tiers"]
+    assert [tiers[tier]["model"] for tier in tiers] == [
+        "gpt-4o-mini",
+        "gpt-4o",
+        "gpt-4o",
+    ]
+    assert (tiers["triage"]["files"], tiers["review"]["files"]) == (4, 3)
+    assert 0 < tiers["triage"]["cost_usd"] < tiers["review"]["cost_usd"]
+    assert all(tier["seconds"] >= 0 for tier in tiers.values())
+    assert result["usage"]["requests"] == 3
+    assert result["usage"]["prompt_tokens"] == sum(
+        tier["prompt_tokens"] for tier in tiers.values()
+    )
+
+
+@pytest.mark.asyncio
+async def test_junior_policy_escalates_only_critical_files(cascade):
+    async with cascade.client() as client:
+        result = await analyze_code(CONTENTS, "Build an API", "Junior", "key", client)
+
+    review_prompt = cascade.prompts("gpt-4o")[0]
+    assert "views.py" not in review_prompt
+    assert result["cascade"]["escalated"] == ["auth.py", "utils.py"]
+    assert result["file_comments"]["views.py"] == ["needs_attention: views.py reason"]
+    assert cascade.requests[1]["max_tokens"] == 1500
+
+
+@pytest.mark.asyncio
+async def test_unusable_triage_escalates_every_file(cascade):
+    cascade.respond = lambda model, prompt: (
+        "no idea" if model == "gpt-4o-mini" else cascade_model(model, prompt)
+    )
+
+    async with cascade.client() as client:
+        result = await analyze_code(CONTENTS, "Build an API", "Middle", "key", client)
+
+    # The triage is asked twice, then every file is reviewed
+    assert len(cascade.prompts("gpt-4o-mini")) == 2
+    assert len(result["cascade"]["escalated"]) == 4
+    assert result["conclusion"] == "Detailed"
+    assert "synthesis" not in result["usage"]["tiers"]
@@ -0,0 +1,54 @@
+from app.chunking import count_tokens, plan_batches, truncate_to_tokens
+
+
+def make_files(count, size):
+    return [
+        {"path": f"file{i:02d}.py", "content": "x" * size, "size": size}
+        for i in range(count)
+    ]
+
+
+def test_count_tokens_is_positive_and_monotonic():
+    assert count_tokens("") == 0
+    assert 0 < count_tokens("def f(): pass") < count_tokens("def f(): pass\n" * 10)
+
+
+def test_truncate_to_tokens_respects_limit():
+    text = "word " * 500
+    truncated = truncate_to_tokens(text, 50)
+    assert count_tokens(truncated) <= 50
+    assert text.startswith(truncated)
+
+
+def test_plan_batches_fills_batches_up_to_budget():
+    files = make_files(10, 400)
+    per_file = count_tokens("x" * 400)
+
+    plan = plan_batches(files, batch_tokens=per_file * 3, max_total_tokens=10**6)
+
+    assert [len(batch) for batch in plan.batches] == [3, 3, 3, 1]
+    assert all(
+        sum(f["tokens"] for f in batch) <= per_file * 3 for batch in plan.batches
+    )
+    assert plan.tokens == per_file * 10
+    assert [f["path"] for f in plan.files] == sorted(f["path"] for f in files)
+
+
+def test_plan_batches_truncates_large_files_and_skips_over_budget():
+    files = make_files(4, 400) + [
+        {"path": "big.py", "content": "y" * 100000, "size": 100000}
+    ]
+    per_file = count_tokens("x" * 400)
+
+    plan = plan_batches(
+        files,
+        batch_tokens=per_file * 2,
+        file_tokens=per_file,
+        max_total_tokens=per_file * 3,
+    )
+
+    big = next(f for f in plan.files if f["path"] == "big.py")
+    assert big["truncated"] is True
+    assert big["tokens"] <= per_file
+    assert plan.tokens <= per_file * 3
+    assert len(plan.skipped) == 2
@@ -0,0 +1,70 @@
+import httpx
+import pytest
+
+from app.clients import ClientPool, ClientSettings, ConnectionStats, create_http_client
+
+
+class ReusingTransport(httpx.AsyncBaseTransport):
+    """Opens one connection on the first request and reuses it afterwards."""
+
+    def __init__(self):
+        self.connected = False
+
+    async def handle_async_request(self, request):
+        if not self.connected:
+            await request.extensions["trace"]("connection.connect_tcp.complete", {})
+            self.connected = True
+        return httpx.Response(200, json={"ok": True})
+
+
+@pytest.mark.asyncio
+async def test_instrumented_client_reports_connection_reuse():
+    stats = ConnectionStats()
+    client = create_http_client(ClientSettings(), stats, transport=ReusingTransport())
+
+    async with client:
+        for _ in range(4):
+            await client.get("https://api.github.com/rate_limit")
+
+    assert stats.as_dict() == {
+        "requests": 4,
+        "connections_opened": 1,
+        "http2_requests": 0,
+        "reuse_ratio": 0.75,
+    }
+
+
+@pytest.mark.asyncio
+async def test_client_pool_reuses_openai_client_per_key():
+    pool = ClientPool(ClientSettings(max_connections=5, openai_timeout=5))
+
+    assert pool.openai("key") is pool.openai("key")
+    assert pool.openai("key") is not pool.openai("other-key")
+    assert pool.openai("key")._client is pool.openai_http
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_webhooks_bypass_the_github_client():
+    github = ReusingTransport()
+    pool = ClientPool(
+        ClientSettings(),
+        github_transport=github,
+        webhook_transport=ReusingTransport(),
+    )
+
+    response = await pool.webhooks.post("https://hooks.test/done", json={})
+    stats = pool.stats()
+    await pool.aclose()
+
+    assert response.status_code == 200
+    assert not github.connected
+    assert stats["webhooks"]["requests"] == 1
+    assert stats["github"]["requests"] == 0
+
+
+def test_stats_endpoint_exposes_pool_counters(test_client):
+    response = test_client.get("/stats")
+
+    assert response.status_code == 200
+    assert set(response.json()["http"]) == {"github", "openai", "webhooks"}
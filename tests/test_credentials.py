@@ -0,0 +1,161 @@
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from app import metrics
+from app.credentials import (
+    DEFAULT_EJECTION,
+    CredentialPool,
+    CredentialTrackingTransport,
+    parse_duration,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def github_response(status, remaining, reset, **headers):
+    return httpx.Response(
+        status,
+        headers={
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(int(reset)),
+            **headers,
+        },
+    )
+
+
+def test_parse_duration():
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("1s") == 1
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1h2m3.5s") == pytest.approx(3723.5)
+
+
+def test_choose_prefers_most_remaining_quota():
+    clock = FakeClock()
+    pool = CredentialPool("github", ["a", "b", "c"], clock=clock)
+
+    # Unused credentials are handed out in turn
+    assert [pool.choose().secret for _ in range(3)] == ["a", "b", "c"]
+
+    pool.observe("a", github_response(200, 4000, clock.now + 3600))
+    pool.observe("b", github_response(200, 100, clock.now + 3600))
+    pool.observe("c", github_response(200, 2500, clock.now + 3600))
+    assert pool.choose().secret == "a"
+
+
+def test_rate_limited_credential_is_ejected_until_reset():
+    clock = FakeClock()
+    pool = CredentialPool("github", ["a", "b"], clock=clock)
+    pool.observe("a", github_response(403, 0, clock.now + 120))
+    pool.observe("b", github_response(200, 10, clock.now + 3600))
+
+    assert pool.choose().secret == "b"
+    assert [entry["ejected"] for entry in pool.stats()] == [True, False]
+
+    clock.now += 121
+    assert pool.stats()[0]["ejected"] is False
+    pool.observe("a", github_response(200, 5000, clock.now + 3600))
+    assert pool.choose().secret == "a"
+
+
+def test_credential_usage_is_exported_as_metrics():
+    clock = FakeClock()
+    pool = CredentialPool("github", ["ghp_secret-a", "ghp_secret-b"], clock=clock)
+    labels = {"provider": "github", "credential": "github-1"}
+    requests = metrics.credential_requests.value(**labels)
+    rate_limited = metrics.credential_rate_limited.value(**labels)
+
+    pool.observe("ghp_secret-a", github_response(200, 12, clock.now + 3600))
+    pool.observe("ghp_secret-a", github_response(403, 0, clock.now + 120))
+
+    assert metrics.credential_requests.value(**labels) == requests + 2
+    assert metrics.credential_rate_limited.value(**labels) == rate_limited + 1
+    assert metrics.credential_remaining.value(**labels) == 0
+    text = metrics.registry.render()
+    assert 'credential_remaining_requests{provider="github",credential="github-1"}' in (
+        text
+    )
+    assert "ghp_secret" not in text
+
+
+def test_http_date_retry_after_ejects_until_that_date():
+    clock = FakeClock()
+    pool = CredentialPool("openai", ["a", "b"], clock=clock)
+    pool.observe(
+        "a", httpx.Response(429, headers={"Retry-After": formatdate(clock.now + 90)})
+    )
+    pool.observe("b", httpx.Response(429, headers={"Retry-After": "tomorrow"}))
+
+    assert pool.credentials[0].ejected_until == clock.now + 90
+    assert pool.credentials[1].ejected_until == clock.now + DEFAULT_EJECTION
+
+
+def test_permission_errors_do_not_eject():
+    clock = FakeClock()
+    pool = CredentialPool("github", ["a"], clock=clock)
+    pool.observe("a", github_response(403, 4000, clock.now + 3600))
+
+    assert pool.stats()[0]["ejected"] is False
+    assert pool.stats()[0]["rate_limited"] == 0
+
+
+def test_all_ejected_returns_soonest_restored():
+    clock = FakeClock()
+    pool = CredentialPool("openai", ["a", "b"], clock=clock)
+    pool.observe("a", httpx.Response(429, headers={"Retry-After": "30"}))
+    pool.observe("b", httpx.Response(429, headers={"x-ratelimit-reset-requests": "5s"}))
+
+    assert pool.choose().secret == "b"
+
+
+def test_from_env_prefers_pool_and_follows_rotation(monkeypatch):
+    monkeypatch.setenv("GITHUB_TOKEN", "single")
+    monkeypatch.setenv("GITHUB_TOKENS", "one, two,one")
+    pool = CredentialPool.from_env("github")
+    assert [entry["name"] for entry in pool.stats()] == ["github-1", "github-2"]
+
+    pool.choose()
+    monkeypatch.setenv("GITHUB_TOKENS", "two,three")
+    assert pool.choose().secret in ("two", "three")
+    assert [c.secret for c in pool.credentials] == ["two", "three"]
+
+    monkeypatch.delenv("GITHUB_TOKENS")
+    monkeypatch.delenv("GITHUB_TOKEN")
+    assert pool.choose() is None
+
+
+@pytest.mark.asyncio
+async def test_transport_reports_openai_headers_to_pool():
+    clock = FakeClock()
+    pool = CredentialPool("openai", ["sk-1", "sk-2"], clock=clock)
+
+    def handler(request):
+        return httpx.Response(
+            200,
+            headers={
+                "x-ratelimit-remaining-requests": "42",
+                "x-ratelimit-reset-requests": "1m",
+            },
+            json={},
+        )
+
+    transport = CredentialTrackingTransport(httpx.MockTransport(handler), pool)
+    async with httpx.AsyncClient(transport=transport) as client:
+        await client.get(
+            "https://api.openai.com/v1/models", headers={"Authorization": "Bearer sk-2"}
+        )
+
+    first, second = pool.stats()
+    assert first["requests"] == 0
+    assert second["requests"] == 1
+    assert second["remaining"] == 42
+    assert second["reset"] == clock.now + 60
+    assert "sk-2" not in str(pool.stats())
@@ -0,0 +1,242 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import httpx
+import pytest
+
+from app.backends import BackendSettings
+from app.cache import MemoryCacheBackend, SnapshotCache
+from app.clients import ClientPool, ClientSettings
+from app.credentials import CredentialPool
+from app.files import ContentStore, RepoFile
+from app.github import fetch_repository_files
+from app.selection import FileSelector
+
+# Repository served by the peak RSS test: 64 files of 512 KiB
+LARGE_FILES = 64
+LARGE_FILE_LINES = 512 * 1024 // 9
+
+
+def test_content_store_spills_beyond_budget():
+    store = ContentStore(budget=10)
+
+    small = store.add(b"12345")
+    large = store.add(b"x" * 20)
+
+    assert not small.spilled
+    assert large.spilled
+    assert small.text() == "12345"
+    assert large.text() == "x" * 20
+    assert store.stats() == {"budget": 10, "memory_bytes": 5, "spilled_bytes": 20}
+    store.close()
+
+
+def test_content_store_keeps_interleaved_spills_apart():
+    store = ContentStore(budget=4)
+    first, second = store.writer(), store.writer()
+
+    # Concurrent downloads write to the spill file in turns
+    for index in range(3):
+        first.write(b"aa%d" % index)
+        second.write(b"bb%d" % index)
+
+    assert first.close().text() == "aa0aa1aa2"
+    assert second.close().text() == "bb0bb1bb2"
+    assert store.memory_bytes == 0
+
+
+def test_repo_file_reads_like_a_file_dict():
+    store = ContentStore(budget=0)
+    file = RepoFile("main.py", 5, None, store.add("héllo".encode()))
+
+    assert file == {"path": "main.py", "content": "héllo", "size": 5, "sha": None}
+    assert file.get("truncated") is None
+    file["sha"] = "abc"
+    assert file.sha == "abc"
+    assert not hasattr(file, "__dict__")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", ["contents", "tree"])
+async def test_fetch_streams_into_store(fake_github, strategy):
+    files = {f"pkg/module{index}.py": f"x = {index}\n" * 50 for index in range(6)}
+    fake_github.add_repo("user", "repo", files)
+    store = ContentStore(budget=1000)
+
+    async with fake_github.client() as client:
+        result = await fetch_repository_files(
+            "https://github.com/user/repo",
+            "token",
+            strategy=strategy,
+            client=client,
+            store=store,
+        )
+
+    assert all(isinstance(file, RepoFile) for file in result)
+    assert {file["path"]: file["content"] for file in result} == files
+    assert 0 < store.memory_bytes <= 1000
+    assert store.spilled_bytes > 0
+
+
+def test_peak_rss_of_review_fetch_stays_near_budget():
+    total_mb = LARGE_FILES * LARGE_FILE_LINES * 9 / (1024 * 1024)
+
+    bounded = _measure_fetch(1024 * 1024)
+    unbounded = _measure_fetch(10**12)
+
+    assert bounded["files"] == unbounded["files"] == LARGE_FILES
+    assert bounded["spilled_bytes"] > 0
+    # Raw downloads stream past the rate limiter without being kept
+    assert bounded["etag_entries"] == 0
+    assert bounded["growth_mb"] < total_mb / 4
+    # Without a budget every body stays resident, which also shows that the
+    # measurement sees the bodies at all
+    assert unbounded["peak_mb"] - bounded["peak_mb"] > total_mb / 2
+
+
+@pytest.mark.skipif(
+    not os.path.exists("/proc/self/statm"), reason="reads the current RSS from /proc"
+)
+def test_peak_rss_of_cached_review_stays_near_budget():
+    total_mb = LARGE_FILES * LARGE_FILE_LINES * 9 / (1024 * 1024)
+
+    cached = _measure_fetch(1024 * 1024, cached=True)
+
+    assert cached["files"] == LARGE_FILES
+    assert cached["snapshot_hits"] == 1
+    # The snapshot is read into the review's store, which spills it
+    assert cached["spilled_bytes"] > 0
+    # The first fetch set the peak; what the cached files keep resident is
+    # measured instead
+    assert cached["held_mb"] < total_mb / 4
+
+
+def _measure_fetch(budget: int, cached: bool = False) -> dict:
+    """
+    Fetches the large repository in a fresh interpreter and returns its peak
+    RSS and how much the fetch raised it. With `cached`, a first fetch fills
+    an in-memory snapshot cache and the measured one is served from it.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    args = [str(budget)] + (["cached"] if cached else [])
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), *args],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=root,
+        env={**os.environ, "PYTHONPATH": root},
+    ).stdout
+    return json.loads(output)
+
+
+async def _large_body(index: int):
+    line = b"x = %04d\n" % index
+    for start in range(0, LARGE_FILE_LINES, 4096):
+        yield line * min(4096, LARGE_FILE_LINES - start)
+
+
+def _large_repo(request: httpx.Request) -> httpx.Response:
+    # Bodies are generated while streaming so the server holds none of them;
+    # like GitHub, raw downloads carry an ETag and their length
+    if request.url.host == "raw.githubusercontent.com":
+        index = int(request.url.path.rsplit("module", 1)[1].removesuffix(".py"))
+        return httpx.Response(
+            200,
+            headers={
+                "ETag": f'"module{index}"',
+                "Content-Length": str(LARGE_FILE_LINES * 9),
+            },
+            content=_large_body(index),
+        )
+    if request.url.path.endswith("/commits/HEAD"):
+        return httpx.Response(200, text="0123456789abcdef" * 2 + "01234567")
+    listing = [
+        {
+            "type": "file",
+            "name": f"module{index}.py",
+            "path": f"module{index}.py",
+            "size": LARGE_FILE_LINES * 9,
+            "download_url": "https://raw.githubusercontent.com/o/r/main/"
+            f"module{index}.py",
+        }
+        for index in range(LARGE_FILES)
+    ]
+    return httpx.Response(200, json=listing)
+
+
+def _rss_mb() -> float:
+    """
+    Current resident set size; unlike the peak, it falls again.
+    """
+    with open("/proc/self/statm") as statm:
+        pages = int(statm.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _large_selector() -> FileSelector:
+    return FileSelector(
+        extensions={".py"},
+        max_file_bytes=10**9,
+        max_total_bytes=10**12,
+        max_total_tokens=10**9,
+    )
+
+
+async def _fetch_large_repo(budget: int, cached: bool = False) -> dict:
+    from benchmarks.harness import peak_rss_mb
+
+    store = ContentStore(budget=budget)
+    cache = SnapshotCache(MemoryCacheBackend()) if cached else None
+    # The application's GitHub client, with its rate limiter and breaker
+    pool = ClientPool(
+        ClientSettings(),
+        github_credentials=CredentialPool("github", []),
+        openai_credentials=CredentialPool("openai", []),
+        github_transport=httpx.MockTransport(_large_repo),
+        backends=[BackendSettings()],
+    )
+    try:
+        if cache is not None:
+            # An earlier review takes the snapshot, the measured one reads it
+            first = ContentStore(budget=budget)
+            await fetch_repository_files(
+                "https://github.com/o/r",
+                "token",
+                client=pool.github,
+                cache=cache,
+                store=first,
+                selector=_large_selector(),
+            )
+            first.close()
+        resident = _rss_mb()
+        before = peak_rss_mb()
+        files = await fetch_repository_files(
+            "https://github.com/o/r",
+            "token",
+            client=pool.github,
+            cache=cache,
+            store=store,
+            selector=_large_selector(),
+        )
+        growth = peak_rss_mb() - before
+        held = _rss_mb() - resident
+    finally:
+        await pool.aclose()
+    return {
+        "files": len(files),
+        "peak_mb": peak_rss_mb(),
+        "growth_mb": growth,
+        "held_mb": held,
+        "etag_entries": pool.github_rate_limiter.stats()["etag_entries"],
+        "snapshot_hits": cache.hits if cache else 0,
+        **store.stats(),
+    }
+
+
+if __name__ == "__main__":
+    budget, cached = int(sys.argv[1]), sys.argv[2:] == ["cached"]
+    print(json.dumps(asyncio.run(_fetch_large_repo(budget, cached))))
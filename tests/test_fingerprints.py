@@ -0,0 +1,185 @@
+import os
+import time
+
+import pytest
+
+from app.cache import MemoryCacheBackend
+from app.fingerprints import (
+    FingerprintIndex,
+    duplicate_report,
+    fingerprint,
+    similarity,
+)
+from app.incremental import FragmentStore
+from app.review_service import perform_code_review
+from tests.test_incremental import REQUEST, fake_model, prompts
+
+
+def module(name: str, functions: int = 6) -> str:
+    return "".join(
+        f"def {name}_{index}(items, limit={index}):\n"
+        f"    total = sum(item.{name} for item in items if item.size > limit)\n"
+        f"    return total * {index} + len(items)\n\n"
+        for index in range(functions)
+    )
+
+
+def test_signatures_ignore_layout_and_track_edits():
+    source = module("price")
+    reformatted = source.replace("    ", "\t").replace(" + ", "+")
+    edited = source + "def extra(items):\n    return [item.price for item in items]\n"
+
+    assert fingerprint(source) == fingerprint(reformatted)
+    assert similarity(fingerprint(source), fingerprint(edited)) >= 0.8
+    assert similarity(fingerprint(source), fingerprint(module("weight"))) < 0.5
+    # Too short to tell copies from coincidences
+    assert fingerprint("import os\n") is None
+
+
+@pytest.mark.asyncio
+async def test_index_matches_copies_from_other_repositories():
+    index = FingerprintIndex(threshold=0.8)
+    original = module("price")
+    await index.register(
+        "alice/shop", [{"path": "cart.py", "content": original, "sha": "a1"}]
+    )
+
+    matches = await index.register(
+        "bob/store",
+        [
+            {"path": "basket.py", "content": original, "sha": "a1"},
+            {"path": "cart.py", "content": original + "X = 1\n", "sha": "b1"},
+            {"path": "stock.py", "content": module("weight"), "sha": "b2"},
+            {"path": "__init__.py", "content": "", "sha": "b3"},
+        ],
+    )
+
+    assert [(m.path, m.matched_path, m.exact) for m in matches] == [
+        ("basket.py", "cart.py", True),
+        ("cart.py", "cart.py", False),
+    ]
+    assert matches[0].repository == "alice/shop"
+    assert 0.8 <= matches[1].similarity < 1.0
+    # Copies within a repository do not count
+    own = index.lookup("alice/shop", "a1", fingerprint(original))
+    assert own.repository == "bob/store"
+    assert duplicate_report(matches, 4)["repositories"] == [
+        {"repository": "alice/shop", "files": 2, "share": 0.5}
+    ]
+    assert index.stats()["entries"] == 4
+
+
+def test_index_replaces_changed_files_and_evicts_the_oldest():
+    index = FingerprintIndex(max_entries=2)
+    signatures = [fingerprint(module(name)) for name in ("a", "b", "c")]
+
+    index.add("o/r", "a.py", "1", signatures[0])
+    index.add("o/r", "a.py", "2", signatures[1])
+    assert len(index) == 1
+    assert index.lookup("x/y", "1", signatures[0]) is None
+
+    index.add("o/r", "b.py", "3", signatures[1])
+    index.add("o/r", "c.py", "4", signatures[2])
+    assert len(index) == 2
+    assert index.lookup("x/y", "4", signatures[2]).matched_path == "c.py"
+    # "a.py" was the oldest entry and made room for "c.py"
+    assert index.lookup("x/y", "2", signatures[1]).matched_path == "b.py"
+
+
+@pytest.mark.asyncio
+async def test_full_review_reuses_fragments_of_copied_files(fake_github):
+    shared = module("price")
+    fake_github.add_repo("alice", "shop", {"cart.py": shared, "app.py": "run()"})
+    fake_github.add_repo("bob", "store", {"cart.py": shared, "main.py": "go()"})
+    store = FragmentStore(MemoryCacheBackend())
+    index = FingerprintIndex()
+    model = fake_model()
+
+    async with fake_github.client() as client:
+        first = await perform_code_review(
+            {**REQUEST, "github_repo_url": "https://github.com/alice/shop"},
+            "token",
+            "key",
+            client,
+            model,
+            fragment_store=store,
+            fingerprint_index=index,
+        )
+        model.chat.completions.create.reset_mock()
+        second = await perform_code_review(
+            {**REQUEST, "github_repo_url": "https://github.com/bob/store"},
+            "token",
+            "key",
+            client,
+            model,
+            fragment_store=store,
+            fingerprint_index=index,
+        )
+
+    assert first["duplicates"] == {"files": [], "repositories": []}
+    (prompt,) = prompts(model)
+    assert "File: main.py" in prompt and "cart.py" not in prompt
+    assert second["found_files"] == ["cart.py", "main.py"]
+    assert second["file_comments"]["cart.py"] == ["Reviewed cart.py"]
+    assert second["duplicates"]["files"][0]["repository"] == "alice/shop"
+    assert second["duplicates"]["repositories"][0]["share"] == 0.5
+    assert store.stats()["reused_files"] == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("reuse_similarity", [None, 0.9])
+async def test_near_copies_reuse_fragments_only_when_enabled(
+    fake_github, monkeypatch, reuse_similarity
+):
+    monkeypatch.setattr(
+        "app.incremental.FINGERPRINT_REUSE_SIMILARITY", reuse_similarity
+    )
+    shared = module("price")
+    # Same signature, different blob: the layout differs
+    reformatted = shared.replace("    ", "\t")
+    fake_github.add_repo("alice", "shop", {"cart.py": shared})
+    fake_github.add_repo("bob", "store", {"cart.py": reformatted, "main.py": "go()"})
+    store = FragmentStore(MemoryCacheBackend())
+    index = FingerprintIndex()
+    model = fake_model()
+
+    async with fake_github.client() as client:
+        for owner, repo in (("alice", "shop"), ("bob", "store")):
+            model.chat.completions.create.reset_mock()
+            result = await perform_code_review(
+                {**REQUEST, "github_repo_url": f"https://github.com/{owner}/{repo}"},
+                "token",
+                "key",
+                client,
+                model,
+                fragment_store=store,
+                fingerprint_index=index,
+            )
+
+    (prompt,) = prompts(model)
+    match = result["duplicates"]["files"][0]
+    assert (match["path"], match["exact"], match["similarity"]) == (
+        "cart.py",
+        False,
+        1.0,
+    )
+    assert ("File: cart.py" in prompt) is (reuse_similarity is None)
+    assert store.stats()["reused_files"] == (reuse_similarity is not None)
+
+
+def test_lookup_takes_under_a_millisecond_at_100k_files():
+    index = FingerprintIndex(max_entries=200_000)
+    sources = [module(f"field{seed}", functions=4) for seed in range(200)]
+    for seed, source in enumerate(sources):
+        index.add("cohort/original", f"m{seed}.py", f"s{seed}", fingerprint(source))
+    for entry in range(100_000 - len(sources)):
+        index.add("cohort/other", f"f{entry}.py", str(entry), os.urandom(128))
+    queries = [fingerprint(source + "\nX = 1\n") for source in sources]
+
+    started = time.perf_counter()
+    matches = [index.lookup("cohort/new", "?", signature) for signature in queries]
+    elapsed = (time.perf_counter() - started) / len(queries)
+
+    assert len(index) == 100_000
+    assert all(match is not None for match in matches)
+    assert elapsed < 0.001
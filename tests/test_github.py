@@ -1,9 +1,11 @@
-from unittest.mock import AsyncMock, Mock, patch
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 
+import httpx
 import pytest
 
 from app.exceptions import ReviewServiceError
-from app.github import fetch_repository_files
+from app.github import CrawlStats, _process_repository_contents, fetch_repository_files
 
 
 @pytest.mark.asyncio
@@ -24,14 +26,21 @@ async def test_fetch_repository_files_success():
         mock_response.status_code = 200
         mock_response.json.return_value = mock_contents
 
-        # Mock second response (file content)
+        # Mock second response (file content, streamed)
+        async def file_chunks():
+            yield b"print("
+            yield b"'test')"
+
         mock_file_response = Mock()
         mock_file_response.status_code = 200
-        mock_file_response.text = "print('test')"
+        mock_file_response.aiter_bytes = file_chunks
+        mock_stream = MagicMock()
+        mock_stream.__aenter__.return_value = mock_file_response
 
         # Set up mocked AsyncClient
         mock_client_instance = AsyncMock()
-        mock_client_instance.get.side_effect = [mock_response, mock_file_response]
+        mock_client_instance.get.side_effect = [mock_response]
+        mock_client_instance.stream = Mock(return_value=mock_stream)
         mock_client.return_value.__aenter__.return_value = mock_client_instance
 
         # Call the actual function
@@ -84,6 +93,7 @@ async def test_fetch_repository_files_access_denied():
         mock_response = AsyncMock()
         mock_response.status_code = 403
         mock_response.json = AsyncMock(return_value={"message": "Access Denied"})
+        mock_response.headers = {}
 
         mock_client_instance = AsyncMock()
         mock_client_instance.get.return_value = mock_response
@@ -92,3 +102,116 @@ async def test_fetch_repository_files_access_denied():
         with pytest.raises(ReviewServiceError) as exc_info:
             await fetch_repository_files("https://github.com/user/repo", "fake-token")
         assert "Access denied" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_process_repository_contents_is_bounded_and_concurrent():
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        if request.url.path == "/dir":
+            return httpx.Response(
+                200,
+                json=[
+                    {
+                        "type": "file",
+                        "name": f"b{i}.py",
+                        "path": f"pkg/b{i}.py",
+                        "download_url": f"https://raw.test/pkg/b{i}.py",
+                        "size": 1,
+                    }
+                    for i in range(5)
+                ],
+            )
+        return httpx.Response(200, text=request.url.path)
+
+    contents = [
+        {
+            "type": "file",
+            "name": f"a{i}.py",
+            "path": f"a{i}.py",
+            "download_url": f"https://raw.test/a{i}.py",
+            "size": 1,
+        }
+        for i in range(8)
+    ] + [{"type": "dir", "name": "pkg", "path": "pkg", "url": "https://api.test/dir"}]
+
+    stats = CrawlStats()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        result = await _process_repository_contents(
+            contents, client, {}, asyncio.Semaphore(3), stats
+        )
+
+    assert len(result) == 13
+    assert 1 < peak <= 3
+    assert stats.files == 13
+    assert stats.directories == 1
+    assert stats.requests == 14
+
+
+REPO_FILES = {
+    "main.py": "print('main')",
+    "README.md": "# docs",
+    "pkg/util.py": "def util():\n    return 1\n",
+    "pkg/deep/" + "x" * 120 + ".js": "console.log('long path')",
+}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", ["contents", "tree"])
+async def test_fetch_strategies_return_same_files(fake_github, strategy):
+    fake_github.add_repo("user", "repo", REPO_FILES)
+
+    async with fake_github.client() as client:
+        result = await fetch_repository_files(
+            "https://github.com/user/repo", "token", strategy=strategy, client=client
+        )
+
+    assert [file["path"] for file in result] == sorted(
+        path for path in REPO_FILES if not path.endswith(".md")
+    )
+    assert all(file["content"] == REPO_FILES[file["path"]] for file in result)
+
+
+@pytest.mark.asyncio
+async def test_tree_strategy_uses_two_requests(fake_github):
+    fake_github.add_repo("user", "repo", REPO_FILES)
+
+    async with fake_github.client() as client:
+        await fetch_repository_files(
+            "https://github.com/user/repo", "token", strategy="tree", client=client
+        )
+
+    assert sum(fake_github.calls.values()) == 2
+    assert fake_github.calls["git"] == 1
+    assert fake_github.calls["tarball"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tree_strategy_falls_back_when_truncated(fake_github):
+    fake_github.add_repo("user", "repo", REPO_FILES)
+    fake_github.truncated = True
+
+    async with fake_github.client() as client:
+        result = await fetch_repository_files(
+            "https://github.com/user/repo", "token", strategy="tree", client=client
+        )
+
+    assert len(result) == 3
+    assert fake_github.calls["tarball"] == 0
+    assert fake_github.calls["contents"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_fetch_repository_files_unknown_strategy():
+    with pytest.raises(ReviewServiceError) as exc_info:
+        await fetch_repository_files(
+            "https://github.com/user/repo", "token", strategy="bogus"
+        )
+    assert "Unknown fetch strategy" in str(exc_info.value)
@@ -1,11 +1,20 @@
 import json
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 from openai import OpenAIError
 
+from app import gpt, metrics
+from app.cache import ReviewResultCache
 from app.exceptions import ReviewServiceError
-from app.gpt import analyze_code
+from app.gpt import CommentExtractor, analyze_code, get_openai_client
+
+
+@pytest.fixture(autouse=True)
+def reset_openai_clients():
+    gpt._clients.clear()
+    yield
+    gpt._clients.clear()
 
 
 @pytest.mark.asyncio
@@ -36,10 +45,10 @@ async def test_analyze_code_success():
         )
     ]
 
-    # Synchronous mock for OpenAI API
-    with patch("app.gpt.OpenAI") as mock_openai_class:
+    # Async mock for OpenAI API
+    with patch("app.gpt.AsyncOpenAI") as mock_openai_class:
         mock_client = MagicMock()
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
         mock_openai_class.return_value = mock_client
 
         result = await analyze_code(
@@ -50,6 +59,7 @@ async def test_analyze_code_success():
         )
 
         # Assertions
+        mock_client.chat.completions.create.assert_awaited_once()
         assert result["found_files"] == ["test.py"]
         assert "comments" in result
         assert "rating" in result
@@ -63,10 +73,12 @@ async def test_analyze_code_success():
 async def test_analyze_code_api_error():
     mock_contents = [{"path": "test.py", "content": "print('test')", "size": 100}]
 
-    with patch("openai.OpenAI") as mock_openai_class:
+    with patch("app.gpt.AsyncOpenAI") as mock_openai_class:
         # Configure the mock to raise an OpenAI error
         mock_client = MagicMock()
-        mock_client.chat.completions.create.side_effect = OpenAIError("API Error")
+        mock_client.chat.completions.create = AsyncMock(
+            side_effect=OpenAIError("API Error")
+        )
         mock_openai_class.return_value = mock_client
 
         with pytest.raises(ReviewServiceError) as exc_info:
@@ -79,6 +91,24 @@ async def test_analyze_code_api_error():
         assert "Unable to connect to OpenAI API" in str(exc_info.value)
 
 
+@pytest.mark.asyncio
+async def test_analyze_code_without_batches_is_an_error():
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock()
+
+    with pytest.raises(ReviewServiceError) as exc_info:
+        await analyze_code(
+            contents=[],
+            description="Test assignment",
+            level="Senior",
+            api_key="fake-key",
+            client=client,
+        )
+
+    assert exc_info.value.category == "empty_repository"
+    client.chat.completions.create.assert_not_called()
+
+
 @pytest.mark.asyncio
 async def test_analyze_code_invalid_json():
     # Mock repository contents
@@ -90,11 +120,10 @@ async def test_analyze_code_invalid_json():
         MagicMock(message=MagicMock(content="Invalid JSON response"))
     ]
 
-    # Synchronous mock for OpenAI API
-    with patch("app.gpt.OpenAI") as mock_openai_class:
+    # Async mock for OpenAI API
+    with patch("app.gpt.AsyncOpenAI") as mock_openai_class:
         mock_client = MagicMock()
-        # API call handled as synchronous
-        mock_client.chat.completions.create.return_value = mock_response
+        mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
         mock_openai_class.return_value = mock_client
 
         result = await analyze_code(
@@ -108,3 +137,240 @@ async def test_analyze_code_invalid_json():
         assert result["rating"] == "N/A"
         assert "Error: AI response was not in the expected format" in result["comments"]
         assert result["conclusion"] == "Invalid JSON response"
+
+
+def test_get_openai_client_is_shared_per_key():
+    with patch("app.gpt.AsyncOpenAI", side_effect=lambda **_: MagicMock()) as cls:
+        first = get_openai_client("key-a")
+        second = get_openai_client("key-a")
+        other = get_openai_client("key-b")
+
+    assert first is second
+    assert first is not other
+    assert cls.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_analyze_code_memoizes_identical_requests():
+    mock_contents = [{"path": "test.py", "content": "print('test')", "size": 100}]
+    mock_response = MagicMock()
+    mock_response.choices = [
+        MagicMock(message=MagicMock(content=json.dumps({"rating": "7/10"})))
+    ]
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    cache = ReviewResultCache()
+
+    first = await analyze_code(
+        mock_contents, "Build  an API", "Senior", "key", mock_client, cache
+    )
+    second = await analyze_code(
+        mock_contents, "Build an API\n", " Senior", "key", mock_client, cache
+    )
+    other = await analyze_code(
+        mock_contents, "Build a CLI", "Senior", "key", mock_client, cache
+    )
+
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert second["rating"] == "7/10"
+    assert other["cached"] is False
+    assert mock_client.chat.completions.create.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_analyze_code_does_not_memoize_unparseable_output(monkeypatch):
+    monkeypatch.setattr("app.gpt.LLM_FORMAT_RETRIES", 0)
+    mock_contents = [{"path": "test.py", "content": "print('test')", "size": 100}]
+    mock_response = MagicMock()
+    mock_response.choices = [MagicMock(message=MagicMock(content="not json"))]
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(return_value=mock_response)
+    cache = ReviewResultCache()
+
+    for _ in range(2):
+        result = await analyze_code(
+            mock_contents, "Test", "Senior", "key", mock_client, cache
+        )
+
+    assert result["cached"] is False
+    assert mock_client.chat.completions.create.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_analyze_code_map_reduces_large_repositories(monkeypatch):
+    monkeypatch.setattr("app.chunking.BATCH_TOKENS", 200)
+    monkeypatch.setattr("app.chunking.FILE_TOKENS", 200)
+    contents = [
+        {"path": f"mod{i}.py", "content": "value = 1\n" * 60, "size": 600}
+        for i in range(3)
+    ]
+
+    def completion(content):
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=json.dumps(content)))],
+            usage=MagicMock(prompt_tokens=100, completion_tokens=10),
+        )
+
+    partial = {"comments": ["Shared remark"], "rating": "6/10", "conclusion": "ok"}
+    final = {"rating": "7/10 overall", "conclusion": "Merged conclusion"}
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(
+        side_effect=[completion(partial)] * 3 + [completion(final)]
+    )
+
+    result = await analyze_code(contents, "Test", "Senior", "key", mock_client)
+
+    assert mock_client.chat.completions.create.await_count == 4
+    assert result["found_files"] == ["mod0.py", "mod1.py", "mod2.py"]
+    assert result["comments"] == ["Shared remark"]
+    assert result["rating"] == "7/10 overall"
+    assert result["conclusion"] == "Merged conclusion"
+    assert result["usage"]["batches"] == 3
+    assert result["usage"]["requests"] == 4
+    assert result["usage"]["total_tokens"] == 440
+    reduce_prompt = mock_client.chat.completions.create.await_args.kwargs["messages"][
+        1
+    ]["content"]
+    assert "Part 3:" in reduce_prompt
+
+
+def test_comment_extractor_emits_comments_as_they_complete():
+    answer = json.dumps(
+        {"comments": ['First, with "quotes"', "Second"], "rating": "8/10"}
+    )
+    extractor = CommentExtractor()
+
+    emitted = []
+    for char in answer:
+        emitted.append(extractor.feed(char))
+
+    flat = [comment for batch in emitted for comment in batch]
+    assert flat == ['First, with "quotes"', "Second"]
+    # Each comment is reported as soon as its closing quote arrives
+    assert emitted[answer.index(', "Second"') - 1] == ['First, with "quotes"']
+
+
+@pytest.mark.asyncio
+async def test_analyze_code_streams_progress_events(streamed_completion):
+    answer = json.dumps(
+        {"comments": ["Good naming", "Add tests"], "rating": "8/10", "conclusion": "ok"}
+    )
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(
+        side_effect=lambda **kwargs: streamed_completion(answer)
+    )
+    events = []
+
+    async def progress(event, data):
+        events.append((event, data))
+
+    result = await analyze_code(
+        [{"path": "main.py", "content": "x = 1", "size": 5}],
+        "Test",
+        "Senior",
+        "key",
+        mock_client,
+        progress=progress,
+    )
+
+    assert mock_client.chat.completions.create.await_args.kwargs["stream"] is True
+    assert [event for event, _ in events] == [
+        "batch_started",
+        "comment",
+        "comment",
+        "batch_completed",
+    ]
+    assert events[1][1] == {"batch": 1, "text": "Good naming"}
+    assert result["comments"] == ["Good naming", "Add tests"]
+    assert result["usage"]["total_tokens"] == 70
+
+
+def completion_of(content):
+    return MagicMock(
+        choices=[MagicMock(message=MagicMock(content=content))],
+        usage=MagicMock(prompt_tokens=100, completion_tokens=10),
+    )
+
+
+@pytest.mark.asyncio
+async def test_analyze_code_requests_the_answer_schema():
+    answer = {
+        "comments": ["Good naming"],
+        "file_comments": [{"path": "main.py", "comments": ["Split run()"]}],
+        "rating": "8/10",
+        "conclusion": "ok",
+    }
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(
+        return_value=completion_of(json.dumps(answer))
+    )
+
+    result = await analyze_code(
+        [{"path": "main.py", "content": "x = 1", "size": 5}],
+        "Test",
+        "Senior",
+        "key",
+        mock_client,
+    )
+
+    response_format = mock_client.chat.completions.create.await_args.kwargs[
+        "response_format"
+    ]
+    schema = response_format["json_schema"]["schema"]
+    assert response_format["json_schema"]["strict"] is True
+    assert schema["required"] == ["comments", "file_comments", "rating", "conclusion"]
+    assert schema["additionalProperties"] is False
+    assert result["file_comments"] == {"main.py": ["Split run()"]}
+    assert result["comments"] == ["Good naming", "main.py: Split run()"]
+
+
+@pytest.mark.asyncio
+async def test_truncated_answer_is_repaired_without_a_retry():
+    answer = json.dumps(
+        {"comments": ["Add tests"], "rating": "6/10", "conclusion": "Works, but the"}
+    )
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(
+        return_value=completion_of(answer[: answer.index(' the"')])
+    )
+    repaired = metrics.llm_answers.value(outcome="repaired")
+
+    result = await analyze_code(
+        [{"path": "main.py", "content": "x = 1", "size": 5}],
+        "Test",
+        "Senior",
+        "key",
+        mock_client,
+    )
+
+    assert result["rating"] == "6/10"
+    assert result["conclusion"] == "Works, but"
+    assert result["usage"]["requests"] == 1
+    assert result["usage"]["format_retries"] == 0
+    assert metrics.llm_answers.value(outcome="repaired") == repaired + 1
+
+
+@pytest.mark.asyncio
+async def test_unusable_answer_is_retried_once():
+    # Cut before the rating: too little is left to repair
+    cut = '{"comments": ["Add tests", "Rena'
+    valid = json.dumps({"comments": ["Add tests"], "rating": "6/10"})
+    mock_client = MagicMock()
+    mock_client.chat.completions.create = AsyncMock(
+        side_effect=[completion_of(cut), completion_of(valid)]
+    )
+    retried = metrics.llm_answers.value(outcome="retried")
+
+    result = await analyze_code(
+        [{"path": "main.py", "content": "x = 1", "size": 5}],
+        "Test",
+        "Senior",
+        "key",
+        mock_client,
+    )
+
+    assert result["rating"] == "6/10"
+    assert result["usage"]["requests"] == 2
+    assert result["usage"]["format_retries"] == 1
+    assert metrics.llm_answers.value(outcome="retried") == retried + 1
@@ -0,0 +1,188 @@
+import json
+import re
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.cache import MemoryCacheBackend
+from app.incremental import FragmentStore
+from app.review_service import perform_code_review
+
+REQUEST = {
+    "github_repo_url": "https://github.com/user/repo",
+    "assignment_description": "Build a CLI",
+    "candidate_level": "Middle",
+}
+
+
+def fake_model(general=lambda paths: "Consistent style"):
+    """Reviews each file in the prompt with one comment naming its contents."""
+
+    def create(**kwargs):
+        prompt = kwargs["messages"][1]["content"]
+        paths = re.findall(r"^File: (.+)$", prompt, re.MULTILINE)
+        if paths:
+            answer = {
+                "comments": [general(paths)],
+                "file_comments": {path: [f"Reviewed {path}"] for path in paths},
+                "rating": "7/10",
+                "conclusion": "Solid",
+            }
+        else:
+            answer = {"rating": "8/10", "conclusion": "Improved"}
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=json.dumps(answer)))],
+            usage=MagicMock(prompt_tokens=10, completion_tokens=5),
+        )
+
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    return client
+
+
+def prompts(client):
+    return [
+        call.kwargs["messages"][1]["content"]
+        for call in client.chat.completions.create.await_args_list
+    ]
+
+
+@pytest.mark.asyncio
+async def test_rereview_only_fetches_and_reviews_changed_files(fake_github):
+    files = {"main.py": "print(1)", "util.py": "X = 1", "cli.py": "import sys"}
+    fake_github.add_repo("user", "repo", files)
+    store = FragmentStore(MemoryCacheBackend())
+    model = fake_model()
+
+    async with fake_github.client() as client:
+        first = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+        assert first["delta"] is None
+        assert first["rating"] == "7/10"
+
+        fake_github.add_repo(
+            "user", "repo", {"main.py": "print(1)", "util.py": "X = 2", "new.py": ""}
+        )
+        fake_github.calls.clear()
+        model.chat.completions.create.reset_mock()
+        second = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+
+    assert second["delta"]["reviewed_files"] == ["new.py", "util.py"]
+    assert second["delta"]["reused_files"] == ["main.py"]
+    assert second["delta"]["removed_files"] == ["cli.py"]
+    # Only the two changed bodies are downloaded and sent to the model
+    assert fake_github.calls["raw"] == 2
+    assert fake_github.calls["compare"] == 1
+    assert fake_github.calls["contents"] == 0
+    review_prompt, merge_prompt = prompts(model)
+    assert "File: util.py" in review_prompt and "main.py" not in review_prompt
+    assert "Rating: 7/10" in merge_prompt
+    assert second["found_files"] == ["main.py", "new.py", "util.py"]
+    assert second["file_comments"]["main.py"] == ["Reviewed main.py"]
+    assert "main.py: Reviewed main.py" in second["comments"]
+    assert second["rating"] == "8/10"
+    assert second["usage"]["requests"] == 2
+    assert store.stats() == {"reused_files": 1, "reviewed_files": 5}
+
+
+@pytest.mark.asyncio
+async def test_rereview_keeps_repository_wide_comments(fake_github):
+    fake_github.add_repo("user", "repo", {"main.py": "print(1)", "util.py": "X = 1"})
+    store = FragmentStore(MemoryCacheBackend())
+    model = fake_model(general=lambda paths: f"Overall {', '.join(paths)}")
+
+    async with fake_github.client() as client:
+        first = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+        fake_github.add_repo(
+            "user", "repo", {"main.py": "print(1)", "util.py": "X = 2"}
+        )
+        second = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+
+    assert "Overall main.py, util.py" in second["comments"]
+    assert "Overall util.py" in second["comments"]
+    assert second.keys() == first.keys()
+    assert second["preanalysis"]["files"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rereview_of_unchanged_commit_makes_no_model_calls(fake_github):
+    fake_github.add_repo("user", "repo", {"main.py": "print(1)"})
+    store = FragmentStore(MemoryCacheBackend())
+    model = fake_model()
+
+    async with fake_github.client() as client:
+        first = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+        model.chat.completions.create.reset_mock()
+        second = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+
+    assert model.chat.completions.create.await_count == 0
+    assert second["delta"]["reviewed_files"] == []
+    assert second["comments"] == first["comments"]
+    assert second["rating"] == first["rating"]
+
+
+@pytest.mark.asyncio
+async def test_different_assignment_is_reviewed_from_scratch(fake_github):
+    fake_github.add_repo("user", "repo", {"main.py": "print(1)"})
+    store = FragmentStore(MemoryCacheBackend())
+    model = fake_model()
+
+    async with fake_github.client() as client:
+        await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+        other = await perform_code_review(
+            {**REQUEST, "assignment_description": "Build a web app"},
+            "token",
+            "key",
+            client,
+            model,
+            fragment_store=store,
+        )
+
+    assert other["delta"] is None
+    assert model.chat.completions.create.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_rereview_selects_changed_files_by_size_and_head_rules(fake_github):
+    fake_github.add_repo("user", "repo", {"main.py": "print(1)"})
+    store = FragmentStore(MemoryCacheBackend())
+    model = fake_model()
+
+    async with fake_github.client() as client:
+        await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+        fake_github.add_repo(
+            "user",
+            "repo",
+            {
+                "main.py": "print(2)",
+                ".gitignore": "scratch/\n",
+                "scratch/try.py": "X = 1",
+                "huge.py": "x" * 300_000,
+            },
+        )
+        fake_github.calls.clear()
+        second = await perform_code_review(
+            REQUEST, "token", "key", client, model, fragment_store=store
+        )
+
+    assert second["delta"]["reviewed_files"] == ["main.py"]
+    assert fake_github.calls["git"] == 1
+    # The .gitignore and the one selected file
+    assert fake_github.calls["raw"] == 2
+    skipped = {item["path"]: item["reason"] for item in second["selection"]["skipped"]}
+    assert skipped == {"scratch/try.py": "gitignored", "huge.py": "too_large"}
@@ -0,0 +1,220 @@
+import asyncio
+import time
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+
+from app.exceptions import ReviewServiceError
+from app.jobs import (
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    MemoryJobQueue,
+    RedisJobQueue,
+    WorkerPool,
+    new_job,
+)
+from app.webhooks import WebhookPolicy
+
+REQUEST = {
+    "github_repo_url": "https://github.com/user/repo",
+    "assignment_description": "Test assignment",
+    "candidate_level": "Senior",
+}
+
+
+@pytest.fixture(params=["memory", "redis"])
+def job_queue(request):
+    if request.param == "memory":
+        return MemoryJobQueue()
+    return RedisJobQueue(fake_redis())
+
+
+def fake_redis():
+    fakeredis = pytest.importorskip("fakeredis")
+
+    class FakeRedis(fakeredis.FakeAsyncRedis):
+        # fakeredis returns from an empty BLMOVE at once instead of waiting
+        # out the timeout; BRPOPLPUSH is the same move and does block
+        async def blmove(self, first_list, second_list, timeout, src, dest):
+            assert (src, dest) == ("RIGHT", "LEFT")
+            return await self.brpoplpush(first_list, second_list, timeout)
+
+    return FakeRedis()
+
+
+async def wait_for_status(job_queue, job_id, statuses=(SUCCEEDED, FAILED)):
+    for _ in range(200):
+        job = await job_queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_respects_concurrency(job_queue):
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        return {"status": "success", "rating": "8/10"}
+
+    jobs = [new_job(REQUEST) for _ in range(6)]
+    for job in jobs:
+        await job_queue.enqueue(job)
+
+    pool = WorkerPool(job_queue, handler, concurrency=2)
+    pool.start()
+    try:
+        finished = [await wait_for_status(job_queue, job["job_id"]) for job in jobs]
+    finally:
+        await pool.stop()
+
+    assert all(job["status"] == SUCCEEDED for job in finished)
+    assert finished[0]["result"]["rating"] == "8/10"
+    assert peak == 2
+    assert await job_queue.depth() == 0
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_records_failures_and_delivers_webhook(job_queue):
+    delivered = []
+
+    def webhook(request):
+        delivered.append(request)
+        return httpx.Response(200)
+
+    handler = AsyncMock(side_effect=ReviewServiceError("Repository not found"))
+    job = new_job(REQUEST, webhook_url="https://hooks.test/done")
+    await job_queue.enqueue(job)
+
+    policy = WebhookPolicy(["hooks.test"], secret="s3cret")
+    async with httpx.AsyncClient(transport=httpx.MockTransport(webhook)) as client:
+        pool = WorkerPool(job_queue, handler, http_client=client, webhooks=policy)
+        finished = await pool.process(await job_queue.dequeue())
+
+    assert finished["status"] == FAILED
+    assert finished["error"] == "Repository not found"
+    assert finished["webhook_delivered"] is True
+    assert len(delivered) == 1
+    assert b"Repository not found" in delivered[0].content
+    assert delivered[0].headers["X-Webhook-Signature-256"] == policy.sign(
+        delivered[0].content
+    )
+
+
+@pytest.mark.asyncio
+async def test_worker_pool_skips_webhooks_to_private_addresses():
+    async def resolve(host, port):
+        return ["10.0.0.5"]
+
+    def webhook(request):
+        raise AssertionError("webhook sent to a private address")
+
+    queue = MemoryJobQueue()
+    await queue.enqueue(new_job(REQUEST, webhook_url="https://hooks.test/done"))
+    handler = AsyncMock(return_value={"status": "success"})
+    async with httpx.AsyncClient(transport=httpx.MockTransport(webhook)) as client:
+        pool = WorkerPool(
+            queue, handler, http_client=client, webhooks=WebhookPolicy(resolve=resolve)
+        )
+        finished = await pool.process(await queue.dequeue())
+
+    assert finished["status"] == SUCCEEDED
+    assert finished["webhook_delivered"] is False
+
+
+def test_submit_and_poll_review_job(test_client):
+    review = AsyncMock(return_value={"status": "success", "rating": "9/10"})
+    with patch("app.jobs.perform_code_review", review):
+        response = test_client.post("/reviews", json=REQUEST)
+        assert response.status_code == 202
+        status_url = response.json()["status_url"]
+
+        for _ in range(200):
+            job = test_client.get(status_url).json()
+            if job["status"] == SUCCEEDED:
+                break
+            time.sleep(0.01)
+
+    assert job["result"] == {"status": "success", "rating": "9/10"}
+    assert (
+        review.await_args.kwargs["request"]["github_repo_url"]
+        == REQUEST["github_repo_url"]
+    )
+
+
+def test_unknown_job_returns_404(test_client):
+    response = test_client.get("/reviews/does-not-exist")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_memory_queue_expires_and_caps_job_records():
+    now = [0.0]
+    queue = MemoryJobQueue(ttl=10, max_jobs=2, clock=lambda: now[0])
+    first, second, third = (new_job(REQUEST) for _ in range(3))
+
+    await queue.enqueue(first)
+    now[0] = 5
+    await queue.enqueue(second)
+    now[0] = 11
+    assert await queue.get(first["job_id"]) is None
+    await queue.update(second["job_id"], status=SUCCEEDED)
+    await queue.enqueue(third)
+    await queue.enqueue(new_job(REQUEST))
+
+    # The least recently updated record made room for the newest one
+    assert len(queue) == 2
+    assert await queue.get(second["job_id"]) is None
+    assert (await queue.get(third["job_id"]))["status"] == "queued"
+
+
+@pytest.mark.asyncio
+async def test_redis_queue_requeues_jobs_of_crashed_workers():
+    queue = RedisJobQueue(fake_redis(), claim_ttl=1)
+    job = new_job(REQUEST)
+    await queue.enqueue(job)
+
+    # A worker claims the job, then dies without acknowledging it
+    assert await queue.dequeue() == job["job_id"]
+    await queue.update(job["job_id"], status=RUNNING)
+    assert await queue.requeue_stale() == 0
+    await queue.client.delete(queue._claim_key(job["job_id"]))
+
+    # A lapsed claim is only trusted on the second pass
+    assert await queue.requeue_stale() == 0
+    assert await queue.requeue_stale() == 1
+    assert (await queue.get(job["job_id"]))["status"] == QUEUED
+    assert await queue.dequeue() == job["job_id"]
+
+    await queue.ack(job["job_id"])
+    assert await queue.client.llen(queue._processing_key) == 0
+
+
+@pytest.mark.asyncio
+async def test_stopping_the_pool_hands_running_jobs_back(job_queue):
+    started = asyncio.Event()
+
+    async def handler(request):
+        started.set()
+        await asyncio.sleep(60)
+
+    job = new_job(REQUEST)
+    await job_queue.enqueue(job)
+    pool = WorkerPool(job_queue, handler, concurrency=1)
+    pool.start()
+    await asyncio.wait_for(started.wait(), 5)
+    await pool.stop()
+
+    assert (await job_queue.get(job["job_id"]))["status"] == QUEUED
+    assert await job_queue.depth() == 1
+    assert await job_queue.dequeue() == job["job_id"]
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from app.jsonstream import JSONStream
+
+ANSWER = json.dumps(
+    {
+        "comments": ['Quote "this" \\ path', "Café ☃"],
+        "file_comments": [{"path": "main.py", "comments": ["Split run()"]}],
+        "rating": 7,
+        "flags": [1, 2.5, True, None, {}],
+        "conclusion": "Solid work",
+    }
+)
+
+
+@pytest.mark.parametrize("size", [1, 3, 64])
+def test_reports_string_values_however_the_text_is_split(size):
+    text = f"```json\n{ANSWER}\n```"
+    stream = JSONStream()
+
+    completed = []
+    for start in range(0, len(text), size):
+        completed += stream.feed(text[start : start + size])
+
+    assert stream.done and stream.document() == ANSWER
+    assert completed == [
+        (("comments", 0), 'Quote "this" \\ path'),
+        (("comments", 1), "Café ☃"),
+        (("file_comments", 0, "path"), "main.py"),
+        (("file_comments", 0, "comments", 0), "Split run()"),
+        (("conclusion",), "Solid work"),
+    ]
+
+
+def test_repair_closes_the_answer_wherever_it_was_cut():
+    for cut in range(1, len(ANSWER)):
+        stream = JSONStream()
+        stream.feed(ANSWER[:cut])
+        # Every prefix closes into a valid document
+        json.loads(stream.repair())
+
+    stream = JSONStream()
+    stream.feed(ANSWER[: ANSWER.index("work")])
+    assert json.loads(stream.repair())["conclusion"] == "Solid "
+    assert JSONStream().repair() is None
@@ -0,0 +1,155 @@
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app import metrics
+from app.cache import MemoryCacheBackend, SnapshotCache
+from app.exceptions import ReviewServiceError
+from app.metrics import Registry, estimate_cost
+from app.review_service import perform_code_review
+
+REQUEST = {
+    "github_repo_url": "https://github.com/user/repo",
+    "assignment_description": "Build a CLI",
+    "candidate_level": "Middle",
+}
+
+
+def fake_model():
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(
+        return_value=MagicMock(
+            choices=[
+                MagicMock(
+                    message=MagicMock(
+                        content=json.dumps(
+                            {"comments": ["Fine"], "rating": "7/10", "conclusion": "Ok"}
+                        )
+                    )
+                )
+            ],
+            usage=MagicMock(prompt_tokens=1000, completion_tokens=100),
+        )
+    )
+    return client
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests", ["route"])
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    requests.inc(route='/a"b')
+    requests.inc(2, route='/a"b')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    text = registry.render()
+
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{route="/a\\"b"} 3.0' in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{le="1.0"} 2' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+    assert "latency_seconds_count 3" in text
+    with pytest.raises(ValueError):
+        requests.inc(method="GET")
+
+
+def test_estimate_cost_uses_model_prices():
+    assert estimate_cost("gpt-4o", 1_000_000, 100_000) == pytest.approx(3.5)
+    assert estimate_cost("unknown-model", 1000, 1000) == 0.0
+
+
+@pytest.mark.asyncio
+async def test_review_pipeline_is_instrumented(fake_github):
+    fake_github.add_repo(
+        "user", "repo", {"main.py": "print(1)", "util.py": "X = 1", "README.md": "#"}
+    )
+    cache = SnapshotCache(MemoryCacheBackend())
+    before = {
+        "reviews": metrics.review_seconds.count(),
+        "crawls": metrics.github_crawl_seconds.count(strategy="contents"),
+        "downloads": metrics.github_file_fetch_seconds.count(),
+        "files": metrics.github_files_fetched.value(),
+        "bytes": metrics.github_bytes.value(source="raw"),
+        "prompts": metrics.prompt_build_seconds.count(),
+        "llm": metrics.llm_seconds.count(model="gpt-4o", stream="false"),
+        "tokens": metrics.llm_tokens.value(model="gpt-4o", kind="prompt"),
+        "cost": metrics.llm_cost.value(model="gpt-4o"),
+        "misses": metrics.cache_requests.value(cache="snapshot", result="miss"),
+        "hits": metrics.cache_requests.value(cache="snapshot", result="hit"),
+    }
+
+    async with fake_github.client() as client:
+        first = await perform_code_review(
+            {**REQUEST, "fetch_strategy": "contents"},
+            "token",
+            "key",
+            client,
+            fake_model(),
+            snapshot_cache=cache,
+        )
+        second = await perform_code_review(
+            {**REQUEST, "fetch_strategy": "contents"},
+            "token",
+            "key",
+            client,
+            fake_model(),
+            snapshot_cache=cache,
+        )
+
+    # Instrumentation leaves the results untouched
+    assert first["found_files"] == second["found_files"] == ["main.py", "util.py"]
+    assert first["usage"]["prompt_tokens"] == 1000
+
+    assert metrics.review_seconds.count() - before["reviews"] == 2
+    assert (
+        metrics.github_crawl_seconds.count(strategy="contents") - before["crawls"] == 2
+    )
+    # Only the first review downloads; the second is served by the snapshot
+    assert metrics.github_file_fetch_seconds.count() - before["downloads"] == 2
+    assert metrics.github_files_fetched.value() - before["files"] == 2
+    assert metrics.github_bytes.value(source="raw") - before["bytes"] == 13
+    assert metrics.prompt_build_seconds.count() - before["prompts"] == 2
+    assert (
+        metrics.llm_seconds.count(model="gpt-4o", stream="false") - before["llm"] == 2
+    )
+    assert (
+        metrics.llm_tokens.value(model="gpt-4o", kind="prompt") - before["tokens"]
+        == 2000
+    )
+    assert metrics.llm_cost.value(model="gpt-4o") - before["cost"] == pytest.approx(
+        2 * estimate_cost("gpt-4o", 1000, 100)
+    )
+    assert (
+        metrics.cache_requests.value(cache="snapshot", result="miss") - before["misses"]
+        == 1
+    )
+    assert (
+        metrics.cache_requests.value(cache="snapshot", result="hit") - before["hits"]
+        == 1
+    )
+
+
+@pytest.mark.asyncio
+async def test_review_errors_are_counted_by_category(fake_github):
+    before = metrics.review_errors.value(category="not_found")
+
+    async with fake_github.client() as client:
+        with pytest.raises(ReviewServiceError) as exc_info:
+            await perform_code_review(REQUEST, "token", "key", client, fake_model())
+
+    assert exc_info.value.category == "not_found"
+    assert metrics.review_errors.value(category="not_found") - before == 1
+
+
+def test_metrics_endpoint(test_client):
+    response = test_client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE review_duration_seconds histogram" in response.text
+    assert "# TYPE llm_tokens_total counter" in response.text
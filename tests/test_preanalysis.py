@@ -0,0 +1,210 @@
+import ast
+import textwrap
+
+import pytest
+
+from app.files import RepoFile
+from app.preanalysis import PreAnalyzer, analyze_source
+
+PYTHON_SOURCE = textwrap.dedent('''
+    """Order helpers."""
+    import json
+    import os
+
+
+    def total(items):
+        """Sums the item prices."""
+        result = 0
+        for item in items:
+            result += item["price"] * item.get("quantity", 1)
+        shipping = 4.95 if result else 0
+        discount = result * 0.1
+        taxes = (result - discount) * 0.21
+        result = result - discount + taxes + shipping
+        result = round(result, 2)
+        return result
+
+
+    def classify(order, rules=[]):
+        if not order:
+            return "empty"
+        if order["total"] > 100 and order["country"] == "NL":
+            return "large"
+        for rule in rules:
+            if rule(order):
+                return "custom"
+        try:
+            return json.dumps(order)
+        except:
+            return "invalid"
+
+
+    class Repository:
+        def __init__(self, path):
+            self.path = path
+            self.items = []
+            self.loaded = False
+            self.errors = 0
+            self.version = 1
+
+        def save(self, item):
+            self.items.append(item)
+            self.version += 1
+            self.loaded = True
+            self.errors = 0
+            with open(self.path, "w") as handle:
+                handle.write(json.dumps(self.items, indent=2, sort_keys=True))
+                handle.flush()
+            return item
+''')
+
+JS_SOURCE = textwrap.dedent("""
+    export function add(a, b) {
+      const total = a + b;
+      const label = "sum {";
+      const doubled = total * 2;
+      const half = doubled / 2;
+      const rounded = Math.round(half * 100) / 100;
+      const formatted = new Intl.NumberFormat("en-US").format(rounded);
+      const message = `${label}: ${formatted} (from ${a} and ${b})`;
+      document.querySelector("#sum").textContent = message;
+      return rounded;
+    }
+
+    class Store {
+      find(key) {
+        if (key == null) {
+          return undefined;
+        }
+        const value = this.cache[key];
+        return value;
+      }
+    }
+""")
+
+
+def test_python_simple_bodies_are_elided():
+    analysis = analyze_source("orders.py", PYTHON_SOURCE)
+
+    functions = {function.name: function for function in analysis.functions}
+    assert functions["total"].complexity == 3
+    assert functions["classify"].complexity == 7
+    assert functions["total"].elided
+    assert functions["Repository.save"].elided
+    # Complex functions and constructors keep their bodies
+    assert not functions["classify"].elided
+    assert not functions["Repository.__init__"].elided
+    assert analysis.classes == ["Repository"]
+
+    assert '"""Sums the item prices."""' in analysis.content
+    assert "...  # 9 lines elided, complexity 3" in analysis.content
+    assert "self.version += 1" not in analysis.content
+    assert analysis.tokens_after < analysis.tokens_before
+    ast.parse(analysis.content)
+
+
+def test_python_lint_findings():
+    analysis = analyze_source("orders.py", PYTHON_SOURCE)
+
+    assert analysis.lint == [
+        "line 4: unused import 'os'",
+        "line 20: mutable default argument in 'classify'",
+        "line 30: bare 'except:'",
+    ]
+    assert analysis.content.startswith("# pre-analysis: 2 of 4 function bodies")
+    assert "# lint: line 4: unused import 'os'" in analysis.content
+
+
+def test_brace_languages_are_scanned():
+    analysis = analyze_source("store.js", JS_SOURCE)
+
+    functions = {function.name: function for function in analysis.functions}
+    assert functions["add"].elided
+    assert functions["find"].complexity == 2
+    # The loose equality keeps the body in view
+    assert not functions["find"].elided
+    assert analysis.classes == ["Store"]
+    assert analysis.lint == ["line 16: loose equality, use === / !=="]
+    assert "// ... 9 lines elided, complexity 1" in analysis.content
+
+
+def test_unparseable_files_pass_through():
+    source = "def broken(:\n    pass\n"
+
+    analysis = analyze_source("broken.py", source)
+
+    assert analysis.error
+    assert analysis.content == source
+    assert analysis.tokens_after == analysis.tokens_before
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("workers", [0, 2])
+async def test_pre_analyzer_compresses_files(workers):
+    analyzer = PreAnalyzer(workers=workers, pool_min_files=1)
+    files = [
+        {"path": "orders.py", "content": PYTHON_SOURCE, "size": 1, "sha": "a"},
+        {"path": "store.js", "content": JS_SOURCE, "size": 2, "sha": "b"},
+        {"path": "Gemfile.rb", "content": "puts 1\n", "size": 3, "sha": "c"},
+    ]
+
+    try:
+        compressed, report = await analyzer.run(files)
+    finally:
+        analyzer.close()
+
+    assert [file["path"] for file in compressed] == [
+        "orders.py",
+        "store.js",
+        "Gemfile.rb",
+    ]
+    assert compressed[0]["sha"] == "a"
+    assert "self.version += 1" not in compressed[0]["content"]
+    # Files in languages without a parser are left as they are
+    assert compressed[2] is files[2]
+    assert report["files"] == 2
+    assert report["elided_functions"] == 3
+    assert report["tokens_after"] < report["tokens_before"]
+    assert set(report["lint"]) == {"orders.py", "store.js"}
+    assert analyzer.stats()["tokens_before"] == report["tokens_before"]
+
+
+@pytest.mark.asyncio
+async def test_disabled_pre_analyzer_passes_files_through():
+    files = [{"path": "orders.py", "content": PYTHON_SOURCE}]
+
+    assert await PreAnalyzer(enabled=False).run(files) == (files, None)
+
+
+class CountingBody:
+    """Content handle counting how often its file is decoded."""
+
+    def __init__(self, text):
+        self._text = text
+        self.reads = 0
+
+    def text(self):
+        self.reads += 1
+        return self._text
+
+
+@pytest.mark.asyncio
+async def test_pre_analyzer_stops_at_the_token_budget():
+    analyzer = PreAnalyzer(workers=0, pool_min_files=1)
+    bodies = [CountingBody(PYTHON_SOURCE) for _ in range(3)]
+    files = [
+        RepoFile(f"mod{i}.py", len(PYTHON_SOURCE), str(i), body)
+        for i, body in enumerate(bodies)
+    ]
+    files.append(RepoFile("notes.txt", 5, "n", CountingBody("notes")))
+    budget = 2 * analyze_source("mod0.py", PYTHON_SOURCE).tokens_after
+
+    compressed, report = await analyzer.run(files, max_total_tokens=budget)
+
+    assert report["files"] == 2
+    assert "self.version += 1" not in compressed[0]["content"]
+    # Past the budget, files are neither decoded nor replaced
+    assert [body.reads for body in bodies] == [1, 1, 0]
+    assert compressed[2] is files[2]
+    assert compressed[3] is files[3]
+    assert files[3]._content.reads == 0
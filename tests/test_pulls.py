@@ -0,0 +1,236 @@
+import json
+import re
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.diffs import DiffParser, group_hunks, nearest_anchor, parse_patch
+from app.github import parse_pull_url
+from app.review_service import perform_pull_review
+
+REQUEST = {
+    "pull_request_url": "https://github.com/user/repo/pull/7",
+    "assignment_description": "Add pagination to the API",
+    "candidate_level": "Middle",
+}
+
+DIFF = """\
+diff --git a/app/api.py b/app/api.py
+index 1111111..2222222 100644
+--- a/app/api.py
++++ b/app/api.py
+@@ -10,3 +10,4 @@ def list_items(page):
+     items = load()
+--- legacy separator
++    size = 50
++    return items[page * size : (page + 1) * size]
+     # end
+\\ No newline at end of file
+diff --git a/docs/old.md b/docs/new.md
+similarity index 90%
+rename from docs/old.md
+rename to docs/new.md
+diff --git a/tests/test_api.py b/tests/test_api.py
+new file mode 100644
+--- /dev/null
++++ b/tests/test_api.py
+@@ -0,0 +1,2 @@
++def test_pages():
++    assert True
+"""
+
+
+def numbered_module(lines: int, changed: dict) -> tuple:
+    old = [f"value_{index} = {index}" for index in range(1, lines + 1)]
+    new = list(old)
+    for line, text in changed.items():
+        new[line - 1] = text
+    return "\n".join(old) + "\n", "\n".join(new) + "\n"
+
+
+def fake_diff_model(line_comments):
+    """Comments on the given lines of every file in the prompt."""
+
+    def create(**kwargs):
+        prompt = kwargs["messages"][1]["content"]
+        paths = re.findall(r"^File: (\S+) \(", prompt, re.MULTILINE)
+        if paths:
+            answer = {
+                "comments": ["Focused change"],
+                "line_comments": [
+                    {"path": path, "line": line, "comment": f"Check {path}:{line}"}
+                    for path in paths
+                    for line in line_comments
+                ],
+                "rating": "7/10",
+                "conclusion": "Reasonable",
+            }
+        else:
+            answer = {"rating": "7/10", "conclusion": "Merged"}
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=json.dumps(answer)))],
+            usage=MagicMock(prompt_tokens=len(prompt) // 4, completion_tokens=5),
+        )
+
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(side_effect=create)
+    return client
+
+
+def test_parse_pull_url():
+    assert parse_pull_url("https://github.com/user/repo/pull/42") == (
+        "user",
+        "repo",
+        42,
+    )
+    with pytest.raises(Exception, match="Invalid pull request path"):
+        parse_pull_url("https://github.com/user/repo/issues/42")
+
+
+def test_diff_parser_reads_files_hunks_and_line_numbers():
+    parser = DiffParser()
+    for line in DIFF.splitlines():
+        parser.feed(line)
+    api, docs, tests = parser.close()
+
+    assert (api.path, api.status, len(api.hunks)) == ("app/api.py", "modified", 1)
+    hunk = api.hunks[0]
+    assert hunk.section == "def list_items(page):"
+    # A removed line starting with "--" stays part of the hunk
+    assert hunk.lines[1] == "--- legacy separator"
+    assert [number for number, _ in hunk.numbered()] == [10, None, 11, 12, 13]
+    assert (api.additions, api.deletions) == (2, 1)
+    assert (docs.path, docs.previous_path, docs.status) == (
+        "docs/new.md",
+        "docs/old.md",
+        "renamed",
+    )
+    assert not docs.hunks
+    assert (tests.path, tests.status, tests.hunks[0].new_end) == (
+        "tests/test_api.py",
+        "added",
+        2,
+    )
+
+
+def test_hunks_close_together_are_grouped():
+    old, new = numbered_module(200, {5: "x = 1", 12: "y = 2", 150: "z = 3"})
+    patch_text = "\n".join(
+        FakePatch.unified(old, new),
+    )
+    file = parse_patch("values.py", patch_text)
+
+    groups = group_hunks([file], gap=20)
+
+    assert [len(group.hunks) for group in groups] == [1, 1]
+    assert 5 in groups[0].anchors() and 12 in groups[0].anchors()
+    assert min(groups[1].anchors()) == 147
+    # Without bridging every hunk is its own group
+    assert len(group_hunks([file], gap=0)) == 2
+    assert group_hunks([file], max_tokens=20)[0].truncated
+
+
+def test_nearest_anchor():
+    anchors = [4, 5, 6, 20]
+    assert nearest_anchor(anchors, 5) == 5
+    assert nearest_anchor(anchors, 1) == 4
+    assert nearest_anchor(anchors, 12) == 6
+    assert nearest_anchor(anchors, 14) == 20
+    assert nearest_anchor(anchors, 99) == 20
+
+
+class FakePatch:
+    @staticmethod
+    def unified(old, new):
+        from tests.conftest import FakeGitHub
+
+        return FakeGitHub._patch(old, new).splitlines()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("source", ["files", "diff"])
+async def test_pull_review_anchors_comments_to_changed_lines(fake_github, source):
+    old, new = numbered_module(400, {100: "value_100 = compute()"})
+    fake_github.add_repo("user", "repo", {"values.py": new})
+    fake_github.add_pull(
+        "user",
+        "repo",
+        7,
+        {
+            "values.py": (old, new),
+            "helpers.py": (None, "def helper():\n    return 1\n"),
+            "legacy.py": ("print('bye')\n", None),
+        },
+    )
+    model = fake_diff_model([100, 300])
+
+    async with fake_github.client() as client:
+        result = await perform_pull_review(
+            {**REQUEST, "diff_source": source}, "token", "key", client, model
+        )
+
+    (prompt,) = [
+        call.kwargs["messages"][1]["content"]
+        for call in model.chat.completions.create.await_args_list
+    ]
+    # Only the hunks are sent, never the unchanged body of the file
+    assert "value_300" not in prompt
+    assert "  100 +value_100 = compute()" in prompt
+    assert fake_github.calls["raw"] == fake_github.calls["contents"] == 0
+    assert result["found_files"] == ["helpers.py", "values.py"]
+    assert {
+        (comment["path"], comment["line"]) for comment in result["review_comments"]
+    } == {("values.py", 100), ("values.py", 103), ("helpers.py", 2)}
+    assert "values.py: line 100: Check values.py:100" in result["comments"]
+    assert result["pull_request"]["additions"] == 3
+    assert result["selection"]["skipped"] == [
+        {"path": "legacy.py", "reason": "removed"}
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pull_review_tokens_follow_the_diff(fake_github, monkeypatch):
+    monkeypatch.setattr("app.chunking.BATCH_TOKENS", 2000)
+    small = {f"m{index}.py": numbered_module(300, {50: "x = 0"}) for index in range(2)}
+    large = {
+        f"m{index}.py": numbered_module(300, {50: "x = 0"}) for index in range(250)
+    }
+    fake_github.add_pull("user", "repo", 1, small)
+    fake_github.add_pull("user", "repo", 2, large)
+
+    async with fake_github.client() as client:
+        first = await perform_pull_review(
+            {**REQUEST, "pull_request_url": "https://github.com/user/repo/pull/1"},
+            "token",
+            "key",
+            client,
+            fake_diff_model([]),
+        )
+        fake_github.calls.clear()
+        second = await perform_pull_review(
+            {**REQUEST, "pull_request_url": "https://github.com/user/repo/pull/2"},
+            "token",
+            "key",
+            client,
+            fake_diff_model([]),
+        )
+
+    # The 250 files are listed over three pages
+    assert fake_github.calls["pulls"] == 3
+    assert len(second["found_files"]) == 250
+    ratio = second["usage"]["contents_tokens"] / first["usage"]["contents_tokens"]
+    assert 110 < ratio < 140
+    assert second["usage"]["batches"] > 1
+
+
+@pytest.mark.asyncio
+async def test_pull_review_endpoint(test_client):
+    with patch("app.api.perform_pull_review", new_callable=AsyncMock) as mock_review:
+        mock_review.return_value = {"status": "success", "review_comments": []}
+
+        response = test_client.post("/review/pull", json=REQUEST)
+
+    assert response.status_code == 200
+    assert mock_review.await_args.kwargs["request"]["pull_request_url"] == (
+        REQUEST["pull_request_url"]
+    )
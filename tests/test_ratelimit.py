@@ -0,0 +1,261 @@
+import hashlib
+import json
+import random
+from email.utils import formatdate
+
+import httpx
+import pytest
+
+from app.exceptions import ReviewServiceError
+from app.github import resolve_head_sha
+from app.ratelimit import GitHubRateLimiter, RateLimitedTransport
+
+API = "https://api.github.com/repos/user/repo"
+
+
+class FakeTime:
+    """Clock whose sleeps return immediately and advance the time instead."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+class RateLimitedServer:
+    """
+    Mock GitHub endpoint with a primary quota, ETags and scripted failures.
+    """
+
+    def __init__(self, time, limit=10, window=60):
+        self.time = time
+        self.limit = limit
+        self.remaining = limit
+        self.reset = time.now + window
+        self.failures = []
+        self.requests = 0
+
+    def headers(self):
+        return {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(int(self.reset)),
+        }
+
+    def handler(self, request):
+        if request.url.host != "api.github.com":
+            # Raw downloads and other hosts have no quota
+            return httpx.Response(200, headers={"ETag": '"raw"'}, content=b"body")
+        self.requests += 1
+        if self.failures:
+            return self.failures.pop(0)
+        body = json.dumps({"path": request.url.path}).encode()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if request.headers.get("If-None-Match") == etag:
+            # Conditional hits do not count against the quota
+            return httpx.Response(304, headers={**self.headers(), "ETag": etag})
+        if self.remaining == 0:
+            return httpx.Response(403, headers=self.headers(), json={"message": "x"})
+        self.remaining -= 1
+        return httpx.Response(
+            200,
+            headers={
+                **self.headers(),
+                "ETag": etag,
+                "Content-Type": "application/json; charset=utf-8",
+            },
+            content=body,
+        )
+
+
+def make_client(server, time, **kwargs):
+    limiter = GitHubRateLimiter(
+        clock=time.clock, sleep=time.sleep, rng=random.Random(0), **kwargs
+    )
+    transport = RateLimitedTransport(httpx.MockTransport(server.handler), limiter)
+    return httpx.AsyncClient(transport=transport), limiter
+
+
+@pytest.mark.asyncio
+async def test_requests_are_paced_once_quota_is_low():
+    time = FakeTime()
+    server = RateLimitedServer(time, limit=10, window=60)
+    client, limiter = make_client(server, time, reserve=4)
+
+    async with client:
+        for index in range(8):
+            await client.get(f"{API}/contents/f{index}")
+
+    # Six requests leave four; the next two are spread over the window
+    assert time.sleeps == pytest.approx([60 / 4, (60 - 15) / 3])
+    assert limiter.stats()["waits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_exhausted_quota_waits_for_reset_and_retries():
+    time = FakeTime()
+    server = RateLimitedServer(time, limit=5, window=30)
+    server.failures = [
+        httpx.Response(
+            403,
+            headers={
+                "X-RateLimit-Remaining": "0",
+                "X-RateLimit-Reset": str(time.now + 2),
+            },
+            json={"message": "API rate limit exceeded"},
+        )
+    ]
+    client, limiter = make_client(server, time)
+
+    async with client:
+        response = await client.get(f"{API}/contents")
+
+    assert response.status_code == 200
+    assert limiter.retries == 1
+    assert 2 <= time.sleeps[0] <= 2.5
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "failure, expected",
+    [
+        (httpx.Response(429, headers={"Retry-After": "3"}), 3),
+        # HTTP-date 30s after FakeTime's start
+        (
+            httpx.Response(
+                429, headers={"Retry-After": formatdate(1_000_030, usegmt=True)}
+            ),
+            30,
+        ),
+        # Unparseable, so the default backoff applies
+        (httpx.Response(403, headers={"Retry-After": "soon"}), 5),
+        (
+            httpx.Response(
+                403, json={"message": "You have exceeded a secondary rate limit"}
+            ),
+            5,
+        ),
+    ],
+)
+async def test_secondary_rate_limits_back_off_with_jitter(failure, expected):
+    time = FakeTime()
+    server = RateLimitedServer(time)
+    server.failures = [failure]
+    client, limiter = make_client(server, time, backoff_base=5)
+
+    async with client:
+        response = await client.get(f"{API}/contents")
+
+    assert response.status_code == 200
+    assert server.requests == 2
+    assert expected <= time.sleeps[0] <= expected * 1.25
+
+
+@pytest.mark.asyncio
+async def test_permission_errors_are_not_retried():
+    time = FakeTime()
+    server = RateLimitedServer(time)
+    server.failures = [httpx.Response(403, json={"message": "Resource not accessible"})]
+    client, limiter = make_client(server, time)
+
+    async with client:
+        response = await client.get(f"{API}/contents")
+
+    assert response.status_code == 403
+    assert server.requests == 1
+    assert time.sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_long_rate_limit_surfaces_as_review_error():
+    time = FakeTime()
+    server = RateLimitedServer(time)
+    server.failures = [httpx.Response(429, headers={"Retry-After": "3600"})]
+    client, _ = make_client(server, time, max_wait=60)
+
+    async with client:
+        with pytest.raises(ReviewServiceError) as exc_info:
+            await resolve_head_sha("user", "repo", client, {})
+
+    assert "rate limit exceeded" in str(exc_info.value)
+    assert time.sleeps == []
+
+
+@pytest.mark.asyncio
+async def test_etag_revalidation_does_not_spend_quota():
+    time = FakeTime()
+    server = RateLimitedServer(time, limit=10)
+    client, limiter = make_client(server, time)
+
+    async with client:
+        first = await client.get(f"{API}/contents")
+        second = await client.get(f"{API}/contents")
+
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert server.requests == 2
+    assert server.remaining == 9
+    assert limiter.stats()["revalidated"] == 1
+
+
+@pytest.mark.asyncio
+async def test_only_api_requests_are_charged_and_paced():
+    time = FakeTime()
+    server = RateLimitedServer(time, limit=10, window=60)
+    client, limiter = make_client(server, time, reserve=4)
+
+    async with client:
+        await client.get(f"{API}/contents")
+        for index in range(20):
+            await client.get(f"https://raw.githubusercontent.com/user/repo/m/f{index}")
+        webhook = await client.post("https://example.com/hook", json={})
+
+    assert webhook.status_code == 200
+    assert time.sleeps == []
+    [quota] = limiter.stats()["credentials"].values()
+    assert quota["remaining"] == server.remaining
+
+
+@pytest.mark.asyncio
+async def test_server_count_overrides_the_local_estimate():
+    time = FakeTime()
+    server = RateLimitedServer(time, limit=10, window=60)
+    client, limiter = make_client(server, time, reserve=3)
+
+    async with client:
+        for index in range(5):
+            await client.get(f"{API}/contents/f{index}")
+        # Requests charged locally but not counted by GitHub, e.g. failures
+        quota = next(iter(limiter.quotas.values()))
+        quota.remaining -= 3
+        await client.get(f"{API}/contents/f5")
+        await client.get(f"{API}/contents/f6")
+
+    # The estimate dropped to the reserve once, then followed the server
+    assert len(time.sleeps) == 1
+    assert quota.remaining == server.remaining == 3
+
+
+@pytest.mark.asyncio
+async def test_etag_cache_keeps_only_api_json_within_its_byte_budget():
+    time = FakeTime()
+    server = RateLimitedServer(time, limit=100)
+    client, limiter = make_client(server, time, etag_cache_bytes=100)
+
+    async with client:
+        for index in range(6):
+            await client.get(f"{API}/contents/f{index}")
+        await client.get(f"{API}/contents/f0")
+        for _ in range(2):
+            await client.get("https://raw.githubusercontent.com/user/repo/m/f")
+
+    stats = limiter.stats()
+    # Bodies are 40 bytes: two fit, and the oldest make way for newer ones
+    assert (stats["etag_entries"], stats["etag_bytes"]) == (2, 80)
+    assert stats["revalidated"] == 0
@@ -0,0 +1,257 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+from app import gpt
+from app.clients import ClientSettings, ConnectionStats, create_http_client
+from app.exceptions import CircuitOpenError
+from app.github import fetch_repository_files
+from app.resilience import CircuitBreaker, Hedger, HedgerPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class FlakyService:
+    """Mock endpoint that answers with scripted delays and status codes."""
+
+    def __init__(self, status=200, delay=0.0, body=None):
+        self.status = status
+        self.delay = delay
+        self.body = body or {}
+        self.requests = 0
+
+    async def handler(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        return httpx.Response(self.status, json=self.body)
+
+
+def guarded_client(service, breaker):
+    return create_http_client(
+        ClientSettings(),
+        ConnectionStats(),
+        transport=httpx.MockTransport(service.handler),
+        breaker=breaker,
+    )
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_errors_and_fails_fast():
+    clock = FakeClock()
+    breaker = CircuitBreaker("github", min_requests=4, open_seconds=30, clock=clock)
+    service = FlakyService(status=502, body={"message": "Bad gateway"})
+
+    async with guarded_client(service, breaker) as client:
+        for _ in range(4):
+            await client.get("https://api.github.com/repos/user/repo")
+        with pytest.raises(CircuitOpenError) as exc_info:
+            await client.get("https://api.github.com/repos/user/repo")
+
+        assert service.requests == 4
+        assert exc_info.value.retry_after == 30
+        assert "github is temporarily unavailable" in str(exc_info.value)
+
+        # The fetcher surfaces the open circuit as is, not as a generic error
+        with pytest.raises(CircuitOpenError):
+            await fetch_repository_files(
+                "https://github.com/user/repo", "token", client=client
+            )
+
+        # After the open period one probe is let through and closes the circuit
+        clock.now += 31
+        service.status = 200
+        response = await client.get("https://api.github.com/repos/user/repo")
+
+    assert response.status_code == 200
+    assert breaker.stats()["state"] == "closed"
+    assert breaker.stats()["trips"] == 1
+    assert breaker.stats()["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_slow_responses():
+    breaker = CircuitBreaker(
+        "openai", slow_seconds=0.02, slow_rate=0.5, min_requests=2, clock=FakeClock()
+    )
+    service = FlakyService(delay=0.05)
+
+    async with guarded_client(service, breaker) as client:
+        await client.get("https://api.openai.com/v1/models")
+        await client.get("https://api.openai.com/v1/models")
+        with pytest.raises(CircuitOpenError):
+            await client.get("https://api.openai.com/v1/models")
+
+    assert service.requests == 2
+
+
+def test_failed_probe_reopens_circuit():
+    clock = FakeClock()
+    breaker = CircuitBreaker("openai", min_requests=1, open_seconds=10, clock=clock)
+    breaker.before()
+    breaker.record(0.1, failed=True)
+    assert breaker.state == "open"
+
+    clock.now += 10
+    breaker.before()
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before()
+    breaker.record(0.1, failed=True)
+
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+
+
+@pytest.mark.asyncio
+async def test_analysis_fails_fast_while_openai_circuit_is_open():
+    breaker = CircuitBreaker("openai", min_requests=2, clock=FakeClock())
+    service = FlakyService(status=500, body={"error": {"message": "overloaded"}})
+
+    async with guarded_client(service, breaker) as http_client:
+        client = AsyncOpenAI(api_key="key", http_client=http_client, max_retries=0)
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await gpt.analyze_code(
+                    [{"path": "main.py", "content": "print(1)"}],
+                    "CLI",
+                    "Junior",
+                    "key",
+                    client,
+                )
+        with pytest.raises(CircuitOpenError):
+            await gpt.analyze_code(
+                [{"path": "main.py", "content": "print(1)"}],
+                "CLI",
+                "Junior",
+                "key",
+                client,
+            )
+
+    assert service.requests == 2
+
+
+def test_hedge_delay_follows_latency_quantile():
+    hedger = Hedger(enabled=True, min_samples=20, initial_delay=30, min_delay=0.5)
+    assert hedger.delay() == 30
+
+    hedger.latencies.extend([1.0] * 18 + [4.0, 9.0])
+    assert hedger.delay() == 4.0
+
+    hedger.latencies.clear()
+    hedger.latencies.extend([0.1] * 20)
+    assert hedger.delay() == 0.5
+
+
+@pytest.mark.asyncio
+async def test_slow_attempt_is_hedged_and_backup_wins():
+    hedger = Hedger(enabled=True, initial_delay=0.02, min_delay=0)
+    delays = [1.0, 0.0]
+    cancelled = []
+
+    async def attempt():
+        delay = delays.pop(0)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(delay)
+            raise
+        return delay
+
+    result = await asyncio.wait_for(hedger.run(attempt), timeout=0.5)
+    await asyncio.sleep(0)
+
+    assert result == 0.0
+    assert cancelled == [1.0]
+    assert hedger.stats()["hedged"] == 1
+    assert hedger.stats()["backup_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_retryable_failure_starts_backup_immediately():
+    hedger = Hedger(enabled=True, initial_delay=10)
+    outcomes = [ConnectionError("reset"), "ok"]
+
+    async def attempt():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    result = await asyncio.wait_for(
+        hedger.run(attempt, lambda error: isinstance(error, ConnectionError)),
+        timeout=0.5,
+    )
+
+    assert result == "ok"
+    assert hedger.retried == 1
+    assert hedger.hedged == 0
+
+
+@pytest.mark.asyncio
+async def test_non_retryable_failure_is_raised():
+    hedger = Hedger(enabled=True, initial_delay=10)
+
+    async def attempt():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        await hedger.run(attempt, lambda error: isinstance(error, ConnectionError))
+    assert hedger.retried == 0
+
+
+@pytest.mark.asyncio
+async def test_completions_are_hedged_with_fake_client(monkeypatch):
+    monkeypatch.setattr(
+        gpt,
+        "completion_hedgers",
+        HedgerPool(lambda: Hedger(enabled=True, initial_delay=0.02)),
+    )
+    answer = json.dumps({"comments": [], "rating": "7/10", "conclusion": "Fine"})
+    delays = [1.0, 0.0]
+
+    async def create(**kwargs):
+        # The first completion hangs; the hedge answers at once
+        await asyncio.sleep(delays.pop(0))
+        return MagicMock(
+            choices=[MagicMock(message=MagicMock(content=answer))],
+            usage=MagicMock(prompt_tokens=10, completion_tokens=5),
+        )
+
+    client = MagicMock()
+    client.chat.completions.create = AsyncMock(side_effect=create)
+
+    result = await asyncio.wait_for(
+        gpt.analyze_code(
+            [{"path": "main.py", "content": "print(1)"}], "CLI", "Junior", "key", client
+        ),
+        timeout=0.5,
+    )
+
+    assert result["rating"] == "7/10"
+    assert result["usage"]["requests"] == 2
+    assert result["usage"]["prompt_tokens"] == 10
+    assert gpt.completion_hedgers.stats()["gpt-4o/2048"]["backup_wins"] == 1
+
+
+def test_hedge_delays_are_kept_per_model_and_length():
+    hedgers = HedgerPool(lambda: Hedger(enabled=True, min_samples=20, min_delay=0))
+    assert gpt.hedge_key("gpt-4o", 2000) == gpt.hedge_key("gpt-4o", 1500)
+    assert gpt.hedge_key("gpt-4o", 1000) == "gpt-4o/1024"
+
+    hedgers.get(gpt.hedge_key("gpt-4o-mini", 1000)).latencies.extend([0.5] * 20)
+    hedgers.get(gpt.hedge_key("gpt-4o", 2000)).latencies.extend([20.0] * 20)
+
+    # A fast triage model does not make every slow review completion a hedge
+    assert hedgers.get("gpt-4o-mini/1024").delay() == 0.5
+    assert hedgers.get("gpt-4o/2048").delay() == 20.0
+    assert set(hedgers.stats()) == {"gpt-4o-mini/1024", "gpt-4o/2048"}
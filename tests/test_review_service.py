@@ -1,4 +1,4 @@
-from unittest.mock import AsyncMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 
 import pytest
 
@@ -37,13 +37,21 @@ async def test_perform_code_review_success():
         )
 
         mock_fetch.assert_called_once_with(
-            mock_request["github_repo_url"], "fake-token"
+            mock_request["github_repo_url"],
+            "fake-token",
+            strategy=None,
+            client=None,
+            cache=None,
+            progress=None,
+            selector=ANY,
+            store=ANY,
         )
 
         assert result["status"] == "success"
         assert "found_files" in result
         assert "comments" in result
         assert "rating" in result
+        assert result["selection"]["skipped"] == []
 
 
 @pytest.mark.asyncio
@@ -58,3 +66,26 @@ async def test_perform_code_review_missing_fields():
             request=mock_request, github_token="fake-token", openai_key="fake-key"
         )
     assert "Missing required field" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_perform_code_review_closes_the_content_store():
+    mock_request = {
+        "github_repo_url": "https://github.com/user/repo",
+        "assignment_description": "Test assignment",
+        "candidate_level": "Senior",
+    }
+    store = MagicMock()
+    mock_fetch = AsyncMock(return_value=[{"path": "a.py", "content": "x = 1"}])
+    mock_analyze = AsyncMock(side_effect=ReviewServiceError("boom"))
+
+    with patch("app.review_service.ContentStore", return_value=store), patch(
+        "app.review_service.fetch_repository_files", mock_fetch
+    ), patch("app.review_service.analyze_code", mock_analyze):
+        with pytest.raises(ReviewServiceError):
+            await perform_code_review(
+                request=mock_request, github_token="fake-token", openai_key="key"
+            )
+
+    assert mock_fetch.call_args.kwargs["store"] is store
+    store.close.assert_called_once_with()
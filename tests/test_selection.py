@@ -0,0 +1,134 @@
+import pytest
+
+from app.github import SUPPORTED_EXTENSIONS, fetch_repository_files
+from app.selection import FileSelector, GitAttributes, GitIgnore, importance
+
+
+def entry(path, size=100):
+    return {"path": path, "size": size}
+
+
+def test_gitignore_patterns():
+    ignore = GitIgnore(
+        "# comment\n*.log\nbuild/\n/secret.py\n!keep.log\ndocs/**/*.py\n"
+    )
+
+    assert ignore.ignores("app/debug.log")
+    assert not ignore.ignores("keep.log")
+    assert ignore.ignores("build/out.py")
+    assert ignore.ignores("pkg/build/out.py")
+    assert ignore.ignores("secret.py")
+    assert not ignore.ignores("pkg/secret.py")
+    assert ignore.ignores("docs/a/b/conf.py")
+    assert not ignore.ignores("src/main.py")
+
+
+def test_gitattributes_linguist_markers():
+    attributes = GitAttributes(
+        "gen/** linguist-generated=true\n"
+        "gen/keep.py -linguist-generated\n"
+        "third/* linguist-vendored\n"
+    )
+
+    assert attributes.marked("gen/models.py") == "linguist-generated"
+    assert attributes.marked("gen/keep.py") is None
+    assert attributes.marked("third/lib.js") == "linguist-vendored"
+    assert attributes.marked("src/app.py") is None
+
+
+def test_importance_ranks_entry_points_core_then_tests():
+    assert importance("main.py") > importance("app/service.py")
+    assert importance("app/service.py") > importance("tests/test_service.py")
+    assert importance("tests/test_service.py") > importance("examples/demo.py")
+    assert importance("latest.py") == importance("other.py")
+
+
+def test_select_skips_with_reasons():
+    selector = FileSelector(extensions=SUPPORTED_EXTENSIONS, max_file_bytes=1000)
+    selector.load_rules(
+        gitignore="*.tmp.py\n", gitattributes="api/*.py linguist-generated\n"
+    )
+
+    selected = selector.select(
+        [
+            entry("main.py"),
+            entry("README.md"),
+            entry("node_modules/lib/index.js"),
+            entry("static/app.min.js"),
+            entry("proto/service_pb2.py"),
+            entry("db/migrations/0001_initial.py"),
+            entry("scratch.tmp.py"),
+            entry("api/client.py"),
+            entry("big.py", size=5000),
+        ]
+    )
+
+    assert [file["path"] for file in selected] == ["main.py"]
+    assert selector.report.skipped == [
+        {"path": "api/client.py", "reason": "linguist-generated"},
+        {"path": "big.py", "reason": "too_large"},
+        {"path": "db/migrations/0001_initial.py", "reason": "vendored"},
+        {"path": "node_modules/lib/index.js", "reason": "vendored"},
+        {"path": "proto/service_pb2.py", "reason": "generated"},
+        {"path": "scratch.tmp.py", "reason": "gitignored"},
+        {"path": "static/app.min.js", "reason": "generated"},
+    ]
+
+
+def test_select_keeps_most_important_files_within_budget():
+    selector = FileSelector(max_total_bytes=250, max_total_tokens=10**6)
+
+    selected = selector.select(
+        [
+            entry("examples/demo.py"),
+            entry("tests/test_app.py"),
+            entry("app/service.py"),
+            entry("main.py"),
+        ]
+    )
+
+    assert [file["path"] for file in selected] == ["app/service.py", "main.py"]
+    assert selector.report.selected_bytes == 200
+    assert {item["reason"] for item in selector.report.skipped} == {"budget"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("strategy", ["contents", "tree"])
+async def test_fetch_skips_files_before_download(fake_github, strategy):
+    fake_github.add_repo(
+        "user",
+        "repo",
+        {
+            ".gitignore": "local/\n",
+            ".gitattributes": "gen/* linguist-generated\n",
+            "main.py": "print('main')",
+            "gen/schema.py": "SCHEMA = {}",
+            "local/notes.py": "# scratch",
+            "node_modules/pkg/index.js": "module.exports = 1",
+            "web/bundle.min.js": "var a=1",
+        },
+    )
+    selector = FileSelector(extensions=SUPPORTED_EXTENSIONS)
+
+    async with fake_github.client() as client:
+        files = await fetch_repository_files(
+            "https://github.com/user/repo",
+            "token",
+            strategy=strategy,
+            client=client,
+            selector=selector,
+        )
+
+    assert [file["path"] for file in files] == ["main.py"]
+    reasons = {item["path"]: item["reason"] for item in selector.report.skipped}
+    assert reasons["gen/schema.py"] == "linguist-generated"
+    assert reasons["web/bundle.min.js"] == "generated"
+    if strategy == "contents":
+        # Ruled-out directories are never listed, let alone downloaded
+        assert reasons["local/"] == "gitignored"
+        assert reasons["node_modules/"] == "vendored"
+        assert fake_github.calls["contents"] == 3
+        # The two rules files plus main.py are the only bodies downloaded
+        assert fake_github.calls["raw"] == 3
+    else:
+        assert fake_github.calls["raw"] == 2